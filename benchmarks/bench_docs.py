@@ -0,0 +1,141 @@
+"""
+Benchmarks database documentation generation on synthetic wide schemas.
+
+For each schema shape (number of tables x number of columns per table) the benchmark builds the schema,
+with table and column comments, in a scratch database of a local throwaway PostgreSQL server and measures
+separately:
+
+    extract    PgDbDocGenerate._db_schema(), reading tables, columns and comments from the catalog
+    render     DocGenerator.generate(), rendering the HTML
+
+reporting wall time, peak memory traced by tracemalloc and the number of queries the extraction runs.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_docs --shapes 100x10,1000x50,5000x100,20000x300 --output results.json
+    python -m benchmarks.bench_docs --baseline results.json
+"""
+
+import argparse
+import time
+
+from dbmake import database
+from dbmake import db_tasks
+from dbmake.doc_generator import DocGenerator
+
+from . import support
+
+# Tables created per transaction, each CREATE TABLE holds a lock until commit
+TABLES_PER_TRANSACTION = 200
+
+
+def build_schema(db_adapter, tables, columns):
+    """
+    Creates tables with columns of mixed types, commenting every table and every other column
+    """
+    cursor = db_adapter.get_cursor()
+    types = ("integer", "text", "timestamp", "numeric(12,2)", "boolean")
+
+    for first in range(0, tables, TABLES_PER_TRANSACTION):
+        statements = []
+
+        for number in range(first, min(first + TABLES_PER_TRANSACTION, tables)):
+            table = "wide_%s" % number
+            definitions = ["id serial PRIMARY KEY"] + [
+                "c_%s %s" % (column, types[column % len(types)]) for column in range(1, columns)
+            ]
+            statements.append("CREATE TABLE %s (%s);" % (table, ", ".join(definitions)))
+            statements.append("COMMENT ON TABLE %s IS 'Synthetic table number %s';" % (table, number))
+            statements.extend(
+                "COMMENT ON COLUMN %s.c_%s IS 'Column %s of %s';" % (table, column, column, table)
+                for column in range(1, columns, 2)
+            )
+
+        cursor.execute("\n".join(statements))
+        db_adapter.commit()
+
+    cursor.execute("ANALYZE")
+    db_adapter.commit()
+
+
+def bench_shape(options, tables, columns):
+    """
+    :return: A list of result dictionaries
+    """
+    results = []
+
+    with support.ScratchDatabase(options, "dbmake_bench_docs") as config:
+        db_adapter = database.InstrumentedPgAdapter(config)
+        try:
+            started_at = time.time()
+            build_schema(db_adapter, tables, columns)
+            print("Built %s tables of %s columns in %.1fs" % (tables, columns, time.time() - started_at))
+
+            doc_task = db_tasks.PgDbDocGenerate(config, db_adapter)
+
+            db_adapter.stats.reset()
+            extraction = support.measure(lambda: doc_task._db_schema(config.dbname, 0), options.repeat)
+            # The adapter has counted the timed runs plus the one traced by tracemalloc
+            queries = db_adapter.stats.round_trips // (options.repeat + 1)
+
+            rendering = support.measure(lambda: DocGenerator(extraction.result).generate(), options.repeat)
+        finally:
+            db_adapter.disconnect()
+
+    for operation, measurement, operation_queries in (("extract", extraction, queries), ("render", rendering, 0)):
+        results.append({
+            "tables": tables,
+            "columns": columns,
+            "operation": operation,
+            "seconds": measurement.seconds,
+            "peak_bytes": measurement.peak_bytes,
+            "queries": operation_queries,
+        })
+
+    results[-1]["html_bytes"] = len(rendering.result)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks dbmake's documentation generation")
+    parser.add_argument("--shapes", default="100x10,1000x50,5000x100,20000x300",
+                        help="Comma separated schema shapes, <tables>x<columns per table>")
+    parser.add_argument("--repeat", type=int, default=1, help="Number of timed runs, the best one counts")
+    parser.add_argument("--keep", action="store_true", help="Don't drop scratch databases")
+    parser.add_argument("--output", help="Save results as JSON")
+    parser.add_argument("--baseline", help="Compare with results of a previous run")
+    support.add_server_arguments(parser)
+    options = parser.parse_args()
+
+    results = []
+    for shape in options.shapes.split(","):
+        tables, columns = [int(number) for number in shape.split("x")]
+        results.extend(bench_shape(options, tables, columns))
+
+    ratios = support.compare(results, support.load_baseline(options.baseline),
+                             ("tables", "columns", "operation"), "seconds")
+
+    rows = []
+    for entry in results:
+        ratio = ratios.get((entry["tables"], entry["columns"], entry["operation"]))
+        rows.append([
+            entry["tables"],
+            entry["columns"],
+            entry["operation"],
+            "%.3f" % entry["seconds"],
+            support.format_bytes(entry["peak_bytes"]),
+            entry["queries"],
+            "-" if ratio is None else "%.2fx" % ratio,
+        ])
+
+    print("")
+    support.print_table(["tables", "columns", "operation", "seconds", "peak memory", "queries", "vs baseline"],
+                        rows)
+
+    if options.output:
+        support.save_results(options.output, results)
+
+
+if __name__ == "__main__":
+    main()
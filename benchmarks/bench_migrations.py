@@ -0,0 +1,236 @@
+"""
+Benchmarks the migration engine on synthetic migration directories.
+
+For each corpus size the benchmark generates a migrations directory and measures:
+
+    revisions      MigrationsManager.revisions(), listing the directory
+    load           MigrationsManager._migrations_list(), parsing all migration files
+    plan           MigrationsManager.plan() of a fresh database up to the latest revision
+    migrate up     migrate_to_revision() of a fresh database to the latest revision, end to end
+    migrate down   migrate_to_revision() back to revision 0
+
+Migrating needs a local throwaway PostgreSQL server (--host, --port, --user, ...), a scratch
+database is created and dropped for every corpus. Use --no-migrate to measure the rest only.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_migrations --sizes 100,1000,10000,50000 --output results.json
+    python -m benchmarks.bench_migrations --baseline results.json
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from dbmake import database
+from dbmake import migrations
+from dbmake.common import ZERO_MIGRATION_FILE_NAME
+
+from . import support
+
+# Shares of generated migration files per size class
+SMALL_SHARE = 0.80
+MEDIUM_SHARE = 0.18
+
+# Number of INSERT rows in a large migration file, each is roughly 100 bytes
+LARGE_MIGRATION_ROWS = 10000
+
+# Corpora above that size aren't migrated by default, each migration creates a table
+DEFAULT_MIGRATE_LIMIT = 10000
+
+
+def generate_corpus(migrations_dir, size, seed=0):
+    """
+    Generates a migrations directory of a ZERO-MIGRATION and size migrations. Most migrations are small
+    (a single CREATE TABLE), some are medium (a table with indexes, comments and a function) and a few
+    are large (bulk INSERTs), so statement splitting and file sizes are exercised as in real projects.
+    Every migration has a "Migrate DOWN" section dropping its table.
+    :return: Total size of generated files in bytes
+    """
+    rand = random.Random(seed)
+    total_size = 0
+
+    with open(os.path.join(migrations_dir, ZERO_MIGRATION_FILE_NAME), 'w') as f:
+        f.write("SELECT 1;\n%s\nSELECT 1;\n" % migrations.Migration.MIGRATE_UP_DOWN_SEPARATOR)
+
+    for revision in range(1, size + 1):
+        table = "t_%s" % revision
+        share = rand.random()
+
+        if share < SMALL_SHARE:
+            up = _small_migration(table)
+        elif share < SMALL_SHARE + MEDIUM_SHARE:
+            up = _medium_migration(table)
+        else:
+            up = _large_migration(table)
+
+        content = "%s\n%s\nDROP TABLE %s CASCADE;\n" % (up, migrations.Migration.MIGRATE_UP_DOWN_SEPARATOR, table)
+
+        # Revisions are timestamps in real projects, sparse but ascending
+        path = os.path.join(migrations_dir, "%s_create_%s.sql" % (1400000000 + revision * 60, table))
+        with open(path, 'w') as f:
+            f.write(content)
+
+        total_size += len(content)
+
+    return total_size
+
+
+def _small_migration(table):
+    return "CREATE TABLE %s (id serial PRIMARY KEY, name text NOT NULL);" % table
+
+
+def _medium_migration(table):
+    return """
+CREATE TABLE %(table)s (
+    id serial PRIMARY KEY,
+    name text NOT NULL,
+    note text DEFAULT 'it''s a note; not a statement',
+    created_at timestamp DEFAULT now()
+);
+COMMENT ON TABLE %(table)s IS 'Generated table; part of a benchmark';
+COMMENT ON COLUMN %(table)s.name IS 'Name';
+CREATE INDEX %(table)s_name_idx ON %(table)s (name);
+CREATE INDEX %(table)s_created_at_idx ON %(table)s (created_at);
+CREATE FUNCTION %(table)s_touch() RETURNS trigger AS $$
+BEGIN
+    NEW.created_at := now();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+/* A block comment; with a semicolon */
+CREATE TRIGGER %(table)s_touch BEFORE UPDATE ON %(table)s FOR EACH ROW EXECUTE PROCEDURE %(table)s_touch();
+""" % {"table": table}
+
+
+def _large_migration(table):
+    rows = ",\n".join(
+        "(%s, 'row number %s of a generated bulk insert, padded to be about a hundred bytes')" % (i, i)
+        for i in range(LARGE_MIGRATION_ROWS)
+    )
+    return "CREATE TABLE %s (id integer PRIMARY KEY, name text);\nINSERT INTO %s (id, name) VALUES\n%s;" % (
+        table, table, rows
+    )
+
+
+def bench_corpus(options, size):
+    """
+    Runs all measurements on a corpus of a size
+    :return: A list of result dictionaries
+    """
+    migrations_dir = tempfile.mkdtemp(prefix="dbmake_bench_%s_" % size)
+    results = []
+
+    def result(operation, measurement, **extra):
+        entry = {
+            "size": size,
+            "operation": operation,
+            "seconds": measurement.seconds,
+            "peak_bytes": measurement.peak_bytes,
+        }
+        entry.update(extra)
+        results.append(entry)
+
+    try:
+        started_at = time.time()
+        corpus_bytes = generate_corpus(migrations_dir, size, options.seed)
+        print("Generated %s migrations, %s, in %.1fs" % (size, support.format_bytes(corpus_bytes),
+                                                         time.time() - started_at))
+
+        result("revisions", support.measure(
+            lambda: migrations.MigrationsManager(migrations_dir).revisions(), options.repeat))
+        result("load", support.measure(
+            lambda: migrations.MigrationsManager(migrations_dir)._migrations_list(), options.repeat))
+
+        manager = migrations.MigrationsManager(migrations_dir).load()
+        latest_revision = manager.latest_revision()
+        result("plan", support.measure(lambda: manager.plan(None, latest_revision), options.repeat))
+
+        if options.migrate and size <= options.migrate_limit:
+            results.extend(bench_migrate(options, manager, size))
+    finally:
+        shutil.rmtree(migrations_dir)
+
+    return results
+
+
+def bench_migrate(options, manager, size):
+    """
+    Migrates a scratch database up to the latest revision and back down to revision 0, counting round trips
+    """
+    results = []
+    listener = migrations.MigrationListener()
+
+    with support.ScratchDatabase(options, "dbmake_bench_migrations") as config:
+        db_adapter = database.InstrumentedPgAdapter(config)
+        try:
+            # A scratch database is empty, migrating it needs a migrations table as "dbmake init" creates
+            migrations.MigrationsDao(db_adapter).create_table()
+
+            for operation, target_revision in (("migrate up", manager.latest_revision()), ("migrate down", 0)):
+                db_adapter.stats.reset()
+                started_at = time.time()
+                manager.migrate_to_revision(target_revision, db_adapter, listener=listener)
+
+                results.append({
+                    "size": size,
+                    "operation": operation,
+                    "seconds": time.time() - started_at,
+                    "peak_bytes": None,
+                    "round_trips": db_adapter.stats.round_trips,
+                    "commits": db_adapter.stats.commits,
+                })
+        finally:
+            db_adapter.disconnect()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks dbmake's migration engine")
+    parser.add_argument("--sizes", default="100,1000,10000,50000",
+                        help="Comma separated numbers of migrations of generated corpora")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs, the best one counts")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the corpora generator")
+    parser.add_argument("--no-migrate", dest="migrate", action="store_false",
+                        help="Don't migrate databases, no PostgreSQL server is needed then")
+    parser.add_argument("--migrate-limit", type=int, default=DEFAULT_MIGRATE_LIMIT,
+                        help="Largest corpus to migrate end to end")
+    parser.add_argument("--keep", action="store_true", help="Don't drop scratch databases")
+    parser.add_argument("--output", help="Save results as JSON")
+    parser.add_argument("--baseline", help="Compare with results of a previous run")
+    support.add_server_arguments(parser)
+    options = parser.parse_args()
+
+    results = []
+    for size in [int(size) for size in options.sizes.split(",")]:
+        results.extend(bench_corpus(options, size))
+
+    ratios = support.compare(results, support.load_baseline(options.baseline), ("size", "operation"), "seconds")
+
+    rows = []
+    for entry in results:
+        ratio = ratios.get((entry["size"], entry["operation"]))
+        rows.append([
+            entry["size"],
+            entry["operation"],
+            "%.4f" % entry["seconds"],
+            "-" if entry["peak_bytes"] is None else support.format_bytes(entry["peak_bytes"]),
+            entry.get("round_trips", "-"),
+            entry.get("commits", "-"),
+            "-" if ratio is None else "%.2fx" % ratio,
+        ])
+
+    print("")
+    support.print_table(["migrations", "operation", "seconds", "peak memory", "round trips", "commits",
+                         "vs baseline"], rows)
+
+    if options.output:
+        support.save_results(options.output, results)
+
+
+if __name__ == "__main__":
+    main()
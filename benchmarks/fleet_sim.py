@@ -0,0 +1,355 @@
+"""
+Simulates a fleet of databases on a single local PostgreSQL server, for scale testing the commands
+that fan out over all connections of a migrations directory (migrate, status, verify, ...).
+
+    setup      Creates N databases, initializes dbmake in each of them, migrates each one to a random
+               revision of a migrations directory and writes their connections into the directory's
+               .dbmake/databases.json (replacing it, a copy of an existing file is kept as .bak)
+    proxy      Runs a TCP proxy in front of the server that injects latency, failures and hangs
+               per database, as a stand-in for a fleet of remote servers
+    teardown   Drops the databases
+
+Usage (from the repository root):
+
+    python -m benchmarks.fleet_sim setup -m /tmp/fleet -n 200 --generate 50 --proxy-port 6543
+    python -m benchmarks.fleet_sim proxy --listen-port 6543 --latency 20 --slow-share 0.1 --fail-share 0.05
+    dbmake status -m /tmp/fleet
+    python -m benchmarks.fleet_sim teardown -n 200
+
+Databases are chosen to be slow, failing or hanging by a hash of their names and --seed, so
+the same fleet behaves the same way from run to run.
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import struct
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from dbmake import database
+from dbmake import db_tasks
+from dbmake import migrations
+from dbmake.common import DBMAKE_CONFIG_DIR, DBMAKE_CONFIG_FILE
+
+from . import support
+from .bench_migrations import generate_corpus
+
+DEFAULT_PREFIX = "dbmake_fleet"
+
+
+def database_names(options):
+    return ["%s_%04d" % (options.prefix, number) for number in range(options.number)]
+
+
+def setup(options):
+    """
+    Creates the fleet's databases and seeds each one at a random revision
+    """
+    migrations_dir = os.path.abspath(options.migrations_dir)
+
+    if options.generate:
+        if not os.path.exists(migrations_dir):
+            os.makedirs(migrations_dir)
+        generate_corpus(migrations_dir, options.generate, options.seed)
+
+    manager = migrations.MigrationsManager(migrations_dir).load()
+    revisions = manager.revisions()
+    rand = random.Random(options.seed)
+    dbnames = database_names(options)
+
+    # Databases are created one by one, CREATE DATABASE can't run concurrently from the same template
+    create_task = db_tasks.PgDbCreate(support.server_config(options))
+    for dbname in dbnames:
+        if not create_task.execute(dbname):
+            raise SystemExit("Failed to create database %s" % dbname)
+    create_task.db_adapter.disconnect()
+
+    targets = [(dbname, rand.choice(revisions)) for dbname in dbnames]
+
+    def seed(target):
+        dbname, revision = target
+        config = support.server_config(options, dbname)
+        db_adapter = database.DbAdapterFactory.create(config)
+        try:
+            db_tasks.PgDbInit(config, db_adapter).execute()
+            manager.migrate_to_revision(revision, db_adapter, listener=migrations.MigrationListener())
+        finally:
+            db_adapter.disconnect()
+
+    started_at = time.time()
+    pool = ThreadPool(options.jobs)
+    try:
+        pool.map(seed, targets, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    print("Seeded %s databases in %.1fs" % (len(targets), time.time() - started_at))
+
+    write_config(options, migrations_dir, dbnames)
+
+
+def write_config(options, migrations_dir, dbnames):
+    """
+    Writes connections of the fleet's databases into the migrations directory's config file, connecting
+    through the proxy if a proxy port is given
+    """
+    config_dir = os.path.join(migrations_dir, DBMAKE_CONFIG_DIR)
+    config_file = os.path.join(config_dir, DBMAKE_CONFIG_FILE)
+
+    if not os.path.exists(config_dir):
+        os.makedirs(config_dir)
+
+    if os.path.exists(config_file):
+        shutil.copy(config_file, config_file + ".bak")
+
+    port = options.proxy_port if options.proxy_port else options.port
+    host = "127.0.0.1" if options.proxy_port else options.host
+
+    connections_list = [
+        database.DbConnectionConfig(host, dbname, options.user, options.password, dbname, str(port))
+        for dbname in dbnames
+    ]
+    with open(config_file, 'w') as f:
+        f.write(json.dumps(connections_list, default=lambda o: o.__dict__, sort_keys=True, indent=4))
+
+    print("Wrote %s connections into %s" % (len(connections_list), config_file))
+
+
+def teardown(options):
+    """
+    Drops the fleet's databases
+    """
+    create_task = db_tasks.PgDbCreate(support.server_config(options))
+    create_task.db_adapter.set_isolation_level(0)
+    cursor = create_task.db_adapter.get_cursor()
+
+    for dbname in database_names(options):
+        cursor.execute("DROP DATABASE IF EXISTS %s" % dbname)
+
+    create_task.db_adapter.disconnect()
+    print("Dropped %s databases" % options.number)
+
+
+class Behaviour:
+    """
+    What the proxy does to connections of a single database
+    """
+
+    NORMAL = "normal"
+    SLOW = "slow"
+    FAIL = "fail"
+    HANG = "hang"
+
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def of(options, dbname):
+        """
+        :return: One of the behaviours, chosen by a hash of dbname and the proxy's seed
+        """
+        share = random.Random("%s:%s" % (options.seed, dbname)).random()
+
+        for behaviour, behaviour_share in ((Behaviour.FAIL, options.fail_share),
+                                           (Behaviour.HANG, options.hang_share),
+                                           (Behaviour.SLOW, options.slow_share)):
+            if share < behaviour_share:
+                return behaviour
+            share -= behaviour_share
+
+        return Behaviour.NORMAL
+
+
+class FaultInjectingProxy:
+    """
+    A TCP proxy of the PostgreSQL protocol. It reads a client's startup message to find out the database
+    the client connects to, then either forwards the connection to the server, delaying every packet the
+    server sends back (Behaviour.NORMAL, Behaviour.SLOW), closes it (Behaviour.FAIL) or leaves it unanswered
+    (Behaviour.HANG).
+    """
+
+    SSL_REQUEST_CODE = 80877103
+    GSSENC_REQUEST_CODE = 80877104
+
+    def __init__(self, options):
+        self._options = options
+        self.connections = {}
+        self._lock = threading.Lock()
+
+    def serve_forever(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(("127.0.0.1", self._options.listen_port))
+        listener.listen(128)
+        print("Proxying 127.0.0.1:%s to %s:%s" % (self._options.listen_port, self._options.host, self._options.port))
+
+        while True:
+            client, _ = listener.accept()
+            thread = threading.Thread(target=self._handle, args=(client,))
+            thread.daemon = True
+            thread.start()
+
+    def _handle(self, client):
+        try:
+            startup_message = self._read_startup_message(client)
+            if startup_message is None:
+                client.close()
+                return
+
+            dbname = self._startup_parameters(startup_message).get("database")
+            behaviour = Behaviour.of(self._options, dbname)
+
+            with self._lock:
+                self.connections[behaviour] = self.connections.get(behaviour, 0) + 1
+
+            if behaviour == Behaviour.FAIL:
+                client.close()
+                return
+
+            if behaviour == Behaviour.HANG:
+                # Keep the connection until the client gives up
+                while client.recv(65536):
+                    pass
+                client.close()
+                return
+
+            latency = self._options.latency
+            if behaviour == Behaviour.SLOW:
+                latency = self._options.slow_latency
+
+            server = socket.create_connection((self._options.host, int(self._options.port)))
+            server.sendall(startup_message)
+        except socket.error:
+            client.close()
+            return
+
+        upstream = threading.Thread(target=self._pump, args=(client, server, 0))
+        upstream.daemon = True
+        upstream.start()
+        self._pump(server, client, latency)
+
+    def _read_startup_message(self, client):
+        """
+        Reads a client's startup message, declining SSL and GSSAPI encryption requests that precede it
+        :return: bytes, or None if the client has disconnected
+        """
+        while True:
+            header = self._recv_exactly(client, 8)
+            if header is None:
+                return None
+
+            length, code = struct.unpack("!ii", header)
+            if length == 8 and code in (self.SSL_REQUEST_CODE, self.GSSENC_REQUEST_CODE):
+                client.sendall(b"N")
+                continue
+
+            body = self._recv_exactly(client, length - 8)
+            if body is None:
+                return None
+
+            return header + body
+
+    @staticmethod
+    def _startup_parameters(startup_message):
+        parts = startup_message[8:].split(b"\x00")
+        parameters = {}
+        for key, value in zip(parts[0::2], parts[1::2]):
+            if key:
+                parameters[key.decode()] = value.decode()
+
+        parameters.setdefault("database", parameters.get("user"))
+
+        return parameters
+
+    @staticmethod
+    def _recv_exactly(sock, size):
+        data = b""
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def _pump(self, source, destination, latency):
+        """
+        Forwards data from source to destination, delaying each chunk by latency milliseconds
+        (plus up to --jitter milliseconds)
+        """
+        rand = random.Random()
+        try:
+            while True:
+                data = source.recv(65536)
+                if not data:
+                    break
+
+                if latency:
+                    time.sleep((latency + rand.uniform(0, self._options.jitter)) / 1000.0)
+
+                destination.sendall(data)
+        except socket.error:
+            pass
+        finally:
+            for sock in (source, destination):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+                sock.close()
+
+
+def proxy(options):
+    FaultInjectingProxy(options).serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulates a fleet of databases on a local PostgreSQL server")
+    subparsers = parser.add_subparsers(dest="command")
+
+    setup_parser = subparsers.add_parser("setup", help="Create and seed the fleet's databases")
+    setup_parser.add_argument("-m", "--migrations-dir", required=True)
+    setup_parser.add_argument("--generate", type=int, default=0,
+                              help="Generate a synthetic migrations directory of that many migrations first")
+    setup_parser.add_argument("-j", "--jobs", type=int, default=8, help="Number of databases seeded concurrently")
+    setup_parser.add_argument("--proxy-port", type=int, help="Write connections through the proxy on that port")
+
+    proxy_parser = subparsers.add_parser("proxy", help="Run a fault injecting proxy in front of the server")
+    proxy_parser.add_argument("--listen-port", type=int, default=6543)
+    proxy_parser.add_argument("--latency", type=float, default=0, help="Milliseconds added to every server packet")
+    proxy_parser.add_argument("--jitter", type=float, default=0, help="Random milliseconds added to the latency")
+    proxy_parser.add_argument("--slow-share", type=float, default=0, help="Share of slow databases")
+    proxy_parser.add_argument("--slow-latency", type=float, default=500, help="Latency of slow databases")
+    proxy_parser.add_argument("--fail-share", type=float, default=0,
+                              help="Share of databases whose connections are closed at once")
+    proxy_parser.add_argument("--hang-share", type=float, default=0,
+                              help="Share of databases whose connections are never answered")
+
+    teardown_parser = subparsers.add_parser("teardown", help="Drop the fleet's databases")
+
+    for subparser in (setup_parser, teardown_parser):
+        subparser.add_argument("-n", "--number", type=int, default=100, help="Number of databases")
+        subparser.add_argument("--prefix", default=DEFAULT_PREFIX, help="Prefix of the databases' names")
+
+    for subparser in (setup_parser, proxy_parser, teardown_parser):
+        subparser.add_argument("--seed", type=int, default=0)
+        support.add_server_arguments(subparser)
+
+    options = parser.parse_args()
+
+    if options.command == "setup":
+        setup(options)
+    elif options.command == "proxy":
+        proxy(options)
+    elif options.command == "teardown":
+        teardown(options)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Helpers shared by dbmake benchmarks: connecting to a local throwaway PostgreSQL server,
+scratch databases and measuring time and memory of a callable. Round trips are counted by
+dbmake.database.InstrumentedPgAdapter.
+"""
+
+import getpass
+import json
+import os
+import time
+import tracemalloc
+
+import psycopg2
+
+from dbmake import database
+
+
+def add_server_arguments(parser):
+    """
+    Adds the arguments of a PostgreSQL server the benchmarks create their scratch databases on
+    :param argparse.ArgumentParser parser:
+    """
+    parser.add_argument("--host", default=os.environ.get("PGHOST", "localhost"))
+    parser.add_argument("--port", default=os.environ.get("PGPORT", "5432"))
+    parser.add_argument("--user", default=os.environ.get("PGUSER", getpass.getuser()))
+    parser.add_argument("--password", default=os.environ.get("PGPASSWORD", ""))
+    parser.add_argument("--maintenance-db", default="postgres",
+                        help="Database to connect to for creating and dropping scratch databases")
+
+
+def server_config(options, dbname=None, connection_name=None):
+    """
+    :return: DbConnectionConfig of a database on the benchmarks' server
+    """
+    dbname = dbname or options.maintenance_db
+    return database.DbConnectionConfig(
+        options.host, dbname, options.user, options.password, connection_name or dbname, str(options.port)
+    )
+
+
+class ScratchDatabase:
+    """
+    Context manager creating an empty database on the benchmarks' server and dropping it on exit
+    """
+
+    def __init__(self, options, dbname):
+        self._options = options
+        self.dbname = dbname
+
+    def __enter__(self):
+        self._execute("DROP DATABASE IF EXISTS %s" % self.dbname)
+        self._execute("CREATE DATABASE %s" % self.dbname)
+        return server_config(self._options, self.dbname)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self._options.keep:
+            self._execute("DROP DATABASE IF EXISTS %s" % self.dbname)
+        return False
+
+    def _execute(self, query):
+        connection = psycopg2.connect(**connect_kwargs(server_config(self._options)))
+        try:
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute(query)
+        finally:
+            connection.close()
+
+
+def connect_kwargs(config):
+    """
+    :param DbConnectionConfig config:
+    :return: psycopg2.connect() keyword arguments
+    """
+    return dict(host=config.host, port=config.port, dbname=config.dbname, user=config.user,
+                password=config.password)
+
+
+class Measurement:
+    """
+    Result of measuring a callable: best wall time of a number of runs and peak memory
+    traced by tracemalloc during a separate run
+    """
+
+    seconds = None
+    peak_bytes = None
+    result = None
+
+    def __init__(self, seconds, peak_bytes, result):
+        self.seconds = seconds
+        self.peak_bytes = peak_bytes
+        self.result = result
+
+
+def measure(function, repeat=3):
+    """
+    Measures a callable. Tracing memory slows Python down severalfold, so time is measured
+    by runs that don't trace.
+    :param function: A callable without arguments
+    :param repeat: Number of timed runs, the best one counts
+    :return: Measurement
+    """
+    seconds = None
+    result = None
+
+    for _ in range(repeat):
+        started_at = time.time()
+        result = function()
+        elapsed = time.time() - started_at
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+
+    tracemalloc.start()
+    try:
+        function()
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return Measurement(seconds, peak_bytes, result)
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(size) < 1024 or unit == "GB":
+            return "%.1f %s" % (size, unit) if unit != "B" else "%d B" % size
+        size /= 1024.0
+
+
+def print_table(header, rows):
+    """
+    Prints rows of strings as a table with aligned columns
+    """
+    widths = [max(len(str(row[i])) for row in [header] + rows) for i in range(len(header))]
+
+    def line(row):
+        return "  ".join(str(cell).rjust(width) for cell, width in zip(row, widths))
+
+    print(line(header))
+    print("  ".join("-" * width for width in widths))
+    for row in rows:
+        print(line(row))
+
+
+def save_results(path, results):
+    """
+    Saves results of a benchmark run, a list of flat dictionaries, as JSON
+    """
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=4, sort_keys=True)
+
+
+def load_baseline(path):
+    """
+    Loads results of a previous benchmark run
+    :return: A list of dictionaries, or None if no path is given
+    """
+    if path is None:
+        return None
+
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def compare(results, baseline, key_fields, value_field):
+    """
+    Returns a dictionary of a result's key to a ratio of its value to the matching value of a baseline
+    run, e.g. 1.25 means 25% slower than the baseline
+    """
+    if not baseline:
+        return {}
+
+    def key(result):
+        return tuple(result.get(field) for field in key_fields)
+
+    baseline_values = dict((key(result), result.get(value_field)) for result in baseline)
+
+    ratios = {}
+    for result in results:
+        baseline_value = baseline_values.get(key(result))
+        if baseline_value:
+            ratios[key(result)] = result[value_field] / float(baseline_value)
+
+    return ratios
@@ -0,0 +1,354 @@
+"""
+Python API of dbmake, for embedding it into other applications (deploy services, test harnesses etc.)
+
+Unlike the command line commands, API functions print nothing, return result objects
+and raise exceptions derived from DbmakeException:
+
+    import dbmake.api
+
+    manager = dbmake.api.load_migrations("/path/to/migrations")
+    results = dbmake.api.migrate([config_1, config_2], manager, to=1431012345, jobs=4)
+
+    for result in results:
+        print(result.connection_name, result.from_revision, result.to_revision, result.duration)
+
+A loaded migrations set (MigrationsManager) parses the migration files once, and may be reused
+for any number of calls. Targets may be DbConnectionConfig instances, then the API connects
+and disconnects by itself, or already connected database adapters owned by the caller,
+which are left connected.
+"""
+
+import time
+from multiprocessing.pool import ThreadPool
+
+import psycopg2
+
+from . import common
+from . import database
+from . import migrations as migrations_module
+from . import scheduling
+
+
+class StepResult:
+    """
+    Result of a single migration step taken on a database
+    """
+
+    revision = None
+    name = None
+    direction = None
+
+    # Revision the database is at once the step is done
+    to_revision = None
+
+    # Seconds
+    duration = None
+
+    def __init__(self, step):
+        """
+        :param migrations.MigrationStep step:
+        """
+        self.revision = step.migration.revision
+        self.name = step.migration.name
+        self.direction = step.direction
+        self.to_revision = step.revision
+        self.duration = step.duration
+
+
+class TargetResult:
+    """
+    Result of migrating a single database
+    """
+
+    connection_name = None
+    from_revision = None
+    to_revision = None
+
+    # A list of StepResult in the order the steps were taken
+    steps = None
+
+    # Messages the migrations reported while running (resumed statements, backfill progress etc.)
+    messages = None
+
+    # Seconds, connecting included
+    duration = None
+
+    # An exception that stopped migrating of the database, None on success
+    error = None
+
+    def __init__(self, connection_name):
+        self.connection_name = connection_name
+        self.steps = []
+        self.messages = []
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class StatusResult:
+    """
+    Current revision of a single database
+    """
+
+    connection_name = None
+
+    # None if the database has no migrations table
+    revision = None
+    name = None
+    latest_revision = None
+
+    # Number of migrations above the database's revision
+    pending = None
+
+    error = None
+
+    def __init__(self, connection_name):
+        self.connection_name = connection_name
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class _CollectingListener(migrations_module.MigrationListener):
+    """
+    Collects migration progress into a TargetResult instead of printing it
+    """
+
+    def __init__(self, target_result, listener=None):
+        migrations_module.MigrationListener.__init__(self)
+        self._target_result = target_result
+        self._listener = listener
+
+    def on_step_start(self, step):
+        if self._listener is not None:
+            self._listener.on_step_start(step)
+
+    def on_step_finish(self, step):
+        self._target_result.steps.append(StepResult(step))
+        self._target_result.to_revision = step.revision
+
+        if self._listener is not None:
+            self._listener.on_step_finish(step)
+
+    def on_message(self, message):
+        self._target_result.messages.append(message)
+
+        if self._listener is not None:
+            self._listener.on_message(message)
+
+
+def load_migrations(migrations_dir):
+    """
+    Loads migrations of a migrations directory
+    :param migrations_dir: Path to a migrations directory
+    :return: MigrationsManager
+    """
+    return migrations_module.MigrationsManager(migrations_dir).load()
+
+
+def migrate(targets, migrations, to=None, steps=None, jobs=1, dry_run=False, listener=None, raise_on_error=True,
+            lock_timeout=None, order_by_cost=False):
+    """
+    Migrates databases to a revision.
+
+    :param targets: A list of DbConnectionConfig or connected database adapters
+    :param migrations: MigrationsManager or a path to a migrations directory
+    :param to: Revision to migrate to [Default: the latest revision]
+    :param steps: Number of revisions to migrate up (positive) or down (negative) from each
+                  database's current revision, instead of to
+    :param jobs: Number of databases to migrate concurrently
+    :param dry_run: Plan the steps without taking them
+    :param migrations.MigrationListener listener: Additionally receives progress of all databases,
+                  it must be thread safe if jobs > 1
+    :param raise_on_error: Raise MigrationFailed if any database has failed, otherwise only
+                  report the failure in the database's result
+    :param lock_timeout: Seconds to wait for another run that is migrating a database to finish, the database
+                  fails with MigrationLockTimeout then [Default: MigrationLock.DEFAULT_TIMEOUT]
+    :param order_by_cost: Estimate the cost of migrating every database first, and start the most expensive
+                  ones first, so the run takes as little total time as the jobs allow
+    :return: A list of TargetResult in the order of targets
+    :raise MigrationFailed, RevisionNotFound
+    """
+    manager = _manager(migrations)
+
+    if to is not None and steps is not None:
+        raise common.BadCommandArguments("Either a target revision or a number of steps may be set, not both")
+
+    if to is None and steps is None:
+        to = manager.latest_revision()
+    elif to is not None and not manager.is_revision_exists(to):
+        raise common.RevisionNotFound("Error! Target revision's migration file %s was not found!" % to)
+
+    def migrate_target(target):
+        started_at = time.time()
+        result = TargetResult(_connection_name(target))
+        target_listener = _CollectingListener(result, listener)
+
+        try:
+            with _connected(target) as db_adapter:
+                migrations_dao = migrations_module.MigrationsDao(db_adapter)
+
+                if not migrations_dao.is_migration_table_exists():
+                    raise common.MigrationsTableNotFound(
+                        "%s: Error! No migrations table has been found." % result.connection_name)
+
+                result.from_revision = int(migrations_dao.find_most_recent().revision)
+                result.to_revision = result.from_revision
+
+                target_revision = to
+                if steps is not None:
+                    target_revision = manager.relative_revision(result.from_revision, steps)
+
+                manager.migrate_to_revision(target_revision, db_adapter, dry_run, target_listener,
+                                            lock_timeout=lock_timeout)
+        except Exception as e:
+            result.error = e
+
+        result.duration = time.time() - started_at
+
+        return result
+
+    targets = list(targets)
+    if order_by_cost and jobs > 1 and len(targets) > jobs:
+        results = _map(migrate_target, _order_by_cost(targets, manager, to, steps, jobs), jobs)
+        results_by_name = dict((result.connection_name, result) for result in results)
+        results = [results_by_name[_connection_name(target)] for target in targets]
+    else:
+        results = _map(migrate_target, targets, jobs)
+
+    failed = [result for result in results if not result.ok]
+    if failed and raise_on_error:
+        exception = common.MigrationFailed("Failed to migrate %s of %s databases: %s" % (
+            len(failed), len(results), ", ".join(result.connection_name for result in failed)
+        ))
+        exception.results = results
+        raise exception
+
+    return results
+
+
+def status(targets, migrations, jobs=1):
+    """
+    Reads current revisions of databases
+
+    :param targets: A list of DbConnectionConfig or connected database adapters
+    :param migrations: MigrationsManager or a path to a migrations directory
+    :param jobs: Number of databases to query concurrently
+    :return: A list of StatusResult in the order of targets
+    """
+    manager = _manager(migrations)
+    revisions = manager.revisions()
+
+    def target_status(target):
+        result = StatusResult(_connection_name(target))
+        result.latest_revision = revisions[-1] if revisions else None
+
+        try:
+            with _connected(target) as db_adapter:
+                migration_vo = migrations_module.MigrationsDao(db_adapter).find_head()
+
+                if migration_vo is not None:
+                    result.revision = int(migration_vo.revision)
+                    result.name = migration_vo.migration_name
+                    result.pending = len([r for r in revisions if r > result.revision])
+        except common.MigrationsTableNotFound:
+            pass
+        except Exception as e:
+            result.error = e
+
+        return result
+
+    return _map(target_status, targets, jobs)
+
+
+def _order_by_cost(targets, manager, to, steps, jobs):
+    """
+    Orders targets by the estimated cost of migrating them, the most expensive first.
+    Targets whose cost can't be estimated cost nothing, they're going to fail fast anyway.
+    """
+    revisions = manager.revisions()
+
+    def estimate_target(target):
+        try:
+            with _connected(target) as db_adapter:
+                estimate = scheduling.probe(db_adapter, _connection_name(target))
+                db_adapter.rollback()
+        except Exception:
+            return scheduling.CostEstimate(_connection_name(target))
+
+        target_revision = to
+        if steps is not None and estimate.revision is not None:
+            target_revision = manager.relative_revision(int(estimate.revision), steps)
+        if target_revision is not None:
+            estimate.pending = scheduling.pending_count(estimate.revision, target_revision, revisions)
+
+        return estimate
+
+    estimates = scheduling.estimate(_map(estimate_target, targets, jobs))
+
+    return scheduling.lpt_order(targets, [estimate.cost for estimate in estimates])
+
+
+def _manager(migrations):
+    if isinstance(migrations, migrations_module.MigrationsManager):
+        return migrations.load()
+
+    return load_migrations(migrations)
+
+
+def _map(function, targets, jobs):
+    targets = list(targets)
+
+    if jobs <= 1 or len(targets) <= 1:
+        return [function(target) for target in targets]
+
+    pool = ThreadPool(min(jobs, len(targets)))
+    try:
+        return pool.map(function, targets, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _connection_name(target):
+    if isinstance(target, database.DbConnectionConfig):
+        return target.connection_name
+
+    return target.get_db_connection_config().connection_name
+
+
+class _connected:
+    """
+    Context manager yielding a connected adapter of a target. Adapters created here are disconnected
+    on exit, caller's adapters are left connected.
+    """
+
+    def __init__(self, target):
+        self._target = target
+        self._db_adapter = None
+
+    def __enter__(self):
+        if not isinstance(self._target, database.DbConnectionConfig):
+            return self._target
+
+        try:
+            self._db_adapter = database.DbAdapterFactory.create(self._target)
+        except psycopg2.OperationalError as e:
+            raise common.ConnectionFailed("%s: Failed to connect database %s on host %s:%s, user: %s (%s)" % (
+                self._target.connection_name,
+                self._target.dbname,
+                self._target.host,
+                self._target.port,
+                self._target.user,
+                str(e).strip()
+            ))
+
+        return self._db_adapter
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._db_adapter is not None:
+            self._db_adapter.disconnect()
+
+        return False
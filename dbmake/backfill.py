@@ -0,0 +1,208 @@
+import re
+import time
+
+from .common import DbmakeException
+from .migrations import Migration, MigrationProgressDao, MigrationProgressVO, PrintMigrationListener
+from .helper import format_duration, quote_identifier, quote_qualified_name
+
+
+class BackfillMigration(Migration):
+    """
+    A migration that updates a table's rows in key range chunks, each chunk in its own transaction,
+    instead of running one giant UPDATE. A checkpoint is committed with every chunk, so an interrupted
+    backfill continues from the last committed chunk when migrating again.
+
+    A backfill migration file declares the backfill with directives:
+
+        -- DBMAKE: BACKFILL
+        -- DBMAKE: TABLE customers
+        -- DBMAKE: KEY id
+        -- DBMAKE: SET email = lower(email)
+        -- DBMAKE: WHERE email <> lower(email)   [Optional]
+        -- DBMAKE: RANGE 1 50000000              [Optional. Default: min and max values of the key]
+        -- DBMAKE: BATCH SIZE 10000              [Optional. Number of keys per chunk]
+        -- DBMAKE: SLEEP 0.5                     [Optional. Seconds to sleep between chunks]
+
+        -- DBMAKE: SEPARATOR
+
+        -- DBMAKE: MIGRATE DOWN
+        ...
+
+    The "Migrate UP" section holds nothing but the directives, statements there are rejected rather than
+    left unexecuted. Schema changes the backfill needs belong to a migration of their own.
+    """
+
+    PROGRESS_TASK = "backfill"
+
+    # How often (in seconds) to report the backfill progress
+    REPORT_INTERVAL = 5
+
+    table = None
+    key = None
+    set_expression = None
+    where_condition = None
+    key_range = None
+    batch_size = 10000
+    sleep = 0
+
+    def __init__(self, migration_file, directives=None):
+        """
+        :param migration_file: Full path to a migration file including the file's name
+        :param directives: The migration file's directives if they have already been read
+        :raise AttributeError, IOError, DbmakeException
+        """
+        Migration.__init__(self, migration_file, streaming=False, directives=directives)
+
+        for directive in self.directives:
+            if directive.startswith("TABLE "):
+                self.table = directive[len("TABLE "):].strip()
+            elif directive.startswith("KEY "):
+                self.key = directive[len("KEY "):].strip()
+            elif directive.startswith("SET "):
+                self.set_expression = directive[len("SET "):].strip()
+            elif directive.startswith("WHERE "):
+                self.where_condition = directive[len("WHERE "):].strip()
+            elif directive.startswith("RANGE "):
+                result = re.match(r'^RANGE\s+(-?[0-9]+)\s+(-?[0-9]+)$', directive)
+                if result is None:
+                    raise DbmakeException("Error! Bad backfill RANGE in %s" % migration_file)
+                self.key_range = (int(result.group(1)), int(result.group(2)))
+            elif directive.startswith("BATCH SIZE "):
+                self.batch_size = int(directive[len("BATCH SIZE "):])
+            elif directive.startswith("SLEEP "):
+                self.sleep = float(directive[len("SLEEP "):])
+
+        if self.table is None or self.key is None or self.set_expression is None:
+            raise DbmakeException("Error! Backfill %s must declare TABLE, KEY and SET" % migration_file)
+
+        if self.batch_size <= 0:
+            raise DbmakeException("Error! Backfill BATCH SIZE must be positive in %s" % migration_file)
+
+        # The backfill is all the "Migrate UP" section does, statements written there would never run
+        if next(iter(self.compiled.up), None) is not None:
+            raise DbmakeException("Error! Backfill %s can't have statements in its \"Migrate UP\" section, "
+                                  "only directives" % migration_file)
+
+    @property
+    def rehearsable(self):
+        # A backfill commits chunk by chunk, a rehearsal would hold its row locks and sleep in one transaction
+        return False
+
+    def relations(self, migrate_up=True):
+        if migrate_up:
+            return [self.table]
+
+        return Migration.relations(self, migrate_up)
+
+    def migrate(self, db_adapter, listener=None):
+        """
+        Runs the backfill chunk by chunk, resuming from the last checkpoint if there is one
+        :param MigrationListener listener: Receives the progress [Default: PrintMigrationListener]
+        """
+        if listener is None:
+            listener = PrintMigrationListener()
+
+        progress_dao = MigrationProgressDao(db_adapter)
+        progress_dao.create_table()
+
+        key_range = self.key_range
+        if key_range is None:
+            key_range = self._fetch_key_range(db_adapter)
+
+            # An empty table has nothing to backfill
+            if key_range is None:
+                return True
+
+        range_start, range_end = key_range
+
+        progress_vo = progress_dao.find(self.revision, self.PROGRESS_TASK)
+        if progress_vo is None:
+            progress_vo = MigrationProgressVO()
+            progress_vo.revision = self.revision
+            progress_vo.task = self.PROGRESS_TASK
+            progress_vo.checkpoint = range_start - 1
+            progress_vo.rows_done = 0
+        else:
+            progress_vo.checkpoint = int(progress_vo.checkpoint)
+            listener.on_message("Resuming backfill of %s after %s = %s (%s rows done)" % (
+                self.table, self.key, progress_vo.checkpoint, progress_vo.rows_done
+            ))
+
+        # The query is executed with parameters, a literal "%" of the directives must be escaped
+        query = "UPDATE %s SET %s WHERE %s > %%s AND %s <= %%s" % (
+            quote_qualified_name(self.table),
+            self.set_expression.replace('%', '%%'),
+            quote_identifier(self.key),
+            quote_identifier(self.key)
+        )
+        if self.where_condition is not None:
+            query += " AND (%s)" % self.where_condition.replace('%', '%%')
+
+        started_at = time.time()
+        reported_at = started_at
+        first_key = progress_vo.checkpoint
+        first_rows_done = progress_vo.rows_done
+
+        cursor = db_adapter.get_cursor()
+
+        while progress_vo.checkpoint < range_end:
+            chunk_end = min(progress_vo.checkpoint + self.batch_size, range_end)
+            cursor.execute(query, (progress_vo.checkpoint, chunk_end))
+
+            progress_vo.checkpoint = chunk_end
+            progress_vo.rows_done += max(cursor.rowcount, 0)
+            progress_dao.save(progress_vo)
+            db_adapter.commit()
+
+            now = time.time()
+            if now - reported_at >= self.REPORT_INTERVAL or chunk_end == range_end:
+                reported_at = now
+                self._report(listener, progress_vo, first_key, range_end, progress_vo.rows_done - first_rows_done,
+                             now - started_at)
+
+            if self.sleep > 0 and chunk_end < range_end:
+                time.sleep(self.sleep)
+
+        cursor.close()
+
+        # The backfill is done, the next run of the migration (after a rollback) must start over
+        progress_dao.delete(self.revision, self.PROGRESS_TASK)
+        db_adapter.commit()
+
+        return True
+
+    def rollback(self, db_adapter, listener=None):
+        """
+        Applies the migration's "Migrate DOWN" statements and forgets the backfill's checkpoint
+        """
+        progress_dao = MigrationProgressDao(db_adapter)
+        progress_dao.create_table()
+        progress_dao.delete(self.revision, self.PROGRESS_TASK)
+
+        return Migration.rollback(self, db_adapter, listener)
+
+    def _fetch_key_range(self, db_adapter):
+        """
+        Returns the minimum and maximum values of the table's key or None if the table is empty
+        """
+        result = db_adapter.fetch_single_dict("SELECT min(%s) AS range_start, max(%s) AS range_end FROM %s" % (
+            quote_identifier(self.key), quote_identifier(self.key), quote_qualified_name(self.table)
+        ))
+
+        if result is None or result["range_start"] is None:
+            return None
+
+        return int(result["range_start"]), int(result["range_end"])
+
+    def _report(self, listener, progress_vo, first_key, range_end, rows_done, elapsed):
+        """
+        Prints the backfill's throughput and an ETA extrapolated from the share of the key range done so far
+        """
+        done = float(progress_vo.checkpoint - first_key) / max(range_end - first_key, 1)
+        rate = rows_done / elapsed if elapsed > 0 else 0
+        eta = elapsed * (1 - done) / done if done > 0 else 0
+
+        listener.on_message("Backfill %s: %s = %s of %s, %s rows, %.0f rows/s, %.1f%% done, ETA %s" % (
+            self.table, self.key, progress_vo.checkpoint, range_end, progress_vo.rows_done, rate, done * 100,
+            format_duration(eta)
+        ))
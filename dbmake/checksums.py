@@ -0,0 +1,107 @@
+"""
+Content checksums of migration files. A migration's checksum is recorded in the migrations table
+when the migration is applied, so an applied migration file that has been edited afterwards can be
+detected by rehashing the migrations directory.
+"""
+
+import hashlib
+import json
+import mmap
+import multiprocessing
+import os
+
+
+def file_checksum(path):
+    """
+    Returns SHA-256 hex digest of a file's content. The file is memory mapped rather than read,
+    so hashing doesn't copy the file's content into the process' memory.
+    :param path: str
+    :return: str
+    """
+    sha256 = hashlib.sha256()
+
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size > 0:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                sha256.update(buffer)
+            finally:
+                buffer.close()
+
+    return sha256.hexdigest()
+
+
+class ChecksumCache:
+    """
+    Checksums of files of a single directory, persisted in a JSON file. A cached checksum is reused
+    for as long as its file's size and modification time stay the same.
+    """
+
+    # Below that number of files to hash, a process pool costs more than it saves
+    PARALLEL_THRESHOLD = 64
+
+    _cache_file = None
+    _entries = None
+
+    def __init__(self, cache_file):
+        """
+        :param cache_file: Full path to a JSON file to persist the checksums in
+        """
+        self._cache_file = cache_file
+        self._entries = {}
+
+        if os.path.exists(cache_file):
+            try:
+                with open(cache_file, 'r') as f:
+                    self._entries = json.load(f)
+            except ValueError:
+                # A corrupted cache is simply rebuilt
+                self._entries = {}
+
+    def checksums(self, files, processes=None):
+        """
+        Returns checksums of files, rehashing only those that are not cached or have changed.
+        Files are hashed by a pool of processes when there are many of them.
+
+        :param files: A list of full paths to files
+        :param processes: Number of hashing processes [Default: number of CPUs]
+        :return: dict of a file path to its checksum
+        """
+        checksums = {}
+        stale_files = []
+        stats = {}
+
+        for file_ in files:
+            stat = os.stat(file_)
+            stats[file_] = [stat.st_size, stat.st_mtime]
+
+            entry = self._entries.get(os.path.basename(file_))
+            if entry is not None and entry[:2] == stats[file_]:
+                checksums[file_] = entry[2]
+            else:
+                stale_files.append(file_)
+
+        if len(stale_files) >= self.PARALLEL_THRESHOLD:
+            pool = multiprocessing.Pool(processes)
+            try:
+                stale_checksums = pool.map(file_checksum, stale_files, chunksize=16)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            stale_checksums = [file_checksum(file_) for file_ in stale_files]
+
+        for file_, checksum in zip(stale_files, stale_checksums):
+            checksums[file_] = checksum
+            self._entries[os.path.basename(file_)] = stats[file_] + [checksum]
+
+        return checksums
+
+    def save(self):
+        """
+        Atomically replaces the cache file with the current checksums
+        """
+        temporary_file = self._cache_file + ".tmp"
+        with open(temporary_file, 'w') as f:
+            json.dump(self._entries, f)
+        os.rename(temporary_file, self._cache_file)
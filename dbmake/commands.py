@@ -2,11 +2,23 @@ import os
 import time
 import getpass
 import psycopg2
+from multiprocessing.pool import ThreadPool
+from . import checksums
 from . import database
 from . import db_tasks
+from . import lint
+from . import metrics
 from . import migrations
+from . import profiling
+from . import progress
+from . import rollout
+from . import snapshots
+from . import tenants
 from .common import MIGRATIONS_TABLE, BadCommandArguments, FAILURE, SUCCESS, DBMAKE_CONFIG_DIR, \
-    DBMAKE_CONFIG_FILE, ZERO_MIGRATION_FILE_NAME, ZERO_MIGRATION_NAME, DOCUMENTATION_DIR
+    DBMAKE_CONFIG_FILE, ZERO_MIGRATION_FILE_NAME, ZERO_MIGRATION_NAME, DOCUMENTATION_DIR, CHECKSUMS_CACHE_FILE, \
+    MigrationsTableNotFound, MigrationLockTimeout, ROLLOUT_STATE_FILE, SNAPSHOTS_DIR, DbmakeException
+from .helper import format_duration
+from .impact import format_size
 
 
 class BaseCommand:
@@ -62,7 +74,8 @@ class Init(BaseCommand):
             self.db_name,
             self.db_user,
             self.db_pass,
-            self.connection_name
+            self.connection_name,
+            self.db_port if self.db_port is not None else database.DbConnectionConfig.port
         )
 
         # Check connection parameters by establishing a connection to db
@@ -146,6 +159,7 @@ class Init(BaseCommand):
             migration_vo = migrations.MigrationVO()
             migration_vo.revision = 0
             migration_vo.migration_name = ZERO_MIGRATION_NAME
+            migration_vo.checksum = checksums.file_checksum(zero_migration_file)
 
             # Save the new migration record
             migration_dao = migrations.MigrationsDao(db_adapter)
@@ -157,7 +171,11 @@ class Init(BaseCommand):
             #    db_adapter
             # )
             migrations_manager = migrations.MigrationsManager(self.migrations_dir)
-            result = migrations_manager.migrate_to_revision(0, db_adapter)
+            try:
+                result = migrations_manager.migrate_to_revision(0, db_adapter)
+            except MigrationLockTimeout as e:
+                print("%s: %s" % (self.db_connection_config.connection_name, e))
+                return FAILURE
 
             if result is False:
                 print("Error! Failed to apply MIGRATION-ZERO.")
@@ -311,11 +329,23 @@ class Migrate(BaseCommand):
     dry_run = False
     migration_direction = _MIGRATE_UP
     migration_steps = None
+    progress_interval = None
+    impact_report = False
+    rehearse = False
+    lock_profile = False
+    lock_timeout = None
+    tenants_pattern = None
+    init_tenants = False
+    jobs = tenants.DEFAULT_JOBS
+    use_snapshots = False
+    online_ddl = False
 
     def execute(self):
 
         if self.dry_run:
             print("Running DRY")
+        elif self.rehearse or self.lock_profile:
+            print("Rehearsing, all changes will be rolled back")
 
         if self.migrations_dir is None:
             self.migrations_dir = os.path.abspath(os.getcwd())
@@ -335,88 +365,193 @@ class Migrate(BaseCommand):
 
         migrations_manager = migrations.MigrationsManager(self.migrations_dir)
         revisions = migrations_manager.revisions()
+        result = SUCCESS
 
-        for db_connection_config in connections_configs:
+        if self.tenants_pattern is not None:
+            return self._migrate_tenants(connections_configs, migrations_manager)
 
-            # If migration direction is UP and a schema has no migration yet
-            # then the ZERO-MIGRATION must be applied first before applying
-            # following migrations
-            apply_zero_migration = False
+        use_snapshots = self.use_snapshots and not (self.dry_run or self.rehearse or self.lock_profile)
+        if use_snapshots:
+            fingerprints = snapshots.fingerprints(migrations_manager, self.migrations_dir)
 
-            try:
-                db_adapter = database.DbAdapterFactory.create(db_connection_config)
-            except psycopg2.OperationalError as e:
-                print("%s: Failed to connect database %s on host %s:%s, user: %s" % (
-                        db_connection_config.connection_name,
-                        db_connection_config.db_name,
-                        db_connection_config.host,
-                        db_connection_config.port,
-                        db_connection_config.user
-                     ))
-                print(e.message.decode())
-                continue
+        for db_connection_config in connections_configs:
+            with profiling.section(db_connection_config.connection_name):
+                # If migration direction is UP and a schema has no migration yet
+                # then the ZERO-MIGRATION must be applied first before applying
+                # following migrations
+                apply_zero_migration = False
+
+                try:
+                    db_adapter = metrics.connect(db_connection_config)
+                except psycopg2.OperationalError as e:
+                    print("%s: Failed to connect database %s on host %s:%s, user: %s" % (
+                            db_connection_config.connection_name,
+                            db_connection_config.dbname,
+                            db_connection_config.host,
+                            db_connection_config.port,
+                            db_connection_config.user
+                         ))
+                    print(str(e).strip())
+                    continue
 
-            migrations_dao = migrations.MigrationsDao(db_adapter)
+                migrations_dao = migrations.MigrationsDao(db_adapter)
 
-            if migrations_dao.is_migration_table_exists() is True:
+                if migrations_dao.is_migration_table_exists() is True:
 
-                # Find current migration
-                recent_migration_vo = migrations_dao.find_most_recent()
-                current_revision = int(recent_migration_vo.revision)
+                    # Find current migration
+                    recent_migration_vo = migrations_dao.find_most_recent()
+                    current_revision = int(recent_migration_vo.revision)
 
-                # Find target revision
-                if self.target_revision is None and self.migration_steps is None:
-                    target_revision = migrations_manager.latest_revision()
+                    # Find target revision
+                    if self.target_revision is None and self.migration_steps is None:
+                        target_revision = migrations_manager.latest_revision()
 
-                elif self.target_revision is not None:
-                    target_revision = self.target_revision
+                    elif self.target_revision is not None:
+                        target_revision = self.target_revision
 
-                    if not migrations_manager.is_revision_exists(target_revision):
-                        print("Error! Target revision's migration file %s was not found!" % target_revision)
-                        return FAILURE
+                        if not migrations_manager.is_revision_exists(target_revision):
+                            print("Error! Target revision's migration file %s was not found!" % target_revision)
+                            return FAILURE
 
-                elif self.migration_steps is not None:
+                    elif self.migration_steps is not None:
 
-                    if current_revision not in revisions:
-                        print("%s: Error! Current revision's migration wasn't found." \
-                                % db_connection_config.connection_name)
-                        return FAILURE
+                        if current_revision not in revisions:
+                            print("%s: Error! Current revision's migration wasn't found." \
+                                    % db_connection_config.connection_name)
+                            return FAILURE
+                        else:
+                            current_index = revisions.index(current_revision)
+
+                            if (
+                                self.migration_direction == self._MIGRATE_UP
+                                and (current_index + self.migration_steps) >= len(revisions)
+                            ):
+                                # If number of steps exceed size of revisions list, and migration direction is UP,
+                                # then set target revision to the latest one
+                                target_revision = revisions[-1]
+                            elif (
+                                self.migration_direction == self._MIGRATE_DOWN
+                                and (current_index - self.migration_steps) < 0
+                            ):
+                                # If number of steps exceed the zero index of a revisions list, and migration
+                                # direction is DOWN, then set target revision to the latest one
+                                target_revision = 0
+                            elif self.migration_direction == self._MIGRATE_UP:
+                                target_revision = revisions[current_index + self.migration_steps]
+                            elif self.migration_direction == self._MIGRATE_DOWN:
+                                target_revision = revisions[current_index - self.migration_steps]
+                            else:
+                                print("%s: Error! Can't define target revision" % db_connection_config.connection_name)
+                                return FAILURE
+
+                    # Migrate...
+                    print ("%s: Migrating... (target revision:  %s)" % (db_connection_config.connection_name,
+                                                                        target_revision))
+                    listener = metrics.listener(db_connection_config.connection_name)
+
+                    if use_snapshots:
+                        snapshot_cache = snapshots.SnapshotCache.for_connection(
+                            self.migrations_dir, db_connection_config.connection_name
+                        )
+
+                        # Jumping down to a snapshot replaces rolling the migrations back
+                        snapshot = None
+                        if target_revision < current_revision:
+                            snapshot = snapshot_cache.get(target_revision, fingerprints[target_revision])
+
+                        if snapshot is not None:
+                            db_adapter.disconnect()
+                            if snapshots.restore(db_connection_config, snapshot):
+                                print("Restored the snapshot of revision %s" % target_revision)
+                                metrics.revision(db_connection_config.connection_name, target_revision, revisions)
+                            else:
+                                print("%s: Error! Failed to restore the snapshot of revision %s" % (
+                                    db_connection_config.connection_name, target_revision
+                                ))
+                                result = FAILURE
+                            print("-" * 20)
+                            continue
+
+                        listener = snapshots.SnapshotListener(snapshot_cache, fingerprints, db_connection_config,
+                                                              listener)
+
+                    try:
+                        with progress.monitor(db_connection_config, db_adapter, listener, self.progress_interval):
+                            migrations_manager.migrate_to_revision(
+                                target_revision, db_adapter, self.dry_run, listener, self.impact_report,
+                                self.rehearse, self.lock_profile, self.lock_timeout, self.online_ddl
+                            )
+                    except MigrationLockTimeout as e:
+                        print("%s: %s" % (db_connection_config.connection_name, e))
+                        result = FAILURE
                     else:
-                        current_index = revisions.index(current_revision)
+                        if not self.dry_run and not self.rehearse and not self.lock_profile:
+                            metrics.revision(db_connection_config.connection_name, target_revision, revisions)
+                    print("-" * 20)
+                else:
+                    print("%s: Error! No migrations table has been found." % db_connection_config.connection_name)
 
-                        if (
-                            self.migration_direction == self._MIGRATE_UP
-                            and (current_index + self.migration_steps) >= len(revisions)
-                        ):
-                            # If number of steps exceed size of revisions list, and migration direction is UP,
-                            # then set target revision to the latest one
-                            target_revision = revisions[-1]
-                        elif (
-                            self.migration_direction == self._MIGRATE_DOWN
-                            and (current_index - self.migration_steps) < 0
-                        ):
-                            # If number of steps exceed the zero index of a revisions list, and migration
-                            # direction is DOWN, then set target revision to the latest one
-                            target_revision = 0
-                        elif self.migration_direction == self._MIGRATE_UP:
-                            target_revision = revisions[current_index + self.migration_steps]
-                        elif self.migration_direction == self._MIGRATE_DOWN:
-                            target_revision = revisions[current_index - self.migration_steps]
-                        else:
-                            print("%s: Error! Can't define target revision" % db_connection_config.connection_name)
-                            return FAILURE
+                db_adapter.disconnect()
 
-                # Migrate...
-                print ("%s: Migrating... (target revision:  %s)" % (db_connection_config.connection_name,
-                                                                    target_revision))
-                migrations_manager.migrate_to_revision(target_revision, db_adapter, self.dry_run)
+        return result
+
+    def _migrate_tenants(self, connections_configs, migrations_manager):
+        """
+        Migrates tenant schemas of every database instead of the databases themselves
+        """
+        if self.target_revision is not None and not migrations_manager.is_revision_exists(self.target_revision):
+            print("Error! Target revision's migration file %s was not found!" % self.target_revision)
+            return FAILURE
+
+        steps = self.migration_steps
+        if steps is not None and self.migration_direction == self._MIGRATE_DOWN:
+            steps = -steps
+
+        result = SUCCESS
+
+        for db_connection_config in connections_configs:
+            with profiling.section(db_connection_config.connection_name):
+                print("%s: Migrating tenants %s..." % (db_connection_config.connection_name, self.tenants_pattern))
+
+                tenant_migrator = tenants.TenantMigrator(db_connection_config, migrations_manager, self.jobs,
+                                                         migrations.PrintMigrationListener(), self.init_tenants)
+                started_at = time.time()
+                try:
+                    tenant_results = tenant_migrator.migrate(self.tenants_pattern, self.target_revision, steps,
+                                                             self.dry_run)
+                except psycopg2.OperationalError as e:
+                    print("%s: Failed to connect database %s on host %s:%s, user: %s" % (
+                        db_connection_config.connection_name,
+                        db_connection_config.dbname,
+                        db_connection_config.host,
+                        db_connection_config.port,
+                        db_connection_config.user
+                    ))
+                    print(str(e).strip())
+                    result = FAILURE
+                    continue
+
+                if self.dry_run:
+                    for tenant_result in tenant_results:
+                        if tenant_result.steps > 0:
+                            print(tenant_result)
+
+                failed = [tenant_result for tenant_result in tenant_results if not tenant_result.ok]
+                print("%s: %s tenants, %s %s, %s skipped, %s failed, took %s" % (
+                    db_connection_config.connection_name,
+                    len(tenant_results),
+                    len([tenant_result for tenant_result in tenant_results if tenant_result.steps > 0]),
+                    "to migrate" if self.dry_run else "migrated",
+                    len([tenant_result for tenant_result in tenant_results if tenant_result.skipped is not None]),
+                    len(failed),
+                    format_duration(time.time() - started_at)
+                ))
                 print("-" * 20)
-            else:
-                print("%s: Error! No migrations table has been found." % db_connection_config.connection_name)
 
-            db_adapter.disconnect()
+                if failed:
+                    result = FAILURE
 
-        return SUCCESS
+        return result
 
     def print_help(self):
         # --no-dump               Don't dump database structure into ZERO MIGRATION file
@@ -435,13 +570,38 @@ class Migrate(BaseCommand):
             --up=<steps>                          Number of revisions to migrate UP
             --down=<steps>                        Number of revisions to migrate DOWN (rollback)
             -d, --dry-run                         Dry run (print commands, but do not execute)
-        """ % (DBMAKE_CONFIG_FILE, DBMAKE_CONFIG_DIR))
+            --progress[=<seconds>]                Report progress of long-running statements (CREATE INDEX,
+                                                  CLUSTER, VACUUM, ...) every <seconds> [Default: %s]
+            --impact                              Report tables each migration created, dropped, rewritten or
+                                                  resized, and store the report in the migrations table
+            --rehearse                            Run the migrations in a transaction and roll it back, reporting
+                                                  their impact. Non-transactional migrations are skipped
+            --lock-profile                        Rehearse the migrations statement by statement and report which
+                                                  locks each of them takes, for how long and what traffic they block
+            --lock-timeout=<seconds>              How long to wait for another dbmake run that is migrating the same
+                                                  database to finish [Default: %s]
+            --tenants=<pattern>                   Migrate every schema matching <pattern> (e.g. "tenant_*") as
+                                                  a tenant with a migrations table of its own
+            --init-tenants                        Create migrations tables of tenants that have none, recorded
+                                                  at the ZERO-MIGRATION
+            -j <n>, --jobs=<n>                    Number of tenants to migrate concurrently [Default: %s]
+            --snapshots                           Snapshot the database after every migration UP, and restore
+                                                  a snapshot instead of migrating DOWN when there is one.
+                                                  Restoring recreates the database, for dev and CI databases only
+            --online-ddl                          Rewrite statements that lock existing tables (CREATE INDEX,
+                                                  ADD CONSTRAINT, SET NOT NULL) into their low-lock forms and
+                                                  run them statement by statement. A dry run shows the rewrites
+        """ % (DBMAKE_CONFIG_FILE, DBMAKE_CONFIG_DIR, progress.DEFAULT_INTERVAL,
+               migrations.MigrationLock.DEFAULT_TIMEOUT, tenants.DEFAULT_JOBS))
 
     def _parse_options(self, args):
 
         options = ['-m', '--migration-dir', '--migrations-dir=', '-c',
                    '--connection', '--connection=', '-r', '--revision', '--revision=',
-                   '--up', '--up=', '--down', '--down=', '-d', '--dry-run']
+                   '--up', '--up=', '--down', '--down=', '-d', '--dry-run', '--progress', '--progress=',
+                   '--impact', '--rehearse', '--lock-profile', '--lock-timeout', '--lock-timeout=',
+                   '--tenants', '--tenants=', '--init-tenants', '-j', '--jobs', '--jobs=', '--snapshots',
+                   '--online-ddl']
 
         while len(args) > 0:
             # Parse optional [(-m | --migrations-dir) <path>]
@@ -508,6 +668,78 @@ class Migrate(BaseCommand):
                 args.pop(0)
                 self.dry_run = True
 
+            # Parse optional [--progress[=<seconds>]]
+            elif args[0] == '--progress':
+                args.pop(0)
+                self.progress_interval = progress.DEFAULT_INTERVAL
+
+            elif args[0].startswith("--progress="):
+                self.progress_interval = abs(float(args[0].split('=')[1]))
+                args.pop(0)
+
+            # Parse optional [--impact]
+            elif args[0] == '--impact':
+                args.pop(0)
+                self.impact_report = True
+
+            # Parse optional [--rehearse]
+            elif args[0] == '--rehearse':
+                args.pop(0)
+                self.rehearse = True
+
+            # Parse optional [--lock-profile]
+            elif args[0] == '--lock-profile':
+                args.pop(0)
+                self.lock_profile = True
+
+            # Parse optional [--lock-timeout=<seconds>]
+            elif args[0] == '--lock-timeout':
+                if len(args) < 2:
+                    raise BadCommandArguments
+                args.pop(0)
+                self.lock_timeout = abs(float(args.pop(0)))
+
+            elif args[0].startswith("--lock-timeout="):
+                self.lock_timeout = abs(float(args[0].split('=')[1]))
+                args.pop(0)
+
+            # Parse optional [--tenants=<pattern>]
+            elif args[0] == '--tenants':
+                if len(args) < 2:
+                    raise BadCommandArguments
+                args.pop(0)
+                self.tenants_pattern = str(args.pop(0))
+
+            elif args[0].startswith("--tenants="):
+                self.tenants_pattern = str(args[0].split('=', 1)[1])
+                args.pop(0)
+
+            # Parse optional [--init-tenants]
+            elif args[0] == '--init-tenants':
+                args.pop(0)
+                self.init_tenants = True
+
+            # Parse optional [(-j | --jobs)]
+            elif args[0] == '-j' or args[0] == '--jobs':
+                if len(args) < 2:
+                    raise BadCommandArguments
+                args.pop(0)
+                self.jobs = abs(int(args.pop(0)))
+
+            elif args[0].startswith("--jobs="):
+                self.jobs = abs(int(args[0].split('=')[1]))
+                args.pop(0)
+
+            # Parse optional [--snapshots]
+            elif args[0] == '--snapshots':
+                args.pop(0)
+                self.use_snapshots = True
+
+            # Parse optional [--online-ddl]
+            elif args[0] == '--online-ddl':
+                args.pop(0)
+                self.online_ddl = True
+
             elif args[0] not in options:
                 raise BadCommandArguments
 
@@ -546,37 +778,42 @@ class Status(BaseCommand):
             print("Failed to read config file")
             return FAILURE
 
+        # Revisions of the migrations directory tell how many migrations every database is behind
+        revisions = migrations.MigrationsManager(self.migrations_dir).revisions()
+
         for db_connection_config in connections_configs:
-            try:
-                db_adapter = database.DbAdapterFactory.create(db_connection_config)
-            except psycopg2.OperationalError as e:
-                print("%s: Failed to connect database %s on host %s:%s, user: %s" % (
-                        db_connection_config.connection_name,
-                        db_connection_config.dbname,
-                        db_connection_config.host,
-                        db_connection_config.port,
-                        db_connection_config.user
-                     ))
+            with profiling.section(db_connection_config.connection_name):
+                try:
+                    db_adapter = metrics.connect(db_connection_config)
+                except psycopg2.OperationalError as e:
+                    print("%s: Failed to connect database %s on host %s:%s, user: %s" % (
+                            db_connection_config.connection_name,
+                            db_connection_config.dbname,
+                            db_connection_config.host,
+                            db_connection_config.port,
+                            db_connection_config.user
+                         ))
 
-                # Continue to a next connection
-                continue
+                    # Continue to a next connection
+                    continue
 
-            migrations_dao = migrations.MigrationsDao(db_adapter)
+                migrations_dao = migrations.MigrationsDao(db_adapter)
 
-            if migrations_dao.is_migration_table_exists() is True:
-                last_migration = migrations_dao.find_most_recent()
+                try:
+                    last_migration = migrations_dao.find_head()
 
-                if last_migration is None:
-                    print("%s: No migrations" % db_connection_config.connection_name)
-                else:
-                    print("%s: Revision %s" % (
-                            db_connection_config.connection_name,
-                            last_migration.revision
-                         ))
-            else:
-                print("%s: Error! No migrations table were found." % db_connection_config.connection_name)
+                    if last_migration is None:
+                        print("%s: No migrations" % db_connection_config.connection_name)
+                    else:
+                        metrics.revision(db_connection_config.connection_name, last_migration.revision, revisions)
+                        print("%s: Revision %s" % (
+                                db_connection_config.connection_name,
+                                last_migration.revision
+                             ))
+                except MigrationsTableNotFound:
+                    print("%s: Error! No migrations table were found." % db_connection_config.connection_name)
 
-            db_adapter.disconnect()
+                db_adapter.disconnect()
 
         return SUCCESS
 
@@ -770,58 +1007,67 @@ class Rollback(BaseCommand):
 
         migrations_manager = migrations.MigrationsManager(self.migrations_dir)
         revisions = migrations_manager.revisions()
+        result = SUCCESS
 
         for db_connection_config in connections_configs:
+            with profiling.section(db_connection_config.connection_name):
+                try:
+                    db_adapter = metrics.connect(db_connection_config)
+                except psycopg2.OperationalError as e:
+                    print("%s: Failed to connect database %s on host %s:%s, user: %s" % (
+                            db_connection_config.connection_name,
+                            db_connection_config.dbname,
+                            db_connection_config.host,
+                            db_connection_config.port,
+                            db_connection_config.user
+                         ))
+                    print(str(e).strip())
+                    continue
 
-            try:
-                db_adapter = database.DbAdapterFactory.create(db_connection_config)
-            except psycopg2.OperationalError as e:
-                print("%s: Failed to connect database %s on host %s:%s, user: %s" % (
-                        db_connection_config.connection_name,
-                        db_connection_config.db_name,
-                        db_connection_config.host,
-                        db_connection_config.port,
-                        db_connection_config.user
-                     ))
-                print(e.message.decode())
-                continue
+                migrations_dao = migrations.MigrationsDao(db_adapter)
 
-            migrations_dao = migrations.MigrationsDao(db_adapter)
+                if migrations_dao.is_migration_table_exists() is True:
 
-            if migrations_dao.is_migration_table_exists() is True:
+                    # Find current migration
+                    recent_migration_vo = migrations_dao.find_most_recent()
+                    current_revision = int(recent_migration_vo.revision)
 
-                # Find current migration
-                recent_migration_vo = migrations_dao.find_most_recent()
-                current_revision = int(recent_migration_vo.revision)
+                    # Find target revision
+                    if current_revision not in revisions:
+                        print("%s: Error! Current revision's migration wasn't found."
+                              % db_connection_config.connection_name)
+                        return FAILURE
+                    else:
+                        current_index = revisions.index(current_revision)
 
-                # Find target revision
-                if current_revision not in revisions:
-                    print("%s: Error! Current revision's migration wasn't found."
-                          % db_connection_config.connection_name)
-                    return FAILURE
-                else:
-                    current_index = revisions.index(current_revision)
+                        if (current_index - 1) < 0:
+                            # If number of steps exceed the zero index of a revisions list, and migration
+                            # direction is DOWN, then set target revision to the latest one
+                            target_revision = 0
+                        else:
+                            target_revision = revisions[current_index - 1]
 
-                    if (current_index - 1) < 0:
-                        # If number of steps exceed the zero index of a revisions list, and migration
-                        # direction is DOWN, then set target revision to the latest one
-                        target_revision = 0
+                    # Migrate...
+                    print("%s: Rolling back... (target revision:  %s)" % (
+                            db_connection_config.connection_name,
+                            target_revision
+                         ))
+                    listener = metrics.listener(db_connection_config.connection_name)
+                    try:
+                        migrations_manager.migrate_to_revision(target_revision, db_adapter, self.dry_run, listener)
+                    except MigrationLockTimeout as e:
+                        print("%s: %s" % (db_connection_config.connection_name, e))
+                        result = FAILURE
                     else:
-                        target_revision = revisions[current_index - 1]
-
-                # Migrate...
-                print("%s: Rolling back... (target revision:  %s)" % (
-                        db_connection_config.connection_name,
-                        target_revision
-                     ))
-                migrations_manager.migrate_to_revision(target_revision, db_adapter, self.dry_run)
-                print("-" * 20)
-            else:
-                print("%s: Error! No migrations table has been found." % db_connection_config.connection_name)
+                        if not self.dry_run:
+                            metrics.revision(db_connection_config.connection_name, target_revision, revisions)
+                    print("-" * 20)
+                else:
+                    print("%s: Error! No migrations table has been found." % db_connection_config.connection_name)
 
-            db_adapter.disconnect()
+                db_adapter.disconnect()
 
-        return SUCCESS
+        return result
 
     def print_help(self):
         print("""
@@ -1062,7 +1308,11 @@ class Create(BaseCommand):
                 return FAILURE
 
             migrations_manager = migrations.MigrationsManager(migrations_dir)
-            result = migrations_manager.migrate_to_revision(migrations_manager.latest_revision(), db_adapter)
+            try:
+                result = migrations_manager.migrate_to_revision(migrations_manager.latest_revision(), db_adapter)
+            except MigrationLockTimeout as e:
+                print("%s: %s" % (db_connection_config.connection_name, e))
+                return FAILURE
 
             if not result:
                 print("Error! Failed to migrate...")
@@ -1277,6 +1527,805 @@ class Create(BaseCommand):
              ))
 
 
+class CloneSchema(BaseCommand):
+
+    source_connection_name = None
+    target_connection_names = None
+    migrations_dir = None
+
+    def execute(self):
+
+        if self.migrations_dir is None:
+            self.migrations_dir = os.path.abspath(os.getcwd())
+
+        config_file = self.migrations_dir + os.sep + DBMAKE_CONFIG_DIR + os.sep + DBMAKE_CONFIG_FILE
+
+        try:
+            source_config = database.DbConnectionConfig.read(config_file, self.source_connection_name)
+        except IOError:
+            print("Error! Failed to read a config file.")
+            return FAILURE
+
+        if source_config is False:
+            print("Error! A connection with name %s doesn't exist." % self.source_connection_name)
+            return FAILURE
+
+        # Every target must be an existing and yet empty database
+        targets_configs = []
+        for target_connection_name in self.target_connection_names:
+            target_config = database.DbConnectionConfig.read(config_file, target_connection_name)
+
+            if target_config is False:
+                print("Error! A connection with name %s doesn't exist." % target_connection_name)
+                return FAILURE
+
+            try:
+                target_adapter = database.DbAdapterFactory.create(target_config)
+            except psycopg2.OperationalError as e:
+                print("%s: Failed to connect database %s on host %s:%s, user: %s" % (
+                        target_config.connection_name,
+                        target_config.dbname,
+                        target_config.host,
+                        target_config.port,
+                        target_config.user
+                     ))
+                return FAILURE
+
+            target_tables = target_adapter.get_tables()
+            target_adapter.disconnect()
+
+            if len(target_tables) > 0:
+                print("%s: Error! Database is not empty." % target_connection_name)
+                return FAILURE
+
+            targets_configs.append(target_config)
+
+        try:
+            source_adapter = database.DbAdapterFactory.create(source_config)
+        except psycopg2.OperationalError as e:
+            print("Failed to connect to the source database.")
+            return FAILURE
+
+        db_tasks_factory = db_tasks.AbstractDbTasksFactory.create(database.DbType.POSTGRES)
+        clone_schema_task = db_tasks_factory.create(db_tasks.DbTaskType.CLONE_SCHEMA, source_config, source_adapter)
+        cloned = clone_schema_task.execute(targets_configs)
+        source_adapter.disconnect()
+
+        print("Cloned into %s of %s databases" % (len(cloned), len(targets_configs)))
+
+        if len(cloned) != len(targets_configs):
+            return FAILURE
+
+        return SUCCESS
+
+    def print_help(self):
+        print("""
+        usage: dbmake clone-schema (-s | --source) <connection name> ((-t | --target) <connection name>)+ [options]
+
+        Pipes a schema-only dump of the source database straight into every target database and
+        stamps the targets with the source's schema revision. The source is dumped once no matter
+        how many targets are given, and the dump never touches the disk.
+
+        Note:
+        Target databases must exist, be empty and have their connection details added to dbmake.
+
+        Options:
+            -m, --migrations-dir    Where migrations reside
+
+        Required options:
+            -s, --source            Connection name of a database to clone the schema from
+            -t, --target            Connection name of a database to clone the schema into (repeatable)
+        """)
+
+    def _parse_options(self, args):
+
+        options = [
+            '-m', '--migrations-dir', '--migrations-dir=',
+            '-s', '--source', '--source=',
+            '-t', '--target', '--target='
+        ]
+
+        self.target_connection_names = []
+
+        while len(args) > 0:
+            # Parse optional [(-m | --migrations-dir) <path>]
+            if args[0] == '-m' or args[0] == '--migrations-dir':
+                if len(args) < 2:
+                    raise BadCommandArguments
+                args.pop(0)
+                self.migrations_dir = str(args.pop(0))
+
+            elif args[0].startswith("--migrations-dir="):
+                self.migrations_dir = str(args[0].split('=')[1])
+                args.pop(0)
+
+            # Parse (-s | --source) <connection name>
+            elif args[0] == '-s' or args[0] == '--source':
+                if len(args) < 2:
+                    raise BadCommandArguments
+                args.pop(0)
+                self.source_connection_name = str(args.pop(0))
+
+            elif args[0].startswith("--source="):
+                self.source_connection_name = str(args[0].split('=')[1])
+                args.pop(0)
+
+            # Parse (-t | --target) <connection name>
+            elif args[0] == '-t' or args[0] == '--target':
+                if len(args) < 2:
+                    raise BadCommandArguments
+                args.pop(0)
+                self.target_connection_names.append(str(args.pop(0)))
+
+            elif args[0].startswith("--target="):
+                self.target_connection_names.append(str(args[0].split('=')[1]))
+                args.pop(0)
+
+            elif args[0] not in options:
+                raise BadCommandArguments
+
+        if self.source_connection_name is None or len(self.target_connection_names) == 0:
+            raise BadCommandArguments
+
+        if self.source_connection_name in self.target_connection_names:
+            raise BadCommandArguments
+
+        print(self.__repr__())
+
+    def __repr__(self):
+        return "source_conn_name=%s, target_conn_names=%s" % (
+            self.source_connection_name, ",".join(self.target_connection_names)
+        )
+
+
+class Verify(BaseCommand):
+
+    connection_name = None
+    migrations_dir = None
+    jobs = 8
+
+    def execute(self):
+
+        if self.migrations_dir is None:
+            self.migrations_dir = os.path.abspath(os.getcwd())
+
+        # Get database connection\s configurations
+        connections_configs = []
+        if self.connection_name is not None:
+            config_file = self.migrations_dir + os.sep + DBMAKE_CONFIG_DIR + os.sep + DBMAKE_CONFIG_FILE
+            connections_configs.append(database.DbConnectionConfig.read(config_file, self.connection_name))
+        else:
+            config_file = self.migrations_dir + os.sep + DBMAKE_CONFIG_DIR + os.sep + DBMAKE_CONFIG_FILE
+            connections_configs = database.DbConnectionConfig.read_all(config_file)
+
+        if connections_configs is False or connections_configs[0] is False:
+            print("Failed to read config file")
+            return FAILURE
+
+        # Hash the migrations directory, reusing cached checksums of unchanged files
+        migrations_manager = migrations.MigrationsManager(self.migrations_dir)
+        migration_files = dict(migrations_manager.migration_files())
+
+        checksum_cache = checksums.ChecksumCache(
+            self.migrations_dir + os.sep + DBMAKE_CONFIG_DIR + os.sep + CHECKSUMS_CACHE_FILE
+        )
+        files_checksums = checksum_cache.checksums(list(migration_files.values()))
+        checksum_cache.save()
+
+        def _verify(db_connection_config):
+            """
+            Compares checksums recorded in a database against the migrations directory's ones
+            :return: A list of error messages
+            """
+            try:
+                db_adapter = database.DbAdapterFactory.create(db_connection_config)
+            except psycopg2.OperationalError as e:
+                return ["Failed to connect database %s on host %s:%s, user: %s" % (
+                    db_connection_config.dbname,
+                    db_connection_config.host,
+                    db_connection_config.port,
+                    db_connection_config.user
+                )]
+
+            try:
+                recorded_checksums = migrations.MigrationsDao(db_adapter).find_checksums()
+            except psycopg2.Error as e:
+                return ["Failed to read the migrations table: %s" % str(e).strip()]
+            finally:
+                db_adapter.disconnect()
+
+            errors = []
+            for revision in sorted(recorded_checksums):
+                if revision not in migration_files:
+                    errors.append("Revision %s: Applied migration file is missing" % revision)
+                elif (
+                    recorded_checksums[revision] is not None
+                    and recorded_checksums[revision] != files_checksums[migration_files[revision]]
+                ):
+                    errors.append("Revision %s: %s has been modified since it was applied" % (
+                        revision, os.path.basename(migration_files[revision])
+                    ))
+
+            return errors
+
+        def _profiled_verify(db_connection_config):
+            with profiling.section(db_connection_config.connection_name):
+                return _verify(db_connection_config)
+
+        pool = ThreadPool(max(min(self.jobs, len(connections_configs)), 1))
+        try:
+            results = pool.map(_profiled_verify, connections_configs)
+        finally:
+            pool.close()
+            pool.join()
+
+        result = SUCCESS
+        for db_connection_config, errors in zip(connections_configs, results):
+            if len(errors) == 0:
+                print("%s: OK" % db_connection_config.connection_name)
+                continue
+
+            result = FAILURE
+            for error in errors:
+                print("%s: Error! %s" % (db_connection_config.connection_name, error))
+
+        return result
+
+    def print_help(self):
+        print("""
+        usage: dbmake verify [options]
+
+        Checks that migration files applied on database(s) haven't been modified since they were applied,
+        by comparing checksums recorded in the migrations table against the migrations directory.
+
+        Note:
+        If connection name is not provided, the command will verify all connections
+        initialized in the migrations directory.
+
+        Options:
+            -m, --migrations-dir    Where migrations reside
+            -c, --connection        Connection name of a database to verify
+            -j, --jobs              Number of databases to verify concurrently [Default: 8]
+        """)
+
+    def _parse_options(self, args):
+
+        options = ['-m', '--migrations-dir', '--migrations-dir=', '-c', '--connection', '--connection=',
+                   '-j', '--jobs', '--jobs=']
+
+        while len(args) > 0:
+            # Parse optional [(-m | --migrations-dir) <path>]
+            if args[0] == '-m' or args[0] == '--migrations-dir':
+                if len(args) < 2:
+                    raise BadCommandArguments
+                args.pop(0)
+                self.migrations_dir = str(args.pop(0))
+
+            elif args[0].startswith("--migrations-dir="):
+                self.migrations_dir = str(args[0].split('=')[1])
+                args.pop(0)
+
+            # Parse optional [(c | --connection)]
+            elif args[0] == '-c' or args[0] == '--connection':
+                if len(args) < 2:
+                    raise BadCommandArguments
+                args.pop(0)
+                self.connection_name = str(args.pop(0))
+
+            elif args[0].startswith("--connection="):
+                self.connection_name = str(args[0].split('=')[1])
+                args.pop(0)
+
+            # Parse optional [(-j | --jobs)]
+            elif args[0] == '-j' or args[0] == '--jobs':
+                if len(args) < 2:
+                    raise BadCommandArguments
+                args.pop(0)
+                self.jobs = abs(int(args.pop(0)))
+
+            elif args[0].startswith("--jobs="):
+                self.jobs = abs(int(args[0].split('=')[1]))
+                args.pop(0)
+
+            elif args[0] not in options:
+                raise BadCommandArguments
+
+        # Parse all the remaining necessary options
+        if len(args) > 0:
+            raise BadCommandArguments
+
+        print(self.__repr__())
+
+    def __repr__(self):
+        return "(conn_name=%s)" % self.connection_name
+
+
+class Rollout(BaseCommand):
+
+    migrations_dir = None
+    target_revision = None
+    canary = rollout.DEFAULT_CANARY
+    wave_size = rollout.DEFAULT_WAVE_SIZE
+    jobs = rollout.DEFAULT_JOBS
+    max_failures = "0"
+    max_wave_time = None
+    restart = False
+    dry_run = False
+
+    def execute(self):
+
+        if self.migrations_dir is None:
+            self.migrations_dir = os.path.abspath(os.getcwd())
+
+        config_file = self.migrations_dir + os.sep + DBMAKE_CONFIG_DIR + os.sep + DBMAKE_CONFIG_FILE
+        connections_configs = database.DbConnectionConfig.read_all(config_file)
+
+        if connections_configs is False or connections_configs[0] is False:
+            print("Failed to read config file")
+            return FAILURE
+
+        migrations_manager = migrations.MigrationsManager(self.migrations_dir)
+        target_revision = self.target_revision
+        if target_revision is None:
+            target_revision = migrations_manager.latest_revision()
+        elif not migrations_manager.is_revision_exists(target_revision):
+            print("Error! Target revision's migration file %s was not found!" % target_revision)
+            return FAILURE
+
+        state_file = self.migrations_dir + os.sep + DBMAKE_CONFIG_DIR + os.sep + ROLLOUT_STATE_FILE
+
+        try:
+            state = None if self.restart else rollout.RolloutState.load(state_file)
+
+            if state is not None and state.status != rollout.RolloutState.FINISHED:
+                if state.target_revision != target_revision:
+                    print("Error! An unfinished rollout to revision %s exists, run with --restart to discard it"
+                          % state.target_revision)
+                    return FAILURE
+
+                print("Continuing the rollout to revision %s from wave %s/%s" % (
+                    target_revision, state.next_wave + 1, len(state.waves)
+                ))
+            else:
+                connection_names = [config.connection_name for config in connections_configs]
+                waves = rollout.plan_waves(connection_names, self.canary, self.wave_size)
+                has_canary = (isinstance(self.canary, list)
+                              or rollout.resolve_amount(self.canary, len(connection_names)) > 0)
+                state = rollout.RolloutState(target_revision, waves, has_canary)
+        except DbmakeException as e:
+            print(e)
+            return FAILURE
+
+        if self.dry_run:
+            for index, wave in enumerate(state.waves):
+                if index < state.next_wave:
+                    continue
+                print("Wave %s%s: %s" % (
+                    index + 1, " (canary)" if state.has_canary and index == 0 else "", ", ".join(wave)
+                ))
+            return SUCCESS
+
+        state = rollout.Rollout(migrations_manager, connections_configs, state, state_file, self.jobs,
+                                self.max_failures, self.max_wave_time, migrations.PrintMigrationListener()).run()
+
+        print("-" * 20)
+        if state.status != rollout.RolloutState.FINISHED:
+            print("Rollout to revision %s has stopped: %s" % (target_revision, state.reason))
+            print("Run the command again to continue it")
+            return FAILURE
+
+        print("Rollout to revision %s has finished, %s databases failed%s" % (
+            target_revision, len(state.failed), (": " + ", ".join(state.failed)) if state.failed else ""
+        ))
+
+        return FAILURE if state.failed else SUCCESS
+
+    def print_help(self):
+        print("""
+        usage: dbmake rollout [options]
+
+        Migrates all databases of the migrations directory in waves: a canary set of databases first,
+        then the rest, the databases of a wave concurrently. The rollout stops when the canary fails,
+        when failed databases exceed the failure budget or when a wave takes longer than the limit.
+        Its state is kept in %s, running the command again continues a stopped rollout.
+
+        Options:
+            -m, --migrations-dir                 Where migrations reside
+            -r <value>, --revision=<value>       Number of revision to migrate to [Default: the latest revision]
+            --canary=(<count> | <percent>% | <name>,<name>...)
+                                                 Databases to migrate first [Default: %s]
+            --wave-size=(<count> | <percent>%)   Number of databases per wave [Default: %s]
+            -j <n>, --jobs=<n>                   Number of databases of a wave to migrate concurrently
+                                                 [Default: %s]
+            --max-failures=(<count> | <percent>%)
+                                                 Number of databases that may fail [Default: 0]
+            --max-wave-time=<seconds>            Stop if a wave takes longer than that
+            --restart                            Discard an unfinished rollout and start a new one
+            -d, --dry-run                        Print the waves, do not migrate
+        """ % (DBMAKE_CONFIG_DIR + os.sep + ROLLOUT_STATE_FILE, rollout.DEFAULT_CANARY, rollout.DEFAULT_WAVE_SIZE,
+               rollout.DEFAULT_JOBS))
+
+    def _parse_options(self, args):
+
+        options = ['-m', '--migrations-dir', '--migrations-dir=', '-r', '--revision', '--revision=', '--canary=',
+                   '--wave-size=', '-j', '--jobs', '--jobs=', '--max-failures=', '--max-wave-time=', '--restart',
+                   '-d', '--dry-run']
+
+        while len(args) > 0:
+            # Parse optional [(-m | --migrations-dir) <path>]
+            if args[0] == '-m' or args[0] == '--migrations-dir':
+                if len(args) < 2:
+                    raise BadCommandArguments
+                args.pop(0)
+                self.migrations_dir = str(args.pop(0))
+
+            elif args[0].startswith("--migrations-dir="):
+                self.migrations_dir = str(args[0].split('=')[1])
+                args.pop(0)
+
+            # Parse optional [(r | --revision)]
+            elif args[0] == '-r' or args[0] == '--revision':
+                if len(args) < 2:
+                    raise BadCommandArguments
+                args.pop(0)
+                self.target_revision = abs(int(args.pop(0)))
+
+            elif args[0].startswith("--revision="):
+                self.target_revision = abs(int(args[0].split('=')[1]))
+                args.pop(0)
+
+            # Parse optional [--canary=<count | percent% | names>]
+            elif args[0].startswith("--canary="):
+                canary = args.pop(0).split('=', 1)[1]
+                try:
+                    rollout.parse_amount(canary)
+                    self.canary = canary
+                except ValueError:
+                    self.canary = [name.strip() for name in canary.split(',') if name.strip()]
+
+            # Parse optional [--wave-size=<count | percent%>]
+            elif args[0].startswith("--wave-size="):
+                self.wave_size = args.pop(0).split('=', 1)[1]
+                try:
+                    rollout.parse_amount(self.wave_size)
+                except ValueError:
+                    raise BadCommandArguments
+
+            # Parse optional [(-j | --jobs)]
+            elif args[0] == '-j' or args[0] == '--jobs':
+                if len(args) < 2:
+                    raise BadCommandArguments
+                args.pop(0)
+                self.jobs = abs(int(args.pop(0)))
+
+            elif args[0].startswith("--jobs="):
+                self.jobs = abs(int(args[0].split('=')[1]))
+                args.pop(0)
+
+            # Parse optional [--max-failures=<count | percent%>]
+            elif args[0].startswith("--max-failures="):
+                self.max_failures = args.pop(0).split('=', 1)[1]
+                try:
+                    rollout.parse_amount(self.max_failures)
+                except ValueError:
+                    raise BadCommandArguments
+
+            # Parse optional [--max-wave-time=<seconds>]
+            elif args[0].startswith("--max-wave-time="):
+                self.max_wave_time = abs(float(args[0].split('=')[1]))
+                args.pop(0)
+
+            # Parse optional [--restart]
+            elif args[0] == '--restart':
+                args.pop(0)
+                self.restart = True
+
+            # Parse optional [(-d | --dry-run)]
+            elif args[0] == '-d' or args[0] == '--dry-run':
+                args.pop(0)
+                self.dry_run = True
+
+            elif args[0] not in options:
+                raise BadCommandArguments
+
+        # Parse all the remaining necessary options
+        if len(args) > 0:
+            raise BadCommandArguments
+
+        print(self.__repr__())
+
+    def __repr__(self):
+        return "(target_revision=%s, canary=%s, wave_size=%s)" % (self.target_revision, self.canary, self.wave_size)
+
+
+class Reset(BaseCommand):
+
+    connection_name = None
+    migrations_dir = None
+    target_revision = None
+
+    def execute(self):
+
+        if self.migrations_dir is None:
+            self.migrations_dir = os.path.abspath(os.getcwd())
+
+        config_file = self.migrations_dir + os.sep + DBMAKE_CONFIG_DIR + os.sep + DBMAKE_CONFIG_FILE
+        db_connection_config = database.DbConnectionConfig.read(config_file, self.connection_name)
+
+        if db_connection_config is False:
+            print("Error! Failed to read the '%s' connection config" % self.connection_name)
+            return FAILURE
+
+        migrations_manager = migrations.MigrationsManager(self.migrations_dir)
+        target_revision = self.target_revision
+        if target_revision is None:
+            target_revision = migrations_manager.latest_revision()
+        elif not migrations_manager.is_revision_exists(target_revision):
+            print("Error! Target revision's migration file %s was not found!" % target_revision)
+            return FAILURE
+
+        fingerprints = snapshots.fingerprints(migrations_manager, self.migrations_dir)
+        snapshot_cache = snapshots.SnapshotCache.for_connection(self.migrations_dir, self.connection_name)
+        snapshot = snapshot_cache.get(target_revision, fingerprints[target_revision])
+
+        try:
+            if snapshot is not None:
+                print("%s: Restoring the snapshot of revision %s..." % (self.connection_name, target_revision))
+                if not snapshots.restore(db_connection_config, snapshot):
+                    print("Error! Failed to restore the snapshot of revision %s" % target_revision)
+                    return FAILURE
+                return SUCCESS
+
+            # No snapshot yet, the database is rebuilt from the ZERO-MIGRATION and snapshotted on the way up
+            print("%s: Recreating the database at revision %s..." % (self.connection_name, target_revision))
+            snapshots.recreate_database(db_connection_config)
+
+            db_tasks_factory = db_tasks.AbstractDbTasksFactory.create()
+            if not db_tasks_factory.create(db_tasks.DbTaskType.INIT, db_connection_config).execute():
+                return FAILURE
+
+            db_adapter = database.DbAdapterFactory.create(db_connection_config)
+        except psycopg2.Error as e:
+            print("Error! Failed to recreate database %s: %s" % (db_connection_config.dbname, str(e).strip()))
+            return FAILURE
+
+        try:
+            listener = snapshots.SnapshotListener(snapshot_cache, fingerprints, db_connection_config)
+            migrations_manager.migrate_to_revision(target_revision, db_adapter, listener=listener)
+        except DbmakeException as e:
+            print(e)
+            return FAILURE
+        finally:
+            db_adapter.disconnect()
+
+        return SUCCESS
+
+    def print_help(self):
+        print("""
+        usage: dbmake reset (-c | --connection=)<name> [options]
+
+        Drops a database, recreates it and brings it to a revision: from the revision's snapshot if
+        there is one, otherwise by migrating it up from the ZERO-MIGRATION, snapshotting every revision
+        on the way. Snapshots are kept in %s. Meant for dev and CI databases, sessions of the database
+        are disconnected.
+
+        Options:
+            -m, --migrations-dir                 Where migrations reside
+            -c <name>, --connection=<name>       Connection name of a database to reset
+            -r <value>, --revision=<value>       Number of revision to reset to [Default: the latest revision]
+        """ % (DBMAKE_CONFIG_DIR + os.sep + SNAPSHOTS_DIR + os.sep + "<connection name>"))
+
+    def _parse_options(self, args):
+
+        options = ['-m', '--migrations-dir', '--migrations-dir=', '-c', '--connection', '--connection=',
+                   '-r', '--revision', '--revision=']
+
+        while len(args) > 0:
+            # Parse optional [(-m | --migrations-dir) <path>]
+            if args[0] == '-m' or args[0] == '--migrations-dir':
+                if len(args) < 2:
+                    raise BadCommandArguments
+                args.pop(0)
+                self.migrations_dir = str(args.pop(0))
+
+            elif args[0].startswith("--migrations-dir="):
+                self.migrations_dir = str(args[0].split('=')[1])
+                args.pop(0)
+
+            # Parse [(c | --connection)]
+            elif args[0] == '-c' or args[0] == '--connection':
+                if len(args) < 2:
+                    raise BadCommandArguments
+                args.pop(0)
+                self.connection_name = str(args.pop(0))
+
+            elif args[0].startswith("--connection="):
+                self.connection_name = str(args[0].split('=')[1])
+                args.pop(0)
+
+            # Parse optional [(r | --revision)]
+            elif args[0] == '-r' or args[0] == '--revision':
+                if len(args) < 2:
+                    raise BadCommandArguments
+                args.pop(0)
+                self.target_revision = abs(int(args.pop(0)))
+
+            elif args[0].startswith("--revision="):
+                self.target_revision = abs(int(args[0].split('=')[1]))
+                args.pop(0)
+
+            elif args[0] not in options:
+                raise BadCommandArguments
+
+        # Parse all the remaining necessary options
+        if len(args) > 0 or self.connection_name is None:
+            raise BadCommandArguments
+
+        print(self.__repr__())
+
+    def __repr__(self):
+        return "(conn_name=%s, target_revision=%s)" % (self.connection_name, self.target_revision)
+
+
+class Lint(BaseCommand):
+
+    connection_name = None
+    migrations_dir = None
+    target_revision = None
+    max_impact = lint.DEFAULT_MAX_IMPACT
+
+    def execute(self):
+
+        if self.migrations_dir is None:
+            self.migrations_dir = os.path.abspath(os.getcwd())
+
+        # Get database connection\s configurations
+        config_file = self.migrations_dir + os.sep + DBMAKE_CONFIG_DIR + os.sep + DBMAKE_CONFIG_FILE
+        if self.connection_name is not None:
+            connections_configs = [database.DbConnectionConfig.read(config_file, self.connection_name)]
+        else:
+            connections_configs = database.DbConnectionConfig.read_all(config_file)
+
+        if connections_configs is False or connections_configs[0] is False:
+            print("Failed to read config file")
+            return FAILURE
+
+        migrations_manager = migrations.MigrationsManager(self.migrations_dir)
+        target_revision = self.target_revision
+        if target_revision is None:
+            target_revision = migrations_manager.latest_revision()
+        elif not migrations_manager.is_revision_exists(target_revision):
+            print("Error! Target revision's migration file %s was not found!" % target_revision)
+            return FAILURE
+
+        result = SUCCESS
+
+        for db_connection_config in connections_configs:
+            try:
+                db_adapter = metrics.connect(db_connection_config)
+            except psycopg2.OperationalError as e:
+                print("%s: Failed to connect database %s on host %s:%s, user: %s" % (
+                    db_connection_config.connection_name,
+                    db_connection_config.dbname,
+                    db_connection_config.host,
+                    db_connection_config.port,
+                    db_connection_config.user
+                ))
+                result = FAILURE
+                continue
+
+            try:
+                try:
+                    head = migrations.MigrationsDao(db_adapter).find_head()
+                    current_revision = None if head is None else int(head.revision)
+                except MigrationsTableNotFound:
+                    current_revision = None
+
+                pending = [step.migration for step in migrations_manager.plan(current_revision, target_revision)
+                           if step.direction == migrations.MigrationDirection.UP]
+                findings = lint.weigh(lint.check(pending), db_adapter)
+            except DbmakeException as e:
+                print("%s: %s" % (db_connection_config.connection_name, e))
+                result = FAILURE
+                continue
+            finally:
+                db_adapter.disconnect()
+
+            print("%s: %s pending migrations, %s findings" % (
+                db_connection_config.connection_name, len(pending), len(findings)
+            ))
+            for finding in findings:
+                print("    " + finding.line())
+
+            exceeding = [finding for finding in findings if finding.impact >= self.max_impact]
+            if exceeding:
+                print("%s: Error! %s findings reach the impact limit of %s" % (
+                    db_connection_config.connection_name, len(exceeding), format_size(self.max_impact)
+                ))
+                result = FAILURE
+
+        return result
+
+    def print_help(self):
+        print("""
+        usage: dbmake lint [options]
+
+        Checks the migrations a database is missing for statements that lock or rewrite big tables:
+        CREATE INDEX without CONCURRENTLY, ADD COLUMN with a volatile default, ALTER COLUMN TYPE,
+        constraints added without NOT VALID, SET NOT NULL and UPDATE/DELETE without WHERE.
+        A finding's impact is the number of bytes of the live table the statement reads or writes
+        under its lock. The command fails if any finding reaches the impact limit.
+        A migration silences a rule with a "-- DBMAKE: %s<rule>" directive.
+
+        Options:
+            -m, --migrations-dir                 Where migrations reside
+            -c <name>, --connection=<name>       Connection name of a database to lint against
+                                                 [Default: all connections]
+            -r <value>, --revision=<value>       Number of revision to lint up to [Default: the latest revision]
+            --max-impact=<size>                  Impact limit, e.g. 500MB or 2GB [Default: %s]
+        """ % (lint.LINT_IGNORE_DIRECTIVE, format_size(lint.DEFAULT_MAX_IMPACT)))
+
+    def _parse_options(self, args):
+
+        options = ['-m', '--migrations-dir', '--migrations-dir=', '-c', '--connection', '--connection=',
+                   '-r', '--revision', '--revision=', '--max-impact=']
+
+        while len(args) > 0:
+            # Parse optional [(-m | --migrations-dir) <path>]
+            if args[0] == '-m' or args[0] == '--migrations-dir':
+                if len(args) < 2:
+                    raise BadCommandArguments
+                args.pop(0)
+                self.migrations_dir = str(args.pop(0))
+
+            elif args[0].startswith("--migrations-dir="):
+                self.migrations_dir = str(args[0].split('=')[1])
+                args.pop(0)
+
+            # Parse optional [(c | --connection)]
+            elif args[0] == '-c' or args[0] == '--connection':
+                if len(args) < 2:
+                    raise BadCommandArguments
+                args.pop(0)
+                self.connection_name = str(args.pop(0))
+
+            elif args[0].startswith("--connection="):
+                self.connection_name = str(args[0].split('=')[1])
+                args.pop(0)
+
+            # Parse optional [(r | --revision)]
+            elif args[0] == '-r' or args[0] == '--revision':
+                if len(args) < 2:
+                    raise BadCommandArguments
+                args.pop(0)
+                self.target_revision = abs(int(args.pop(0)))
+
+            elif args[0].startswith("--revision="):
+                self.target_revision = abs(int(args[0].split('=')[1]))
+                args.pop(0)
+
+            # Parse optional [--max-impact=<size>]
+            elif args[0].startswith("--max-impact="):
+                try:
+                    self.max_impact = lint.parse_size(args.pop(0).split('=', 1)[1])
+                except ValueError:
+                    raise BadCommandArguments
+
+            elif args[0] not in options:
+                raise BadCommandArguments
+
+        # Parse all the remaining necessary options
+        if len(args) > 0:
+            raise BadCommandArguments
+
+        print(self.__repr__())
+
+    def __repr__(self):
+        return "(conn_name=%s, target_revision=%s, max_impact=%s)" % (
+            self.connection_name, self.target_revision, self.max_impact
+        )
+
+
 class DocGenerate(BaseCommand):
 
     # Connection name of database against which the documentation will be generated
@@ -3,7 +3,15 @@ ZERO_MIGRATION_NAME = "initial_migration"
 ZERO_MIGRATION_FILE_NAME = "0_" + ZERO_MIGRATION_NAME + ".sql"
 DBMAKE_CONFIG_DIR = ".dbmake"
 DBMAKE_CONFIG_FILE = "databases.json"
+CHECKSUMS_CACHE_FILE = "checksums.json"
+ROLLOUT_STATE_FILE = "rollout.json"
+SNAPSHOTS_DIR = "snapshots"
+COMPILE_CACHE_DIR = "cache"
 MIGRATIONS_TABLE = "_dbmake_migrations"
+PROGRESS_TABLE = "_dbmake_progress"
+
+# Key of the advisory lock a dbmake run holds on a database while migrating it ("dbmake" in ASCII)
+MIGRATION_LOCK_KEY = 0x64626d616b65
 DOCUMENTATION_DIR = "doc"
 DBMAKE_VERSION = 'dbmake 0.1.2'
 
@@ -21,3 +29,27 @@ class BadCommandArguments(DbmakeException):
 
 class CommandNotExists(DbmakeException):
     pass
+
+
+class SqlSyntaxError(DbmakeException):
+    pass
+
+
+class ConnectionFailed(DbmakeException):
+    pass
+
+
+class MigrationsTableNotFound(DbmakeException):
+    pass
+
+
+class RevisionNotFound(DbmakeException):
+    pass
+
+
+class MigrationFailed(DbmakeException):
+    pass
+
+
+class MigrationLockTimeout(DbmakeException):
+    pass
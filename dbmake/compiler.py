@@ -0,0 +1,570 @@
+"""
+Compiled migrations: a migration file lexed once into the statements of its "Migrate UP" and "Migrate DOWN"
+sections, psql includes (\\i, \\ir) resolved. Every statement knows the file and the line it comes from,
+the relations it touches and whether it can run inside a transaction.
+
+Statements are kept as offsets into their files rather than as text, so they're executed right from
+the memory mapped files. Still, a compiled migration takes memory in proportion to its number of statements,
+so migration files too large for that are never compiled into lists: a LexedMigration lexes such a file again
+whenever its statements are iterated.
+
+Compiled migrations are cached in .dbmake/cache as JSON, keyed by the content hash of the migration file.
+A cached migration is reused as long as the files it includes have the same checksums too.
+Lexed migrations aren't cached.
+
+Touched relations are found by matching statements against the DDL and DML forms migrations are mostly
+made of. A statement of any other form (a DO block, a function call, ...) may touch anything, so the
+relations of a section that has one are unknown.
+"""
+
+import json
+import mmap
+import os
+import re
+
+from .checksums import file_checksum
+from .common import DBMAKE_CONFIG_DIR, COMPILE_CACHE_DIR, SqlSyntaxError
+from .sql_lexer import SqlStatementSplitter, SqlStatementType
+
+# Bumped whenever the compiled form changes, so caches of earlier versions are ignored
+COMPILER_VERSION = 1
+
+SEPARATOR = b"-- DBMAKE: SEPARATOR"
+
+_NAME = r'(?:"(?:[^"]|"")+"|[\w$]+)(?:\s*\.\s*(?:"(?:[^"]|"")+"|[\w$]+))?'
+_NAME_LIST = r'(?P<names>' + _NAME + r'(?:\s*,\s*' + _NAME + r')*)'
+_ONE_NAME = r'(?P<name>' + _NAME + r')'
+
+# Forms of statements and the relations they touch
+_RELATION_FORMS = [re.compile(form, re.I | re.S) for form in (
+    r'^CREATE\s+(?:(?:GLOBAL|LOCAL)\s+)?(?:TEMP\s+|TEMPORARY\s+|UNLOGGED\s+)?TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?'
+    + _ONE_NAME,
+    r'^CREATE\s+MATERIALIZED\s+VIEW\s+(?:IF\s+NOT\s+EXISTS\s+)?' + _ONE_NAME,
+    r'^ALTER\s+(?:TABLE|MATERIALIZED\s+VIEW)\s+(?:IF\s+EXISTS\s+)?(?:ONLY\s+)?' + _ONE_NAME,
+    r'^DROP\s+(?:TABLE|MATERIALIZED\s+VIEW)\s+(?:IF\s+EXISTS\s+)?' + _NAME_LIST,
+    r'^CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?:CONCURRENTLY\s+)?(?:(?:IF\s+NOT\s+EXISTS\s+)?' + _NAME + r'\s+)?'
+    r'ON\s+(?:ONLY\s+)?' + _ONE_NAME,
+    r'^CREATE\s+(?:OR\s+REPLACE\s+)?(?:CONSTRAINT\s+)?TRIGGER\s+.*?\bON\s+' + _ONE_NAME,
+    r'^INSERT\s+INTO\s+' + _ONE_NAME,
+    r'^UPDATE\s+(?:ONLY\s+)?' + _ONE_NAME,
+    r'^DELETE\s+FROM\s+(?:ONLY\s+)?' + _ONE_NAME,
+    r'^TRUNCATE\s+(?:TABLE\s+)?(?:ONLY\s+)?' + _NAME_LIST,
+    r'^COPY\s+' + _ONE_NAME,
+    r'^REFRESH\s+MATERIALIZED\s+VIEW\s+(?:CONCURRENTLY\s+)?' + _ONE_NAME,
+    r'^(?:VACUUM|ANALYZE)(?:\s*\([^)]*\)|\s+(?:FULL|FREEZE|VERBOSE|ANALYZE))*\s+' + _NAME_LIST,
+    r'^CLUSTER\s+(?:VERBOSE\s+)?' + _ONE_NAME,
+    r'^REINDEX\s+(?:\([^)]*\)\s*)?TABLE\s+(?:CONCURRENTLY\s+)?' + _ONE_NAME,
+    r'^LOCK\s+(?:TABLE\s+)?(?:ONLY\s+)?' + _NAME_LIST,
+)]
+
+# Forms of statements that touch no table or materialized view
+_NEUTRAL_FORMS = re.compile(
+    r'^(?:COMMENT|GRANT|REVOKE|SET|RESET|SELECT\s+set_config|'
+    r'CREATE\s+(?:OR\s+REPLACE\s+)?(?:SEQUENCE|TYPE|FUNCTION|PROCEDURE|VIEW|RECURSIVE\s+VIEW|EXTENSION|DOMAIN|'
+    r'SCHEMA|ROLE|USER|AGGREGATE|OPERATOR|COLLATION|RULE)|'
+    r'ALTER\s+(?:SEQUENCE|TYPE|FUNCTION|PROCEDURE|VIEW|EXTENSION|DOMAIN|SCHEMA|ROLE|USER|DEFAULT\s+PRIVILEGES)|'
+    r'DROP\s+(?:SEQUENCE|TYPE|FUNCTION|PROCEDURE|VIEW|EXTENSION|DOMAIN|ROLE|USER|AGGREGATE|OPERATOR))\b',
+    re.I
+)
+
+_CREATE_TABLE = re.compile(r'^CREATE\s+(?:(?:GLOBAL|LOCAL|TEMP|TEMPORARY|UNLOGGED)\s+)*TABLE\b', re.I)
+
+_REFERENCES = re.compile(r'\bREFERENCES\s+' + _ONE_NAME, re.I)
+
+# A renamed relation can't be found by its old name after the statement, nor by the new one before it
+_RENAME = re.compile(r'\bRENAME\s+TO\b|\bSET\s+SCHEMA\b', re.I)
+
+# Statements PostgreSQL refuses to run inside a transaction block
+_NON_TRANSACTIONAL = re.compile(
+    r'^(?:CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY|DROP\s+INDEX\s+CONCURRENTLY|'
+    r'REINDEX\b.*\bCONCURRENTLY|VACUUM|(?:CREATE|DROP)\s+(?:DATABASE|TABLESPACE)|ALTER\s+SYSTEM)\b',
+    re.I | re.S
+)
+
+_NEWLINE = re.compile(br"\n")
+
+# Comments and literals are blanked out before statements are matched against the forms
+_NOISE = re.compile(
+    r"--[^\n]*|/\*.*?\*/|(?<![\w$])[eE]'(?:\\.|''|[^'\\])*'|'(?:''|[^'])*'"
+    r"|(?P<tag>\$(?:[A-Za-z_\x80-\xff][\w\x80-\xff]*)?\$).*?(?P=tag)",
+    re.S
+)
+
+
+def normalize(sql):
+    """
+    Returns a statement's text with comments, string literals and dollar-quoted bodies blanked out
+    and whitespace collapsed
+    :param bytes sql:
+    :return: str
+    """
+    text = _NOISE.sub(" ", sql.decode('utf-8', 'replace'))
+    return " ".join(text.split())
+
+
+def touched_relations(text):
+    """
+    Returns names of the tables and materialized views a statement touches, as they're written in it,
+    or None if the statement's form is unknown
+    :param str text: A normalize()d statement
+    :return: list or None
+    """
+    if _RENAME.search(text) is not None:
+        return None
+
+    relations = None
+    for form in _RELATION_FORMS:
+        match = form.match(text)
+        if match is not None:
+            if 'names' in form.groupindex:
+                relations = [name.strip() for name in match.group('names').split(",")]
+            else:
+                relations = [match.group('name')]
+            break
+
+    if relations is None:
+        if _NEUTRAL_FORMS.match(text) is None:
+            return None
+        relations = []
+
+    for match in _REFERENCES.finditer(text):
+        relations.append(match.group('name'))
+
+    return _unique(relations)
+
+
+def is_transactional(text):
+    """
+    :param str text: A normalize()d statement
+    :return: False if PostgreSQL refuses to run the statement inside a transaction block
+    """
+    return _NON_TRANSACTIONAL.match(text) is None
+
+
+def creates_table(text):
+    """
+    :param str text: A normalize()d statement
+    :return: Whether the statement creates a table, its first touched relation
+    """
+    return _CREATE_TABLE.match(text) is not None
+
+
+def relation_key(name):
+    """
+    Folds a relation's name the way PostgreSQL does, so names written differently can be compared
+    """
+    parts = [part[1:-1].replace('""', '"') if part.startswith('"') else part.lower()
+             for part in re.findall(r'"(?:[^"]|"")+"|[^.\s]+', name)]
+    if len(parts) == 2 and parts[0] == "public":
+        parts = parts[1:]
+    return ".".join(parts)
+
+
+def _unique(items):
+    seen = set()
+    return [item for item in items if not (item in seen or seen.add(item))]
+
+
+class CompiledStatement:
+    """
+    A single statement of a compiled migration
+    """
+
+    type_ = SqlStatementType.STATEMENT
+
+    # Path of the included file the statement comes from relative to the migration file's directory,
+    # None for the migration file itself
+    file = None
+
+    # Offsets of the statement's first and past its last byte within its file
+    start = None
+    end = None
+
+    # Number of the statement's first line within its file, starting with 1
+    line = None
+
+    # Boundaries of "COPY ... FROM STDIN" data within the statement's file
+    copy_data_start = None
+    copy_data_end = None
+
+    # Names of the relations the statement touches, None if unknown
+    relations = None
+
+    transactional = True
+
+    def sql(self, buffer):
+        """
+        :param buffer: The statement's file, memory mapped or read
+        :return: bytes
+        """
+        return buffer[self.start:self.end]
+
+    def location(self, migration_file):
+        """
+        :return: "<file>:<line>" of the statement, for messages
+        """
+        return "%s:%s" % (os.path.basename(migration_file) if self.file is None else self.file, self.line)
+
+    def to_dict(self):
+        return {
+            "type": self.type_,
+            "file": self.file,
+            "start": self.start,
+            "end": self.end,
+            "line": self.line,
+            "copy_data": None if self.copy_data_start is None else [self.copy_data_start, self.copy_data_end],
+            "relations": self.relations,
+            "transactional": self.transactional,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        statement = cls()
+        statement.type_ = data["type"]
+        statement.file = data["file"]
+        statement.start = data["start"]
+        statement.end = data["end"]
+        statement.line = data["line"]
+        if data["copy_data"] is not None:
+            statement.copy_data_start, statement.copy_data_end = data["copy_data"]
+        statement.relations = data["relations"]
+        statement.transactional = data["transactional"]
+
+        return statement
+
+
+class CompiledMigration:
+    """
+    Statements of a migration file's "Migrate UP" and "Migrate DOWN" sections
+    """
+
+    # A list of CompiledStatement
+    up = None
+
+    # A list of CompiledStatement, None if the file has no "Migrate DOWN" section
+    down = None
+
+    # Included file's path relative to the migration file's directory -> its checksum
+    includes = None
+
+    def __init__(self, up=None, down=None, includes=None):
+        self.up = up if up is not None else []
+        self.down = down
+        self.includes = includes if includes is not None else {}
+
+    def section(self, migrate_up):
+        return self.up if migrate_up else self.down
+
+    def relations(self, migrate_up=True):
+        """
+        :return: Names of the relations a section touches, None if unknown
+        """
+        relations = []
+        for statement in self.section(migrate_up) or []:
+            if statement.relations is None:
+                return None
+            relations.extend(statement.relations)
+
+        return _unique(relations)
+
+    @property
+    def transactional(self):
+        """
+        Whether every statement of both sections can run inside a transaction block
+        """
+        return all(statement.transactional for statement in self.up + (self.down or []))
+
+    @property
+    def has_copy(self):
+        return any(statement.type_ == SqlStatementType.COPY for statement in self.up + (self.down or []))
+
+    def to_dict(self):
+        return {
+            "version": COMPILER_VERSION,
+            "up": [statement.to_dict() for statement in self.up],
+            "down": None if self.down is None else [statement.to_dict() for statement in self.down],
+            "includes": self.includes,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            [CompiledStatement.from_dict(statement) for statement in data["up"]],
+            None if data["down"] is None else [CompiledStatement.from_dict(statement) for statement in data["down"]],
+            data["includes"]
+        )
+
+
+class Compiler:
+    """
+    Lexes a migration file and the files it includes into a CompiledMigration.
+    Paths of \\ir are relative to the including file's directory, paths of \\i to the migration file's one.
+    """
+
+    def __init__(self, migration_file):
+        self._migration_file = os.path.abspath(migration_file)
+        self._directory = os.path.dirname(self._migration_file)
+
+    def compile(self):
+        """
+        :return: CompiledMigration
+        :raise SqlSyntaxError
+        """
+        compiled = CompiledMigration()
+        sections = [compiled.up]
+
+        for statement in self.statements(compiled.includes):
+            if statement is None:
+                compiled.down = []
+                sections.append(compiled.down)
+            else:
+                sections[-1].append(statement)
+
+        return compiled
+
+    def statements(self, includes):
+        """
+        Generates CompiledStatement of the migration file one by one, the separator of its sections as None
+        :param dict includes: Receives included file's path relative to the migration file's directory -> its checksum
+        :raise SqlSyntaxError
+        """
+        return self._statements(self._migration_file, includes, [], SEPARATOR)
+
+    def _statements(self, file_, includes, including, separator=None):
+        """
+        Generates CompiledStatement of a file, those of its includes in their place.
+        A separator is generated as None.
+        :param including: Absolute paths of the files that include this one, to detect circular includes
+        """
+        if file_ in including:
+            raise SqlSyntaxError("Error! %s includes itself" % file_)
+
+        relative_file = None
+        if file_ != self._migration_file:
+            relative_file = os.path.relpath(file_, self._directory)
+            includes[relative_file] = file_checksum(file_)
+
+        with open(file_, 'rb') as f:
+            # Empty files can't be mapped
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            for statement in self._file_statements(file_, relative_file, buffer, includes, including, separator):
+                yield statement
+        finally:
+            buffer.close()
+
+    def _file_statements(self, file_, relative_file, buffer, includes, including, separator):
+        line = 1
+        position = 0
+        for statement in SqlStatementSplitter(buffer, separator):
+            line += len(_NEWLINE.findall(buffer, position, statement.offset))
+            position = statement.offset
+
+            if statement.type_ == SqlStatementType.SEPARATOR:
+                yield None
+
+            elif statement.type_ == SqlStatementType.INCLUDE:
+                path = statement.sql.decode('utf-8')
+                base = os.path.dirname(file_) if statement.relative else self._directory
+                included_file = os.path.normpath(os.path.join(base, path))
+
+                if not os.path.isfile(included_file):
+                    raise SqlSyntaxError("Error! %s:%s includes %s, which doesn't exist" % (
+                        os.path.basename(file_) if relative_file is None else relative_file, line, path
+                    ))
+
+                for included in self._statements(included_file, includes, including + [file_]):
+                    yield included
+
+            else:
+                compiled_statement = CompiledStatement()
+                compiled_statement.type_ = statement.type_
+                compiled_statement.file = relative_file
+                compiled_statement.start = statement.offset
+                compiled_statement.end = statement.offset + len(statement.sql)
+                compiled_statement.line = line
+                compiled_statement.copy_data_start = statement.copy_data_start
+                compiled_statement.copy_data_end = statement.copy_data_end
+                text = normalize(statement.sql)
+                compiled_statement.relations = touched_relations(text)
+                compiled_statement.transactional = is_transactional(text)
+                yield compiled_statement
+
+
+class LexedMigration:
+    """
+    Statements of a migration file too large to keep its statements in lists: the file is lexed again whenever
+    a section's statements are iterated. What the statements are like is found out in a single pass over
+    the file, once it's asked for. Has the interface of CompiledMigration, but can't be cached.
+    """
+
+    def __init__(self, migration_file):
+        self._migration_file = migration_file
+
+        # Summary of the statements, read by _summarize()
+        self._summarized = False
+        self._has_down = False
+        self._relations = None
+        self._transactional = True
+        self._has_copy = False
+        self._includes = None
+
+    @property
+    def up(self):
+        return self.section(True)
+
+    @property
+    def down(self):
+        return self.section(False)
+
+    @property
+    def includes(self):
+        self._summarize()
+        return self._includes
+
+    def section(self, migrate_up):
+        """
+        :return: An iterable of the section's CompiledStatement, None if the file has no "Migrate DOWN" section
+        """
+        if not migrate_up:
+            self._summarize()
+            if not self._has_down:
+                return None
+
+        return _LexedSection(self._migration_file, migrate_up)
+
+    def relations(self, migrate_up=True):
+        """
+        :return: Names of the relations a section touches, None if unknown
+        """
+        self._summarize()
+        relations = self._relations[migrate_up]
+        return None if relations is None else list(relations)
+
+    @property
+    def transactional(self):
+        self._summarize()
+        return self._transactional
+
+    @property
+    def has_copy(self):
+        self._summarize()
+        return self._has_copy
+
+    def _summarize(self):
+        if self._summarized:
+            return
+
+        includes = {}
+        relations = {True: [], False: []}
+        migrate_up = True
+
+        for statement in Compiler(self._migration_file).statements(includes):
+            if statement is None:
+                self._has_down = True
+                migrate_up = False
+                continue
+
+            self._transactional = self._transactional and statement.transactional
+            self._has_copy = self._has_copy or statement.type_ == SqlStatementType.COPY
+
+            if relations[migrate_up] is not None:
+                if statement.relations is None:
+                    relations[migrate_up] = None
+                else:
+                    relations[migrate_up].extend(relation for relation in statement.relations
+                                                 if relation not in relations[migrate_up])
+
+        self._relations = relations
+        self._includes = includes
+        self._summarized = True
+
+
+class _LexedSection(object):
+    """
+    Statements of a section of a LexedMigration, lexed from its file each time they're iterated
+    """
+
+    def __init__(self, migration_file, migrate_up):
+        self._migration_file = migration_file
+        self._migrate_up = migrate_up
+
+    def __iter__(self):
+        statements = Compiler(self._migration_file).statements({})
+        try:
+            migrate_up = True
+            for statement in statements:
+                if statement is None:
+                    if self._migrate_up:
+                        return
+                    migrate_up = False
+                elif migrate_up == self._migrate_up:
+                    yield statement
+        finally:
+            # Unmaps the file right away if the section is left early
+            statements.close()
+
+
+class CompileCache:
+    """
+    Compiled migrations of a migrations directory, a JSON file per migration file's content hash
+    """
+
+    def __init__(self, directory):
+        """
+        :param directory: Directory to keep the compiled migrations in, created if missing
+        """
+        self._directory = directory
+
+    def get(self, migration_file):
+        """
+        Returns the migration file compiled, compiling and caching it if it isn't cached yet
+        :return: CompiledMigration
+        :raise SqlSyntaxError
+        """
+        cache_file = os.path.join(self._directory, file_checksum(migration_file) + ".json")
+        migration_dir = os.path.dirname(os.path.abspath(migration_file))
+
+        if os.path.exists(cache_file):
+            try:
+                with open(cache_file, 'r') as f:
+                    data = json.load(f)
+            except ValueError:
+                data = None
+
+            if data is not None and data.get("version") == COMPILER_VERSION and all(
+                os.path.isfile(os.path.join(migration_dir, path))
+                and file_checksum(os.path.join(migration_dir, path)) == checksum
+                for path, checksum in data["includes"].items()
+            ):
+                return CompiledMigration.from_dict(data)
+
+        compiled = Compiler(migration_file).compile()
+
+        if not os.path.isdir(self._directory):
+            os.makedirs(self._directory)
+
+        temporary_file = cache_file + ".tmp"
+        with open(temporary_file, 'w') as f:
+            json.dump(compiled.to_dict(), f)
+        os.rename(temporary_file, cache_file)
+
+        return compiled
+
+
+def compile_migration(migration_file):
+    """
+    Compiles a migration file, through the compile cache of its migrations directory if the directory
+    has been initialized by dbmake
+    :return: CompiledMigration
+    :raise SqlSyntaxError
+    """
+    config_dir = os.path.join(os.path.dirname(os.path.abspath(migration_file)), DBMAKE_CONFIG_DIR)
+
+    if not os.path.isdir(config_dir):
+        return Compiler(migration_file).compile()
+
+    return CompileCache(os.path.join(config_dir, COMPILE_CACHE_DIR)).get(migration_file)
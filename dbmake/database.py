@@ -4,6 +4,10 @@ import psycopg2.extras
 import copy
 import os
 import json
+import threading
+import time
+
+from .common import DbmakeException
 
 
 class DbType:
@@ -257,6 +261,10 @@ class DbAdapterFactory:
     """
     Use this class statically to create database adapters based on db_connection_config
     """
+
+    # When set, created adapters are instrumented and count into these stats
+    stats = None
+
     def __init__(self):
         pass
 
@@ -267,8 +275,19 @@ class DbAdapterFactory:
         """
 
         # For sake of first project version only PostgreSQL support is provided
+        if cls.stats is not None:
+            return InstrumentedPgAdapter(db_connection_config, cls.stats)
+
         return PgAdapter(db_connection_config)
 
+    @classmethod
+    def instrument(cls, stats):
+        """
+        Makes all adapters created from now on count their round trips into stats
+        :param AdapterStats stats: Or None to stop instrumenting
+        """
+        cls.stats = stats
+
 
 class PgAdapter(BaseDbAdapter):
     """
@@ -281,8 +300,9 @@ class PgAdapter(BaseDbAdapter):
 
     def _connect(self):
         # Initialize database connection
-        conn_string = "host='%s' dbname='%s' user='%s' password='%s' connect_timeout='3'" % (
+        conn_string = "host='%s' port='%s' dbname='%s' user='%s' password='%s' connect_timeout='3'" % (
             self._db_connection_config.host,
+            self._db_connection_config.port,
             self._db_connection_config.dbname,
             self._db_connection_config.user,
             self._db_connection_config.password
@@ -316,6 +336,9 @@ class PgAdapter(BaseDbAdapter):
     def commit(self):
         self._connection.commit()
 
+    def rollback(self):
+        self._connection.rollback()
+
     def fetch_dict(self, sql_string):
         """
         Executes an SQL string and returns the result as a list of dictionary instances,
@@ -373,5 +396,241 @@ class PgAdapter(BaseDbAdapter):
 
         return records
 
+    def get_backend_pid(self):
+        """
+        :return: PID of the server process serving the adapter's connection
+        """
+        return self._connection.get_backend_pid()
+
     def set_isolation_level(self, isolation_level):
         self._connection.set_isolation_level(isolation_level)
+
+    def set_autocommit(self, autocommit):
+        """
+        Switches the connection into (or out of) a mode where every statement is committed as soon as it executes
+        :param bool autocommit:
+        """
+        self._connection.autocommit = autocommit
+
+
+class RehearsalAdapter(object):
+    """
+    Wraps a database adapter so that everything done through it stays in a single transaction that is
+    rolled back in the end: commits are ignored and a rollback only undoes the current step, back to the
+    savepoint begin_step() has set.
+    """
+
+    SAVEPOINT = "dbmake_rehearsal_step"
+
+    def __init__(self, db_adapter):
+        self._db_adapter = db_adapter
+        self._in_step = False
+
+    def __getattr__(self, name):
+        return getattr(self._db_adapter, name)
+
+    def begin_step(self):
+        cursor = self._db_adapter.get_cursor()
+        cursor.execute("SAVEPOINT " + self.SAVEPOINT)
+        cursor.close()
+        self._in_step = True
+
+    def commit(self):
+        pass
+
+    def execute_string(self, sql_string, cur_factory=None):
+        cursor = self._db_adapter.get_cursor(cur_factory)
+        cursor.execute(sql_string)
+        cursor.close()
+
+    def rollback(self):
+        if self._in_step:
+            cursor = self._db_adapter.get_cursor()
+            cursor.execute("ROLLBACK TO SAVEPOINT " + self.SAVEPOINT)
+            cursor.close()
+        else:
+            self._db_adapter.rollback()
+
+    def set_autocommit(self, autocommit):
+        if autocommit:
+            raise DbmakeException("Statements that can't run inside a transaction can't be rehearsed")
+
+    def set_isolation_level(self, isolation_level):
+        raise DbmakeException("Isolation level can't be changed during a rehearsal")
+
+    def discard(self):
+        """
+        Rolls back everything done through the adapter
+        """
+        self._in_step = False
+        self._db_adapter.rollback()
+
+
+class AdapterStats:
+    """
+    Counters of database work done through instrumented adapters. A single instance may be shared
+    by adapters of many threads.
+    """
+
+    connections = 0
+    round_trips = 0
+    commits = 0
+    rows = 0
+
+    # Seconds spent establishing connections
+    connect_time = 0.0
+
+    # Seconds spent waiting for the server: executing statements, fetching rows and committing
+    server_time = 0.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def add(self, round_trips=0, commits=0, rows=0, server_time=0.0, connections=0, connect_time=0.0):
+        with self._lock:
+            self.round_trips += round_trips
+            self.commits += commits
+            self.rows += rows
+            self.server_time += server_time
+            self.connections += connections
+            self.connect_time += connect_time
+
+    def reset(self):
+        with self._lock:
+            self.connections = 0
+            self.round_trips = 0
+            self.commits = 0
+            self.rows = 0
+            self.connect_time = 0.0
+            self.server_time = 0.0
+
+    def report(self, wall_time=None):
+        """
+        :param wall_time: Seconds the whole run took, to tell the client's share of time
+        :return: str
+        """
+        lines = [
+            "Connections: %s (%.3fs)" % (self.connections, self.connect_time),
+            "Round trips: %s" % self.round_trips,
+            "Commits: %s" % self.commits,
+            "Rows fetched: %s" % self.rows,
+            "Server time: %.3fs" % self.server_time,
+        ]
+
+        if wall_time is not None:
+            client_time = max(wall_time - self.server_time - self.connect_time, 0.0)
+            lines.append("Client time: %.3fs" % client_time)
+            lines.append("Total time: %.3fs" % wall_time)
+
+        return "\n".join(lines)
+
+
+class InstrumentedPgAdapter(PgAdapter):
+    """
+    PgAdapter that counts round trips to the server, commits, fetched rows and time spent waiting
+    for the server, for every cursor of its connection
+    """
+
+    stats = None
+
+    def __init__(self, db_connection_config, stats=None):
+        """
+        :param AdapterStats stats: Stats to count into [Default: the adapter's own stats]
+        """
+        self.stats = stats if stats is not None else AdapterStats()
+        PgAdapter.__init__(self, db_connection_config)
+
+    def _connect(self):
+        started_at = time.time()
+        PgAdapter._connect(self)
+        self.stats.add(connections=1, connect_time=time.time() - started_at)
+
+        self._connection = _InstrumentedConnection(self._connection, self.stats)
+
+
+class _InstrumentedConnection(object):
+    """
+    Proxy of a psycopg2 connection, handing out instrumented cursors
+    """
+
+    def __init__(self, connection, stats):
+        object.__setattr__(self, "_connection", connection)
+        object.__setattr__(self, "_stats", stats)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._connection, name, value)
+
+    def cursor(self, *args, **kwargs):
+        return _InstrumentedCursor(self._connection.cursor(*args, **kwargs), self._stats)
+
+    def commit(self):
+        started_at = time.time()
+        self._connection.commit()
+        self._stats.add(round_trips=1, commits=1, server_time=time.time() - started_at)
+
+    def rollback(self):
+        started_at = time.time()
+        self._connection.rollback()
+        self._stats.add(round_trips=1, server_time=time.time() - started_at)
+
+
+class _InstrumentedCursor(object):
+    """
+    Proxy of a psycopg2 cursor. psycopg2 fetches all rows of a (non-named) cursor's result with
+    the statement itself, so a fetch is counted in rows but not in round trips.
+    """
+
+    def __init__(self, cursor, stats):
+        self._cursor = cursor
+        self._stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._stats.add(rows=1)
+            yield row
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._cursor.__exit__(exc_type, exc_value, traceback)
+
+    def _timed(self, round_trips, method, *args, **kwargs):
+        started_at = time.time()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            self._stats.add(round_trips=round_trips, server_time=time.time() - started_at)
+
+    def execute(self, *args, **kwargs):
+        return self._timed(1, self._cursor.execute, *args, **kwargs)
+
+    def executemany(self, query, vars_list):
+        vars_list = list(vars_list)
+        return self._timed(len(vars_list), self._cursor.executemany, query, vars_list)
+
+    def copy_expert(self, *args, **kwargs):
+        return self._timed(1, self._cursor.copy_expert, *args, **kwargs)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._stats.add(rows=1)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        self._stats.add(rows=len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._stats.add(rows=len(rows))
+        return rows
@@ -1,8 +1,9 @@
 import os
+import subprocess
 import psycopg2
 
 from . import migrations
-from .common import DbmakeException, MIGRATIONS_TABLE, FAILURE
+from .common import DbmakeException, FAILURE
 from .database import DbConnectionConfig, DbAdapterFactory, DbType
 from .doc_generator import DbSchemaType, DocGenerator, TableType, ColumnType
 
@@ -38,6 +39,7 @@ class DbTaskType:
     CREATE = "create"
     DUMP_ZERO_MIGRATION = "dump_zero_migration"
     DOC_GENERATE = "doc_generate"
+    CLONE_SCHEMA = "clone_schema"
 
 
 class BaseDbTasksFactory:
@@ -86,6 +88,8 @@ class PgDbTasksFactory(BaseDbTasksFactory):
             return PgDbCreate(db_connection_config, db_adapter)
         elif task_name == DbTaskType.DOC_GENERATE:
             return PgDbDocGenerate(db_connection_config, db_adapter)
+        elif task_name == DbTaskType.CLONE_SCHEMA:
+            return PgDbCloneSchema(db_connection_config, db_adapter)
         else:
             raise DbmakeException('Unknown task name "' + task_name + '"')
 
@@ -104,17 +108,6 @@ class PgDbInit(BaseDbTask):
         """
         print("PgDbInit START")
 
-        def _create_migrations_table():
-            query = """
-            CREATE TABLE %s (
-                id SERIAL,
-                revision integer NOT NULL,
-                migration_name character varying(100),
-                create_date TIMESTAMP DEFAULT NOW() NOT NULL
-            )
-            """ % MIGRATIONS_TABLE
-            self.db_adapter.execute_string(query)
-
         migrations_dao = migrations.MigrationsDao(self.db_adapter)
 
         if migrations_dao.is_migration_table_exists() is True:
@@ -123,7 +116,7 @@ class PgDbInit(BaseDbTask):
             return False
 
         print("Creating migrations table")
-        _create_migrations_table()
+        migrations_dao.create_table()
         print("PgDbInit FINISH")
 
         return True
@@ -210,6 +203,158 @@ class PgDbCreate(BaseDbTask):
         self.db_adapter.commit()
 
 
+def pg_client_env(db_connection_config):
+    """
+    Returns an environment for PostgreSQL client programs (pg_dump, psql, ...) that carries
+    the connection's password, so it is never exposed on a command line
+    :param DbConnectionConfig db_connection_config:
+    :return: dict
+    """
+    env = dict(os.environ)
+    if db_connection_config.password is not None:
+        env["PGPASSWORD"] = str(db_connection_config.password)
+    return env
+
+
+def pg_client_args(db_connection_config):
+    """
+    Returns the connection arguments for PostgreSQL client programs
+    :param DbConnectionConfig db_connection_config:
+    :return: list
+    """
+    return [
+        "--host=%s" % db_connection_config.host,
+        "--port=%s" % db_connection_config.port,
+        "--username=%s" % db_connection_config.user,
+        "--dbname=%s" % db_connection_config.dbname
+    ]
+
+
+class PgDbCloneSchema(BaseDbTask):
+    """
+    Streams a schema-only dump of the task's (source) database straight into one or more target
+    databases and stamps them with the source's schema revision. The dump is taken once and is
+    piped into all the targets at the same time, nothing is written to disk.
+    """
+
+    # Size of the chunks the dump stream is read and fanned out in
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, db_connection_config, db_adapter=None):
+        BaseDbTask.__init__(self, db_connection_config, db_adapter)
+
+    def execute(self, target_connections_configs):
+        """
+        :param target_connections_configs: A list of DbConnectionConfig of the databases to clone the schema into
+        :return: A list of connection names of the targets the schema has been cloned into
+        """
+        print(self.__class__.__name__ + " BEGIN")
+
+        # The revision is read before the dump starts, so targets are never stamped with a newer
+        # revision than the schema they've got
+        migrations_dao = migrations.MigrationsDao(self.db_adapter)
+        if migrations_dao.is_migration_table_exists() is not True:
+            print("Error! No migrations table has been found in the source database.")
+            return []
+
+        head_migration_vo = migrations_dao.find_most_recent()
+        if head_migration_vo is None:
+            print("Error! The source database has no migrations.")
+            return []
+
+        print("Source revision: %s" % head_migration_vo.revision)
+
+        dump = subprocess.Popen(
+            ["pg_dump", "--schema-only", "--no-privileges", "--no-owner"] +
+            pg_client_args(self.db_connection_config),
+            stdout=subprocess.PIPE,
+            env=pg_client_env(self.db_connection_config)
+        )
+
+        devnull = open(os.devnull, 'w')
+        restores = {}
+        for target_config in target_connections_configs:
+            restores[target_config.connection_name] = subprocess.Popen(
+                ["psql", "--no-psqlrc", "--quiet", "--single-transaction", "--set=ON_ERROR_STOP=1", "--file=-"] +
+                pg_client_args(target_config),
+                stdin=subprocess.PIPE,
+                stdout=devnull,
+                env=pg_client_env(target_config)
+            )
+
+        # Fan the dump stream out into all the restores. A target that breaks its pipe is dropped,
+        # the remaining ones keep receiving the stream
+        receivers = dict(restores)
+        with devnull:
+            while True:
+                chunk = dump.stdout.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+
+                for connection_name, restore in list(receivers.items()):
+                    try:
+                        restore.stdin.write(chunk)
+                    except (IOError, OSError):
+                        print("%s: Restore has stopped receiving the schema" % connection_name)
+                        receivers.pop(connection_name)
+
+            dump.stdout.close()
+            dump_result = dump.wait()
+
+            for restore in restores.values():
+                if dump_result != 0:
+                    # Closing stdin would be a clean end of input, psql would commit the partial schema
+                    restore.kill()
+                else:
+                    try:
+                        restore.stdin.close()
+                    except (IOError, OSError):
+                        pass
+                restore.wait()
+
+        if dump_result != 0:
+            print("Error! Failed to dump the source database schema.")
+            for target_config in target_connections_configs:
+                print("%s: Failure" % target_config.connection_name)
+            return []
+
+        cloned = []
+        for target_config in target_connections_configs:
+            if restores[target_config.connection_name].returncode != 0:
+                print("%s: Failure" % target_config.connection_name)
+                continue
+
+            # Stamp the target with the source's revision
+            try:
+                target_adapter = DbAdapterFactory.create(target_config)
+            except psycopg2.OperationalError as e:
+                print("%s: Failed to connect database %s on host %s:%s, user: %s" % (
+                    target_config.connection_name,
+                    target_config.dbname,
+                    target_config.host,
+                    target_config.port,
+                    target_config.user
+                ))
+                print(str(e).strip())
+                print("%s: Failure, the schema has been restored but not stamped with revision %s" % (
+                    target_config.connection_name, head_migration_vo.revision
+                ))
+                continue
+
+            migration_vo = migrations.MigrationVO()
+            migration_vo.revision = head_migration_vo.revision
+            migration_vo.migration_name = head_migration_vo.migration_name
+            migrations.MigrationsDao(target_adapter).create(migration_vo)
+            target_adapter.disconnect()
+
+            print("%s: OK" % target_config.connection_name)
+            cloned.append(target_config.connection_name)
+
+        print(self.__class__.__name__ + " FINISH")
+
+        return cloned
+
+
 class PgDbDocGenerate(BaseDbTask):
     """
     Generates database documentation.
@@ -239,44 +384,39 @@ class PgDbDocGenerate(BaseDbTask):
         :return: DbSchemaType
         """
 
-        def _columns(dbname_, table, db_adapter, schema='public'):
+        def _columns(dbname_, db_adapter, schema='public'):
             """
-            Returns a list of table's columns
+            Returns columns of all schema tables, fetched by a single query, as a dictionary
+            of a table name to a list of its columns
 
-            :param table: TableType
             :param db_adapter:
             """
-            query_table_columns_with_descriptions = """
+            query_columns_with_descriptions = """
             SELECT
+                cols.table_name,
                 cols.column_name,
                 cols.data_type,
-                (
-                    SELECT
-                        pg_catalog.col_description(c.oid, cols.ordinal_position::int)
-                    FROM
-                        pg_catalog.pg_class c
-                    WHERE
-                        c.oid = (SELECT '{table_name}'::regclass::oid) AND
-                        c.relname = cols.table_name
-                ) as column_comment
-
+                pg_catalog.col_description(c.oid, cols.ordinal_position::int) AS column_comment
             FROM
                 information_schema.columns cols
+                JOIN pg_catalog.pg_namespace n ON n.nspname = cols.table_schema
+                JOIN pg_catalog.pg_class c ON c.relnamespace = n.oid AND c.relname = cols.table_name
             WHERE
                 cols.table_catalog = '{dbname}' AND
-                cols.table_name    = '{table_name}'    AND
-                cols.table_schema  = '{schema_name}';
-            """.format(table_name=table.name, dbname=dbname_, schema_name=schema)
+                cols.table_schema  = '{schema_name}'
+            ORDER BY
+                cols.table_name, cols.ordinal_position;
+            """.format(dbname=dbname_, schema_name=schema)
 
-            result = db_adapter.fetch_dict(query_table_columns_with_descriptions)
+            result = db_adapter.fetch_dict(query_columns_with_descriptions)
 
-            columns = []
+            columns = {}
             for column_ in result:
                 column = ColumnType()
                 column.name = column_['column_name']
                 column.data_type = column_['data_type']
                 column.comment = column_['column_comment']
-                columns.append(column)
+                columns.setdefault(column_['table_name'], []).append(column)
 
             return columns
 
@@ -291,13 +431,14 @@ class PgDbDocGenerate(BaseDbTask):
             """ % schema
 
             result = db_adapter.fetch_dict(query_tables_with_descriptions)
+            columns = _columns(dbname_, db_adapter, schema)
 
             tables = []
             for table_ in result:
                 table = TableType()
                 table.name = table_['table_name']
                 table.comment = table_['description']
-                table.columns = _columns(dbname_, table, db_adapter)
+                table.columns = columns.get(table.name, [])
                 tables.append(table)
 
             return tables
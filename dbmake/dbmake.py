@@ -1,7 +1,11 @@
 #!/usr/bin/python
 
 import sys
+import time
 
+from . import database
+from . import metrics
+from . import profiling
 from .common import FAILURE, SUCCESS
 from .dbmake_cli import get_command, print_help, get_command_class_reference
 from .common import CommandNotExists, BadCommandArguments, DBMAKE_VERSION
@@ -9,15 +13,40 @@ from .common import CommandNotExists, BadCommandArguments, DBMAKE_VERSION
 
 class App:
 
+    # Options that precede a command name, e.g. "dbmake --stats migrate"
+    GLOBAL_OPTIONS = ['--stats', '--profile', '--metrics-file']
+
     def __init__(self):
         self.ide_stop_bothering_with_static_method = "!!!"
 
     def run(self, args=sys.argv):
         self.ide_stop_bothering_with_static_method = "!!!"
 
-        # Pop the script's name from arguments and fetch the command name
+        # Pop the script's name from arguments, global options and fetch the command name
         try:
             args.pop(0)
+            stats = None
+            profile_path = None
+            metrics_file = None
+
+            while len(args) > 0 and args[0].split('=')[0] in self.GLOBAL_OPTIONS:
+                option = args.pop(0)
+
+                if option == '--stats':
+                    stats = database.AdapterStats()
+
+                elif option == '--profile':
+                    profile_path = True
+
+                elif option.startswith('--profile='):
+                    profile_path = option.split('=', 1)[1]
+
+                elif option == '--metrics-file':
+                    metrics_file = args.pop(0)
+
+                elif option.startswith('--metrics-file='):
+                    metrics_file = option.split('=', 1)[1]
+
             command_name = args.pop(0)
         except IndexError:
             print_help()
@@ -43,6 +72,19 @@ class App:
             return SUCCESS
 
         # Get a command instance to execute and execute it
+        profiler = None
+        if profile_path is not None:
+            if profile_path is True:
+                profile_path = profiling.default_path(command_name)
+            profiler = profiling.Profiler(profile_path)
+            profiler.start()
+
+        started_at = time.time()
+        database.DbAdapterFactory.instrument(stats)
+        if metrics_file is not None:
+            metrics.activate(metrics.MetricsRegistry())
+
+        result = FAILURE
         try:
             command = get_command(command_name, args)
             result = command.execute()
@@ -53,6 +95,20 @@ class App:
         except BadCommandArguments:
             print("Bad command arguments")
             return FAILURE
+        finally:
+            database.DbAdapterFactory.instrument(None)
+
+            if metrics_file is not None:
+                metrics.finish_run(command_name, result, time.time() - started_at)
+                metrics.active().write(metrics_file)
+                metrics.activate(None)
+
+            if profiler is not None:
+                print("Profile written to: %s" % ", ".join(profiler.stop()))
+
+        if stats is not None:
+            print("-" * 20)
+            print(stats.report(time.time() - started_at))
 
         return result
 
@@ -3,9 +3,6 @@
 """
 The purpose of this module is to parse user commands passed to "dbmake".
 Also the module contains the HELP string describes how to use the utility.
-
-TODO:
-Implement "reset" command (Drop a database, recreate it and load the recent schema revision into it.)
 """
 
 from . import helper, commands
@@ -41,6 +38,16 @@ def get_command_class_reference(command_name):
         return commands.NewMigration
     elif command_name == 'doc-generate':
         return commands.DocGenerate
+    elif command_name == 'clone-schema':
+        return commands.CloneSchema
+    elif command_name == 'verify':
+        return commands.Verify
+    elif command_name == 'rollout':
+        return commands.Rollout
+    elif command_name == 'reset':
+        return commands.Reset
+    elif command_name == 'lint':
+        return commands.Lint
     else:
         raise CommandNotExists
 
@@ -91,10 +98,21 @@ def print_help():
     print("""
     dbmake - Database Schema Migration Tool
 
-    usage: dbmake <command> [options]
+    usage: dbmake [global options] <command> [options]
        or: dbmake (-h | --help) [<command name>]
        or: dbmake (-v | --version)
 
+    Global options:
+         --stats            Print database round trips, commits, fetched rows and time spent
+                            in the server versus the client when the command finishes
+         --profile[=<path>] Profile the command with cProfile and tracemalloc, write <path>.pstats,
+                            a <path>.txt report of time and memory per connection and of top
+                            allocation sites [Default path: dbmake-<command>-<timestamp>]
+         --metrics-file=<path>
+                            Atomically write Prometheus metrics of the run (revisions, pending
+                            migrations, step durations, connect latency and failures) into a
+                            textfile for node-exporter's textfile collector
+
     Commands:
          init               Add new database connection details and initialize migrations subsystem.
          status             Show database(s) schema revisions.
@@ -104,4 +122,9 @@ def print_help():
          create             Create a new empty database and initializes migrations subsystem in it.
          new-migration      Create a new migration file
          doc-generate       Generate a database documentation
+         clone-schema       Stream a database schema and its revision into other databases
+         verify             Check that applied migration files haven't been modified
+         rollout            Migrate databases in a canary and waves, stopping on failures; resumable
+         reset              Drop a database, recreate it and restore or migrate it to a revision
+         lint               Check pending migrations for statements that lock or rewrite big tables
     """)
@@ -23,6 +23,33 @@ def camelcase(s, delimeter="_"):
     return "".join(map(str.capitalize, l[:]))
 
 
+def quote_identifier(name):
+    """
+    Returns a double-quoted PostgreSQL identifier
+    :param str name:
+    :return: str
+    """
+    return '"%s"' % name.replace('"', '""')
+
+
+def quote_qualified_name(name):
+    """
+    Returns a double-quoted, possibly schema qualified, relation name ("schema.table" or "table")
+    :param str name:
+    :return: str
+    """
+    return ".".join([quote_identifier(part) for part in name.split(".")])
+
+
+def format_duration(seconds):
+    """
+    Formats a number of seconds as H:MM:SS
+    :return: str
+    """
+    seconds = int(seconds)
+    return "%d:%02d:%02d" % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
 def get_module_classes(module_name):
     return pyclbr.readmodule(module_name).keys()
 
@@ -0,0 +1,209 @@
+"""
+Physical impact of migrations: which tables a migration created, dropped or rewrote (a new relfilenode,
+as ALTER COLUMN TYPE, VACUUM FULL or CLUSTER do) and how their sizes and estimated row counts changed.
+
+A snapshot of the tables is taken before and after a migration step, the difference is an ImpactReport.
+"""
+
+import json
+
+from .helper import format_duration
+
+
+class RelationState:
+    """
+    Physical state of a single table or materialized view
+    """
+
+    name = None
+    relfilenode = None
+
+    # Bytes, indexes and TOAST included
+    size = None
+
+    # Planner's estimate, -1 if the table has never been vacuumed or analyzed (PostgreSQL 14+)
+    reltuples = None
+
+    def __init__(self, name, relfilenode, size, reltuples):
+        self.name = name
+        self.relfilenode = relfilenode
+        self.size = size
+        self.reltuples = reltuples
+
+
+def snapshot(db_adapter, relations=None):
+    """
+    Reads the physical state of tables and materialized views of the user's schemas, in a single query.
+    Within a transaction, the state includes the transaction's own changes.
+    :param relations: Names of relations to read, all of them if None
+    :return: dict of a relation's oid to its RelationState
+    """
+    query = """
+    SELECT c.oid, c.oid::regclass::text AS name, c.relfilenode, pg_total_relation_size(c.oid) AS size, c.reltuples
+    FROM pg_catalog.pg_class c
+    JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.relkind IN ('r', 'm')
+      AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+      AND n.nspname NOT LIKE 'pg\\_toast%%'
+      AND n.nspname NOT LIKE 'pg\\_temp\\_%%'
+    """
+    parameters = ()
+
+    if relations is not None:
+        if len(relations) == 0:
+            return {}
+        query += " AND c.oid = ANY (ARRAY(SELECT to_regclass(r) FROM unnest(%s::text[]) r))"
+        parameters = (list(relations),)
+
+    cursor = db_adapter.get_cursor()
+    cursor.execute(query, parameters)
+    states = {}
+    for oid, name, relfilenode, size, reltuples in cursor.fetchall():
+        states[oid] = RelationState(name, relfilenode, size, reltuples)
+    cursor.close()
+
+    return states
+
+
+class RelationImpact:
+
+    CREATED = "created"
+    DROPPED = "dropped"
+    REWRITTEN = "rewritten"
+    CHANGED = "changed"
+
+    name = None
+    change = None
+    size_before = None
+    size_after = None
+    reltuples_before = None
+    reltuples_after = None
+
+    def __init__(self, name, change, before, after):
+        """
+        :param RelationState before: None if the relation has been created
+        :param RelationState after: None if the relation has been dropped
+        """
+        self.name = name
+        self.change = change
+        if before is not None:
+            self.size_before = before.size
+            self.reltuples_before = before.reltuples
+        if after is not None:
+            self.size_after = after.size
+            self.reltuples_after = after.reltuples
+
+    @property
+    def size_delta(self):
+        return (self.size_after or 0) - (self.size_before or 0)
+
+    def to_dict(self):
+        return {
+            "relation": self.name,
+            "change": self.change,
+            "size_before": self.size_before,
+            "size_after": self.size_after,
+            "reltuples_before": self.reltuples_before,
+            "reltuples_after": self.reltuples_after,
+        }
+
+
+class ImpactReport:
+    """
+    Difference of two snapshots, relations that haven't changed are left out
+    """
+
+    relations = None
+    duration = None
+
+    def __init__(self, before, after, duration=None):
+        """
+        :param before: A snapshot() taken before a migration step
+        :param after: A snapshot() taken after it
+        :param duration: Seconds the step took
+        """
+        self.relations = []
+        self.duration = duration
+
+        for oid in sorted(set(before) | set(after), key=lambda o: (after.get(o) or before.get(o)).name):
+            state_before = before.get(oid)
+            state_after = after.get(oid)
+
+            if state_before is None:
+                change = RelationImpact.CREATED
+            elif state_after is None:
+                change = RelationImpact.DROPPED
+            elif state_before.relfilenode != state_after.relfilenode:
+                change = RelationImpact.REWRITTEN
+            elif state_before.size != state_after.size or state_before.reltuples != state_after.reltuples:
+                change = RelationImpact.CHANGED
+            else:
+                continue
+
+            name = (state_after or state_before).name
+            self.relations.append(RelationImpact(name, change, state_before, state_after))
+
+    @property
+    def rewrites(self):
+        return [relation for relation in self.relations if relation.change == RelationImpact.REWRITTEN]
+
+    @property
+    def size_delta(self):
+        return sum(relation.size_delta for relation in self.relations)
+
+    def to_json(self):
+        """
+        :return: The report as it's stored in the migrations table
+        """
+        return json.dumps({
+            "duration": self.duration,
+            "size_delta": self.size_delta,
+            "relations": [relation.to_dict() for relation in self.relations],
+        }, sort_keys=True)
+
+    def lines(self):
+        """
+        :return: A list of human readable lines
+        """
+        if not self.relations:
+            return ["    No tables were created, dropped, rewritten or resized"]
+
+        lines = []
+        for relation in self.relations:
+            line = "    %-9s %s: %s -> %s (%s)" % (
+                relation.change.upper(),
+                relation.name,
+                format_size(relation.size_before),
+                format_size(relation.size_after),
+                format_size(relation.size_delta, signed=True),
+            )
+            if relation.reltuples_before != relation.reltuples_after:
+                line += ", rows ~%s -> ~%s" % (_format_reltuples(relation.reltuples_before),
+                                               _format_reltuples(relation.reltuples_after))
+            lines.append(line)
+
+        summary = "    Total size change: %s" % format_size(self.size_delta, signed=True)
+        if self.duration is not None:
+            summary += ", took %s" % format_duration(self.duration)
+        lines.append(summary)
+
+        return lines
+
+
+def format_size(size, signed=False):
+    if size is None:
+        return "-"
+
+    sign = ("+" if size >= 0 else "-") if signed else ("-" if size < 0 else "")
+    size = abs(size)
+    for unit in ("B", "kB", "MB", "GB"):
+        if size < 1024:
+            return "%s%.0f %s" % (sign, size, unit) if unit == "B" else "%s%.1f %s" % (sign, size, unit)
+        size /= 1024.0
+    return "%s%.1f TB" % (sign, size)
+
+
+def _format_reltuples(reltuples):
+    if reltuples is None or reltuples < 0:
+        return "?"
+    return "%d" % reltuples
@@ -0,0 +1,212 @@
+"""
+Static checks of pending migrations for statements that lock or rewrite big tables (dbmake lint).
+
+Every statement of the migrations' "Migrate UP" sections is matched against a set of rules. A finding is
+weighed by the live statistics of the table it targets, read from pg_class in a single query: its impact
+is the number of bytes the statement reads or writes while it holds its lock. Findings on tables created
+by the pending migrations themselves, or missing from the database, weigh nothing.
+
+A migration file may silence a rule with a "-- DBMAKE: LINT IGNORE <rule>" directive.
+"""
+
+import re
+
+from . import compiler
+from .impact import format_size
+
+LINT_IGNORE_DIRECTIVE = "LINT IGNORE "
+
+# Findings whose impact is at least that many bytes fail the lint
+DEFAULT_MAX_IMPACT = 100 * 1024 * 1024
+
+# Functions whose column default makes ADD COLUMN rewrite the table
+VOLATILE_FUNCTIONS = ["random", "clock_timestamp", "timeofday", "gen_random_uuid", "uuid_generate_v1",
+                      "uuid_generate_v4", "nextval", "txid_current"]
+
+
+class Rule:
+    """
+    A statement pattern that locks or rewrites the table it targets
+    """
+
+    id_ = None
+    pattern = None
+
+    # A pattern the statement must not match for the rule to apply
+    unless = None
+
+    # Times the table's size the statement reads or writes under its lock
+    weight = 1
+
+    hint = None
+
+    def __init__(self, id_, pattern, hint, weight=1, unless=None):
+        self.id_ = id_
+        self.pattern = re.compile(pattern, re.I | re.S)
+        self.hint = hint
+        self.weight = weight
+        self.unless = None if unless is None else re.compile(unless, re.I | re.S)
+
+    def matches(self, text):
+        """
+        :param str text: A compiler.normalize()d statement
+        """
+        return self.pattern.search(text) is not None and (self.unless is None or self.unless.search(text) is None)
+
+
+RULES = [
+    Rule(
+        "index-not-concurrent",
+        r'^CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?!CONCURRENTLY\b)',
+        "blocks writes while the index builds, use CREATE INDEX CONCURRENTLY in a NO TRANSACTION migration"
+    ),
+    Rule(
+        "volatile-default",
+        r'^ALTER\s+TABLE\b.*\bADD\s+(?:COLUMN\s+)?[^,]*?(?:\bDEFAULT\s+[^,]*?\b(?:%s)\s*\(|\b(?:BIG|SMALL)?SERIAL\b'
+        r'|\bGENERATED\s+ALWAYS\s+AS\s*\(.*\bSTORED\b)' % "|".join(VOLATILE_FUNCTIONS),
+        "rewrites the table under an ACCESS EXCLUSIVE lock, add the column without a default and backfill it",
+        weight=2
+    ),
+    Rule(
+        "column-type-change",
+        r'^ALTER\s+TABLE\b.*\bALTER\s+(?:COLUMN\s+)?(?:"(?:[^"]|"")+"|[\w$]+)\s+(?:SET\s+DATA\s+)?TYPE\b',
+        "rewrites the table and its indexes under an ACCESS EXCLUSIVE lock unless the types are binary "
+        "coercible, use an ONLINE SCHEMA CHANGE migration",
+        weight=2
+    ),
+    Rule(
+        "constraint-not-valid",
+        r'^ALTER\s+TABLE\b.*(?:\bFOREIGN\s+KEY\b|\bREFERENCES\b|\bADD\s+(?:CONSTRAINT\s+\S+\s+)?CHECK\b)',
+        "scans the table while blocking writes, add the constraint NOT VALID and VALIDATE it separately",
+        unless=r'\bNOT\s+VALID\b'
+    ),
+    Rule(
+        "set-not-null",
+        r'^ALTER\s+TABLE\b.*\bSET\s+NOT\s+NULL\b',
+        "scans the table under an ACCESS EXCLUSIVE lock, validate a CHECK (... IS NOT NULL) constraint first"
+    ),
+    Rule(
+        "unbatched-dml",
+        r'^(?:UPDATE|DELETE)\b',
+        "touches every row in a single transaction, use a BACKFILL migration",
+        unless=r'\bWHERE\b'
+    ),
+]
+
+
+class Finding:
+    """
+    A statement of a pending migration that matches a rule
+    """
+
+    rule = None
+    migration = None
+
+    # compiler.CompiledStatement
+    statement = None
+
+    relation = None
+
+    # Live statistics of the relation, None if the relation isn't in the database
+    reltuples = None
+    size = None
+
+    def __init__(self, rule, migration, statement, relation):
+        self.rule = rule
+        self.migration = migration
+        self.statement = statement
+        self.relation = relation
+
+    @property
+    def impact(self):
+        """
+        Bytes the statement reads or writes while it holds its lock
+        """
+        return (self.size or 0) * self.rule.weight
+
+    def line(self):
+        """
+        :return: A human readable line
+        """
+        if self.size is None:
+            table = "%s (not in the database)" % self.relation
+        else:
+            table = "%s (~%s rows, %s)" % (self.relation, "%d" % max(self.reltuples, 0), format_size(self.size))
+
+        return "%s  %s  %s: %s, impact %s" % (
+            self.statement.location(self.migration.migration_file), self.rule.id_, table, self.rule.hint,
+            format_size(self.impact)
+        )
+
+
+def parse_size(value):
+    """
+    Parses a number of bytes given as "500", "100kB", "100MB", "2GB" or "1TB"
+    :return: int
+    :raise ValueError
+    """
+    result = re.match(r'^\s*([0-9]+(?:\.[0-9]+)?)\s*([kMGT]?B)?\s*$', value, re.I)
+    if result is None:
+        raise ValueError("Bad size: %s" % value)
+
+    units = {"B": 0, "KB": 1, "MB": 2, "GB": 3, "TB": 4}
+    return int(float(result.group(1)) * 1024 ** units[(result.group(2) or "B").upper()])
+
+
+def check(migrations):
+    """
+    Matches the "Migrate UP" statements of migrations against the rules
+    :param migrations: A list of migrations.Migration in the order they're applied
+    :return: A list of Finding, not weighed yet
+    """
+    findings = []
+    created = set()
+
+    for migration in migrations:
+        ignored = [directive[len(LINT_IGNORE_DIRECTIVE):].strip() for directive in migration.directives
+                   if directive.startswith(LINT_IGNORE_DIRECTIVE)]
+
+        for statement, sql in migration.statements():
+            if not statement.relations:
+                continue
+
+            text = compiler.normalize(sql)
+            relation = statement.relations[0]
+
+            if compiler.creates_table(text):
+                created.add(compiler.relation_key(relation))
+                continue
+
+            if compiler.relation_key(relation) in created:
+                continue
+
+            for rule in RULES:
+                if rule.id_ not in ignored and rule.matches(text):
+                    findings.append(Finding(rule, migration, statement, relation))
+
+    return findings
+
+
+def weigh(findings, db_adapter):
+    """
+    Sets the live statistics of the findings' relations, read in a single query
+    :return: The findings, the biggest impact first
+    """
+    relations = sorted(set(finding.relation for finding in findings))
+
+    if relations:
+        cursor = db_adapter.get_cursor()
+        cursor.execute(
+            "SELECT r.name, c.reltuples, pg_total_relation_size(c.oid) "
+            "FROM unnest(%s::text[]) AS r(name) "
+            "JOIN pg_catalog.pg_class c ON c.oid = to_regclass(r.name)",
+            (relations,)
+        )
+        statistics = dict((name, (reltuples, size)) for name, reltuples, size in cursor.fetchall())
+        cursor.close()
+
+        for finding in findings:
+            if finding.relation in statistics:
+                finding.reltuples, finding.size = statistics[finding.relation]
+
+    return sorted(findings, key=lambda finding: -finding.impact)
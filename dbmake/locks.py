@@ -0,0 +1,232 @@
+"""
+Lock profiles of migrations: which locks a migration takes on which relations and for how long.
+
+A migration is rehearsed statement by statement and pg_locks is sampled for its backend after every
+statement. A lock is assumed to be acquired when the statement that first shows it started, and to be
+held until the migration's transaction ends, as PostgreSQL holds relation locks until then.
+The profile tells what live traffic would wait behind the migration, and for how long.
+
+Locks taken by earlier steps of the same rehearsal stay held, so a step's locks on a relation are only
+seen if they are stronger than the ones the relation was already locked with when the step started.
+"""
+
+import time
+
+# PostgreSQL's table lock modes, from the weakest to the strongest
+LOCK_MODES = [
+    "AccessShareLock",
+    "RowShareLock",
+    "RowExclusiveLock",
+    "ShareUpdateExclusiveLock",
+    "ShareLock",
+    "ShareRowExclusiveLock",
+    "ExclusiveLock",
+    "AccessExclusiveLock",
+]
+
+# Lock mode -> modes it conflicts with
+CONFLICTS = {
+    "AccessShareLock": ["AccessExclusiveLock"],
+    "RowShareLock": ["ExclusiveLock", "AccessExclusiveLock"],
+    "RowExclusiveLock": ["ShareLock", "ShareRowExclusiveLock", "ExclusiveLock", "AccessExclusiveLock"],
+    "ShareUpdateExclusiveLock": ["ShareUpdateExclusiveLock", "ShareLock", "ShareRowExclusiveLock",
+                                 "ExclusiveLock", "AccessExclusiveLock"],
+    "ShareLock": ["RowExclusiveLock", "ShareUpdateExclusiveLock", "ShareRowExclusiveLock", "ExclusiveLock",
+                  "AccessExclusiveLock"],
+    "ShareRowExclusiveLock": ["RowExclusiveLock", "ShareUpdateExclusiveLock", "ShareLock",
+                              "ShareRowExclusiveLock", "ExclusiveLock", "AccessExclusiveLock"],
+    "ExclusiveLock": ["RowShareLock", "RowExclusiveLock", "ShareUpdateExclusiveLock", "ShareLock",
+                      "ShareRowExclusiveLock", "ExclusiveLock", "AccessExclusiveLock"],
+    "AccessExclusiveLock": LOCK_MODES,
+}
+
+# Kinds of live traffic and the lock modes they take
+TRAFFIC = [
+    ("SELECT", "AccessShareLock"),
+    ("SELECT FOR UPDATE", "RowShareLock"),
+    ("INSERT/UPDATE/DELETE", "RowExclusiveLock"),
+    ("VACUUM", "ShareUpdateExclusiveLock"),
+]
+
+
+def blocked_traffic(mode):
+    """
+    :return: A list of kinds of live traffic that wait while a relation is locked in mode
+    """
+    return [traffic for traffic, traffic_mode in TRAFFIC if traffic_mode in CONFLICTS.get(mode, [])]
+
+
+def strength(mode):
+    return LOCK_MODES.index(mode) if mode in LOCK_MODES else -1
+
+
+def sample(db_adapter):
+    """
+    Reads the relation locks the adapter's own backend holds, outside of the system schemas
+    :return: dict of a relation's name to the strongest mode it's locked in
+    """
+    cursor = db_adapter.get_cursor()
+    cursor.execute("""
+        SELECT c.oid::regclass::text, l.mode
+        FROM pg_catalog.pg_locks l
+        JOIN pg_catalog.pg_class c ON c.oid = l.relation
+        JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+        WHERE l.pid = pg_backend_pid()
+          AND l.locktype = 'relation'
+          AND l.granted
+          AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+          AND n.nspname NOT LIKE 'pg\\_toast%%'
+    """, ())
+    locks = {}
+    for relation, mode in cursor.fetchall():
+        if strength(mode) > strength(locks.get(relation)):
+            locks[relation] = mode
+    cursor.close()
+
+    return locks
+
+
+class LockHold:
+    """
+    The strongest lock a migration took on a relation
+    """
+
+    relation = None
+    mode = None
+
+    # Number of the statement that took the lock, starting with 1
+    statement = None
+
+    acquired_at = None
+
+    # Seconds the lock was held for
+    held = None
+
+    def __init__(self, relation, mode, statement, acquired_at):
+        self.relation = relation
+        self.mode = mode
+        self.statement = statement
+        self.acquired_at = acquired_at
+
+    def to_dict(self):
+        return {
+            "relation": self.relation,
+            "mode": self.mode,
+            "statement": self.statement,
+            "held": self.held,
+            "blocks": blocked_traffic(self.mode),
+        }
+
+
+class LockProfile:
+    """
+    Locks a single migration step took, built from samples taken after each of its statements
+    """
+
+    def __init__(self, db_adapter):
+        """
+        :param db_adapter: Adapter of the connection the migration runs on
+        """
+        self._db_adapter = db_adapter
+        self._baseline = {}
+        self._holds = {}
+        self._statements = 0
+
+    def start(self):
+        """
+        Samples the locks already held before the migration's first statement
+        """
+        self._baseline = sample(self._db_adapter)
+
+    def after_statement(self, started_at):
+        """
+        Samples the locks after a statement that started at started_at
+        """
+        self._statements += 1
+
+        for relation, mode in sample(self._db_adapter).items():
+            known = self._holds.get(relation)
+            known_mode = known.mode if known is not None else self._baseline.get(relation)
+
+            if strength(mode) > strength(known_mode):
+                self._holds[relation] = LockHold(relation, mode, self._statements, started_at)
+
+    def finish(self, ended_at=None):
+        """
+        Ends the profile when the migration's transaction ends
+        """
+        if ended_at is None:
+            ended_at = time.time()
+
+        for hold in self._holds.values():
+            hold.held = ended_at - hold.acquired_at
+
+    @property
+    def holds(self):
+        """
+        :return: A list of LockHold, the strongest and longest held first
+        """
+        return sorted(self._holds.values(), key=lambda h: (-strength(h.mode), -(h.held or 0), h.relation))
+
+    def lines(self):
+        """
+        :return: A list of human readable lines, a table of the locks
+        """
+        holds = self.holds
+        if not holds:
+            return ["    No locks on user tables were taken"]
+
+        width = max(len("relation"), max(len(hold.relation) for hold in holds))
+        lines = ["    %-*s  %-24s  %9s  %9s  %s" % (width, "relation", "mode", "statement", "held", "blocks")]
+        for hold in holds:
+            lines.append("    %-*s  %-24s  %9s  %8.3fs  %s" % (
+                width, hold.relation, hold.mode, "#%s" % hold.statement, hold.held or 0,
+                ", ".join(blocked_traffic(hold.mode)) or "-"
+            ))
+
+        return lines
+
+
+class LockProfilingAdapter(object):
+    """
+    Wraps a database adapter so that every statement executed through its cursors is followed by
+    a sample of the backend's locks
+    """
+
+    def __init__(self, db_adapter, profile):
+        """
+        :param LockProfile profile: Profile to sample into
+        """
+        self._db_adapter = db_adapter
+        self._profile = profile
+
+    def __getattr__(self, name):
+        return getattr(self._db_adapter, name)
+
+    def get_cursor(self, cur_factory=None):
+        return _LockProfilingCursor(self._db_adapter.get_cursor(cur_factory), self._profile)
+
+
+class _LockProfilingCursor(object):
+
+    def __init__(self, cursor, profile):
+        self._cursor = cursor
+        self._profile = profile
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def _sampled(self, method, *args, **kwargs):
+        started_at = time.time()
+        result = method(*args, **kwargs)
+        self._profile.after_statement(started_at)
+        return result
+
+    def execute(self, *args, **kwargs):
+        return self._sampled(self._cursor.execute, *args, **kwargs)
+
+    def copy_expert(self, *args, **kwargs):
+        return self._sampled(self._cursor.copy_expert, *args, **kwargs)
@@ -0,0 +1,185 @@
+"""
+Prometheus metrics of dbmake runs, written in the text exposition format for node-exporter's
+textfile collector (dbmake --metrics-file=<path> <command> ...).
+
+The file is replaced atomically when a command finishes, so the collector never reads a partial file.
+Commands report into the active registry through the functions of this module, which do nothing
+unless a registry is active.
+"""
+
+import os
+import threading
+import time
+
+from . import database
+from . import migrations
+from .common import SUCCESS
+
+# Metric name -> (type, help)
+METRICS = {
+    "dbmake_run_timestamp_seconds": ("gauge", "Unix time the dbmake command finished at"),
+    "dbmake_run_duration_seconds": ("gauge", "Duration of the dbmake command"),
+    "dbmake_run_success": ("gauge", "Whether the dbmake command succeeded (1) or failed (0)"),
+    "dbmake_database_revision": ("gauge", "Current migration revision of a database"),
+    "dbmake_pending_migrations": ("gauge", "Number of migrations above a database's current revision"),
+    "dbmake_migration_step_duration_seconds": ("gauge", "Duration of a migration step taken by the run"),
+    "dbmake_connect_duration_seconds": ("gauge", "Duration of connecting a database"),
+    "dbmake_connect_failures": ("gauge", "Number of failed attempts to connect a database during the run"),
+}
+
+_active = None
+
+
+class MetricsRegistry:
+    """
+    Samples of the metrics, by metric name and labels. Thread safe.
+    """
+
+    def __init__(self):
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._samples.setdefault(name, {})[self._key(labels)] = value
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            samples = self._samples.setdefault(name, {})
+            key = self._key(labels)
+            samples[key] = samples.get(key, 0) + value
+
+    def get(self, name, **labels):
+        return self._samples.get(name, {}).get(self._key(labels))
+
+    @staticmethod
+    def _key(labels):
+        return tuple(sorted(labels.items()))
+
+    def render(self):
+        """
+        :return: The samples in Prometheus text exposition format
+        """
+        lines = []
+
+        with self._lock:
+            for name in sorted(self._samples):
+                type_, help_ = METRICS[name]
+                lines.append("# HELP %s %s" % (name, help_))
+                lines.append("# TYPE %s %s" % (name, type_))
+
+                for key in sorted(self._samples[name]):
+                    labels = ",".join('%s="%s"' % (label, _escape(value)) for label, value in key)
+                    lines.append("%s%s %s" % (
+                        name, "{%s}" % labels if labels else "", _format(self._samples[name][key])
+                    ))
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Atomically replaces a file with the samples. The temporary file is created in the same
+        directory, so it's renamed within a single file system.
+        """
+        temporary_file = "%s.%s.tmp" % (path, os.getpid())
+        with open(temporary_file, 'w') as f:
+            f.write(self.render())
+        os.rename(temporary_file, path)
+
+
+class MetricsListener(migrations.PrintMigrationListener):
+    """
+    Prints migration progress as commands do, recording the steps' durations
+    """
+
+    def __init__(self, registry, connection_name):
+        migrations.PrintMigrationListener.__init__(self)
+        self._registry = registry
+        self._connection_name = connection_name
+
+    def on_step_finish(self, step):
+        migrations.PrintMigrationListener.on_step_finish(self, step)
+        self._registry.set(
+            "dbmake_migration_step_duration_seconds", step.duration,
+            connection=self._connection_name,
+            revision=step.migration.revision,
+            direction=step.direction
+        )
+
+
+def activate(registry):
+    """
+    :param MetricsRegistry registry: Registry commands report into, None to stop collecting
+    """
+    global _active
+    _active = registry
+
+
+def active():
+    return _active
+
+
+def listener(connection_name):
+    """
+    :return: A listener for MigrationsManager.migrate_to_revision() that records step durations
+             if metrics are collected, otherwise None (the default, printing listener)
+    """
+    if _active is None:
+        return None
+
+    return MetricsListener(_active, connection_name)
+
+
+def connect(db_connection_config):
+    """
+    Creates a database adapter, recording how long connecting took or that it failed
+    :return: BaseDbAdapter
+    :raise psycopg2.OperationalError
+    """
+    if _active is None:
+        return database.DbAdapterFactory.create(db_connection_config)
+
+    started_at = time.time()
+    try:
+        db_adapter = database.DbAdapterFactory.create(db_connection_config)
+    except Exception:
+        _active.inc("dbmake_connect_failures", connection=db_connection_config.connection_name)
+        raise
+
+    _active.set("dbmake_connect_duration_seconds", time.time() - started_at,
+                connection=db_connection_config.connection_name)
+    _active.inc("dbmake_connect_failures", 0, connection=db_connection_config.connection_name)
+
+    return db_adapter
+
+
+def revision(connection_name, revision_, revisions):
+    """
+    Records a database's current revision and the number of migrations above it
+    :param revisions: All revisions of the migrations directory
+    """
+    if _active is None:
+        return
+
+    _active.set("dbmake_database_revision", int(revision_), connection=connection_name)
+    _active.set("dbmake_pending_migrations", len([r for r in revisions if r > int(revision_)]),
+                connection=connection_name)
+
+
+def finish_run(command_name, result, duration):
+    if _active is None:
+        return
+
+    _active.set("dbmake_run_timestamp_seconds", time.time(), command=command_name)
+    _active.set("dbmake_run_duration_seconds", duration, command=command_name)
+    _active.set("dbmake_run_success", 1 if result == SUCCESS else 0, command=command_name)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
@@ -1,7 +1,24 @@
+import contextlib
+import mmap
 import os
+import random
 import re
+import time
 
+import psycopg2
+
+from . import checksums
 from . import common
+from . import compiler
+from . import database
+from . import impact
+from . import locks
+from . import seed_data
+from .helper import quote_identifier
+from .sql_lexer import SqlStatementType, BufferReader
+
+# SQLSTATE of "relation does not exist"
+UNDEFINED_TABLE = "42P01"
 
 
 class MigrationVO:
@@ -12,6 +29,13 @@ class MigrationVO:
     revision = None
     create_date = None
     migration_name = None
+    checksum = None
+
+    # JSON of impact.ImpactReport, when the migration has been applied with an impact report
+    impact = None
+
+    # Seconds applying the migration took
+    duration = None
 
 
 class MigrationsDao:
@@ -19,28 +43,119 @@ class MigrationsDao:
     TABLE_NAME = common.MIGRATIONS_TABLE
     db_adapter = None
 
-    def __init__(self, db_adapter):
+    # Schema of the migrations table, None for the one search_path finds
+    schema = None
+
+    # Name of the migrations table in statements, qualified with the schema if it's set
+    table = TABLE_NAME
+
+    # Columns added to the migrations table after its first version, see upgrade_table()
+    UPGRADE_COLUMNS = [
+        ("checksum", "character varying(64)"),
+        ("impact", "text"),
+        ("duration", "double precision")
+    ]
+
+    def __init__(self, db_adapter, schema=None):
+        """
+        :param schema: Schema of the migrations table, e.g. a tenant's schema
+        """
         self.db_adapter = db_adapter
+        self.schema = schema
+        if schema is not None:
+            self.table = quote_identifier(schema) + "." + self.TABLE_NAME
+
+    def create_table(self):
+        """
+        Creates the migrations table
+        """
+        self.db_adapter.execute_string("""
+            CREATE TABLE %s (
+                id SERIAL,
+                revision integer NOT NULL,
+                migration_name character varying(100),
+                create_date TIMESTAMP DEFAULT NOW() NOT NULL,
+                checksum character varying(64),
+                impact text,
+                duration double precision
+            )
+            """ % self.table
+        )
 
     def create(self, migration_vo):
         """
         Inserts a new ValueObject record into a table
         :param migration_vo: MigrationVO
         """
+        columns = ['revision', 'migration_name']
+        values = [str(migration_vo.revision), migration_vo.migration_name]
+
+        if migration_vo.checksum is not None:
+            columns.append('checksum')
+            values.append(migration_vo.checksum)
+
+        if migration_vo.impact is not None:
+            columns.append('impact')
+            values.append(migration_vo.impact)
+
+        if migration_vo.duration is not None:
+            columns.append('duration')
+            values.append(migration_vo.duration)
+
         cursor = self.db_adapter.get_cursor()
         cursor.execute(
-            'INSERT INTO ' + self.TABLE_NAME + ' (revision, migration_name) VALUES (%s, %s)',
-            (str(migration_vo.revision), migration_vo.migration_name)
+            'INSERT INTO ' + self.table + ' (' + ', '.join(columns) + ') VALUES (' +
+            ', '.join(['%s'] * len(values)) + ')',
+            values
         )
         self.db_adapter.commit()
         cursor.close()
 
+    def upgrade_table(self):
+        """
+        Adds the columns that later dbmake versions keep in the migrations table to a table
+        created by an earlier version
+        """
+        cursor = self.db_adapter.get_cursor()
+        cursor.execute(
+            "SELECT column_name FROM information_schema.columns WHERE table_name = %s" +
+            ("" if self.schema is None else " AND table_schema = %s"),
+            (self.TABLE_NAME,) if self.schema is None else (self.TABLE_NAME, self.schema)
+        )
+        existing_columns = [row[0] for row in cursor.fetchall()]
+
+        for column, column_type in self.UPGRADE_COLUMNS:
+            if column not in existing_columns:
+                cursor.execute('ALTER TABLE ' + self.table + ' ADD COLUMN ' + column + ' ' + column_type)
+
+        self.db_adapter.commit()
+        cursor.close()
+
+    def find_checksums(self):
+        """
+        Fetches the most recently recorded checksum of every revision up to the current one.
+        Works with migrations tables of any version in a single query.
+        :return: dict of revision to checksum (None if the revision was applied without a checksum)
+        """
+        query = """
+        SELECT DISTINCT ON (m.revision) m.revision, to_jsonb(m) ->> 'checksum' AS checksum
+        FROM {table} m
+        WHERE m.revision <= (SELECT revision FROM {table} ORDER BY create_date DESC, id DESC LIMIT 1)
+        ORDER BY m.revision, m.create_date DESC, m.id DESC
+        """.format(table=self.table)
+
+        checksums_ = {}
+        for record in self.db_adapter.fetch_dict(query):
+            checksums_[int(record["revision"])] = record["checksum"]
+
+        return checksums_
+
     def find_most_recent(self):
         """
         Fetches the most recent record from table by "create_date"
         :return: MigrationVO
         """
-        query = 'SELECT * FROM ' + self.TABLE_NAME + ' ORDER BY create_date DESC LIMIT 1'
+        query = 'SELECT * FROM ' + self.table + ' ORDER BY create_date DESC LIMIT 1'
         result = self.db_adapter.fetch_single_dict(query)
 
         migration_vo = None
@@ -54,13 +169,35 @@ class MigrationsDao:
 
         return migration_vo
 
+    def find_head(self):
+        """
+        Fetches the most recent record in a single round trip, not checking whether the migrations table exists
+        beforehand, for commands that only read a revision of every database
+        :return: MigrationVO, or None if no migration has been applied yet
+        :raise MigrationsTableNotFound
+        """
+        try:
+            return self.find_most_recent()
+        except psycopg2.ProgrammingError as e:
+            if e.pgcode != UNDEFINED_TABLE:
+                raise
+
+            self.db_adapter.rollback()
+            raise common.MigrationsTableNotFound("Error! No migrations table has been found.")
+
     def is_migration_table_exists(self):
         """
         Checks if the migrations table is already exists
         :returns Boolean
         """
         cursor = self.db_adapter.get_cursor()
-        cursor.execute("SELECT * FROM information_schema.tables WHERE table_name='" + self.TABLE_NAME + "'")
+        if self.schema is None:
+            cursor.execute("SELECT * FROM information_schema.tables WHERE table_name='" + self.TABLE_NAME + "'")
+        else:
+            cursor.execute(
+                "SELECT * FROM information_schema.tables WHERE table_name = %s AND table_schema = %s",
+                (self.TABLE_NAME, self.schema)
+            )
 
         if cursor.rowcount == 0:
             cursor.close()
@@ -75,21 +212,202 @@ class MigrationsDao:
         :return: Boolean
         """
         cursor = self.db_adapter.get_cursor()
-        cursor.execute('DROP TABLE "' + self.TABLE_NAME + '"')
+        cursor.execute('DROP TABLE ' + (quote_identifier(self.TABLE_NAME) if self.schema is None else self.table))
         self.db_adapter.commit()
         cursor.close()
 
         return True
 
 
+class MigrationProgressVO:
+    """
+    Migration progress ValueObject, represents a checkpoint of a long running migration task
+    """
+    revision = None
+    task = None
+    checkpoint = None
+    rows_done = 0
+    update_date = None
+
+
+class MigrationProgressDao:
+    """
+    Keeps checkpoints of long running migration tasks, so an interrupted task may be resumed.
+    Checkpoints aren't committed by the DAO, they must be committed together with the work they describe.
+    """
+
+    TABLE_NAME = common.PROGRESS_TABLE
+    db_adapter = None
+
+    def __init__(self, db_adapter):
+        self.db_adapter = db_adapter
+
+    def create_table(self):
+        """
+        Creates the progress table if it doesn't exist yet
+        """
+        self.db_adapter.execute_string("""
+            CREATE TABLE IF NOT EXISTS %s (
+                revision bigint NOT NULL,
+                task character varying(100) NOT NULL,
+                checkpoint text,
+                rows_done bigint DEFAULT 0 NOT NULL,
+                update_date TIMESTAMP DEFAULT NOW() NOT NULL,
+                PRIMARY KEY (revision, task)
+            )
+            """ % self.TABLE_NAME
+        )
+
+    def find(self, revision, task):
+        """
+        Fetches a checkpoint of a migration's task
+        :return: MigrationProgressVO or None
+        """
+        cursor = self.db_adapter.get_cursor()
+        cursor.execute(
+            'SELECT checkpoint, rows_done, update_date FROM ' + self.TABLE_NAME + ' WHERE revision = %s AND task = %s',
+            (revision, task)
+        )
+        result = cursor.fetchone()
+        cursor.close()
+
+        if result is None:
+            return None
+
+        progress_vo = MigrationProgressVO()
+        progress_vo.revision = revision
+        progress_vo.task = task
+        progress_vo.checkpoint = result[0]
+        progress_vo.rows_done = result[1]
+        progress_vo.update_date = result[2]
+
+        return progress_vo
+
+    def save(self, progress_vo):
+        """
+        Inserts or updates a checkpoint of a migration's task
+        :param progress_vo: MigrationProgressVO
+        """
+        cursor = self.db_adapter.get_cursor()
+        cursor.execute(
+            'INSERT INTO ' + self.TABLE_NAME + ' (revision, task, checkpoint, rows_done) VALUES (%s, %s, %s, %s) '
+            'ON CONFLICT (revision, task) DO UPDATE '
+            'SET checkpoint = EXCLUDED.checkpoint, rows_done = EXCLUDED.rows_done, update_date = NOW()',
+            (progress_vo.revision, progress_vo.task, str(progress_vo.checkpoint), progress_vo.rows_done)
+        )
+        cursor.close()
+
+    def delete(self, revision, task):
+        """
+        Deletes a checkpoint of a migration's task
+        """
+        cursor = self.db_adapter.get_cursor()
+        cursor.execute(
+            'DELETE FROM ' + self.TABLE_NAME + ' WHERE revision = %s AND task = %s',
+            (revision, task)
+        )
+        cursor.close()
+
+
+class MigrationLock:
+    """
+    Session level advisory lock a dbmake run holds on a database while migrating it. Session level locks
+    outlive the commits of migration steps, and the server releases them if the run's connection is lost.
+    """
+
+    # Seconds to wait for the lock by default
+    DEFAULT_TIMEOUT = 600
+
+    # Seconds between attempts to get the lock, randomized by +/-50% so that waiters don't poll in step
+    POLL_INTERVAL = 1.0
+
+    def __init__(self, db_adapter, key=common.MIGRATION_LOCK_KEY):
+        self._db_adapter = db_adapter
+        self._key = key
+
+    def try_acquire(self):
+        """
+        :return: True if the lock has been taken, False if another session holds it
+        """
+        cursor = self._db_adapter.get_cursor()
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", (self._key,))
+        acquired = cursor.fetchone()[0]
+        cursor.close()
+
+        # Waiters mustn't sit idle in a transaction. A session level lock outlives the rollback, which
+        # unlike a commit leaves the run's commit count alone.
+        self._db_adapter.rollback()
+
+        return acquired
+
+    def acquire(self, timeout=None, listener=None):
+        """
+        Waits for the lock up to timeout seconds
+        :param MigrationListener listener: Is told once if the lock is held by another session
+        :raise MigrationLockTimeout
+        """
+        if timeout is None:
+            timeout = self.DEFAULT_TIMEOUT
+
+        deadline = time.time() + timeout
+        waiting = False
+
+        while not self.try_acquire():
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise common.MigrationLockTimeout(
+                    "Error! Another dbmake run has been migrating the database for more than %ss" % timeout
+                )
+
+            if not waiting and listener is not None:
+                listener.on_message("Waiting for another dbmake run to finish migrating the database...")
+            waiting = True
+
+            time.sleep(min(remaining, self.POLL_INTERVAL * random.uniform(0.5, 1.5)))
+
+    def release(self):
+        # A failed step leaves its transaction aborted, nothing runs in it until it's rolled back
+        self._db_adapter.rollback()
+
+        cursor = self._db_adapter.get_cursor()
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (self._key,))
+        cursor.close()
+        # The unlock is effective whatever the transaction it ran in becomes
+        self._db_adapter.rollback()
+
+
 class Migration:
 
     """Separates"""
     MIGRATE_UP_DOWN_SEPARATOR = "-- DBMAKE: SEPARATOR"
     name = None
     revision = None
-    migrate_up_statements = None
-    migrate_down_statements = None
+    migration_file = None
+    directives = None
+
+    # The migration file's statements are only compiled once they're needed, most migrations of a directory
+    # have been applied long ago
+    _compiled = None
+    _streaming = None
+    _texts = None
+
+    # Migration files larger than that (in bytes) are executed statement by statement right from the file
+    # and aren't compiled into lists of statements, see compiler.LexedMigration
+    STREAMING_THRESHOLD = 16 * 1024 * 1024
+
+    # Suffix of a directory next to a migration file that holds the migration's seed data files
+    SEED_DATA_DIR_SUFFIX = ".data"
+
+    # Migration files describe themselves with "-- DBMAKE: <directive>" comments at their top
+    DIRECTIVE_PREFIX = "-- DBMAKE:"
+    DIRECTIVES_HEADER_SIZE = 64 * 1024
+
+    # A migration declaring this directive runs each statement in its own transaction and may be resumed
+    # from a failed statement (e.g. a migration with "CREATE INDEX CONCURRENTLY" statements)
+    NO_TRANSACTION_DIRECTIVE = "NO TRANSACTION"
+
+    # Progress task of the checkpoints of a non-transactional migration, suffixed with "up" or "down"
+    STATEMENTS_TASK = "statements"
 
     MIGRATION_TEMPLATE = '''
     -- DBMAKE: MIGRATE UP
@@ -117,69 +435,382 @@ class Migration:
 
     '''
 
-    def __init__(self, migration_file):
+    def __init__(self, migration_file, streaming=None, directives=None, compiled=None):
         """
         :param migration_file: Full path to a migration file including the file's name
+        :param streaming: Whether to execute the migration statement by statement right from the file
+                          instead of reading it into memory. By default only migration files larger
+                          than STREAMING_THRESHOLD, holding COPY data or non-transactional are streamed.
+        :param directives: The migration file's directives if they have already been read
+        :param compiled: The migration file compiled if it has already been
         :raise AttributeError, IOError
         """
-        # print "-----------------------------"
-        # print "Migration file: %s" % migration_file
-
-        # Read a migration file and extract from there "Migrate UP" and "Migrate DOWN" statements
-        f = open(migration_file, 'r')
-        with f:
-            migration_file_content = f.read()
-            migration_file_parts = migration_file_content.split(self.MIGRATE_UP_DOWN_SEPARATOR)
-
-            self.migrate_up_statements = migration_file_parts[0]
-
-            if len(migration_file_parts) > 1:
-                self.migrate_down_statements = migration_file_parts[1]
-
         # Extract the exact migration file name, and then parse a migraiton revision and a name from it
         result = re.match('^(?P<revision>[0-9]+)_(?P<name>.*)\.sql$', migration_file.split('/')[-1])
         self.revision = int(result.group('revision'))
         self.name = result.group('name')
+        self.migration_file = migration_file
+
+        if directives is None:
+            directives = self.read_directives(migration_file)
+        self.directives = directives
+
+        self._compiled = compiled
+        self._streaming = streaming
+
+    @property
+    def compiled(self):
+        """
+        The migration file compiled, a compiler.CompiledMigration, or a compiler.LexedMigration
+        of a file larger than STREAMING_THRESHOLD
+        :raise SqlSyntaxError
+        """
+        if self._compiled is None:
+            if os.path.getsize(self.migration_file) > self.STREAMING_THRESHOLD:
+                self._compiled = compiler.LexedMigration(self.migration_file)
+            else:
+                self._compiled = compiler.compile_migration(self.migration_file)
+
+        return self._compiled
+
+    @property
+    def transactional(self):
+        """
+        Non-transactional migrations, declared so or holding statements PostgreSQL refuses to run
+        in a transaction, are always executed statement by statement
+        """
+        return self.NO_TRANSACTION_DIRECTIVE not in self.directives and self.compiled.transactional
+
+    @property
+    def streaming(self):
+        if self._streaming is None:
+            self._streaming = (
+                os.path.getsize(self.migration_file) > self.STREAMING_THRESHOLD
+                or not self.transactional
+                or self.compiled.has_copy
+            )
+
+        return self._streaming
 
-        # print "Name: %s" % self.name
-        # print "Revision: %s" % self.revision
-        # print "Content:"
-        # print migration_file_content
-        # print "Migration UP:"
-        # print self.migrate_up_statements
-        # print "Migration DOWN:"
-        # print self.migrate_down_statements
-        # print "-----------------------------"
+    @property
+    def migrate_up_statements(self):
+        """
+        "Migrate UP" statements as a single script, None for a streamed migration
+        """
+        return self._section_texts()[0]
 
-    def migrate(self, db_adapter):
+    @property
+    def migrate_down_statements(self):
+        """
+        "Migrate DOWN" statements as a single script, None for a streamed migration or if there's no such section
+        """
+        return self._section_texts()[1]
+
+    def _section_texts(self):
+        if self._texts is None:
+            if self.streaming:
+                self._texts = (None, None)
+            else:
+                # Join "Migrate UP" and "Migrate DOWN" statements, those of included files in their place
+                with self._mapped_files() as buffer_of:
+                    self._texts = (
+                        self._section_text(self.compiled.up, buffer_of),
+                        None if self.compiled.down is None else self._section_text(self.compiled.down, buffer_of)
+                    )
+
+        return self._texts
+
+    def migrate(self, db_adapter, listener=None):
         """
         Applies the migration's "Migrate UP" statements on a database via db_adapter's connection
+        and loads the migration's seed data files within the same transaction
+        :param MigrationListener listener: Receives the progress [Default: PrintMigrationListener]
         """
-        if self.migrate_up_statements is None:
+        if not self.transactional:
+            return self._execute_resumable(db_adapter, migrate_up=True, listener=listener)
+
+        if not self.streaming and self.migrate_up_statements is None:
             return False
 
         # Apply migrations statements
         cursor = db_adapter.get_cursor()
-        cursor.execute(self.migrate_up_statements)
+
+        if self.streaming:
+            self._execute_streaming(cursor, migrate_up=True)
+        elif self.migrate_up_statements:
+            cursor.execute(self.migrate_up_statements)
+
+        for seed_data_file in self.seed_data_files():
+            seed_data_file.load(cursor)
+
         db_adapter.commit()
         cursor.close()
 
         return True
 
-    def rollback(self, db_adapter):
+    def rollback(self, db_adapter, listener=None):
+        """
+        Deletes the rows loaded from the migration's seed data files and applies the migration's
+        "Migrate DOWN" statements on a database via db_adapter's connection
+        :param MigrationListener listener: Receives the progress [Default: PrintMigrationListener]
+        """
+        if not self.transactional:
+            return self._execute_resumable(db_adapter, migrate_up=False, listener=listener)
+
+        if not self.streaming and self.migrate_down_statements is None:
+            return False
+
+        def _unload_seed_data():
+            for seed_data_file in reversed(self.seed_data_files()):
+                seed_data_file.unload(cursor)
+
+        cursor = db_adapter.get_cursor()
+
+        if self.streaming:
+            result = self._execute_streaming(cursor, migrate_up=False, before=_unload_seed_data)
+        else:
+            _unload_seed_data()
+            if self.migrate_down_statements:
+                cursor.execute(self.migrate_down_statements)
+            result = True
+
+        if result:
+            db_adapter.commit()
+        else:
+            db_adapter.rollback()
+        cursor.close()
+
+        return result
+
+    def seed_data_files(self):
+        """
+        Returns a list of SeedDataFile found in the migration's seed data directory
+        (e.g. "1430991341_billing.data" next to "1430991341_billing.sql"), ordered by file name
+        """
+        return seed_data.SeedDataFile.list(self.migration_file[:-len(".sql")] + self.SEED_DATA_DIR_SUFFIX)
+
+    @contextlib.contextmanager
+    def _mapped_files(self):
+        """
+        Maps the migration file and the files it includes into memory for reading, each one once it's needed
+        :return: A function of a compiled statement's file to the file's buffer
+        """
+        directory = os.path.dirname(self.migration_file)
+        buffers = {}
+
+        with contextlib.ExitStack() as stack:
+            def buffer_of(file_):
+                if file_ not in buffers:
+                    path = self.migration_file if file_ is None else os.path.join(directory, file_)
+                    buffers[file_] = stack.enter_context(_mapped_file(path))
+                return buffers[file_]
+
+            yield buffer_of
+
+    @staticmethod
+    def _section_text(statements, buffer_of):
+        """
+        Returns statements of a section as a single script
+        """
+        return b"\n".join(statement.sql(buffer_of(statement.file)) for statement in statements).decode('utf-8')
+
+    @staticmethod
+    def _execute_statement(cursor, buffer, statement):
         """
-        Applies the migration's "Migrate DOWN" statements on a database via db_adapter's connection
+        Executes a single compiled statement, inline "COPY ... FROM STDIN" data is fed to the database
+        without being copied out of the buffer
         """
-        if self.migrate_down_statements is None:
+        if statement.type_ == SqlStatementType.COPY:
+            cursor.copy_expert(
+                statement.sql(buffer),
+                BufferReader(buffer, statement.copy_data_start, statement.copy_data_end)
+            )
+        else:
+            cursor.execute(statement.sql(buffer))
+
+    def _execute_streaming(self, cursor, migrate_up, before=None):
+        """
+        Executes either "Migrate UP" or "Migrate DOWN" statements one by one right from the memory mapped
+        migration file, so memory usage doesn't depend on the file's size.
+        The statements aren't committed, the caller commits them all as a single transaction.
+
+        :param before: A callable to call right before the section's first statement is executed
+        :return: False if the migration has no "Migrate DOWN" section, otherwise True
+        """
+        statements = self.compiled.section(migrate_up)
+        if statements is None:
             return False
 
+        if before is not None:
+            before()
+
+        with self._mapped_files() as buffer_of:
+            for statement in statements:
+                self._execute_statement(cursor, buffer_of(statement.file), statement)
+
+        return True
+
+    def _execute_resumable(self, db_adapter, migrate_up, listener=None):
+        """
+        Executes either "Migrate UP" or "Migrate DOWN" statements of a non-transactional migration,
+        each statement in its own transaction. The number of completed statements is checkpointed
+        after every statement, so if a statement fails, migrating again continues right from it.
+        Seed data files are loaded (or unloaded) in a transaction of their own.
+
+        :return: False if the migration has no "Migrate DOWN" section, otherwise True
+        """
+        if listener is None:
+            listener = PrintMigrationListener()
+
+        task = "%s %s" % (self.STATEMENTS_TASK, "up" if migrate_up else "down")
+        progress_dao = MigrationProgressDao(db_adapter)
+        progress_dao.create_table()
+
+        progress_vo = progress_dao.find(self.revision, task)
+        if progress_vo is None:
+            progress_vo = MigrationProgressVO()
+            progress_vo.revision = self.revision
+            progress_vo.task = task
+            progress_vo.checkpoint = 0
+        else:
+            progress_vo.checkpoint = int(progress_vo.checkpoint)
+            listener.on_message("Resuming revision %s from statement #%s" % (self.revision, progress_vo.checkpoint + 1))
+
         cursor = db_adapter.get_cursor()
-        cursor.execute(self.migrate_down_statements)
+
+        if not migrate_up:
+            for seed_data_file in reversed(self.seed_data_files()):
+                seed_data_file.unload(cursor)
+            db_adapter.commit()
+
+        statements = self.compiled.section(migrate_up)
+        if statements is None:
+            return False
+
+        with self._mapped_files() as buffer_of:
+            resume_from = progress_vo.checkpoint
+
+            # psycopg2 refuses to switch to autocommit in the transaction reading the checkpoint has opened
+            db_adapter.commit()
+            db_adapter.set_autocommit(True)
+
+            try:
+                for index, statement in enumerate(statements):
+                    if index < resume_from:
+                        continue
+
+                    buffer = buffer_of(statement.file)
+
+                    # The first statement may have failed before, there's no checkpoint to tell
+                    if index == resume_from:
+                        self._drop_invalid_index(cursor, statement.sql(buffer), listener)
+
+                    try:
+                        self._execute_statement(cursor, buffer, statement)
+                    except Exception:
+                        listener.on_message("Error! Statement #%s of revision %s (%s) has failed"
+                                            % (index + 1, self.revision, statement.location(self.migration_file)))
+                        raise
+
+                    progress_vo.checkpoint = index + 1
+                    progress_dao.save(progress_vo)
+            finally:
+                db_adapter.set_autocommit(False)
+
+        if migrate_up:
+            for seed_data_file in self.seed_data_files():
+                seed_data_file.load(cursor)
+
+        progress_dao.delete(self.revision, task)
         db_adapter.commit()
         cursor.close()
 
         return True
 
+    @staticmethod
+    def _drop_invalid_index(cursor, sql, listener):
+        """
+        A failed "CREATE INDEX CONCURRENTLY" leaves an invalid index behind, which makes the statement
+        fail again with "already exists". Drops such an index before the statement is retried.
+        """
+        result = re.match(
+            br'^(?:\s|--[^\n]*\n|/\*.*?\*/)*CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+'
+            br'(?:IF\s+NOT\s+EXISTS\s+)?("(?:[^"]|"")+"|[\w$]+)',
+            sql,
+            re.I | re.S
+        )
+        if result is None:
+            return
+
+        index_name = result.group(1).decode('utf-8')
+        cursor.execute(
+            "SELECT 1 FROM pg_index WHERE indexrelid = to_regclass(%s) AND NOT indisvalid",
+            (index_name,)
+        )
+        if cursor.fetchone() is not None:
+            listener.on_message("Dropping invalid index %s left by the failed statement" % index_name)
+            cursor.execute("DROP INDEX CONCURRENTLY %s" % index_name)
+
+    @classmethod
+    def read_directives(cls, migration_file):
+        """
+        Returns a list of "-- DBMAKE: <directive>" comments found in the migration file's "Migrate UP"
+        section, e.g. ["MIGRATE UP", "BACKFILL", "TABLE customers"]. Only the file's first
+        DIRECTIVES_HEADER_SIZE bytes are read.
+        :return: list
+        """
+        with open(migration_file, 'rb') as f:
+            header = f.read(cls.DIRECTIVES_HEADER_SIZE).decode('utf-8', 'replace')
+
+        directives = []
+        for line in header.splitlines():
+            line = line.strip()
+
+            if line.startswith(cls.MIGRATE_UP_DOWN_SEPARATOR):
+                break
+
+            if line.startswith(cls.DIRECTIVE_PREFIX):
+                directives.append(line[len(cls.DIRECTIVE_PREFIX):].strip())
+
+        return directives
+
+    def streamed(self):
+        """
+        Returns a copy of the migration that is executed statement by statement right from its file
+        :return: Migration
+        """
+        return Migration(self.migration_file, streaming=True, directives=self.directives, compiled=self._compiled)
+
+    @property
+    def rehearsable(self):
+        """
+        Whether the migration can run inside a transaction that is rolled back afterwards
+        """
+        return self.transactional
+
+    def statements(self, migrate_up=True):
+        """
+        Generates the compiled statements of the "Migrate UP" or "Migrate DOWN" section with their text
+        :return: Generator of (compiler.CompiledStatement, bytes)
+        """
+        with self._mapped_files() as buffer_of:
+            for statement in self.compiled.section(migrate_up) or []:
+                yield statement, statement.sql(buffer_of(statement.file))
+
+    def relations(self, migrate_up=True):
+        """
+        Returns names of the tables and materialized views migrating UP or DOWN touches, the tables of
+        the migration's seed data included, or None if they're unknown
+        :return: list or None
+        """
+        relations = self.compiled.relations(migrate_up)
+        if relations is None:
+            return None
+
+        return relations + [
+            seed_data_file.table for seed_data_file in self.seed_data_files() if seed_data_file.table not in relations
+        ]
+
     def get_vo(self):
         """
         Returns MigrationVO that represents a new migration record with the Migration's params
@@ -187,10 +818,157 @@ class Migration:
         migration_vo = MigrationVO()
         migration_vo.migration_name = self.name
         migration_vo.revision = self.revision
+        migration_vo.checksum = checksums.file_checksum(self.migration_file)
 
         return migration_vo
 
 
+@contextlib.contextmanager
+def _mapped_file(path):
+    """
+    Maps a file into memory for reading
+    """
+    with open(path, 'rb') as f:
+        # Empty files can't be mapped
+        if os.fstat(f.fileno()).st_size == 0:
+            buffer = None
+        else:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if buffer is None:
+        yield b""
+        return
+
+    try:
+        yield buffer
+    finally:
+        buffer.close()
+
+
+class MigrationType:
+    """
+    Lists all migration types a migration file may declare with a "-- DBMAKE: <type>" directive
+    """
+    BACKFILL = "BACKFILL"
+    ONLINE_SCHEMA_CHANGE = "ONLINE SCHEMA CHANGE"
+
+    def __init__(self):
+        pass
+
+
+class MigrationFactory:
+    """
+    Use this class statically to create migrations of the type their files declare
+    """
+
+    def __init__(self):
+        pass
+
+    @classmethod
+    def create(cls, migration_file):
+        """
+        :param migration_file: Full path to a migration file including the file's name
+        :return: Migration
+        :raise AttributeError, IOError
+        """
+        directives = Migration.read_directives(migration_file)
+
+        if MigrationType.BACKFILL in directives:
+            from .backfill import BackfillMigration
+            return BackfillMigration(migration_file, directives)
+
+        if MigrationType.ONLINE_SCHEMA_CHANGE in directives:
+            from .online_schema_change import OnlineSchemaChangeMigration
+            return OnlineSchemaChangeMigration(migration_file, directives)
+
+        return Migration(migration_file, directives=directives)
+
+
+class MigrationDirection:
+    UP = "up"
+    DOWN = "down"
+
+    def __init__(self):
+        pass
+
+
+class MigrationStep:
+    """
+    A single step of migrating a database from one revision to another
+    """
+
+    # The migration to apply (UP) or to roll back (DOWN)
+    migration = None
+    direction = MigrationDirection.UP
+
+    # The migration whose revision the database is at once the step is done
+    target_migration = None
+
+    # How long the step took, in seconds
+    duration = None
+
+    # impact.ImpactReport of the step, if the manager was asked for one
+    impact = None
+
+    # locks.LockProfile of the step, if the step has been rehearsed with a lock profile
+    locks = None
+
+    def __init__(self, migration, direction, target_migration):
+        self.migration = migration
+        self.direction = direction
+        self.target_migration = target_migration
+
+    @property
+    def revision(self):
+        """
+        The revision the database is at once the step is done
+        """
+        return self.target_migration.revision
+
+
+class MigrationListener:
+    """
+    Receives progress events of MigrationsManager and migrations. The base listener ignores them all,
+    subclass it to collect, report or export the progress.
+    """
+
+    def __init__(self):
+        pass
+
+    def on_step_start(self, step):
+        """
+        :param MigrationStep step: A step that is about to be taken
+        """
+        pass
+
+    def on_step_finish(self, step):
+        """
+        :param MigrationStep step: A step that has been taken, with its duration set
+        """
+        pass
+
+    def on_message(self, message):
+        """
+        :param str message: Any other progress information
+        """
+        pass
+
+
+class PrintMigrationListener(MigrationListener):
+    """
+    Prints the progress, the listener dbmake commands use
+    """
+
+    def on_step_start(self, step):
+        print("Migrating %s to revision: %s..." % (step.direction, step.revision))
+
+    def on_step_finish(self, step):
+        print("OK")
+
+    def on_message(self, message):
+        print(message)
+
+
 class MigrationsManager:
     """
     Performs and rollbacks migrations
@@ -199,54 +977,235 @@ class MigrationsManager:
     # _db_adapter = None
     _migrations_dir = None
     _cur_revision = None
+    _migrations = None
 
     # , db_adapter
     def __init__(self, migrations_dir):
         # self._db_adapter = db_adapter
         self._migrations_dir = migrations_dir
 
-    def migrate_to_revision(self, target_revision, db_adapter, dry_run=False):
+    def migrate_to_revision(self, target_revision, db_adapter, dry_run=False, listener=None, impact_report=False,
+                            rehearse=False, lock_profile=False, lock_timeout=None, online_ddl=False):
         """
         :param target_revision: Migration revision to migrate to
+        :param db_adapter: Adapter of a database to migrate
+        :param dry_run: Report the steps without taking them
+        :param MigrationListener listener: Receives the progress [Default: PrintMigrationListener]
+        :param impact_report: Snapshot tables before and after every step, report which ones were created,
+                              dropped, rewritten or resized and store the report with the step's history record
+        :param rehearse: Take all steps in a single transaction and roll it back, reporting their impact
+        :param lock_profile: Rehearse the steps statement by statement, reporting locks each step takes
+        :param lock_timeout: Seconds to wait for another dbmake run migrating the database to finish
+                             [Default: MigrationLock.DEFAULT_TIMEOUT]
+        :param online_ddl: Rewrite statements that lock existing tables into their low-lock equivalents,
+                           reporting the rewritten statements on dry runs
         :return:
+        :raise MigrationLockTimeout
         """
-        migrations = self._migrations_list()
+        if listener is None:
+            listener = PrintMigrationListener()
 
-        if len(migrations) == 0:
-            raise common.DbmakeException("Error! No migrations found in %s" % self._migrations_dir)
+        if (rehearse or lock_profile) and not dry_run:
+            self._rehearse(target_revision, db_adapter, listener, lock_profile)
+            return True
+
+        if dry_run:
+            return self._take_steps(target_revision, db_adapter, dry_run, listener, impact_report, online_ddl)
+
+        # Many nodes may start migrating a database at once, only the first one to get the lock
+        # takes the steps and the rest find the database already migrated once they get it
+        migration_vo = MigrationsDao(db_adapter).find_most_recent()
+        if migration_vo is not None and int(migration_vo.revision) == target_revision:
+            listener.on_message("Current revision is already equals to target revision")
+            return True
 
-        # migrations_dao = MigrationsDao(self._db_adapter)
+        migration_lock = MigrationLock(db_adapter)
+        migration_lock.acquire(lock_timeout, listener)
+        try:
+            return self._take_steps(target_revision, db_adapter, dry_run, listener, impact_report, online_ddl)
+        finally:
+            migration_lock.release()
+
+    def _take_steps(self, target_revision, db_adapter, dry_run, listener, impact_report, online_ddl=False):
+        """
+        Takes the steps from the database's current revision, read right before, to target_revision
+        """
         migrations_dao = MigrationsDao(db_adapter)
 
+        if not dry_run:
+            migrations_dao.upgrade_table()
+
         # Check schema's current revision against the migration's revision
         # and decide whether to migrate or not
         migration_vo = migrations_dao.find_most_recent()
+        current_revision = None if migration_vo is None else int(migration_vo.revision)
 
-        # If database has no revision, then first apply the ZERO-MIGRATION
-        applied_zero_migration = False
-        if migration_vo is None:
-            if migrations[0].revision != 0:
-                raise common.DbmakeException("Error! No ZERO-MIGRATION was found in %s" % self._migrations_dir)
+        steps = self.plan(current_revision, target_revision)
+
+        if len(steps) == 0:
+            listener.on_message("Current revision is already equals to target revision")
+            return True
+
+        if online_ddl:
+            # Imported here, online_ddl.OnlineMigration extends Migration
+            from .online_ddl import OnlineMigration, transform
+
+        for step in steps:
+            if online_ddl:
+                step.migration = transform(step.migration)
+
+            listener.on_step_start(step)
+            started_at = time.time()
 
-            print("Migrating up to revision: 0...")
+            if online_ddl and dry_run and isinstance(step.migration, OnlineMigration):
+                for line in step.migration.lines():
+                    listener.on_message(line)
+
+            if impact_report and not dry_run:
+                # Only the relations the step touches are snapshotted, if they're known
+                relations = step.migration.relations(step.direction == MigrationDirection.UP)
+                snapshot_before = impact.snapshot(db_adapter, relations)
 
             if not dry_run:
-                # result = migrations[0].migrate(self._db_adapter)
-                result = migrations[0].migrate(db_adapter)
-                if result is True:
-                    # Update migrations table
-                    migrations_dao.create(migrations[0].get_vo())
-                    current_revision = 0
+                if step.direction == MigrationDirection.UP:
+                    result = step.migration.migrate(db_adapter, listener)
+
+                    # If database has no revision, the ZERO-MIGRATION must succeed before anything else
+                    if result is not True and current_revision is None and step.revision == 0:
+                        listener.on_message("Failure")
+                        raise common.MigrationFailed("Error! Failed to migrate to revision %s" % step.revision)
                 else:
-                    print("Failure")
-                    raise common.DbmakeException("Error! Failed to migrate to revision %s" % str(migrations[0].revision))
-            else:
-                current_revision = 0
+                    step.migration.rollback(db_adapter, listener)
 
-            print("OK")
-            applied_zero_migration = True
-        else:
-            current_revision = int(migration_vo.revision)
+                migration_vo = step.target_migration.get_vo()
+
+                if impact_report:
+                    step.impact = impact.ImpactReport(snapshot_before, impact.snapshot(db_adapter, relations),
+                                                      time.time() - started_at)
+                    migration_vo.impact = step.impact.to_json()
+                    self._report_impact(step, listener)
+
+                migration_vo.duration = time.time() - started_at
+
+                # Update migrations table
+                migrations_dao.create(migration_vo)
+
+            step.duration = time.time() - started_at
+            listener.on_step_finish(step)
+
+        return True
+
+    def _rehearse(self, target_revision, db_adapter, listener, lock_profile=False):
+        """
+        Takes the steps to target_revision in a single transaction, reports their impact and rolls
+        the transaction back. Steps that can't run in a transaction are skipped.
+        :param lock_profile: Execute the steps statement by statement, sampling locks after each statement
+        :return: A list of the rehearsed MigrationStep with their impact reports
+        """
+        rehearsal_adapter = database.RehearsalAdapter(db_adapter)
+        migrations_dao = MigrationsDao(rehearsal_adapter)
+
+        try:
+            migrations_dao.upgrade_table()
+            migration_vo = migrations_dao.find_most_recent()
+            current_revision = None if migration_vo is None else int(migration_vo.revision)
+
+            steps = self.plan(current_revision, target_revision)
+
+            for step in steps:
+                listener.on_step_start(step)
+
+                if not step.migration.rehearsable:
+                    listener.on_message("    Skipped, revision %s can't run inside a transaction"
+                                        % step.migration.revision)
+                    continue
+
+                migration = step.migration
+                step_adapter = rehearsal_adapter
+
+                if lock_profile:
+                    migration = migration.streamed()
+                    step.locks = locks.LockProfile(rehearsal_adapter)
+                    step_adapter = locks.LockProfilingAdapter(rehearsal_adapter, step.locks)
+
+                if lock_profile:
+                    # Before the snapshot, sizing the relations takes locks on them the migration would not
+                    step.locks.start()
+
+                started_at = time.time()
+                relations = migration.relations(step.direction == MigrationDirection.UP)
+                snapshot_before = impact.snapshot(rehearsal_adapter, relations)
+                rehearsal_adapter.begin_step()
+
+                if step.direction == MigrationDirection.UP:
+                    migration.migrate(step_adapter, listener)
+                else:
+                    migration.rollback(step_adapter, listener)
+
+                if lock_profile:
+                    # A real migration commits right here, releasing its locks
+                    step.locks.finish()
+
+                migrations_dao.create(step.target_migration.get_vo())
+
+                step.duration = time.time() - started_at
+                step.impact = impact.ImpactReport(snapshot_before, impact.snapshot(rehearsal_adapter, relations),
+                                                  step.duration)
+
+                self._report_impact(step, listener)
+
+                if lock_profile:
+                    for line in step.locks.lines():
+                        listener.on_message(line)
+
+                listener.on_step_finish(step)
+        finally:
+            rehearsal_adapter.discard()
+
+        listener.on_message("Rehearsal is over, all changes have been rolled back")
+
+        return steps
+
+    @staticmethod
+    def _report_impact(step, listener):
+        for line in step.impact.lines():
+            listener.on_message(line)
+        for relation in step.impact.rewrites:
+            listener.on_message("Warning! Revision %s rewrote %s (%s), holding an ACCESS EXCLUSIVE lock" % (
+                step.migration.revision, relation.name, impact.format_size(relation.size_before)
+            ))
+
+    def load(self):
+        """
+        Parses the migration files, before a manager is shared between threads
+        :return: MigrationsManager
+        """
+        self._migrations_list()
+        return self
+
+    def plan(self, current_revision, target_revision):
+        """
+        Returns a list of steps that take a database from current_revision to target_revision
+        :param current_revision: Database's current revision, None if the database has no migrations yet,
+                                 the ZERO-MIGRATION is applied first then
+        :param target_revision: Migration revision to migrate to
+        :return: list of MigrationStep
+        :raise DbmakeException, RevisionNotFound
+        """
+        migrations = self._migrations_list()
+
+        if len(migrations) == 0:
+            raise common.DbmakeException("Error! No migrations found in %s" % self._migrations_dir)
+
+        steps = []
+
+        # If database has no revision, then first apply the ZERO-MIGRATION
+        if current_revision is None:
+            if migrations[0].revision != 0:
+                raise common.DbmakeException("Error! No ZERO-MIGRATION was found in %s" % self._migrations_dir)
+
+            steps.append(MigrationStep(migrations[0], MigrationDirection.UP, migrations[0]))
+            current_revision = 0
 
         # Now let's find indices of current migration and target migration within migrations list
         current_index = None
@@ -259,43 +1218,47 @@ class MigrationsManager:
                 target_index = index
 
         if current_index is None:
-            raise common.DbmakeException("Error! A migration file of current revision was not found. "
-                                         "Current revision: %s" % current_revision)
+            raise common.RevisionNotFound("Error! A migration file of current revision was not found. "
+                                          "Current revision: %s" % current_revision)
         if target_index is None:
-            raise common.DbmakeException("Error! A migration file of target revision was not found. "
-                                         "Target revision: %s" % target_revision)
-
-        if current_index == target_index:
-            if not applied_zero_migration:
-                print("Current revision is already equals to target revision")
-            return True
+            raise common.RevisionNotFound("Error! A migration file of target revision was not found. "
+                                          "Target revision: %s" % target_revision)
 
-        elif (target_index - current_index) > 0:
+        if target_index > current_index:
             for i in range(current_index + 1, target_index + 1, 1):
-                print("Migrating up to revision: %s..." % str(migrations[i].revision))
-
-                if not dry_run:
-                    # migrations[i].migrate(self._db_adapter)
-                    migrations[i].migrate(db_adapter)
-                    migrations_dao.create(migrations[i].get_vo())
-                print("OK")
+                steps.append(MigrationStep(migrations[i], MigrationDirection.UP, migrations[i]))
         else:
             for i in range(current_index, target_index, -1):
-                print("Migrating down to revision: %s..." % str(migrations[i-1].revision))
+                steps.append(MigrationStep(migrations[i], MigrationDirection.DOWN, migrations[i - 1]))
 
-                if not dry_run:
-                    # migrations[i].rollback(self._db_adapter)
-                    migrations[i].rollback(db_adapter)
-                    migrations_dao.create(migrations[i-1].get_vo())
-                print("OK")
+        return steps
 
-        return True
+    def relative_revision(self, current_revision, steps):
+        """
+        Returns the revision that is a number of steps up (positive steps) or down (negative steps)
+        from current_revision, the same way "migrate --up/--down" counts them
+        :raise RevisionNotFound
+        """
+        revisions = self.revisions()
+
+        if current_revision not in revisions:
+            raise common.RevisionNotFound("Error! Current revision's migration wasn't found. "
+                                          "Current revision: %s" % current_revision)
+
+        index = revisions.index(current_revision) + steps
+        index = min(max(index, 0), len(revisions) - 1)
+
+        return revisions[index]
 
     def _migrations_list(self):
         """
         Returns a sorted list of migrations instances representing migrations files
-        within the manager's migrations directory
+        within the manager's migrations directory. The files are parsed once per manager,
+        so a single manager can migrate any number of databases.
         """
+        if self._migrations is not None:
+            return self._migrations
+
         def _sort_by_revision(m):
             """
             A key function to sort migrations list by revision
@@ -308,35 +1271,50 @@ class MigrationsManager:
                 migration_file = self._migrations_dir + os.sep + file_
 
                 try:
-                    migrations.append(Migration(migration_file))
+                    migrations.append(MigrationFactory.create(migration_file))
                 except AttributeError:
                     pass
 
         # Sort migrations in ascending order by migration.revision field
         migrations = sorted(migrations, key=_sort_by_revision)
+        self._migrations = migrations
 
         return migrations
 
-    def revisions(self):
+    def migration_files(self):
         """
-        Returns a sorted list in ascending order of available migration revisions
-        in the migration directory
-        :return:
+        Returns a sorted list in ascending order by revision of (revision, full path) tuples
+        of migration files in the migration directory
+        :return: list
         """
-
-        revisions = []
+        migration_files = []
         for file_ in os.listdir(self._migrations_dir):
             if file_.endswith(".sql"):
                 try:
                     result = re.match('^(?P<revision>[0-9]+)_(?P<name>.*)\.sql$', file_)
-                    revisions.append(int(result.group('revision')))
+                    migration_files.append((int(result.group('revision')), self._migrations_dir + os.sep + file_))
                 except AttributeError:
                     pass
 
         # Sort migrations in ascending order by migration.revision field
-        revisions = sorted(revisions)
+        migration_files = sorted(migration_files)
+
+        return migration_files
+
+    def migrations(self):
+        """
+        Returns a list of the migrations, sorted in ascending order by revision
+        :return: list of Migration
+        """
+        return list(self._migrations_list())
 
-        return revisions
+    def revisions(self):
+        """
+        Returns a sorted list in ascending order of available migration revisions
+        in the migration directory
+        :return:
+        """
+        return [revision for revision, migration_file in self.migration_files()]
 
     def is_revision_exists(self, revision):
         if int(revision) in self.revisions():
@@ -0,0 +1,214 @@
+"""
+Online DDL: an opt-in stage between loading a migration and executing it (dbmake migrate --online-ddl)
+that rewrites statements holding strong locks on existing tables into their low-lock equivalents:
+
+    CREATE INDEX ...                         CREATE INDEX CONCURRENTLY ...
+    ALTER TABLE t ADD CONSTRAINT c           ALTER TABLE t ADD CONSTRAINT c FOREIGN KEY/CHECK ... NOT VALID;
+        FOREIGN KEY/CHECK ...;               ALTER TABLE t VALIDATE CONSTRAINT c;
+    ALTER TABLE t ALTER c SET NOT NULL;      ALTER TABLE t ADD CONSTRAINT t_c_not_null CHECK (c IS NOT NULL) NOT VALID;
+                                             ALTER TABLE t VALIDATE CONSTRAINT t_c_not_null;
+                                             ALTER TABLE t ALTER COLUMN c SET NOT NULL;
+                                             ALTER TABLE t DROP CONSTRAINT t_c_not_null;
+
+A validation only holds a SHARE UPDATE EXCLUSIVE lock when it runs in a transaction of its own, and
+SET NOT NULL skips its table scan given a valid CHECK constraint (PostgreSQL 12+), so a rewritten
+migration runs statement by statement, each statement in its own transaction, and is resumable from
+a failed statement. Tables created earlier in the same migration are left alone, they're empty.
+"""
+
+import re
+
+from . import compiler
+from .compiler import CompiledMigration, CompiledStatement
+from .helper import quote_identifier
+from .migrations import Migration
+
+_NAME = r'(?:"(?:[^"]|"")+"|[\w$]+)'
+_TABLE = r'(?P<table>' + _NAME + r'(?:\s*\.\s*' + _NAME + r')?)'
+_ALTER_TABLE = r'^ALTER\s+TABLE\s+(?:IF\s+EXISTS\s+)?(?:ONLY\s+)?' + _TABLE + r'\s+'
+
+_CREATE_INDEX = re.compile(r'^(CREATE\s+(?:UNIQUE\s+)?INDEX)\s+(?!CONCURRENTLY\b)', re.I)
+_ADD_CONSTRAINT = re.compile(
+    _ALTER_TABLE + r'ADD\s+CONSTRAINT\s+(?P<constraint>' + _NAME + r')\s+(?:FOREIGN\s+KEY|CHECK)\b', re.I
+)
+_SET_NOT_NULL = re.compile(
+    _ALTER_TABLE + r'ALTER\s+(?:COLUMN\s+)?(?P<column>' + _NAME + r')\s+SET\s+NOT\s+NULL\s*;?$', re.I
+)
+_NOT_VALID = re.compile(r'\bNOT\s+VALID\b', re.I)
+
+# PostgreSQL truncates identifiers to that many bytes
+MAX_IDENTIFIER_LENGTH = 63
+
+
+class RewrittenStatement(CompiledStatement):
+    """
+    A statement of a rewritten migration, in place of a part of the original statement
+    """
+
+    text = None
+
+    def __init__(self, original, text):
+        """
+        :param CompiledStatement original: The statement the rewritten one replaces
+        :param str text:
+        """
+        self.file = original.file
+        self.start = original.start
+        self.end = original.end
+        self.line = original.line
+        self.relations = original.relations
+        self.text = text.encode('utf-8')
+        self.transactional = compiler.is_transactional(compiler.normalize(self.text))
+
+    def sql(self, buffer):
+        return self.text
+
+
+class OnlineMigration(Migration):
+    """
+    A migration with rewritten statements, executed statement by statement
+    """
+
+    # Kept apart from the original migration's checkpoints, the statements aren't the same
+    STATEMENTS_TASK = "online statements"
+
+    # A list of (CompiledStatement, a list of str) of the original statements and their rewrites
+    rewrites = None
+
+    def __init__(self, migration, compiled, rewrites):
+        """
+        :param Migration migration: The original migration
+        :param CompiledMigration compiled: The original migration's statements, some of them rewritten
+        """
+        Migration.__init__(self, migration.migration_file, streaming=True,
+                           directives=migration.directives + [Migration.NO_TRANSACTION_DIRECTIVE], compiled=compiled)
+        self.rewrites = rewrites
+
+    def lines(self):
+        """
+        :return: A list of human readable lines, the rewritten statements
+        """
+        lines = []
+        for statement, texts in self.rewrites:
+            lines.append("    %s rewritten as:" % statement.location(self.migration_file))
+            for text in texts:
+                lines.extend("        " + line for line in text.splitlines())
+
+        return lines
+
+
+def rewrite(sql):
+    """
+    Rewrites a single statement into its low-lock equivalent
+    :param str sql: The statement
+    :return: A list of statements, None if the statement has no low-lock equivalent or already is one
+    """
+    text = compiler.normalize(sql.encode('utf-8'))
+
+    if _CREATE_INDEX.match(text):
+        return [_CREATE_INDEX.sub(r'\1 CONCURRENTLY ', sql, count=1)]
+
+    if not _is_single_action(text):
+        return None
+
+    match = _ADD_CONSTRAINT.match(text)
+    if match is not None and _NOT_VALID.search(text) is None:
+        body = sql.rstrip().rstrip(";")
+        # A line comment at the end of the statement would swallow the clause
+        separator = "\n" if "--" in body.splitlines()[-1] else " "
+
+        return [
+            body + separator + "NOT VALID;",
+            "ALTER TABLE %s VALIDATE CONSTRAINT %s;" % (match.group('table'), match.group('constraint')),
+        ]
+
+    match = _SET_NOT_NULL.match(text)
+    if match is not None:
+        table, column = match.group('table'), match.group('column')
+        constraint = quote_identifier(_not_null_constraint_name(table, column))
+
+        return [
+            "ALTER TABLE %s ADD CONSTRAINT %s CHECK (%s IS NOT NULL) NOT VALID;" % (table, constraint, column),
+            "ALTER TABLE %s VALIDATE CONSTRAINT %s;" % (table, constraint),
+            "ALTER TABLE %s ALTER COLUMN %s SET NOT NULL;" % (table, column),
+            "ALTER TABLE %s DROP CONSTRAINT %s;" % (table, constraint),
+        ]
+
+    return None
+
+
+def transform(migration):
+    """
+    Rewrites the migration's statements that lock existing tables into their low-lock equivalents
+    :param Migration migration:
+    :return: OnlineMigration, or the migration itself if none of its statements has been rewritten
+    """
+    # Other types of migrations don't run their statements as they're written
+    if type(migration) is not Migration:
+        return migration
+
+    rewrites = []
+    up = _transform_section(migration, True, rewrites)
+    down = _transform_section(migration, False, rewrites)
+
+    if not rewrites:
+        return migration
+
+    return OnlineMigration(migration, CompiledMigration(up, down, migration.compiled.includes), rewrites)
+
+
+def _transform_section(migration, migrate_up, rewrites):
+    """
+    :return: A list of CompiledStatement of the section with rewritten statements in place of the original ones,
+             None if the migration has no such section
+    """
+    if migration.compiled.section(migrate_up) is None:
+        return None
+
+    statements = []
+    created = set()
+
+    for statement, sql in migration.statements(migrate_up):
+        text = compiler.normalize(sql)
+        relation = statement.relations[0] if statement.relations else None
+
+        texts = None
+        if compiler.creates_table(text):
+            created.add(compiler.relation_key(relation))
+        elif relation is not None and compiler.relation_key(relation) not in created:
+            texts = rewrite(sql.decode('utf-8'))
+
+        if texts is None:
+            statements.append(statement)
+        else:
+            rewrites.append((statement, texts))
+            statements.extend(RewrittenStatement(statement, text_) for text_ in texts)
+
+    return statements
+
+
+def _is_single_action(text):
+    """
+    Whether an ALTER TABLE statement has a single action, i.e. no comma outside of parentheses
+    """
+    depth = 0
+    for char in text:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            return False
+
+    return True
+
+
+def _not_null_constraint_name(table, column):
+    name = "%s_%s_not_null" % (_unquote(re.split(r'\s*\.\s*', table)[-1]), _unquote(column))
+    return name.encode('utf-8')[:MAX_IDENTIFIER_LENGTH].decode('utf-8', 'ignore')
+
+
+def _unquote(name):
+    if name.startswith('"'):
+        return name[1:-1].replace('""', '"')
+    return name.lower()
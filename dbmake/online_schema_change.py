@@ -0,0 +1,515 @@
+import json
+import time
+
+import psycopg2
+
+from .common import DbmakeException
+from .migrations import Migration, MigrationProgressDao, MigrationProgressVO, PrintMigrationListener
+from .helper import format_duration, quote_identifier, quote_qualified_name
+
+# SQLSTATE of "could not obtain lock", raised once lock_timeout elapses
+LOCK_NOT_AVAILABLE = "55P03"
+
+# Types of a KEY column, as format_type() names them
+INTEGER_TYPES = ["smallint", "integer", "bigint"]
+
+
+class OnlineSchemaChangeMigration(Migration):
+    """
+    A migration that changes a big table without holding an ACCESS EXCLUSIVE lock while the table is
+    rewritten (a column type change, a primary key switched to bigint etc.):
+
+      1. A shadow table is created like the table and changed, and a trigger logs the keys of rows
+         written to the table since then into a change log table
+      2. Rows are copied into the shadow table in key range chunks, each chunk in its own transaction
+      3. Rows of the logged keys are copied again until the change log is about drained
+      4. In a short lock window, the rest of the change log is replayed and the tables are swapped.
+         The "Migrate UP" statements run in the same transaction, e.g. to grant privileges on the
+         new table or to recreate views of the table.
+      5. The old table and the change log are dropped
+
+    A checkpoint is committed with every phase and chunk, so an interrupted change continues where it
+    stopped when migrating again. The migration is recorded in the migrations table once the tables
+    have been swapped.
+
+    An online schema change migration file declares the change with directives:
+
+        -- DBMAKE: ONLINE SCHEMA CHANGE
+        -- DBMAKE: TABLE orders
+        -- DBMAKE: KEY id                                   [An integer column, unique]
+        -- DBMAKE: CHANGE ALTER COLUMN id TYPE bigint       [An ALTER TABLE action, one directive per action]
+        -- DBMAKE: BATCH SIZE 10000                         [Optional. Number of keys per chunk]
+        -- DBMAKE: SLEEP 0.5                                [Optional. Seconds to sleep between chunks]
+        -- DBMAKE: LOCK TIMEOUT 2                           [Optional. Seconds to wait for the swap's lock]
+        -- DBMAKE: KEEP OLD TABLE                           [Optional. Keep the old table as _dbmake_<rev>_old]
+
+        -- DBMAKE: SEPARATOR
+
+        -- DBMAKE: MIGRATE DOWN
+        ...
+
+    Columns are copied by name, values converted with assignment casts. Foreign keys of the table are
+    recreated on the shadow table, while a table referenced by foreign keys isn't changed at all. Indexes
+    and constraints of the new table keep the names PostgreSQL generated for the shadow table. Triggers,
+    privileges and row level security policies of the table aren't carried over, the "Migrate UP"
+    statements may restore them.
+    """
+
+    PROGRESS_TASK = "online schema change"
+
+    # Phases of the change, in the order they're taken
+    PHASE_COPY = "copy"
+    PHASE_CATCH_UP = "catch up"
+    PHASE_CLEANUP = "cleanup"
+
+    # How often (in seconds) to report the copy progress
+    REPORT_INTERVAL = 5
+
+    # How many times to try taking a lock that lock_timeout has run out on before giving up
+    LOCK_ATTEMPTS = 10
+
+    table = None
+    key = None
+    changes = None
+    batch_size = 10000
+    sleep = 0
+    lock_timeout = 2
+    keep_old_table = False
+
+    # Schema and name of the table, resolved in the database
+    _schema = None
+    _table_name = None
+
+    def __init__(self, migration_file, directives=None):
+        """
+        :param migration_file: Full path to a migration file including the file's name
+        :param directives: The migration file's directives if they have already been read
+        :raise AttributeError, IOError, DbmakeException
+        """
+        Migration.__init__(self, migration_file, streaming=False, directives=directives)
+
+        self.changes = []
+        for directive in self.directives:
+            if directive.startswith("TABLE "):
+                self.table = directive[len("TABLE "):].strip()
+            elif directive.startswith("KEY "):
+                self.key = directive[len("KEY "):].strip()
+            elif directive.startswith("CHANGE "):
+                self.changes.append(directive[len("CHANGE "):].strip().rstrip(";"))
+            elif directive.startswith("BATCH SIZE "):
+                self.batch_size = int(directive[len("BATCH SIZE "):])
+            elif directive.startswith("SLEEP "):
+                self.sleep = float(directive[len("SLEEP "):])
+            elif directive.startswith("LOCK TIMEOUT "):
+                self.lock_timeout = float(directive[len("LOCK TIMEOUT "):])
+            elif directive == "KEEP OLD TABLE":
+                self.keep_old_table = True
+
+        if self.table is None or self.key is None or not self.changes:
+            raise DbmakeException("Error! Online schema change %s must declare TABLE, KEY and CHANGE"
+                                  % migration_file)
+
+        if self.batch_size <= 0:
+            raise DbmakeException("Error! Online schema change BATCH SIZE must be positive in %s" % migration_file)
+
+        if self.lock_timeout <= 0:
+            raise DbmakeException("Error! Online schema change LOCK TIMEOUT must be positive in %s"
+                                  % migration_file)
+
+    @property
+    def rehearsable(self):
+        # The change commits chunk by chunk and swaps tables, a rehearsal would hold its locks in one transaction
+        return False
+
+    def relations(self, migrate_up=True):
+        if migrate_up:
+            return [self.table]
+
+        return Migration.relations(self, migrate_up)
+
+    def migrate(self, db_adapter, listener=None):
+        """
+        Takes the change's phases, resuming from the last checkpoint if there is one
+        :param MigrationListener listener: Receives the progress [Default: PrintMigrationListener]
+        """
+        if listener is None:
+            listener = PrintMigrationListener()
+
+        progress_dao = MigrationProgressDao(db_adapter)
+        progress_dao.create_table()
+
+        progress_vo = progress_dao.find(self.revision, self.PROGRESS_TASK)
+        self._resolve_table(db_adapter)
+
+        if progress_vo is None:
+            progress_vo = MigrationProgressVO()
+            progress_vo.revision = self.revision
+            progress_vo.task = self.PROGRESS_TASK
+            progress_vo.rows_done = 0
+            self._with_lock_retries(db_adapter, listener, "set up", self._set_up, progress_vo)
+            db_adapter.commit()
+        else:
+            progress_vo.checkpoint = json.loads(progress_vo.checkpoint)
+            listener.on_message("Resuming online schema change of %s at its %s phase (%s rows done)" % (
+                self.table, progress_vo.checkpoint["phase"], progress_vo.rows_done
+            ))
+
+        if progress_vo.checkpoint["phase"] == self.PHASE_COPY:
+            self._copy(db_adapter, listener, progress_vo)
+
+        if progress_vo.checkpoint["phase"] == self.PHASE_CATCH_UP:
+            self._catch_up(db_adapter, listener, progress_vo)
+            self._with_lock_retries(db_adapter, listener, "swap", self._swap, progress_vo)
+            db_adapter.commit()
+            listener.on_message("Swapped %s with its changed copy" % self.table)
+
+        cursor = db_adapter.get_cursor()
+        if not self.keep_old_table:
+            cursor.execute("DROP TABLE IF EXISTS %s" % self._relation("old"))
+        cursor.execute("DROP TABLE IF EXISTS %s" % self._relation("log"))
+
+        # The change is done, the next run of the migration (after a rollback) must start over
+        progress_dao.delete(self.revision, self.PROGRESS_TASK)
+        db_adapter.commit()
+        cursor.close()
+
+        return True
+
+    def rollback(self, db_adapter, listener=None):
+        """
+        Drops what an unfinished change has left behind and applies the migration's "Migrate DOWN" statements
+        """
+        progress_dao = MigrationProgressDao(db_adapter)
+        progress_dao.create_table()
+
+        progress_vo = progress_dao.find(self.revision, self.PROGRESS_TASK)
+        if progress_vo is not None:
+            self._resolve_table(db_adapter)
+
+            cursor = db_adapter.get_cursor()
+            if json.loads(progress_vo.checkpoint)["phase"] != self.PHASE_CLEANUP:
+                cursor.execute("DROP TRIGGER IF EXISTS %s ON %s" % (
+                    quote_identifier(self._name("capture")), self._qualified_table
+                ))
+                cursor.execute("DROP FUNCTION IF EXISTS %s()" % self._relation("capture"))
+                cursor.execute("DROP TABLE IF EXISTS %s" % self._relation("shadow"))
+            cursor.execute("DROP TABLE IF EXISTS %s" % self._relation("log"))
+            progress_dao.delete(self.revision, self.PROGRESS_TASK)
+            db_adapter.commit()
+            cursor.close()
+
+        return Migration.rollback(self, db_adapter, listener)
+
+    def _resolve_table(self, db_adapter):
+        """
+        Finds the schema the table is in, so the shadow table and the change log are created next to it
+        :raise DbmakeException
+        """
+        cursor = db_adapter.get_cursor()
+        cursor.execute(
+            "SELECT n.nspname, c.relname FROM pg_catalog.pg_class c "
+            "JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace "
+            "WHERE c.oid = to_regclass(%s)",
+            (quote_qualified_name(self.table),)
+        )
+        result = cursor.fetchone()
+        cursor.close()
+
+        if result is None:
+            raise DbmakeException("Error! Online schema change table %s doesn't exist" % self.table)
+
+        self._schema, self._table_name = result
+
+    def _name(self, suffix):
+        return "_dbmake_%s_%s" % (self.revision, suffix)
+
+    def _relation(self, suffix):
+        """
+        Returns a quoted name of a relation dbmake creates for the change, in the table's schema
+        """
+        return "%s.%s" % (quote_identifier(self._schema), quote_identifier(self._name(suffix)))
+
+    @property
+    def _qualified_table(self):
+        return "%s.%s" % (quote_identifier(self._schema), quote_identifier(self._table_name))
+
+    def _set_up(self, db_adapter, cursor, progress_vo):
+        """
+        Creates the changed shadow table, the change log table and the trigger logging changes into it,
+        then reads the key range to copy
+        """
+        table = self._qualified_table
+        shadow = self._relation("shadow")
+        log = self._relation("log")
+        key = quote_identifier(self.key)
+
+        cursor.execute(
+            "SELECT conname, conrelid::regclass::text FROM pg_catalog.pg_constraint "
+            "WHERE confrelid = %s::regclass AND contype = 'f'",
+            (table,)
+        )
+        referencing = cursor.fetchall()
+        if referencing:
+            raise DbmakeException("Error! %s can't be changed online, it's referenced by foreign keys: %s" % (
+                self.table, ", ".join("%s of %s" % (name, relation) for name, relation in referencing)
+            ))
+
+        cursor.execute(
+            "SELECT format_type(atttypid, atttypmod) FROM pg_catalog.pg_attribute "
+            "WHERE attrelid = %s::regclass AND attname = %s AND attnum > 0 AND NOT attisdropped",
+            (table, self.key)
+        )
+        result = cursor.fetchone()
+        if result is None:
+            raise DbmakeException("Error! Online schema change table %s has no column %s" % (self.table, self.key))
+
+        # Rows are copied in key ranges
+        if result[0] not in INTEGER_TYPES:
+            raise DbmakeException("Error! Online schema change KEY %s of %s must be an integer column, not %s" % (
+                self.key, self.table, result[0]
+            ))
+
+        cursor.execute("CREATE TABLE %s (LIKE %s INCLUDING ALL)" % (shadow, table))
+
+        # LIKE doesn't copy foreign keys, they're checked as the rows are copied
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_catalog.pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype = 'f'",
+            (table,)
+        )
+        for name, definition in cursor.fetchall():
+            cursor.execute("ALTER TABLE %s ADD CONSTRAINT %s %s" % (shadow, quote_identifier(name), definition))
+
+        for change in self.changes:
+            cursor.execute("ALTER TABLE %s %s" % (shadow, change))
+
+        cursor.execute("CREATE TABLE %s (id bigserial PRIMARY KEY, key %s)" % (log, result[0]))
+        cursor.execute("""
+            CREATE FUNCTION %(function)s() RETURNS trigger LANGUAGE plpgsql AS $$
+            BEGIN
+                IF TG_OP <> 'INSERT' THEN
+                    INSERT INTO %(log)s (key) VALUES (OLD.%(key)s);
+                END IF;
+                IF TG_OP <> 'DELETE' THEN
+                    INSERT INTO %(log)s (key) VALUES (NEW.%(key)s);
+                END IF;
+                RETURN NULL;
+            END
+            $$
+            """ % {"function": self._relation("capture"), "log": log, "key": key}
+        )
+        cursor.execute("CREATE TRIGGER %s AFTER INSERT OR UPDATE OR DELETE ON %s FOR EACH ROW EXECUTE PROCEDURE %s()"
+                       % (quote_identifier(self._name("capture")), table, self._relation("capture")))
+
+        # Writes wait for the trigger to be committed, the range covers every row written before
+        cursor.execute("SELECT min(%s), max(%s) FROM %s" % (key, key, table))
+        range_start, range_end = cursor.fetchone()
+
+        if range_start is None:
+            progress_vo.checkpoint = {"phase": self.PHASE_CATCH_UP}
+        else:
+            progress_vo.checkpoint = {"phase": self.PHASE_COPY, "key": int(range_start) - 1, "end": int(range_end)}
+        self._save(db_adapter, progress_vo)
+
+    def _copy(self, db_adapter, listener, progress_vo):
+        """
+        Copies the table's rows into the shadow table chunk by chunk
+        """
+        cursor = db_adapter.get_cursor()
+        columns = self._copied_columns(cursor)
+        query = "INSERT INTO %s (%s) OVERRIDING SYSTEM VALUE SELECT %s FROM %s WHERE %s > %%s AND %s <= %%s" % (
+            self._relation("shadow"), columns, columns, self._qualified_table,
+            quote_identifier(self.key), quote_identifier(self.key)
+        )
+
+        checkpoint = progress_vo.checkpoint
+        range_end = checkpoint["end"]
+        started_at = time.time()
+        reported_at = started_at
+        first_key = checkpoint["key"]
+        first_rows_done = progress_vo.rows_done
+
+        while checkpoint["key"] < range_end:
+            chunk_end = min(checkpoint["key"] + self.batch_size, range_end)
+            cursor.execute(query, (checkpoint["key"], chunk_end))
+
+            checkpoint["key"] = chunk_end
+            if chunk_end == range_end:
+                checkpoint["phase"] = self.PHASE_CATCH_UP
+            progress_vo.rows_done += max(cursor.rowcount, 0)
+            self._save(db_adapter, progress_vo)
+            db_adapter.commit()
+
+            now = time.time()
+            if now - reported_at >= self.REPORT_INTERVAL or chunk_end == range_end:
+                reported_at = now
+                self._report(listener, checkpoint, first_key, progress_vo.rows_done - first_rows_done,
+                             progress_vo.rows_done, now - started_at)
+
+            if self.sleep > 0 and chunk_end < range_end:
+                time.sleep(self.sleep)
+
+        cursor.close()
+
+    def _catch_up(self, db_adapter, listener, progress_vo):
+        """
+        Replays the change log chunk by chunk until a chunk finds it about drained
+        """
+        cursor = db_adapter.get_cursor()
+        columns = self._copied_columns(cursor)
+        replayed = 0
+
+        while True:
+            changes = self._replay(cursor, columns, self.batch_size)
+            progress_vo.rows_done += changes
+            self._save(db_adapter, progress_vo)
+            db_adapter.commit()
+
+            # Counted in log records, a few hot rows may fill a chunk with a handful of keys
+            replayed += changes
+            if changes < self.batch_size:
+                break
+
+            if self.sleep > 0:
+                time.sleep(self.sleep)
+
+        cursor.close()
+        listener.on_message("Caught up on %s changes of %s" % (replayed, self.table))
+
+    def _swap(self, db_adapter, cursor, progress_vo):
+        """
+        Replays the rest of the change log and swaps the tables while holding the table's ACCESS EXCLUSIVE lock
+        """
+        table = self._qualified_table
+        shadow = self._relation("shadow")
+
+        cursor.execute("LOCK TABLE %s IN ACCESS EXCLUSIVE MODE" % table)
+        progress_vo.rows_done += self._replay(cursor, self._copied_columns(cursor), None)
+
+        cursor.execute("DROP TRIGGER %s ON %s" % (quote_identifier(self._name("capture")), table))
+        cursor.execute("DROP FUNCTION %s()" % self._relation("capture"))
+
+        # Serial columns' sequences must outlive the old table, identity columns' ones must carry on numbering
+        cursor.execute(
+            "SELECT s.oid::regclass::text, a.attname FROM pg_catalog.pg_depend d "
+            "JOIN pg_catalog.pg_class s ON s.oid = d.objid AND s.relkind = 'S' "
+            "JOIN pg_catalog.pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid "
+            "WHERE d.refobjid = %s::regclass AND d.deptype = 'a'",
+            (table,)
+        )
+        for sequence, column in cursor.fetchall():
+            cursor.execute("ALTER SEQUENCE %s OWNED BY %s.%s" % (sequence, shadow, quote_identifier(column)))
+
+        cursor.execute(
+            "SELECT attname FROM pg_catalog.pg_attribute WHERE attrelid = %s::regclass AND attidentity <> ''",
+            (shadow,)
+        )
+        for (column,) in cursor.fetchall():
+            cursor.execute(
+                "SELECT setval(pg_get_serial_sequence(%s, %s), nextval(pg_get_serial_sequence(%s, %s)))",
+                (shadow, column, table, column)
+            )
+
+        cursor.execute("ALTER TABLE %s RENAME TO %s" % (table, quote_identifier(self._name("old"))))
+        cursor.execute("ALTER TABLE %s RENAME TO %s" % (shadow, quote_identifier(self._table_name)))
+
+        if self.migrate_up_statements:
+            cursor.execute(self.migrate_up_statements)
+
+        progress_vo.checkpoint = {"phase": self.PHASE_CLEANUP}
+        self._save(db_adapter, progress_vo)
+
+    def _replay(self, cursor, columns, limit):
+        """
+        Copies the rows of the keys logged first once again, a deleted row is deleted from the shadow table
+        :param limit: Number of change log records to replay, None for all of them
+        :return: Number of the replayed change log records
+        """
+        log = self._relation("log")
+        shadow = self._relation("shadow")
+        key = quote_identifier(self.key)
+
+        if limit is None:
+            cursor.execute("DELETE FROM %s RETURNING key" % log)
+        else:
+            cursor.execute(
+                "DELETE FROM %s WHERE id IN (SELECT id FROM %s ORDER BY id LIMIT %%s) RETURNING key" % (log, log),
+                (limit,)
+            )
+        logged_keys = [row[0] for row in cursor.fetchall()]
+        keys = list(set(logged_keys))
+
+        if keys:
+            cursor.execute("DELETE FROM %s WHERE %s = ANY(%%s)" % (shadow, key), (keys,))
+            cursor.execute("INSERT INTO %s (%s) OVERRIDING SYSTEM VALUE SELECT %s FROM %s WHERE %s = ANY(%%s)" % (
+                shadow, columns, columns, self._qualified_table, key
+            ), (keys,))
+
+        return len(logged_keys)
+
+    def _copied_columns(self, cursor):
+        """
+        Returns a quoted list of the columns both tables have, except for the shadow table's generated ones
+        """
+        cursor.execute(
+            "SELECT s.attname FROM pg_catalog.pg_attribute s "
+            "JOIN pg_catalog.pg_attribute t ON t.attrelid = %s::regclass AND t.attname = s.attname "
+            "AND t.attnum > 0 AND NOT t.attisdropped "
+            "WHERE s.attrelid = %s::regclass AND s.attnum > 0 AND NOT s.attisdropped AND s.attgenerated = '' "
+            "ORDER BY s.attnum",
+            (self._qualified_table, self._relation("shadow"))
+        )
+
+        return ", ".join(quote_identifier(row[0]) for row in cursor.fetchall())
+
+    def _with_lock_retries(self, db_adapter, listener, what, function, progress_vo):
+        """
+        Calls function(db_adapter, cursor, progress_vo) in a transaction that gives up waiting for a lock
+        after lock_timeout seconds, so that writes don't queue up behind it, and tries again a while later
+        :raise DbmakeException
+        """
+        for attempt in range(1, self.LOCK_ATTEMPTS + 1):
+            cursor = db_adapter.get_cursor()
+            try:
+                cursor.execute("SET LOCAL lock_timeout = %s", ("%dms" % (self.lock_timeout * 1000),))
+                function(db_adapter, cursor, progress_vo)
+                return
+            except psycopg2.OperationalError as e:
+                if e.pgcode != LOCK_NOT_AVAILABLE:
+                    raise
+
+                db_adapter.rollback()
+                listener.on_message("Online schema change of %s: %s attempt %s of %s timed out waiting for a lock" % (
+                    self.table, what, attempt, self.LOCK_ATTEMPTS
+                ))
+                time.sleep(min(attempt, 10) * self.lock_timeout)
+            finally:
+                cursor.close()
+
+        raise DbmakeException("Error! Online schema change of %s failed to %s, the table is too busy" % (
+            self.table, what
+        ))
+
+    def _save(self, db_adapter, progress_vo):
+        """
+        Saves the checkpoint, not committing it
+        """
+        saved_vo = MigrationProgressVO()
+        saved_vo.revision = progress_vo.revision
+        saved_vo.task = progress_vo.task
+        saved_vo.checkpoint = json.dumps(progress_vo.checkpoint, sort_keys=True)
+        saved_vo.rows_done = progress_vo.rows_done
+        MigrationProgressDao(db_adapter).save(saved_vo)
+
+    def _report(self, listener, checkpoint, first_key, rows_copied, rows_done, elapsed):
+        """
+        Prints the copy's throughput and an ETA extrapolated from the share of the key range done so far
+        """
+        done = float(checkpoint["key"] - first_key) / max(checkpoint["end"] - first_key, 1)
+        rate = rows_copied / elapsed if elapsed > 0 else 0
+        eta = elapsed * (1 - done) / done if done > 0 else 0
+
+        listener.on_message("Online schema change of %s: %s = %s of %s, %s rows, %.0f rows/s, %.1f%% copied, ETA %s" % (
+            self.table, self.key, checkpoint["key"], checkpoint["end"], rows_done, rate, done * 100,
+            format_duration(eta)
+        ))
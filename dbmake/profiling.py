@@ -0,0 +1,223 @@
+"""
+Profiling of dbmake commands (dbmake --profile[=<path>] <command> ...).
+
+A profiled command run produces:
+
+    <path>.pstats            cProfile statistics of the whole run, for pstats or snakeviz
+    <path>.<section>.pstats  cProfile statistics of each section, e.g. of each connection of a fan-out run
+    <path>.txt               A report of time and memory per section and of top allocation sites
+
+Commands mark their per-connection work with section(), which costs nothing unless a profiler is active:
+
+    for db_connection_config in connections_configs:
+        with profiling.section(db_connection_config.connection_name):
+            ...
+"""
+
+import contextlib
+import cProfile
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+
+# Number of allocation sites and functions listed in the report
+TOP_N = 25
+
+# Frames kept per allocation, more frames attribute allocations better but cost more memory
+TRACEBACK_FRAMES = 10
+
+_active = None
+
+
+class SectionStats:
+    """
+    Time and memory of a single section of a profiled run
+    """
+
+    name = None
+    seconds = 0.0
+
+    # Net change of traced memory over the section, bytes
+    memory_delta = 0
+
+    def __init__(self, name, profile):
+        self.name = name
+        self.profile = profile
+
+
+class Profiler:
+    """
+    Profiles the thread that starts it with cProfile, and sections of any thread with profiles of their own.
+    Memory allocations of all threads are traced by tracemalloc.
+    """
+
+    _path = None
+
+    def __init__(self, path):
+        """
+        :param path: Path of the reports without an extension
+        """
+        self._path = path
+        self._profile = cProfile.Profile()
+        self._thread = None
+        self._started_at = None
+        self._seconds = None
+        self._sections = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def start(self):
+        global _active
+
+        tracemalloc.start(TRACEBACK_FRAMES)
+        self._thread = threading.current_thread()
+        self._started_at = time.time()
+        self._profile.enable()
+        _active = self
+
+    def stop(self):
+        """
+        Stops profiling and writes the reports
+        :return: A list of paths of the written files
+        """
+        global _active
+
+        self._profile.disable()
+        self._seconds = time.time() - self._started_at
+        _active = None
+
+        snapshot = tracemalloc.take_snapshot()
+        traced_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        return self._write(snapshot, traced_memory)
+
+    @contextlib.contextmanager
+    def section(self, name):
+        """
+        Profiles the code of the with-block separately. Sections don't nest, an inner section
+        is accounted to the outer one.
+        """
+        if getattr(self._local, "section", None) is not None:
+            yield
+            return
+
+        profile = cProfile.Profile()
+        in_main_thread = threading.current_thread() is self._thread
+        stats = SectionStats(name, profile)
+        self._local.section = stats
+
+        # A thread can't run two profilers at once, so the run's profiler pauses for the section
+        if in_main_thread:
+            self._profile.disable()
+
+        started_at = time.time()
+        memory_before = tracemalloc.get_traced_memory()[0]
+        try:
+            profile.enable()
+        except ValueError:
+            # Pythons that profile all threads by a single interpreter-wide profiler (3.12+) refuse
+            # a second one while the run's profiler is active, time and memory are still measured then
+            stats.profile = profile = None
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            stats.seconds = time.time() - started_at
+            stats.memory_delta = tracemalloc.get_traced_memory()[0] - memory_before
+            self._local.section = None
+
+            if in_main_thread:
+                self._profile.enable()
+
+            with self._lock:
+                self._sections.append(stats)
+
+    def _write(self, snapshot, traced_memory):
+        files = []
+
+        # The run's statistics include its sections'
+        run_stats = pstats.Stats(self._profile)
+        for section in self._sections:
+            if section.profile is None:
+                continue
+
+            section_file = "%s.%s.pstats" % (self._path, _file_name(section.name))
+            section_stats = pstats.Stats(section.profile)
+            section_stats.dump_stats(section_file)
+            run_stats.add(section_stats)
+            files.append(section_file)
+
+        run_file = self._path + ".pstats"
+        run_stats.dump_stats(run_file)
+        files.insert(0, run_file)
+
+        report_file = self._path + ".txt"
+        with open(report_file, 'w') as f:
+            f.write(self._report(run_stats, snapshot, traced_memory))
+        files.insert(1, report_file)
+
+        return files
+
+    def _report(self, run_stats, snapshot, traced_memory):
+        lines = [
+            "Total time: %.3fs" % self._seconds,
+            "Traced memory: %s current, %s peak" % (_format_bytes(traced_memory[0]), _format_bytes(traced_memory[1])),
+            "",
+        ]
+
+        if self._sections:
+            lines.append("Sections (%s):" % len(self._sections))
+            lines.append("%12s  %12s  %s" % ("seconds", "memory", "section"))
+            for section in sorted(self._sections, key=lambda s: s.seconds, reverse=True):
+                lines.append("%12.3f  %12s  %s" % (section.seconds, _format_bytes(section.memory_delta), section.name))
+            lines.append("")
+
+        lines.append("Top %s allocation sites:" % TOP_N)
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        for statistic in snapshot.filter_traces(filters).statistics("lineno")[:TOP_N]:
+            frame = statistic.traceback[0]
+            lines.append("%12s  %8s blocks  %s:%s" % (
+                _format_bytes(statistic.size), statistic.count, frame.filename, frame.lineno
+            ))
+        lines.append("")
+
+        lines.append("Top %s functions by cumulative time:" % TOP_N)
+        entries = sorted(run_stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+        for (filename, lineno, function), (_, calls, _, cumulative, _) in entries[:TOP_N]:
+            lines.append("%12.3f  %8s calls  %s:%s(%s)" % (cumulative, calls, filename, lineno, function))
+
+        return "\n".join(lines) + "\n"
+
+
+@contextlib.contextmanager
+def section(name):
+    """
+    Profiles a section of a command run separately, if the run is profiled
+    """
+    if _active is None:
+        yield
+    else:
+        with _active.section(name):
+            yield
+
+
+def default_path(command_name):
+    return "dbmake-%s-%s" % (command_name, time.strftime("%Y%m%d-%H%M%S"))
+
+
+def _file_name(name):
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", str(name))
+
+
+def _format_bytes(size):
+    sign = "-" if size < 0 else ""
+    size = abs(size)
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return "%s%.1f %s" % (sign, size, unit)
+        size /= 1024.0
+    return "%s%.1f GB" % (sign, size)
@@ -0,0 +1,240 @@
+"""
+Live progress of long-running statements of a migration (CREATE INDEX, CLUSTER, VACUUM, ANALYZE, COPY).
+
+ProgressMonitor polls PostgreSQL's pg_stat_progress_* views on a second connection for the backend
+that runs the migration, and reports the command, its phase, blocks and tuples done and an ETA.
+Views a server doesn't have are skipped (PostgreSQL 9.6 has the vacuum one only, 12 adds
+create_index and cluster, 13 analyze, 14 copy). Seeing another backend's progress requires the same
+database user or the pg_read_all_stats role.
+"""
+
+import threading
+import time
+
+from .helper import format_duration
+from .database import DbAdapterFactory
+from .migrations import PrintMigrationListener
+
+# view, command, phase, done, total, unit, tuples done
+PROGRESS_VIEWS = [
+    ("pg_stat_progress_create_index", "command", "phase", "blocks_done", "blocks_total", "blocks", "tuples_done"),
+    ("pg_stat_progress_cluster", "command", "phase", "heap_blks_scanned", "heap_blks_total", "blocks",
+     "heap_tuples_written"),
+    ("pg_stat_progress_vacuum", "'VACUUM'", "phase", "heap_blks_scanned", "heap_blks_total", "blocks", "NULL"),
+    ("pg_stat_progress_analyze", "'ANALYZE'", "phase", "sample_blks_scanned", "sample_blks_total", "blocks",
+     "NULL"),
+    ("pg_stat_progress_copy", "command", "type", "bytes_processed", "bytes_total", "bytes", "tuples_processed"),
+]
+
+DEFAULT_INTERVAL = 5
+
+
+class ProgressSample:
+    """
+    A single reading of a progress view
+    """
+
+    command = None
+    phase = None
+    relation = None
+    done = None
+    total = None
+    unit = None
+    tuples = None
+
+    def __init__(self, record):
+        self.command = record["command"]
+        self.phase = record["phase"]
+        self.relation = record["relation"]
+        self.done = record["done"]
+        self.total = record["total"]
+        self.unit = record["unit"]
+        self.tuples = record["tuples"]
+
+
+class ProgressEstimator:
+    """
+    Estimates time left from consecutive samples. Counters of a command restart with every phase
+    (e.g. CREATE INDEX scans the table, then sorts, then loads the tree), so the rate is measured
+    since the first sample of the current phase.
+    """
+
+    def __init__(self):
+        self._phase = None
+        self._first = None
+
+    def eta(self, sample, now):
+        """
+        :param ProgressSample sample:
+        :param now: Time of the sample
+        :return: Seconds left in the current phase, or None if it can't be estimated yet
+        """
+        phase = (sample.command, sample.phase, sample.relation)
+
+        if phase != self._phase or self._first is None:
+            self._phase = phase
+            self._first = (now, sample.done)
+            return None
+
+        first_time, first_done = self._first
+        if not sample.total or sample.done is None or first_done is None or now <= first_time:
+            return None
+
+        rate = (sample.done - first_done) / float(now - first_time)
+        if rate <= 0:
+            return None
+
+        return (sample.total - sample.done) / rate
+
+
+def format_sample(sample, eta):
+    """
+    :return: str, e.g. "CREATE INDEX on orders: building index: scanning table, 1200/50000 blocks (2.4%),
+             tuples 96000, ETA 0:03:20"
+    """
+    parts = ["%s%s: %s" % (sample.command, " on %s" % sample.relation if sample.relation else "", sample.phase)]
+
+    if sample.total:
+        parts.append("%s/%s %s (%.1f%%)" % (sample.done, sample.total, sample.unit,
+                                            100.0 * (sample.done or 0) / sample.total))
+    elif sample.done:
+        parts.append("%s %s" % (sample.done, sample.unit))
+
+    if sample.tuples:
+        parts.append("tuples %s" % sample.tuples)
+
+    if eta is not None:
+        parts.append("ETA %s" % format_duration(eta))
+
+    return ", ".join(parts)
+
+
+class ProgressMonitor:
+    """
+    Background thread reporting progress of a backend's long-running statements
+    """
+
+    def __init__(self, db_adapter, backend_pid, listener, interval=DEFAULT_INTERVAL):
+        """
+        :param db_adapter: Adapter of a second connection to the migrated database, the monitor's own
+        :param backend_pid: PID of the backend that runs the migration
+        :param MigrationListener listener: Receives the progress messages
+        :param interval: Seconds between polls
+        """
+        self._db_adapter = db_adapter
+        self._backend_pid = int(backend_pid)
+        self._listener = listener
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._query = None
+
+    def start(self):
+        # A monitor must never block migrating, so it only reads and commits right away
+        self._db_adapter.set_autocommit(True)
+        self._query = self._build_query()
+
+        if self._query is None:
+            return
+
+        self._thread = threading.Thread(target=self._run, name="dbmake-progress")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _build_query(self):
+        """
+        :return: A query of the progress views the server has, None if it has none
+        """
+        views = [view[0] for view in PROGRESS_VIEWS]
+        existing = self._db_adapter.fetch_single_dict(
+            "SELECT array_remove(ARRAY[%s], NULL) AS views" % ", ".join(
+                "to_regclass('pg_catalog.%s')::text" % view for view in views
+            )
+        )["views"]
+
+        selects = []
+        for view, command, phase, done, total, unit, tuples in PROGRESS_VIEWS:
+            if view in existing or "pg_catalog.%s" % view in existing:
+                selects.append(
+                    "SELECT %s::text AS command, %s::text AS phase, relid::regclass::text AS relation, "
+                    "%s::bigint AS done, %s::bigint AS total, '%s'::text AS unit, %s::bigint AS tuples "
+                    "FROM pg_catalog.%s WHERE pid = %s" % (
+                        command, phase, done, total, unit, tuples, view, self._backend_pid
+                    )
+                )
+
+        if not selects:
+            return None
+
+        return "\nUNION ALL\n".join(selects)
+
+    def _run(self):
+        estimator = ProgressEstimator()
+        last_message = None
+
+        while not self._stop.wait(self._interval):
+            try:
+                records = self._db_adapter.fetch_dict(self._query)
+            except Exception as e:
+                self._listener.on_message("Progress monitor stopped: %s" % str(e).strip())
+                return
+
+            for record in records:
+                sample = ProgressSample(record)
+                message = format_sample(sample, estimator.eta(sample, time.time()))
+
+                # A statement that doesn't report its progress yet would print the same line every poll
+                if message != last_message:
+                    self._listener.on_message("    " + message)
+                    last_message = message
+
+
+class monitor:
+    """
+    Context manager running a ProgressMonitor over a migration on db_adapter. The monitor opens
+    its own connection with db_connection_config, failing to open it only disables the monitor.
+    """
+
+    def __init__(self, db_connection_config, db_adapter, listener=None, interval=DEFAULT_INTERVAL):
+        """
+        :param MigrationListener listener: [Default: PrintMigrationListener]
+        :param interval: Seconds between polls, None disables the monitor
+        """
+        self._db_connection_config = db_connection_config
+        self._db_adapter = db_adapter
+        self._listener = listener if listener is not None else PrintMigrationListener()
+        self._interval = interval
+        self._monitor = None
+        self._monitor_adapter = None
+
+    def __enter__(self):
+        if self._interval is None:
+            return None
+
+        try:
+            self._monitor_adapter = DbAdapterFactory.create(self._db_connection_config)
+            self._monitor = ProgressMonitor(self._monitor_adapter, self._db_adapter.get_backend_pid(),
+                                            self._listener, self._interval)
+            self._monitor.start()
+        except Exception as e:
+            self._listener.on_message("Progress monitor is disabled: %s" % str(e).strip())
+            self._close()
+
+        return self._monitor
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._monitor is not None:
+            self._monitor.stop()
+        self._close()
+        return False
+
+    def _close(self):
+        if self._monitor_adapter is not None:
+            self._monitor_adapter.disconnect()
+            self._monitor_adapter = None
+        self._monitor = None
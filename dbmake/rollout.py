@@ -0,0 +1,295 @@
+"""
+Rollouts of migrations over many databases (dbmake rollout): a canary set of databases is migrated first,
+then the rest in waves, the databases of a wave concurrently.
+
+A rollout stops if the canary fails, if failed databases exceed a failure budget, or if a wave takes
+longer than a time limit. Its state is saved into a JSON file after every wave, so running the rollout
+again continues from the wave it stopped at. Databases that have already been migrated cost a single
+query then.
+"""
+
+import json
+import math
+import os
+import time
+
+from . import api
+from .common import DbmakeException
+
+DEFAULT_CANARY = "1"
+DEFAULT_WAVE_SIZE = "25%"
+DEFAULT_JOBS = 8
+
+
+def parse_amount(value):
+    """
+    Parses a number of databases given as a count ("10") or as a percentage of all of them ("25%")
+    :return: tuple (number, is_percentage)
+    :raise ValueError
+    """
+    value = str(value).strip()
+    if value.endswith("%"):
+        return float(value[:-1]), True
+
+    return int(value), False
+
+
+def resolve_amount(value, total):
+    """
+    :return: Number of databases value stands for out of total, a percentage is rounded up
+    """
+    number, is_percentage = parse_amount(value)
+    if is_percentage:
+        return int(math.ceil(total * number / 100.0))
+
+    return number
+
+
+def plan_waves(connection_names, canary=DEFAULT_CANARY, wave_size=DEFAULT_WAVE_SIZE):
+    """
+    Splits databases into waves, the canary wave first
+    :param connection_names: Connection names in the order to migrate them in
+    :param canary: A list of connection names, or a count or a percentage of the first databases
+    :param wave_size: A count or a percentage of all databases to migrate per wave
+    :return: A list of lists of connection names
+    :raise DbmakeException
+    """
+    connection_names = list(connection_names)
+
+    if isinstance(canary, (list, tuple)):
+        unknown = [name for name in canary if name not in connection_names]
+        if unknown:
+            raise DbmakeException("Error! Unknown canary connections: %s" % ", ".join(unknown))
+        canary_names = [name for name in connection_names if name in canary]
+    else:
+        canary_names = connection_names[:resolve_amount(canary, len(connection_names))]
+
+    rest = [name for name in connection_names if name not in canary_names]
+    size = max(resolve_amount(wave_size, len(connection_names)), 1)
+
+    waves = [canary_names] if canary_names else []
+    for start in range(0, len(rest), size):
+        waves.append(rest[start:start + size])
+
+    return waves
+
+
+class RolloutState:
+    """
+    Progress of a rollout, as persisted in its state file
+    """
+
+    RUNNING = "running"
+    ABORTED = "aborted"
+    FINISHED = "finished"
+
+    target_revision = None
+
+    # A list of lists of connection names, the canary wave first if there is one
+    waves = None
+    has_canary = False
+
+    # Index of the first wave that hasn't passed yet
+    next_wave = 0
+
+    # Connection name -> {"ok", "error", "from_revision", "to_revision", "duration"}
+    results = None
+
+    status = RUNNING
+
+    # Why the rollout has been aborted
+    reason = None
+
+    started_at = None
+    updated_at = None
+
+    def __init__(self, target_revision, waves, has_canary=False):
+        self.target_revision = target_revision
+        self.waves = waves
+        self.has_canary = has_canary
+        self.results = {}
+        self.started_at = time.time()
+
+    @property
+    def failed(self):
+        """
+        :return: A sorted list of connection names of the databases that have failed
+        """
+        return sorted(name for name, result in self.results.items() if not result["ok"])
+
+    @property
+    def database_count(self):
+        return sum(len(wave) for wave in self.waves)
+
+    def record(self, target_result):
+        """
+        :param api.TargetResult target_result:
+        """
+        self.results[target_result.connection_name] = {
+            "ok": target_result.ok,
+            "error": None if target_result.error is None else str(target_result.error).strip(),
+            "from_revision": target_result.from_revision,
+            "to_revision": target_result.to_revision,
+            "duration": target_result.duration,
+        }
+
+    def to_dict(self):
+        return {
+            "target_revision": self.target_revision,
+            "waves": self.waves,
+            "has_canary": self.has_canary,
+            "next_wave": self.next_wave,
+            "results": self.results,
+            "status": self.status,
+            "reason": self.reason,
+            "started_at": self.started_at,
+            "updated_at": self.updated_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls(data["target_revision"], data["waves"], data.get("has_canary", False))
+        state.next_wave = data["next_wave"]
+        state.results = data["results"]
+        state.status = data["status"]
+        state.reason = data.get("reason")
+        state.started_at = data.get("started_at")
+        state.updated_at = data.get("updated_at")
+
+        return state
+
+    @classmethod
+    def load(cls, state_file):
+        """
+        :return: RolloutState, or None if there is no state file
+        :raise DbmakeException: If the state file is corrupted
+        """
+        if not os.path.exists(state_file):
+            return None
+
+        try:
+            with open(state_file, 'r') as f:
+                return cls.from_dict(json.load(f))
+        except (ValueError, KeyError) as e:
+            raise DbmakeException("Error! Corrupted rollout state file %s: %s" % (state_file, e))
+
+    def save(self, state_file):
+        """
+        Atomically replaces the state file
+        """
+        self.updated_at = time.time()
+
+        temporary_file = state_file + ".tmp"
+        with open(temporary_file, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
+        os.rename(temporary_file, state_file)
+
+
+class Rollout:
+    """
+    Takes a rollout's waves one by one, saving its state after every wave
+    """
+
+    def __init__(self, migrations_manager, connections_configs, state, state_file, jobs=DEFAULT_JOBS,
+                 max_failures="0", max_wave_time=None, listener=None):
+        """
+        :param migrations.MigrationsManager migrations_manager:
+        :param connections_configs: DbConnectionConfig of all databases of the rollout
+        :param RolloutState state: A new state, or a loaded one to continue
+        :param state_file: Path to save the state into
+        :param jobs: Number of databases of a wave to migrate concurrently
+        :param max_failures: A count or a percentage of all databases that may fail before the rollout stops.
+                             Any failure of the canary stops it.
+        :param max_wave_time: Seconds a wave may take before the rollout stops, None for no limit
+        :param migrations.MigrationListener listener: Receives the rollout's progress messages
+        """
+        self._manager = migrations_manager.load()
+        self._configs = dict((config.connection_name, config) for config in connections_configs)
+        self._state = state
+        self._state_file = state_file
+        self._jobs = jobs
+        self._max_failures = resolve_amount(max_failures, state.database_count)
+        self._max_wave_time = max_wave_time
+        self._listener = listener
+
+    def run(self):
+        """
+        :return: RolloutState, FINISHED unless the rollout has been stopped
+        """
+        state = self._state
+        state.status = RolloutState.RUNNING
+        state.reason = None
+
+        while state.next_wave < len(state.waves):
+            index = state.next_wave
+            wave = state.waves[index]
+            is_canary = state.has_canary and index == 0
+
+            self._message("Wave %s/%s%s: migrating %s databases..." % (
+                index + 1, len(state.waves), " (canary)" if is_canary else "", len(wave)
+            ))
+
+            started_at = time.time()
+            self._migrate_wave(wave)
+            wave_time = time.time() - started_at
+
+            wave_failed = [name for name in wave if not state.results[name]["ok"]]
+            self._message("Wave %s/%s: %s migrated, %s failed, took %.1fs" % (
+                index + 1, len(state.waves), len(wave) - len(wave_failed), len(wave_failed), wave_time
+            ))
+
+            # A failed wave is taken again when the rollout continues
+            if is_canary and wave_failed:
+                return self._abort("the canary has failed: %s" % ", ".join(wave_failed))
+
+            if len(state.failed) > self._max_failures:
+                return self._abort("%s databases have failed, the failure budget is %s: %s" % (
+                    len(state.failed), self._max_failures, ", ".join(state.failed)
+                ))
+
+            state.next_wave += 1
+
+            if self._max_wave_time is not None and wave_time > self._max_wave_time:
+                return self._abort("wave %s took %.1fs, the limit is %ss" % (
+                    index + 1, wave_time, self._max_wave_time
+                ))
+
+            state.save(self._state_file)
+
+        state.status = RolloutState.FINISHED
+        state.save(self._state_file)
+
+        return state
+
+    def _migrate_wave(self, wave):
+        configs = []
+        for name in wave:
+            if name in self._configs:
+                configs.append(self._configs[name])
+            else:
+                target_result = api.TargetResult(name)
+                target_result.error = DbmakeException("Connection %s is no longer configured" % name)
+                self._state.record(target_result)
+
+        for target_result in api.migrate(configs, self._manager, to=self._state.target_revision, jobs=self._jobs,
+                                         raise_on_error=False, order_by_cost=True):
+            self._state.record(target_result)
+
+            if target_result.ok:
+                self._message("    %s: %s -> %s" % (
+                    target_result.connection_name, target_result.from_revision, target_result.to_revision
+                ))
+            else:
+                self._message("    %s: Error! %s" % (target_result.connection_name, str(target_result.error).strip()))
+
+    def _abort(self, reason):
+        self._state.status = RolloutState.ABORTED
+        self._state.reason = reason
+        self._state.save(self._state_file)
+        self._message("Rollout stopped, %s" % reason)
+
+        return self._state
+
+    def _message(self, message):
+        if self._listener is not None:
+            self._listener.on_message(message)
@@ -0,0 +1,147 @@
+"""
+Ordering of fleet runs by estimated cost. Databases are handed to a pool of workers one by one,
+so starting the most expensive ones first (longest processing time first) keeps a single huge database
+from being started last and finishing long after the rest.
+
+The cost of migrating a database is estimated from the migrations it's missing, the size of its
+relations read from pg_class, and the durations its past migrations took, as recorded in the
+migrations table. Estimating costs a single query per database.
+"""
+
+from .migrations import MigrationsDao
+
+# Number of the most recent migrations whose durations a database's estimate is based on
+HISTORY_SIZE = 20
+
+
+class CostEstimate:
+    """
+    Estimated cost of migrating a single database
+    """
+
+    name = None
+
+    # Bytes of the database's relations, indexes and TOAST included, by pg_class statistics
+    size = 0
+
+    # Current revision, None if no migration has been applied yet
+    revision = None
+
+    # Number of migrations the database is missing
+    pending = 0
+
+    # Mean seconds the database's recent migrations took, None if it has no recorded durations
+    past_duration = None
+
+    # Estimated cost, in seconds if any database of the fleet has recorded durations, otherwise in bytes
+    cost = 0
+
+    def __init__(self, name, size=0, revision=None, past_duration=None):
+        self.name = name
+        self.size = size or 0
+        self.revision = revision
+        self.past_duration = past_duration
+
+
+def probe(db_adapter, name):
+    """
+    Reads what a database's cost is estimated from, in a single query. The estimate's number of pending
+    migrations is left for the caller to set.
+    :return: CostEstimate
+    """
+    # The duration column is read through to_jsonb(), so tables of earlier versions don't fail the query
+    record = db_adapter.fetch_single_dict("""
+        SELECT
+            (SELECT sum(c.relpages)::bigint * current_setting('block_size')::bigint
+             FROM pg_catalog.pg_class c
+             JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+             WHERE c.relkind IN ('r', 'm', 'i', 't')
+               AND n.nspname NOT IN ('pg_catalog', 'information_schema')) AS size,
+            (SELECT revision FROM {table} ORDER BY create_date DESC, id DESC LIMIT 1) AS revision,
+            (SELECT avg((to_jsonb(m) ->> 'duration')::float)
+             FROM (SELECT * FROM {table} ORDER BY create_date DESC, id DESC LIMIT {history}) m) AS past_duration
+        """.format(table=MigrationsDao.TABLE_NAME, history=HISTORY_SIZE))
+
+    return CostEstimate(name, record["size"], record["revision"], record["past_duration"])
+
+
+def pending_count(current_revision, target_revision, revisions):
+    """
+    :return: Number of migrations between two revisions, in either direction
+    """
+    if current_revision is None:
+        return len([revision for revision in revisions if revision <= target_revision])
+
+    low, high = sorted((int(current_revision), int(target_revision)))
+    return len([revision for revision in revisions if low < revision <= high])
+
+
+def estimate(estimates):
+    """
+    Sets the cost of every estimate. A database with recorded durations costs its mean past duration
+    per pending migration. A database without them costs its size times the fleet's median seconds per byte.
+    Without any recorded durations in the fleet, the cost is the size per pending migration.
+    :param estimates: A list of CostEstimate
+    :return: The list of estimates
+    """
+    rates = sorted(
+        estimate_.past_duration / estimate_.size for estimate_ in estimates
+        if estimate_.past_duration is not None and estimate_.size > 0
+    )
+    seconds_per_byte = rates[len(rates) // 2] if rates else None
+
+    for estimate_ in estimates:
+        if estimate_.past_duration is not None:
+            estimate_.cost = estimate_.past_duration * estimate_.pending
+        elif seconds_per_byte is not None:
+            estimate_.cost = seconds_per_byte * estimate_.size * estimate_.pending
+        else:
+            estimate_.cost = estimate_.size * estimate_.pending
+
+    return estimates
+
+
+def lpt_order(items, costs):
+    """
+    Orders items by their costs, the most expensive first. Items of equal cost keep their order.
+    :param items: A list of items to schedule
+    :param costs: A list of the items' costs
+    :return: A list of the items
+    """
+    order = sorted(range(len(items)), key=lambda index: -(costs[index] or 0))
+    return [items[index] for index in order]
+
+
+def makespan(costs, workers):
+    """
+    Total cost of running jobs of costs, in the given order, on a number of workers that each take
+    the next job as soon as they're free
+    """
+    loads = [0] * max(min(workers, len(costs)), 1)
+    for cost in costs:
+        index = loads.index(min(loads))
+        loads[index] += cost or 0
+
+    return max(loads)
+
+
+def schema_sizes(db_adapter, schemas):
+    """
+    Reads sizes of schemas' relations, indexes and TOAST included, in a single query
+    :return: dict of a schema name to bytes
+    """
+    cursor = db_adapter.get_cursor()
+    cursor.execute(
+        "SELECT n.nspname, (sum(c.relpages) + coalesce(sum(t.relpages), 0))::bigint "
+        "    * current_setting('block_size')::bigint "
+        "FROM pg_catalog.pg_class c "
+        "JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace "
+        "LEFT JOIN pg_catalog.pg_class t ON t.oid = c.reltoastrelid "
+        "WHERE c.relkind IN ('r', 'm', 'i') AND n.nspname = ANY (%s) "
+        "GROUP BY n.nspname",
+        (list(schemas),)
+    )
+    sizes = dict((schema, size or 0) for schema, size in cursor.fetchall())
+    cursor.close()
+
+    return sizes
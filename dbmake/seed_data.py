@@ -0,0 +1,159 @@
+"""
+Seed data files are CSV files (optionally gzipped) that accompany a migration and are bulk loaded
+into tables with "COPY ... FROM STDIN" instead of being written as INSERT statements.
+
+A migration's seed data files reside in a directory named after the migration file:
+
+    1430991341_billing.sql
+    1430991341_billing.data/
+        billing_plans.csv
+        public.currencies.csv.gz
+
+Each file is named after its target table (optionally schema qualified) and must start with a header
+line naming the loaded columns. Files are loaded in file name order and unloaded in the reverse one.
+"""
+
+import csv
+import gzip
+import os
+import re
+
+from .common import DbmakeException
+from .helper import quote_identifier, quote_qualified_name
+
+
+class SeedDataFile:
+    """
+    A single seed data file of a migration
+    """
+
+    FILE_NAME_PATTERN = re.compile(r'^(?P<table>[^/]+?)\.csv(?P<gzipped>\.gz)?$')
+
+    # Encoding of seed data files
+    ENCODING = "utf-8"
+
+    path = None
+    table = None
+    gzipped = False
+
+    def __init__(self, path):
+        """
+        :param path: Full path to a seed data file
+        :raise AttributeError: If the file name is not a seed data file's name
+        """
+        result = self.FILE_NAME_PATTERN.match(os.path.basename(path))
+        self.table = result.group('table')
+        self.gzipped = result.group('gzipped') is not None
+        self.path = path
+
+    @classmethod
+    def list(cls, seed_data_dir):
+        """
+        Returns a list of seed data files that reside in seed_data_dir, ordered by file name
+        :param seed_data_dir: str
+        :return: list
+        """
+        if not os.path.isdir(seed_data_dir):
+            return []
+
+        seed_data_files = []
+        for file_ in sorted(os.listdir(seed_data_dir)):
+            try:
+                seed_data_files.append(cls(seed_data_dir + os.sep + file_))
+            except AttributeError:
+                pass
+
+        return seed_data_files
+
+    def open(self):
+        """
+        Opens the file for binary reading, gzipped files are decompressed on the fly
+        """
+        if self.gzipped:
+            return gzip.open(self.path, 'rb')
+        return open(self.path, 'rb')
+
+    def _read_header(self, f):
+        """
+        Reads the header line off the file and returns a list of the loaded columns' names
+        """
+        header = f.readline().decode(self.ENCODING)
+        columns = next(csv.reader([header]), [])
+
+        if len(columns) == 0:
+            raise DbmakeException("Error! Seed data file %s has no header line" % self.path)
+
+        return [column.strip() for column in columns]
+
+    def load(self, cursor):
+        """
+        Streams the file into its table. The file is never read into memory as a whole,
+        gzipped files are decompressed chunk by chunk as COPY consumes them.
+        """
+        with self.open() as f:
+            columns = self._read_header(f)
+            cursor.copy_expert(
+                "COPY %s (%s) FROM STDIN WITH (FORMAT csv, ENCODING '%s')" % (
+                    quote_qualified_name(self.table),
+                    ", ".join([quote_identifier(column) for column in columns]),
+                    self.ENCODING
+                ),
+                f
+            )
+
+    def unload(self, cursor):
+        """
+        Deletes the rows the file has loaded into its table. The file is streamed into a temporary
+        table, which then is joined with the target table by its primary key if the file provides all
+        of its columns, otherwise by all the loaded columns. Columns of types that have no equality
+        operator (e.g. json) are compared as text.
+        """
+        table = quote_qualified_name(self.table)
+        temporary_table = quote_identifier("_dbmake_seed_data")
+
+        with self.open() as f:
+            columns = self._read_header(f)
+            quoted_columns = ", ".join([quote_identifier(column) for column in columns])
+
+            cursor.execute("CREATE TEMPORARY TABLE %s ON COMMIT DROP AS SELECT %s FROM %s WITH NO DATA" % (
+                temporary_table, quoted_columns, table
+            ))
+            cursor.copy_expert(
+                "COPY %s (%s) FROM STDIN WITH (FORMAT csv, ENCODING '%s')" % (
+                    temporary_table, quoted_columns, self.ENCODING
+                ),
+                f
+            )
+
+        cursor.execute("""
+            SELECT a.attname
+            FROM pg_index i
+            JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+            WHERE i.indrelid = %s::regclass AND i.indisprimary
+            """, (table,)
+        )
+        key_columns = [row[0] for row in cursor.fetchall()]
+
+        if len(key_columns) > 0 and set(key_columns).issubset(columns):
+            condition = " AND ".join(["t.%s = s.%s" % ((quote_identifier(column),) * 2) for column in key_columns])
+        else:
+            cursor.execute("""
+                SELECT a.attname
+                FROM pg_attribute a
+                WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped
+                  AND NOT EXISTS (
+                      SELECT 1 FROM pg_operator o
+                      WHERE o.oprname = '=' AND o.oprleft = a.atttypid AND o.oprright = a.atttypid
+                  )
+                """, (table,)
+            )
+            text_columns = set(row[0] for row in cursor.fetchall())
+
+            condition = " AND ".join([
+                ("t.%s::text IS NOT DISTINCT FROM s.%s::text" if column in text_columns
+                 else "t.%s IS NOT DISTINCT FROM s.%s") % ((quote_identifier(column),) * 2)
+                for column in columns
+            ])
+
+        cursor.execute("DELETE FROM %s t USING %s s WHERE %s" % (table, temporary_table, condition))
+        cursor.execute("DROP TABLE %s" % temporary_table)
@@ -0,0 +1,266 @@
+"""
+Physical snapshots of development and CI databases, one per revision: a pg_dump of the whole database
+in the custom format, its migrations table included, taken right after the database has been migrated
+UP to the revision. Migrating DOWN to a revision that has a snapshot, or resetting a database to it,
+restores the snapshot into a recreated database instead of rolling migrations back one by one.
+
+A snapshot is only reused while the migration files up to its revision are unchanged, as told by
+a fingerprint of their checksums. Snapshots are kept in .dbmake/snapshots/<connection name>/ and
+the least recently used ones are evicted once they exceed a size cap.
+
+Restoring drops the database, so snapshots are meant for databases nobody else depends on.
+"""
+
+import copy
+import hashlib
+import json
+import os
+import subprocess
+import time
+
+from . import checksums
+from . import database
+from . import migrations
+from .common import DBMAKE_CONFIG_DIR, CHECKSUMS_CACHE_FILE, SNAPSHOTS_DIR
+from .db_tasks import pg_client_env, pg_client_args
+from .helper import quote_identifier
+
+# Total bytes of a connection's snapshots before the least recently used ones are evicted
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+
+# Number of pg_restore jobs a snapshot is restored with
+RESTORE_JOBS = 4
+
+# Database a dropped database is recreated from
+MAINTENANCE_DB = "postgres"
+
+
+class SnapshotCache:
+    """
+    Snapshots of a single database, indexed in a JSON file next to them
+    """
+
+    INDEX_FILE = "index.json"
+
+    _directory = None
+    _max_size = None
+
+    # Revision (str) -> {"fingerprint", "size", "created_at", "last_used"}
+    _entries = None
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        """
+        :param directory: Directory the snapshots are kept in, created if missing
+        :param max_size: Total bytes of snapshots to keep
+        """
+        self._directory = directory
+        self._max_size = max_size
+        self._entries = {}
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        index_file = os.path.join(directory, self.INDEX_FILE)
+        if os.path.exists(index_file):
+            try:
+                with open(index_file, 'r') as f:
+                    self._entries = json.load(f)
+            except ValueError:
+                # Snapshots of a corrupted index are orphaned and simply retaken
+                self._entries = {}
+
+    @classmethod
+    def for_connection(cls, migrations_dir, connection_name, max_size=DEFAULT_MAX_SIZE):
+        return cls(os.path.join(migrations_dir, DBMAKE_CONFIG_DIR, SNAPSHOTS_DIR, connection_name), max_size)
+
+    def path(self, revision):
+        return os.path.join(self._directory, "%s.dump" % revision)
+
+    @property
+    def size(self):
+        return sum(entry["size"] for entry in self._entries.values())
+
+    def revisions(self):
+        return sorted(int(revision) for revision in self._entries)
+
+    def get(self, revision, fingerprint):
+        """
+        Looks a revision's snapshot up, marking it as recently used
+        :param fingerprint: Fingerprint of the migration files up to the revision
+        :return: Path to the snapshot, or None if there is none or it was taken of other migration files
+        """
+        entry = self._entries.get(str(revision))
+        if entry is None:
+            return None
+
+        if entry["fingerprint"] != fingerprint or not os.path.exists(self.path(revision)):
+            self.remove(revision)
+            return None
+
+        entry["last_used"] = time.time()
+        self.save()
+
+        return self.path(revision)
+
+    def add(self, revision, fingerprint):
+        """
+        Records a snapshot that has been written to path(revision) and evicts snapshots over the size cap
+        :return: A list of revisions of the evicted snapshots
+        """
+        now = time.time()
+        self._entries[str(revision)] = {
+            "fingerprint": fingerprint,
+            "size": os.path.getsize(self.path(revision)),
+            "created_at": now,
+            "last_used": now,
+        }
+        evicted = self.evict()
+        self.save()
+
+        return evicted
+
+    def remove(self, revision):
+        self._entries.pop(str(revision), None)
+        if os.path.exists(self.path(revision)):
+            os.remove(self.path(revision))
+        self.save()
+
+    def evict(self):
+        """
+        Removes the least recently used snapshots until the rest fit the size cap
+        :return: A list of revisions of the removed snapshots
+        """
+        evicted = []
+        by_last_use = sorted(self._entries.items(), key=lambda item: item[1]["last_used"])
+
+        total = self.size
+        for revision, entry in by_last_use:
+            if total <= self._max_size:
+                break
+            total -= entry["size"]
+            del self._entries[revision]
+            if os.path.exists(self.path(revision)):
+                os.remove(self.path(revision))
+            evicted.append(int(revision))
+
+        return evicted
+
+    def save(self):
+        """
+        Atomically replaces the index file
+        """
+        index_file = os.path.join(self._directory, self.INDEX_FILE)
+        temporary_file = index_file + ".tmp"
+        with open(temporary_file, 'w') as f:
+            json.dump(self._entries, f, indent=2, sort_keys=True)
+        os.rename(temporary_file, index_file)
+
+
+def fingerprints(migrations_manager, migrations_dir):
+    """
+    Fingerprints every revision with the checksums of the migration files up to it, reusing
+    the checksums cached by "dbmake verify"
+    :return: dict of a revision to its fingerprint
+    """
+    migration_files = migrations_manager.migration_files()
+    checksum_cache = checksums.ChecksumCache(os.path.join(migrations_dir, DBMAKE_CONFIG_DIR, CHECKSUMS_CACHE_FILE))
+    file_checksums = checksum_cache.checksums([migration_file for revision, migration_file in migration_files])
+    checksum_cache.save()
+
+    sha256 = hashlib.sha256()
+    result = {}
+    for revision, migration_file in migration_files:
+        sha256.update(file_checksums[migration_file].encode())
+        result[revision] = sha256.hexdigest()
+
+    return result
+
+
+def capture(db_connection_config, path):
+    """
+    Dumps the whole database into path, in pg_dump's custom format
+    :return: bool
+    """
+    temporary_file = path + ".tmp"
+    command = ["pg_dump", "--format=custom", "--file=%s" % temporary_file] + pg_client_args(db_connection_config)
+
+    if subprocess.call(command, env=pg_client_env(db_connection_config)) != 0:
+        if os.path.exists(temporary_file):
+            os.remove(temporary_file)
+        return False
+
+    os.rename(temporary_file, path)
+    return True
+
+
+def recreate_database(db_connection_config):
+    """
+    Drops the database, disconnecting its sessions, and creates it empty, connected to the maintenance database
+    """
+    maintenance_config = copy.copy(db_connection_config)
+    maintenance_config.dbname = MAINTENANCE_DB
+
+    db_adapter = database.DbAdapterFactory.create(maintenance_config)
+    try:
+        db_adapter.set_isolation_level(0)
+        cursor = db_adapter.get_cursor()
+        cursor.execute(
+            "SELECT pg_terminate_backend(pid) FROM pg_catalog.pg_stat_activity "
+            "WHERE datname = %s AND pid <> pg_backend_pid()",
+            (db_connection_config.dbname,)
+        )
+        cursor.execute("DROP DATABASE IF EXISTS %s" % quote_identifier(db_connection_config.dbname))
+        cursor.execute("CREATE DATABASE %s" % quote_identifier(db_connection_config.dbname))
+        cursor.close()
+    finally:
+        db_adapter.disconnect()
+
+
+def restore(db_connection_config, path, jobs=RESTORE_JOBS):
+    """
+    Replaces the database with a snapshot. Sessions of the database are disconnected.
+    :return: bool
+    """
+    recreate_database(db_connection_config)
+
+    command = ["pg_restore", "--no-owner", "--no-privileges", "--jobs=%s" % jobs] + \
+        pg_client_args(db_connection_config) + [path]
+
+    return subprocess.call(command, env=pg_client_env(db_connection_config)) == 0
+
+
+class SnapshotListener(migrations.MigrationListener):
+    """
+    Snapshots the database after every step that has migrated it UP, passing the progress on to another listener
+    """
+
+    def __init__(self, cache, fingerprints_, db_connection_config, listener=None):
+        """
+        :param SnapshotCache cache:
+        :param fingerprints_: fingerprints() of the migrations
+        :param migrations.MigrationListener listener: [Default: PrintMigrationListener]
+        """
+        migrations.MigrationListener.__init__(self)
+        self._cache = cache
+        self._fingerprints = fingerprints_
+        self._db_connection_config = db_connection_config
+        self._listener = listener if listener is not None else migrations.PrintMigrationListener()
+
+    def on_step_start(self, step):
+        self._listener.on_step_start(step)
+
+    def on_step_finish(self, step):
+        self._listener.on_step_finish(step)
+
+        if step.direction != migrations.MigrationDirection.UP or step.revision not in self._fingerprints:
+            return
+
+        if not capture(self._db_connection_config, self._cache.path(step.revision)):
+            self._listener.on_message("Warning! Failed to snapshot revision %s" % step.revision)
+            return
+
+        for revision in self._cache.add(step.revision, self._fingerprints[step.revision]):
+            self._listener.on_message("Evicted the snapshot of revision %s" % revision)
+
+    def on_message(self, message):
+        self._listener.on_message(message)
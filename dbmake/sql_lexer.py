@@ -0,0 +1,295 @@
+"""
+PostgreSQL aware splitter of SQL scripts into separate statements.
+
+The splitter works on any bytes-like buffer (bytes, mmap) and only ever slices a single statement
+out of it, so a migration file of any size can be executed statement by statement straight from
+a memory mapped file. Statements are kept as raw bytes and are sent to a database as they are
+written in a file, the same way psql does it.
+
+The psql meta-commands that include other scripts (\\i, \\ir, \\include, \\include_relative) are reported
+as INCLUDE items for the caller to resolve, any other meta-command is a syntax error.
+"""
+
+import re
+
+from .common import SqlSyntaxError
+
+
+# Everything that changes the lexer's state: quotes, dollar quotes, comments, statement terminator
+# and psql meta-commands
+_TOKENS = re.compile(br"""
+    (?P<escape_string>(?<![\w$])[eE]')
+    | (?P<quote>['"])
+    | (?P<dollar_quote>(?<![\w$])\$(?:[A-Za-z_\x80-\xff][\w\x80-\xff]*)?\$)
+    | (?P<line_comment>--)
+    | (?P<block_comment>/\*)
+    | (?P<semicolon>;)
+    | (?P<meta_command>\\)
+""", re.X)
+
+_NON_SPACE = re.compile(br"\S")
+_ESCAPE_STRING_END = re.compile(br"\\.|''|'", re.S)
+_BLOCK_COMMENT_BOUNDARY = re.compile(br"/\*|\*/")
+_COPY_FROM_STDIN = re.compile(
+    br"^\s*(?:(?:--[^\n]*\n|/\*.*?\*/)\s*)*COPY\b.*?\bFROM\s+STDIN\b",
+    re.I | re.S
+)
+_COPY_DATA_END = re.compile(br"^\\\.\r?$", re.M)
+_INCLUDE = re.compile(br"\\(?P<command>ir|i|include_relative|include)[ \t]+(?P<path>[^\r\n]*?)[ \t]*\r?$", re.M)
+
+
+class SqlStatementType:
+    """
+    Lists all kinds of items SqlStatementSplitter produces
+    """
+    STATEMENT = "statement"
+    COPY = "copy"
+    SEPARATOR = "separator"
+    INCLUDE = "include"
+
+    def __init__(self):
+        pass
+
+
+class SqlStatement:
+    """
+    A single statement of an SQL script
+    """
+    type_ = SqlStatementType.STATEMENT
+
+    # Raw statement bytes without leading comments, including the terminating semicolon if there is one
+    sql = None
+
+    # Offset of the statement within a script's buffer
+    offset = None
+
+    # Boundaries of "COPY ... FROM STDIN" data within a script's buffer
+    copy_data_start = None
+    copy_data_end = None
+
+    # Whether an INCLUDE item's path (its sql) is relative to the including script's directory (\ir)
+    relative = False
+
+    def __init__(self, type_, sql, offset):
+        self.type_ = type_
+        self.sql = sql
+        self.offset = offset
+
+
+class SqlStatementSplitter:
+    """
+    Splits an SQL script into statements. Understands single and double quotes, escape strings (E''),
+    dollar quotes, line and nested block comments and inline "COPY ... FROM STDIN" data blocks.
+    A "-- DBMAKE: SEPARATOR" comment outside of any quotes is reported as a SEPARATOR item,
+    a psql include meta-command on a line of its own as an INCLUDE item.
+    """
+
+    DEFAULT_SEPARATOR = b"-- DBMAKE: SEPARATOR"
+
+    def __init__(self, buffer, separator=DEFAULT_SEPARATOR):
+        """
+        :param buffer: bytes or mmap holding an SQL script
+        :param separator: A line comment to report as a SEPARATOR item, None to report none
+        """
+        self._buffer = buffer
+        self._separator = separator
+
+    def __iter__(self):
+        return self.statements()
+
+    def statements(self):
+        """
+        Generates SqlStatement items in the order they appear in the script
+        :raise SqlSyntaxError: On unterminated quotes, comments or COPY data and unsupported meta-commands
+        """
+        buffer = self._buffer
+        size = len(buffer)
+        statement_start = 0
+        has_content = False
+        position = 0
+
+        while True:
+            match = _TOKENS.search(buffer, position)
+            scan_end = size if match is None else match.start()
+
+            if not has_content and _NON_SPACE.search(buffer, position, scan_end) is not None:
+                has_content = True
+
+            if match is None:
+                break
+
+            token = match.lastgroup
+
+            if token == 'quote':
+                has_content = True
+                position = self._skip_quoted(match.end(), match.group())
+
+            elif token == 'escape_string':
+                has_content = True
+                position = self._skip_escape_string(match.end())
+
+            elif token == 'dollar_quote':
+                has_content = True
+                tag = match.group()
+                end = buffer.find(tag, match.end())
+                if end == -1:
+                    raise SqlSyntaxError("Unterminated dollar-quoted string at offset %s" % match.start())
+                position = end + len(tag)
+
+            elif token == 'line_comment':
+                end = buffer.find(b"\n", match.end())
+                position = size if end == -1 else end + 1
+
+                if (
+                    self._separator is not None
+                    and buffer[match.start():match.start() + len(self._separator)] == self._separator
+                ):
+                    if has_content:
+                        yield self._statement(statement_start, match.start())
+                    yield SqlStatement(SqlStatementType.SEPARATOR, None, match.start())
+                    statement_start = position
+                    has_content = False
+
+            elif token == 'block_comment':
+                position = self._skip_block_comment(match.end())
+
+            elif token == 'meta_command':
+                include = _INCLUDE.match(buffer, match.start())
+                if has_content or include is None or not include.group('path'):
+                    raise SqlSyntaxError("Unsupported psql meta-command at offset %s" % match.start())
+
+                statement = SqlStatement(SqlStatementType.INCLUDE, include.group('path'), match.start())
+                statement.relative = include.group('command') in (b"ir", b"include_relative")
+                yield statement
+
+                position = include.end()
+                statement_start = position
+
+            else:
+                position = match.end()
+
+                if has_content:
+                    statement = self._statement(statement_start, position)
+
+                    if _COPY_FROM_STDIN.match(statement.sql):
+                        position = self._read_copy_data(statement, position)
+
+                    yield statement
+
+                statement_start = position
+                has_content = False
+
+        if has_content:
+            yield self._statement(statement_start, size)
+
+    def _statement(self, start, end):
+        # The statement starts at its first byte that is neither a space nor a part of a leading comment
+        offset = _NON_SPACE.search(self._buffer, start, end).start()
+        while self._buffer[offset:offset + 2] in (b"--", b"/*"):
+            if self._buffer[offset:offset + 2] == b"--":
+                comment_end = self._buffer.find(b"\n", offset, end)
+                comment_end = end if comment_end == -1 else comment_end + 1
+            else:
+                comment_end = self._skip_block_comment(offset + 2)
+            offset = _NON_SPACE.search(self._buffer, comment_end, end).start()
+
+        statement = SqlStatement(SqlStatementType.STATEMENT, self._buffer[offset:end].rstrip(), offset)
+        return statement
+
+    def _skip_quoted(self, position, quote):
+        """
+        Returns the position right after a quoted string or identifier that starts at position
+        """
+        while True:
+            end = self._buffer.find(quote, position)
+            if end == -1:
+                raise SqlSyntaxError("Unterminated quoted string at offset %s" % position)
+
+            # Doubled quote is an escaped one
+            if self._buffer[end + 1:end + 2] == quote:
+                position = end + 2
+                continue
+
+            return end + 1
+
+    def _skip_escape_string(self, position):
+        """
+        Returns the position right after an E'' string that starts at position
+        """
+        while True:
+            match = _ESCAPE_STRING_END.search(self._buffer, position)
+            if match is None:
+                raise SqlSyntaxError("Unterminated escape string at offset %s" % position)
+
+            if match.group() == b"'":
+                return match.end()
+
+            position = match.end()
+
+    def _skip_block_comment(self, position):
+        """
+        Returns the position right after a (possibly nested) block comment that starts at position
+        """
+        depth = 1
+        while depth > 0:
+            match = _BLOCK_COMMENT_BOUNDARY.search(self._buffer, position)
+            if match is None:
+                raise SqlSyntaxError("Unterminated block comment at offset %s" % position)
+
+            depth += 1 if match.group() == b"/*" else -1
+            position = match.end()
+
+        return position
+
+    def _read_copy_data(self, statement, position):
+        """
+        Turns the statement into a COPY item and returns the position right after its data block
+        """
+        line_end = self._buffer.find(b"\n", position)
+        if line_end == -1:
+            raise SqlSyntaxError("Missing COPY data at offset %s" % statement.offset)
+
+        match = _COPY_DATA_END.search(self._buffer, line_end + 1)
+        if match is None:
+            raise SqlSyntaxError("Unterminated COPY data at offset %s" % statement.offset)
+
+        statement.type_ = SqlStatementType.COPY
+        statement.copy_data_start = line_end + 1
+        statement.copy_data_end = match.start()
+
+        return match.end()
+
+
+class BufferReader:
+    """
+    Read-only file-like view of a buffer's range, lets copy_expert() consume
+    "COPY ... FROM STDIN" data right from a memory mapped script
+    """
+
+    def __init__(self, buffer, start, end):
+        self._buffer = buffer
+        self._position = start
+        self._end = end
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            end = self._end
+        else:
+            end = min(self._position + size, self._end)
+
+        data = self._buffer[self._position:end]
+        self._position = end
+
+        return data
+
+    def readline(self, size=-1):
+        end = self._buffer.find(b"\n", self._position, self._end)
+        end = self._end if end == -1 else end + 1
+
+        if size is not None and size >= 0:
+            end = min(end, self._position + size)
+
+        data = self._buffer[self._position:end]
+        self._position = end
+
+        return data
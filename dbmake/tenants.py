@@ -0,0 +1,386 @@
+"""
+Schema-per-tenant migrations: a database holding a schema per tenant, each with its own migrations
+table, migrated by the same migrations directory (dbmake migrate --tenants=<pattern>).
+
+Tenants are migrated concurrently, through a pool of connections to the database. A tenant is migrated
+with search_path set to its schema (then public), so migrations are written without schema names.
+Revisions of all tenants are read in a few batched queries up front, and tenants already at the target
+revision cost nothing more. Each connection records migrations through a single prepared INSERT,
+which PostgreSQL re-parses for the current search_path.
+
+Concurrent dbmake runs take turns on a tenant by an advisory lock of its own, a tenant locked by
+another run is skipped rather than waited for.
+"""
+
+import contextlib
+import queue
+import threading
+import time
+import zlib
+from multiprocessing.pool import ThreadPool
+
+from . import database
+from . import migrations
+from . import scheduling
+from .common import MIGRATIONS_TABLE, MIGRATION_LOCK_KEY, DbmakeException
+from .helper import format_duration, quote_identifier
+
+# Number of concurrently migrated tenants, and of connections of the pool, by default
+DEFAULT_JOBS = 8
+
+# Number of tenants whose revisions a single query reads
+HEADS_BATCH_SIZE = 500
+
+RECORD_STATEMENT = "dbmake_record_migration"
+
+
+def like_pattern(pattern):
+    """
+    Translates a shell-style pattern of schema names ("tenant_*", "shop_?") into a LIKE pattern
+    """
+    return pattern.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_").replace("*", "%").replace("?", "_")
+
+
+def tenant_lock_key(schema):
+    """
+    Key of the advisory lock on a tenant, within the key space of dbmake's migration lock
+    """
+    return (MIGRATION_LOCK_KEY & 0xffffffff) << 32 | zlib.crc32(schema.encode('utf-8')) & 0xffffffff
+
+
+def discover(db_adapter, pattern):
+    """
+    :param pattern: Shell-style pattern of tenant schema names
+    :return: A sorted list of names of the matching schemas
+    """
+    cursor = db_adapter.get_cursor()
+    cursor.execute(
+        "SELECT nspname FROM pg_catalog.pg_namespace "
+        "WHERE nspname LIKE %s AND nspname NOT LIKE 'pg\\_%%' AND nspname <> 'information_schema' "
+        "ORDER BY nspname",
+        (like_pattern(pattern),)
+    )
+    schemas = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+
+    return schemas
+
+
+def read_heads(db_adapter, schemas, batch_size=HEADS_BATCH_SIZE):
+    """
+    Reads current revisions of many tenants, in a query per batch_size tenants
+    :return: dict of a schema to its current revision (None if no migration has been applied yet),
+             schemas that have no migrations table are left out
+    """
+    cursor = db_adapter.get_cursor()
+    cursor.execute(
+        "SELECT n.nspname FROM pg_catalog.pg_class c "
+        "JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE c.relname = %s AND c.relkind = 'r' AND n.nspname = ANY (%s)",
+        (MIGRATIONS_TABLE, list(schemas))
+    )
+    initialized = sorted(row[0] for row in cursor.fetchall())
+
+    heads = dict((schema, None) for schema in initialized)
+
+    for start in range(0, len(initialized), batch_size):
+        batch = initialized[start:start + batch_size]
+        cursor.execute(
+            " UNION ALL ".join(
+                "(SELECT %%s, revision FROM %s.%s ORDER BY create_date DESC, id DESC LIMIT 1)" % (
+                    quote_identifier(schema), MIGRATIONS_TABLE
+                ) for schema in batch
+            ),
+            batch
+        )
+        for schema, revision in cursor.fetchall():
+            heads[schema] = int(revision)
+
+    db_adapter.commit()
+    cursor.close()
+
+    return heads
+
+
+class AdapterPool:
+    """
+    A fixed size pool of connections to a single database, opened as they're first needed
+    """
+
+    def __init__(self, db_connection_config, size):
+        self._db_connection_config = db_connection_config
+        self._size = size
+        self._idle = queue.Queue()
+        self._adapters = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def acquire(self):
+        """
+        Lends a database adapter for the with-block
+        """
+        db_adapter = self._get()
+        try:
+            yield db_adapter
+        finally:
+            self._idle.put(db_adapter)
+
+    def _get(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if len(self._adapters) < self._size:
+                db_adapter = database.DbAdapterFactory.create(self._db_connection_config)
+                self._adapters.append(db_adapter)
+                return db_adapter
+
+        return self._idle.get()
+
+    def close(self):
+        for db_adapter in self._adapters:
+            db_adapter.disconnect()
+        self._adapters = []
+
+
+class TenantResult:
+    """
+    Result of migrating a single tenant
+    """
+
+    schema = None
+    from_revision = None
+
+    # Revision the tenant is at after the run (would be at, after a dry run)
+    to_revision = None
+
+    target_revision = None
+
+    # Number of steps taken (or planned, by a dry run)
+    steps = 0
+
+    # Why the tenant hasn't been migrated, if it hasn't
+    skipped = None
+
+    # Exception the tenant has failed with
+    error = None
+
+    # Seconds
+    duration = 0.0
+
+    def __init__(self, schema, from_revision=None):
+        self.schema = schema
+        self.from_revision = from_revision
+        self.to_revision = from_revision
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __str__(self):
+        if self.error is not None:
+            return "%s: Error! %s" % (self.schema, str(self.error).strip())
+        if self.skipped is not None:
+            return "%s: Skipped, %s" % (self.schema, self.skipped)
+        if self.steps == 0:
+            return "%s: Already at revision %s" % (self.schema, self.to_revision)
+        return "%s: %s -> %s, %s steps (%s)" % (
+            self.schema, self.from_revision, self.to_revision, self.steps, format_duration(self.duration)
+        )
+
+
+class TenantMigrator:
+    """
+    Migrates tenant schemas of a database
+    """
+
+    def __init__(self, db_connection_config, migrations_manager, jobs=DEFAULT_JOBS, listener=None,
+                 init=False):
+        """
+        :param migrations.MigrationsManager migrations_manager:
+        :param jobs: Number of tenants to migrate concurrently, and of connections to open
+        :param migrations.MigrationListener listener: Is told about every finished tenant, it must be thread safe
+                                                      [Default: MigrationListener, reporting nothing]
+        :param init: Create migrations tables of tenants that have none, recorded at the ZERO-MIGRATION
+                     as "dbmake init" does. Otherwise such tenants are skipped.
+        """
+        self._db_connection_config = db_connection_config
+        self._manager = migrations_manager.load()
+        self._jobs = max(jobs, 1)
+        self._listener = listener if listener is not None else migrations.MigrationListener()
+        self._init = init
+        self._pool = None
+        self._prepared = set()
+        self._migration_vos = {}
+
+    def migrate(self, pattern, target_revision=None, steps=None, dry_run=False):
+        """
+        :param pattern: Shell-style pattern of tenant schema names
+        :param target_revision: Revision to migrate to [Default: the latest revision]
+        :param steps: Number of revisions to migrate up (positive) or down (negative) from each tenant's
+                      current revision, instead of target_revision
+        :param dry_run: Plan the steps without taking them
+        :return: A list of TenantResult, in the order of the schema names
+        """
+        if target_revision is None and steps is None:
+            target_revision = self._manager.latest_revision()
+
+        # Checksums of migration files are computed once, not per tenant
+        for migration in self._manager.migrations():
+            self._migration_vos[migration.revision] = migration.get_vo()
+
+        self._pool = AdapterPool(self._db_connection_config, self._jobs)
+        try:
+            with self._pool.acquire() as db_adapter:
+                schemas = discover(db_adapter, pattern)
+                heads = read_heads(db_adapter, schemas)
+
+                missing = [schema for schema in schemas if schema not in heads]
+                if missing and self._init and not dry_run:
+                    self._init_tenants(db_adapter, missing)
+                    heads.update((schema, 0) for schema in missing)
+
+            results = {}
+            pending = []
+
+            for schema in schemas:
+                result = results[schema] = TenantResult(schema, heads.get(schema))
+
+                if schema not in heads:
+                    result.skipped = "no migrations table" + ("" if dry_run else ", use --init-tenants to create it")
+                    continue
+
+                try:
+                    result.target_revision = self._target(result.from_revision, target_revision, steps)
+                except Exception as e:
+                    result.error = e
+                    continue
+
+                if result.target_revision != result.from_revision:
+                    pending.append(result)
+
+            # The largest tenants start first, so none of them is left to finish alone at the end
+            if len(pending) > self._jobs:
+                with self._pool.acquire() as db_adapter:
+                    sizes = scheduling.schema_sizes(db_adapter, [result.schema for result in pending])
+                    db_adapter.commit()
+                pending = scheduling.lpt_order(pending, [sizes.get(result.schema, 0) for result in pending])
+
+            if dry_run:
+                for result in pending:
+                    result.steps = len(self._manager.plan(result.from_revision, result.target_revision))
+                    result.to_revision = result.target_revision
+            elif len(pending) > 0:
+                pool = ThreadPool(min(self._jobs, len(pending)))
+                try:
+                    for _ in pool.imap_unordered(self._migrate_tenant, pending):
+                        pass
+                finally:
+                    pool.close()
+                    pool.join()
+        finally:
+            self._pool.close()
+            self._pool = None
+
+        return [results[schema] for schema in schemas]
+
+    def _target(self, current_revision, target_revision, steps):
+        if steps is None:
+            return target_revision
+        return self._manager.relative_revision(current_revision, steps)
+
+    def _init_tenants(self, db_adapter, schemas):
+        """
+        Creates migrations tables of tenants, recorded at the ZERO-MIGRATION, in a single transaction
+        """
+        zero_migration_vo = self._migration_vos.get(0)
+        if zero_migration_vo is None:
+            raise DbmakeException("Error! No ZERO-MIGRATION was found to record tenants at")
+
+        for schema in schemas:
+            migrations_dao = migrations.MigrationsDao(db_adapter, schema)
+            migrations_dao.create_table()
+
+            cursor = db_adapter.get_cursor()
+            cursor.execute(
+                "INSERT INTO " + migrations_dao.table + " (revision, migration_name, checksum) VALUES (%s, %s, %s)",
+                (zero_migration_vo.revision, zero_migration_vo.migration_name, zero_migration_vo.checksum)
+            )
+            cursor.close()
+
+        db_adapter.commit()
+
+    def _migrate_tenant(self, result):
+        started_at = time.time()
+
+        try:
+            with self._pool.acquire() as db_adapter:
+                self._set_search_path(db_adapter, result.schema)
+                try:
+                    self._take_steps(db_adapter, result)
+                finally:
+                    db_adapter.rollback()
+                    db_adapter.execute_string("RESET search_path")
+        except Exception as e:
+            result.error = e
+
+        result.duration = time.time() - started_at
+        self._listener.on_message(str(result))
+
+        return result
+
+    def _take_steps(self, db_adapter, result):
+        migration_lock = migrations.MigrationLock(db_adapter, tenant_lock_key(result.schema))
+        if not migration_lock.try_acquire():
+            result.skipped = "another dbmake run is migrating it"
+            return
+
+        try:
+            # Another run may have migrated the tenant since its revision has been read
+            migration_vo = migrations.MigrationsDao(db_adapter, result.schema).find_most_recent()
+            current_revision = None if migration_vo is None else int(migration_vo.revision)
+            result.from_revision = result.to_revision = current_revision
+
+            for step in self._manager.plan(current_revision, result.target_revision):
+                if step.direction == migrations.MigrationDirection.UP:
+                    step.migration.migrate(db_adapter)
+                else:
+                    step.migration.rollback(db_adapter)
+
+                self._record(db_adapter, self._migration_vos[step.revision])
+                result.to_revision = step.revision
+                result.steps += 1
+        finally:
+            migration_lock.release()
+
+    @staticmethod
+    def _set_search_path(db_adapter, schema):
+        # Session level, as non-transactional migrations commit statement by statement
+        cursor = db_adapter.get_cursor()
+        cursor.execute("SELECT set_config('search_path', %s, false)", (quote_identifier(schema) + ", public",))
+        cursor.close()
+        db_adapter.commit()
+
+    def _record(self, db_adapter, migration_vo):
+        """
+        Records a migration in the current tenant's migrations table
+        """
+        cursor = db_adapter.get_cursor()
+
+        # The statement can't be prepared until search_path finds a migrations table. A connection
+        # is used by a single thread at a time, and prepared statements outlive rollbacks.
+        if db_adapter not in self._prepared:
+            cursor.execute(
+                "PREPARE " + RECORD_STATEMENT + " (integer, text, text) AS "
+                "INSERT INTO " + MIGRATIONS_TABLE + " (revision, migration_name, checksum) VALUES ($1, $2, $3)"
+            )
+            self._prepared.add(db_adapter)
+
+        cursor.execute(
+            "EXECUTE " + RECORD_STATEMENT + " (%s, %s, %s)",
+            (migration_vo.revision, migration_vo.migration_name, migration_vo.checksum)
+        )
+        cursor.close()
+        db_adapter.commit()
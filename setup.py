@@ -60,7 +60,7 @@ setup(
     # simple. Or you can use find_packages().
     # packages=find_packages(exclude=['contrib', 'docs', 'tests', 'venv', 'bin']),
     #packages=["dbmake"],
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks']),
 
     # Alternatively, if you want to distribute just a my_module.py, uncomment this:
     # py_modules=["dbmake"],
@@ -0,0 +1,84 @@
+"""
+Fixtures of tests that need a PostgreSQL database. Such tests are skipped unless the DBMAKE_TEST_DB
+environment variable holds connection parameters of a throwaway database, e.g.:
+
+    DBMAKE_TEST_DB="host=localhost port=5432 dbname=dbmake_test user=postgres password=secret"
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from dbmake import database
+from dbmake.common import DBMAKE_CONFIG_DIR, DBMAKE_CONFIG_FILE, MIGRATIONS_TABLE, PROGRESS_TABLE
+
+
+def db_config_from_env():
+    """
+    :return: DbConnectionConfig of the test database, or None if it isn't configured
+    """
+    dsn = os.environ.get("DBMAKE_TEST_DB")
+    if not dsn:
+        return None
+
+    parameters = dict(parameter.split("=", 1) for parameter in dsn.split())
+    return database.DbConnectionConfig(
+        parameters.get("host", "localhost"),
+        parameters["dbname"],
+        parameters.get("user"),
+        parameters.get("password", ""),
+        "test",
+        parameters.get("port", database.DbConnectionConfig.port)
+    )
+
+
+@unittest.skipIf(db_config_from_env() is None, "DBMAKE_TEST_DB is not set")
+class DbTestCase(unittest.TestCase):
+    """
+    Provides a test database, cleared of dbmake tables and of "t_*" tables tests create, and a migrations
+    directory whose config file holds the test database's connection. Adapters created by dbmake while
+    a test runs are instrumented, assertQueryBudget() checks their counters.
+    """
+
+    def setUp(self):
+        self.db_config = db_config_from_env()
+        self.migrations_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.migrations_dir, DBMAKE_CONFIG_DIR))
+        self.db_config.save(os.path.join(self.migrations_dir, DBMAKE_CONFIG_DIR, DBMAKE_CONFIG_FILE))
+
+        self._clear_database()
+
+        self.stats = database.AdapterStats()
+        database.DbAdapterFactory.instrument(self.stats)
+
+    def tearDown(self):
+        database.DbAdapterFactory.instrument(None)
+        self._clear_database()
+        shutil.rmtree(self.migrations_dir)
+
+    def _clear_database(self):
+        db_adapter = database.PgAdapter(self.db_config)
+        try:
+            tables = [table for table in db_adapter.get_tables()
+                      if table.startswith("t_") or table in (MIGRATIONS_TABLE, PROGRESS_TABLE)]
+            for table in tables:
+                db_adapter.execute_string("DROP TABLE %s CASCADE" % table)
+        finally:
+            db_adapter.disconnect()
+
+    def write_migration(self, file_name, up, down=""):
+        """
+        Writes a migration file into the test's migrations directory
+        """
+        with open(os.path.join(self.migrations_dir, file_name), 'w') as f:
+            f.write("%s\n-- DBMAKE: SEPARATOR\n%s\n" % (up, down))
+
+    def assertQueryBudget(self, round_trips=None, commits=None, connections=None):
+        """
+        Fails if adapters created since the last stats.reset() exceeded any of the budgets
+        """
+        for name, budget in (("round trips", round_trips), ("commits", commits), ("connections", connections)):
+            spent = getattr(self.stats, name.replace(" ", "_"))
+            if budget is not None and spent > budget:
+                self.fail("Spent %s %s, the budget is %s" % (spent, name, budget))
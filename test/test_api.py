@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+from dbmake import api
+from dbmake.common import MigrationFailed, MigrationsTableNotFound
+from dbmake.database import DbConnectionConfig
+from dbmake.migrations import MigrationsManager, MigrationVO
+
+
+class TestApi(TestCase):
+
+    def setUp(self):
+        self.migrations_dir = tempfile.mkdtemp()
+        for file_ in ("0_zero_migration.sql", "10_first.sql", "20_second.sql", "30_third.sql"):
+            with open(os.path.join(self.migrations_dir, file_), 'w') as f:
+                f.write("SELECT 1;\n-- DBMAKE: SEPARATOR\nSELECT 2;")
+
+        self.manager = MigrationsManager(self.migrations_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.migrations_dir)
+
+    def target(self, connection_name):
+        # A caller's adapter, the API neither connects nor disconnects it
+        db_adapter = mock.Mock()
+        db_adapter.get_db_connection_config.return_value = DbConnectionConfig(
+            "localhost", connection_name, "postgres", "", connection_name
+        )
+        return db_adapter
+
+    def head(self, revision, name):
+        migration_vo = MigrationVO()
+        migration_vo.revision = revision
+        migration_vo.migration_name = name
+        return migration_vo
+
+    @mock.patch("dbmake.migrations.MigrationsDao")
+    def test_status(self, migrations_dao_class):
+        migrations_dao_class.return_value.find_head.side_effect = [
+            self.head(10, "first"),
+            MigrationsTableNotFound("Error! No migrations table has been found."),
+            RuntimeError("connection lost"),
+        ]
+
+        results = api.status([self.target("a"), self.target("b"), self.target("c")], self.manager)
+
+        self.assertEqual([result.connection_name for result in results], ["a", "b", "c"])
+        self.assertTrue(results[0].ok)
+        self.assertEqual((results[0].revision, results[0].name, results[0].pending, results[0].latest_revision),
+                         (10, "first", 2, 30))
+
+        # A database without a migrations table isn't an error, it has no revision
+        self.assertTrue(results[1].ok)
+        self.assertIsNone(results[1].revision)
+
+        self.assertFalse(results[2].ok)
+        self.assertIsInstance(results[2].error, RuntimeError)
+
+    @mock.patch("dbmake.migrations.MigrationsDao")
+    def test_migrate(self, migrations_dao_class):
+        migrations_dao_class.return_value.is_migration_table_exists.return_value = True
+        migrations_dao_class.return_value.find_most_recent.return_value = self.head(10, "first")
+
+        def migrate_to_revision(target_revision, db_adapter, dry_run, listener, **kwargs):
+            for step in self.manager.plan(10, target_revision):
+                step.duration = 0.5
+                listener.on_step_start(step)
+                listener.on_message("Migrated %s" % step.migration.name)
+                listener.on_step_finish(step)
+
+        with mock.patch.object(self.manager, "migrate_to_revision", side_effect=migrate_to_revision):
+            results = api.migrate([self.target("a")], self.manager, to=30)
+
+        result = results[0]
+        self.assertTrue(result.ok)
+        self.assertEqual((result.from_revision, result.to_revision), (10, 30))
+        self.assertEqual([(step.revision, step.name, step.duration) for step in result.steps],
+                         [(20, "second", 0.5), (30, "third", 0.5)])
+        self.assertEqual(result.messages, ["Migrated second", "Migrated third"])
+
+    @mock.patch("dbmake.migrations.MigrationsDao")
+    def test_migrate_failure(self, migrations_dao_class):
+        migrations_dao_class.return_value.is_migration_table_exists.return_value = False
+
+        results = api.migrate([self.target("a")], self.manager, raise_on_error=False)
+        self.assertIsInstance(results[0].error, MigrationsTableNotFound)
+
+        with self.assertRaises(MigrationFailed) as context:
+            api.migrate([self.target("a")], self.manager)
+        self.assertEqual([result.connection_name for result in context.exception.results], ["a"])
@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+from dbmake.backfill import BackfillMigration
+from dbmake.common import DbmakeException
+from dbmake.migrations import MigrationFactory, MigrationProgressVO
+
+
+class TestBackfillMigration(TestCase):
+
+    def setUp(self):
+        self.migrations_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.migrations_dir)
+
+    def migration(self, *directives):
+        path = os.path.join(self.migrations_dir, "5_lower_emails.sql")
+        with open(path, 'w') as f:
+            f.write("".join("-- DBMAKE: %s\n" % directive for directive in directives))
+            f.write("-- DBMAKE: SEPARATOR\n")
+        return MigrationFactory.create(path)
+
+    def migrate(self, migration, checkpoint=None):
+        """
+        Runs the backfill on a mocked database
+        :return: (executed (query, parameters), the progress DAO mock)
+        """
+        db_adapter = mock.Mock()
+        cursor = db_adapter.get_cursor.return_value
+        cursor.rowcount = 3
+
+        progress_vo = None
+        if checkpoint is not None:
+            progress_vo = MigrationProgressVO()
+            progress_vo.checkpoint = str(checkpoint)
+            progress_vo.rows_done = 30
+
+        with mock.patch("dbmake.backfill.MigrationProgressDao") as progress_dao_class:
+            progress_dao = progress_dao_class.return_value
+            progress_dao.find.return_value = progress_vo
+
+            self.assertTrue(migration.migrate(db_adapter, mock.Mock()))
+
+        return [call[0] for call in cursor.execute.call_args_list], progress_dao
+
+    def test_directives(self):
+        migration = self.migration("BACKFILL", "TABLE customers", "KEY id", "SET email = lower(email)",
+                                   "RANGE 1 100", "BATCH SIZE 40")
+
+        self.assertIsInstance(migration, BackfillMigration)
+        self.assertEqual((migration.key_range, migration.batch_size), ((1, 100), 40))
+        self.assertFalse(migration.rehearsable)
+
+        with self.assertRaises(DbmakeException):
+            self.migration("BACKFILL", "TABLE customers", "KEY id")
+
+    def test_rejects_up_statements(self):
+        path = os.path.join(self.migrations_dir, "5_lower_emails.sql")
+        with open(path, 'w') as f:
+            f.write("-- DBMAKE: BACKFILL\n-- DBMAKE: TABLE customers\n-- DBMAKE: KEY id\n"
+                    "-- DBMAKE: SET email = lower(email)\n"
+                    "CREATE INDEX customers_email ON customers (email);\n"
+                    "-- DBMAKE: SEPARATOR\n")
+
+        with self.assertRaises(DbmakeException):
+            MigrationFactory.create(path)
+
+    def test_chunks(self):
+        executed, progress_dao = self.migrate(self.migration(
+            "BACKFILL", "TABLE customers", "KEY id", "SET email = lower(email)", "RANGE 1 100", "BATCH SIZE 40"
+        ))
+
+        self.assertEqual(executed, [
+            ('UPDATE "customers" SET email = lower(email) WHERE "id" > %s AND "id" <= %s', (0, 40)),
+            ('UPDATE "customers" SET email = lower(email) WHERE "id" > %s AND "id" <= %s', (40, 80)),
+            ('UPDATE "customers" SET email = lower(email) WHERE "id" > %s AND "id" <= %s', (80, 100)),
+        ])
+
+        # A checkpoint is saved with every chunk and dropped once the backfill is done
+        self.assertEqual(progress_dao.save.call_count, 3)
+        self.assertEqual(progress_dao.save.call_args[0][0].rows_done, 9)
+        progress_dao.delete.assert_called_once_with(5, BackfillMigration.PROGRESS_TASK)
+
+    def test_resumes_after_checkpoint(self):
+        executed, progress_dao = self.migrate(self.migration(
+            "BACKFILL", "TABLE customers", "KEY id", "SET email = lower(email)", "RANGE 1 100", "BATCH SIZE 40"
+        ), checkpoint=80)
+
+        self.assertEqual([parameters for query, parameters in executed], [(80, 100)])
+        self.assertEqual(progress_dao.save.call_args[0][0].rows_done, 33)
+
+    def test_percent_signs(self):
+        executed, progress_dao = self.migrate(self.migration(
+            "BACKFILL", "TABLE customers", "KEY id", "SET code = format('%s-1', code)", "WHERE code LIKE 'a%'",
+            "RANGE 1 10"
+        ))
+
+        query, parameters = executed[0]
+        self.assertEqual(query % parameters,
+                         'UPDATE "customers" SET code = format(\'%s-1\', code) WHERE "id" > 0 AND "id" <= 10 '
+                         'AND (code LIKE \'a%\')')
@@ -0,0 +1,66 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from dbmake import checksums
+
+
+class TestChecksumCache(TestCase):
+
+    def setUp(self):
+        self.migrations_dir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.migrations_dir, "checksums.json")
+        self.migration_file = os.path.join(self.migrations_dir, "1_first_migration.sql")
+        self.empty_file = os.path.join(self.migrations_dir, "2_empty.sql")
+
+        with open(self.migration_file, 'wb') as f:
+            f.write(b"CREATE TABLE a (id int);")
+        open(self.empty_file, 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.migrations_dir)
+
+    def test_file_checksum(self):
+        self.assertEqual(
+            checksums.file_checksum(self.migration_file),
+            hashlib.sha256(b"CREATE TABLE a (id int);").hexdigest()
+        )
+        self.assertEqual(checksums.file_checksum(self.empty_file), hashlib.sha256(b"").hexdigest())
+
+    def test_reuse_cached_checksums(self):
+        cache = checksums.ChecksumCache(self.cache_file)
+        cache.checksums([self.migration_file, self.empty_file])
+        cache.save()
+
+        # A cached checksum is trusted while the file's size and mtime stay the same
+        cache = checksums.ChecksumCache(self.cache_file)
+        cache._entries[os.path.basename(self.migration_file)][2] = "cached"
+        self.assertEqual(cache.checksums([self.migration_file])[self.migration_file], "cached")
+
+    def test_rehash_modified_files(self):
+        cache = checksums.ChecksumCache(self.cache_file)
+        cache.checksums([self.migration_file])
+        cache.save()
+
+        with open(self.migration_file, 'ab') as f:
+            f.write(b"\nDROP TABLE b;")
+
+        cache = checksums.ChecksumCache(self.cache_file)
+        self.assertEqual(
+            cache.checksums([self.migration_file])[self.migration_file],
+            checksums.file_checksum(self.migration_file)
+        )
+
+    def test_parallel_hashing(self):
+        files = []
+        for revision in range(checksums.ChecksumCache.PARALLEL_THRESHOLD):
+            file_ = os.path.join(self.migrations_dir, "%s_migration.sql" % revision)
+            with open(file_, 'w') as f:
+                f.write("SELECT %s;" % revision)
+            files.append(file_)
+
+        result = checksums.ChecksumCache(self.cache_file).checksums(files, processes=2)
+
+        self.assertEqual(result[files[5]], hashlib.sha256(b"SELECT 5;").hexdigest())
@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+from dbmake import compiler
+from dbmake.common import SqlSyntaxError
+from dbmake.migrations import Migration
+
+
+class TestTouchedRelations(TestCase):
+
+    def relations(self, sql):
+        return compiler.touched_relations(compiler.normalize(sql))
+
+    def test_forms(self):
+        self.assertEqual(self.relations(b"CREATE TABLE IF NOT EXISTS public.a (id int REFERENCES b (id));"),
+                         ["public.a", "b"])
+        self.assertEqual(self.relations(b'DROP TABLE x, "Y" CASCADE;'), ["x", '"Y"'])
+        self.assertEqual(self.relations(b"CREATE UNIQUE INDEX CONCURRENTLY i ON ONLY s.t (a);"), ["s.t"])
+        self.assertEqual(self.relations(b"-- UPDATE x\nUPDATE t SET a = 'DELETE FROM y';"), ["t"])
+        self.assertEqual(self.relations(b"COMMENT ON TABLE a IS 'x';"), [])
+
+    def test_unknown_forms(self):
+        self.assertIsNone(self.relations(b"DO $$ BEGIN DELETE FROM z; END $$;"))
+        self.assertIsNone(self.relations(b"ALTER TABLE a RENAME TO b;"))
+
+    def test_transactional(self):
+        self.assertFalse(compiler.is_transactional(compiler.normalize(b"CREATE INDEX CONCURRENTLY i ON t (a);")))
+        self.assertFalse(compiler.is_transactional(compiler.normalize(b"VACUUM t;")))
+        self.assertTrue(compiler.is_transactional(compiler.normalize(b"CREATE INDEX i ON t (a);")))
+
+
+class TestCompiler(TestCase):
+
+    def setUp(self):
+        self.migrations_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.migrations_dir, "common"))
+
+        self.migration_file = self.write("1_users.sql", (
+            "-- DBMAKE: MIGRATE UP\n"
+            "CREATE TABLE users (id int);\n"
+            "\\ir common/index.sql\n"
+            "-- DBMAKE: SEPARATOR\n"
+            "-- DBMAKE: MIGRATE DOWN\n"
+            "DROP TABLE users;\n"
+        ))
+        self.write("common/index.sql", "\n\nCREATE INDEX CONCURRENTLY users_id ON users (id);\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.migrations_dir)
+
+    def write(self, name, content):
+        path = os.path.join(self.migrations_dir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_compile(self):
+        compiled = compiler.Compiler(self.migration_file).compile()
+
+        self.assertEqual([(s.file, s.line) for s in compiled.up], [(None, 2), ("common/index.sql", 3)])
+        self.assertEqual([(s.file, s.line) for s in compiled.down], [(None, 6)])
+        self.assertEqual(compiled.relations(), ["users"])
+        self.assertFalse(compiled.transactional)
+        self.assertEqual(list(compiled.includes), ["common/index.sql"])
+
+        with open(self.migration_file, 'rb') as f:
+            self.assertEqual(compiled.down[0].sql(f.read()), b"DROP TABLE users;")
+
+    def test_circular_and_missing_includes(self):
+        self.write("common/index.sql", "\\ir index.sql\n")
+        self.assertRaises(SqlSyntaxError, compiler.Compiler(self.migration_file).compile)
+
+        os.remove(os.path.join(self.migrations_dir, "common/index.sql"))
+        self.assertRaises(SqlSyntaxError, compiler.Compiler(self.migration_file).compile)
+
+    def test_cache(self):
+        cache_dir = os.path.join(self.migrations_dir, ".dbmake", "cache")
+        cache = compiler.CompileCache(cache_dir)
+
+        compiled = cache.get(self.migration_file)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        self.assertEqual(cache.get(self.migration_file).to_dict(), compiled.to_dict())
+
+        # An edited include invalidates the cached migration
+        self.write("common/index.sql", "CREATE INDEX users_id ON users (id);\n")
+        self.assertTrue(cache.get(self.migration_file).transactional)
+
+    def test_lexed_migration(self):
+        compiled = compiler.Compiler(self.migration_file).compile()
+        lexed = compiler.LexedMigration(self.migration_file)
+
+        for migrate_up in (True, False):
+            self.assertEqual([s.to_dict() for s in lexed.section(migrate_up)],
+                             [s.to_dict() for s in compiled.section(migrate_up)])
+            self.assertEqual(lexed.relations(migrate_up), compiled.relations(migrate_up))
+        self.assertEqual((lexed.transactional, lexed.has_copy, lexed.includes),
+                         (compiled.transactional, compiled.has_copy, compiled.includes))
+
+        self.write("2_no_down.sql", "SELECT 1;\n")
+        self.assertIsNone(compiler.LexedMigration(os.path.join(self.migrations_dir, "2_no_down.sql")).down)
+
+    def test_migrations_compile_lazily(self):
+        os.mkdir(os.path.join(self.migrations_dir, ".dbmake"))
+
+        with mock.patch.object(compiler, "compile_migration", wraps=compiler.compile_migration) as compile_migration:
+            migration = Migration(self.migration_file)
+            compile_migration.assert_not_called()
+
+            self.assertFalse(migration.transactional)
+            compile_migration.assert_called_once_with(self.migration_file)
+
+        # Large migration files are lexed on the fly and never cached
+        with mock.patch.object(Migration, "STREAMING_THRESHOLD", 10):
+            migration = Migration(self.write("2_large.sql", "CREATE TABLE a (id int);\n-- DBMAKE: SEPARATOR\n"))
+
+            self.assertIsInstance(migration.compiled, compiler.LexedMigration)
+            self.assertTrue(migration.streaming)
+            self.assertEqual(migration.relations(), ["a"])
+            self.assertEqual(len(os.listdir(os.path.join(self.migrations_dir, ".dbmake", "cache"))), 1)
@@ -0,0 +1,64 @@
+from unittest import TestCase, mock
+
+import psycopg2
+
+from dbmake import db_tasks
+from dbmake.database import DbConnectionConfig
+
+
+class TestPgDbCloneSchema(TestCase):
+
+    def setUp(self):
+        self.source_config = DbConnectionConfig("localhost", "source", "postgres", "", "source")
+        self.target_configs = [DbConnectionConfig("localhost", "target_%s" % i, "postgres", "", "target_%s" % i)
+                               for i in range(2)]
+
+    @mock.patch("dbmake.db_tasks.DbAdapterFactory")
+    @mock.patch("dbmake.db_tasks.migrations.MigrationsDao")
+    @mock.patch("dbmake.db_tasks.subprocess.Popen")
+    def test_failing_dump_aborts_restores(self, popen, migrations_dao_class, db_adapter_factory):
+        migrations_dao_class.return_value.is_migration_table_exists.return_value = True
+        migrations_dao_class.return_value.find_most_recent.return_value.revision = 3
+
+        dump = mock.Mock()
+        dump.stdout.read.side_effect = [b"CREATE TABLE a (id int);\n", b""]
+        dump.wait.return_value = 1
+        restores = [mock.Mock(), mock.Mock()]
+        popen.side_effect = [dump] + restores
+
+        with mock.patch("builtins.print"):
+            cloned = db_tasks.PgDbCloneSchema(self.source_config, mock.Mock()).execute(self.target_configs)
+
+        self.assertEqual(cloned, [])
+        for restore in restores:
+            restore.kill.assert_called_once_with()
+            restore.stdin.close.assert_not_called()
+
+        # No target is stamped with the source's revision
+        migrations_dao_class.return_value.create.assert_not_called()
+        db_adapter_factory.create.assert_not_called()
+
+    @mock.patch("dbmake.db_tasks.DbAdapterFactory")
+    @mock.patch("dbmake.db_tasks.migrations.MigrationsDao")
+    @mock.patch("dbmake.db_tasks.subprocess.Popen")
+    def test_unreachable_target_isnt_stamped(self, popen, migrations_dao_class, db_adapter_factory):
+        migrations_dao_class.return_value.is_migration_table_exists.return_value = True
+        migrations_dao_class.return_value.find_most_recent.return_value.revision = 3
+
+        dump = mock.Mock()
+        dump.stdout.read.side_effect = [b"CREATE TABLE a (id int);\n", b""]
+        dump.wait.return_value = 0
+        restores = [mock.Mock(returncode=0), mock.Mock(returncode=0)]
+        popen.side_effect = [dump] + restores
+
+        target_adapter = mock.Mock()
+        db_adapter_factory.create.side_effect = [psycopg2.OperationalError("refused"), target_adapter]
+
+        with mock.patch("builtins.print"):
+            cloned = db_tasks.PgDbCloneSchema(self.source_config, mock.Mock()).execute(self.target_configs)
+
+        # A target that can't be stamped doesn't stop the remaining ones from being stamped
+        self.assertEqual(cloned, ["target_1"])
+        migrations_dao_class.assert_called_with(target_adapter)
+        migrations_dao_class.return_value.create.assert_called_once_with(mock.ANY)
+        target_adapter.disconnect.assert_called_once_with()
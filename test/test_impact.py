@@ -0,0 +1,44 @@
+import json
+from unittest import TestCase
+
+from dbmake.impact import ImpactReport, RelationImpact, RelationState, format_size
+
+
+class TestImpactReport(TestCase):
+
+    def setUp(self):
+        self.before = {
+            1: RelationState("orders", 100, 8192, 10),
+            2: RelationState("users", 200, 16384, 20),
+            3: RelationState("legacy", 300, 4096, 5),
+        }
+        self.after = {
+            1: RelationState("orders", 101, 24576, 10),
+            2: RelationState("users", 200, 16384, 20),
+            4: RelationState("invoices", 400, 8192, 0),
+        }
+
+    def test_classifies_changes(self):
+        report = ImpactReport(self.before, self.after, 1.5)
+
+        self.assertEqual([(r.name, r.change) for r in report.relations], [
+            ("invoices", RelationImpact.CREATED),
+            ("legacy", RelationImpact.DROPPED),
+            ("orders", RelationImpact.REWRITTEN),
+        ])
+        self.assertEqual([r.name for r in report.rewrites], ["orders"])
+        self.assertEqual(report.size_delta, 8192 - 4096 + 16384)
+
+    def test_to_json(self):
+        report = json.loads(ImpactReport(self.before, self.after, 1.5).to_json())
+
+        self.assertEqual(report["duration"], 1.5)
+        self.assertEqual(len(report["relations"]), 3)
+
+    def test_unchanged(self):
+        self.assertEqual(ImpactReport(self.before, self.before).relations, [])
+
+    def test_format_size(self):
+        self.assertEqual(format_size(None), "-")
+        self.assertEqual(format_size(512), "512 B")
+        self.assertEqual(format_size(-2048, signed=True), "-2.0 kB")
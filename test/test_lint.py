@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+from dbmake import lint
+from dbmake.migrations import Migration
+
+
+class TestLint(TestCase):
+
+    def setUp(self):
+        self.migrations_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.migrations_dir)
+
+    def migration(self, name, content):
+        path = os.path.join(self.migrations_dir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return Migration(path)
+
+    def test_check(self):
+        findings = lint.check([
+            self.migration("1_a.sql", (
+                "CREATE TABLE events (id int);\n"
+                "CREATE INDEX events_id ON events (id);\n"
+                "CREATE INDEX users_email ON users (email);\n"
+                "CREATE INDEX CONCURRENTLY users_name ON users (name);\n"
+                "ALTER TABLE users ADD COLUMN token uuid DEFAULT gen_random_uuid();\n"
+                "ALTER TABLE users ADD COLUMN created timestamp DEFAULT now();\n"
+                "ALTER TABLE users ALTER COLUMN id TYPE bigint;\n"
+                "ALTER TABLE orders ADD CONSTRAINT orders_user FOREIGN KEY (user_id) REFERENCES users (id);\n"
+                "ALTER TABLE orders ADD CONSTRAINT orders_total CHECK (total > 0) NOT VALID;\n"
+                "ALTER TABLE orders ALTER COLUMN total SET NOT NULL;\n"
+                "UPDATE orders SET total = 0;\n"
+                "DELETE FROM orders WHERE total < 0;\n"
+            )),
+            self.migration("2_b.sql", "-- DBMAKE: LINT IGNORE unbatched-dml\nDELETE FROM users;\n"),
+        ])
+
+        self.assertEqual([(finding.rule.id_, finding.relation, finding.statement.line) for finding in findings], [
+            ("index-not-concurrent", "users", 3),
+            ("volatile-default", "users", 5),
+            ("column-type-change", "users", 7),
+            ("constraint-not-valid", "orders", 8),
+            ("set-not-null", "orders", 10),
+            ("unbatched-dml", "orders", 11),
+        ])
+
+    def test_weigh(self):
+        findings = lint.check([self.migration("1_a.sql", (
+            "CREATE INDEX users_email ON users (email);\n"
+            "ALTER TABLE orders ALTER COLUMN id TYPE bigint;\n"
+            "UPDATE missing SET a = 1;\n"
+        ))])
+
+        db_adapter = mock.Mock()
+        db_adapter.get_cursor.return_value.fetchall.return_value = [("users", 1000.0, 300), ("orders", 10.0, 200)]
+
+        findings = lint.weigh(findings, db_adapter)
+
+        self.assertEqual([(finding.relation, finding.impact) for finding in findings],
+                         [("orders", 400), ("users", 300), ("missing", 0)])
+        self.assertEqual(db_adapter.get_cursor.return_value.execute.call_count, 1)
+
+    def test_parse_size(self):
+        self.assertEqual(lint.parse_size("500"), 500)
+        self.assertEqual(lint.parse_size("100MB"), 100 * 1024 * 1024)
+        self.assertEqual(lint.parse_size("1.5 kb"), 1536)
+        self.assertRaises(ValueError, lint.parse_size, "lots")
@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+from dbmake import locks
+from dbmake.migrations import MigrationsManager
+
+
+class TestLockProfile(TestCase):
+
+    def test_blocked_traffic(self):
+        self.assertEqual(locks.blocked_traffic("AccessExclusiveLock"),
+                         ["SELECT", "SELECT FOR UPDATE", "INSERT/UPDATE/DELETE", "VACUUM"])
+        self.assertEqual(locks.blocked_traffic("ShareLock"), ["INSERT/UPDATE/DELETE", "VACUUM"])
+        self.assertEqual(locks.blocked_traffic("AccessShareLock"), [])
+
+    def test_strongest_lock_since_the_statement_that_took_it(self):
+        samples = [
+            {"orders": "RowExclusiveLock"},
+            {"orders": "RowExclusiveLock"},
+            {"orders": "RowExclusiveLock", "users": "AccessShareLock"},
+            {"orders": "AccessExclusiveLock", "users": "AccessShareLock"},
+        ]
+        profile = locks.LockProfile(None)
+
+        with mock.patch.object(locks, "sample", side_effect=samples):
+            profile.start()
+            profile.after_statement(10.0)
+            profile.after_statement(12.0)
+            profile.after_statement(15.0)
+        profile.finish(20.0)
+
+        self.assertEqual([(h.relation, h.mode, h.statement, h.held) for h in profile.holds], [
+            ("orders", "AccessExclusiveLock", 3, 5.0),
+            ("users", "AccessShareLock", 2, 8.0),
+        ])
+
+
+class TestRehearsalLockProfile(TestCase):
+
+    def setUp(self):
+        self.migrations_dir = tempfile.mkdtemp()
+        for file_, up in (("0_zero_migration.sql", "SELECT 1;"), ("10_first.sql", "ALTER TABLE orders ADD note text;")):
+            with open(os.path.join(self.migrations_dir, file_), 'w') as f:
+                f.write(up + "\n-- DBMAKE: SEPARATOR\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.migrations_dir)
+
+    @mock.patch("dbmake.migrations.MigrationsDao")
+    def test_baseline_precedes_impact_snapshot(self, migrations_dao_class):
+        migrations_dao_class.return_value.find_most_recent.return_value = None
+        calls = []
+
+        def sample(db_adapter):
+            calls.append("sample")
+            return {}
+
+        def snapshot(db_adapter, relations=None):
+            calls.append("snapshot")
+            return {}
+
+        with mock.patch.object(locks, "sample", side_effect=sample), \
+                mock.patch("dbmake.migrations.impact.snapshot", side_effect=snapshot):
+            MigrationsManager(self.migrations_dir)._rehearse(10, mock.Mock(), mock.Mock(), lock_profile=True)
+
+        # Sizing the relations locks them, the baseline must not absorb these locks
+        self.assertEqual(calls[:2], ["sample", "snapshot"])
+        self.assertEqual(calls.count("snapshot"), 4)
@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+import psycopg2
+
+from dbmake import commands
+from dbmake import database
+from dbmake import metrics
+from dbmake.common import DBMAKE_CONFIG_DIR, DBMAKE_CONFIG_FILE, ZERO_MIGRATION_FILE_NAME
+
+
+class TestMetricsRegistry(TestCase):
+
+    def setUp(self):
+        self.registry = metrics.MetricsRegistry()
+        metrics.activate(self.registry)
+
+    def tearDown(self):
+        metrics.activate(None)
+
+    def test_render(self):
+        metrics.revision("db_1", 1430991341, [0, 1430991341, 1431012345, 1431099999])
+        self.registry.inc("dbmake_connect_failures", connection='say "hi"\n')
+
+        self.assertEqual(self.registry.render(), "\n".join([
+            "# HELP dbmake_connect_failures Number of failed attempts to connect a database during the run",
+            "# TYPE dbmake_connect_failures gauge",
+            'dbmake_connect_failures{connection="say \\"hi\\"\\n"} 1',
+            "# HELP dbmake_database_revision Current migration revision of a database",
+            "# TYPE dbmake_database_revision gauge",
+            'dbmake_database_revision{connection="db_1"} 1430991341',
+            "# HELP dbmake_pending_migrations Number of migrations above a database's current revision",
+            "# TYPE dbmake_pending_migrations gauge",
+            'dbmake_pending_migrations{connection="db_1"} 2',
+        ]) + "\n")
+
+    def test_write_replaces_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "dbmake.prom")
+            with open(path, 'w') as f:
+                f.write("stale")
+
+            metrics.finish_run("status", 0, 1.5)
+            self.registry.write(path)
+
+            with open(path, 'r') as f:
+                self.assertIn('dbmake_run_success{command="status"} 1', f.read())
+            self.assertEqual(os.listdir(directory), ["dbmake.prom"])
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestConnectFailures(TestCase):
+
+    def setUp(self):
+        self.registry = metrics.MetricsRegistry()
+        metrics.activate(self.registry)
+
+        self.migrations_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.migrations_dir, DBMAKE_CONFIG_DIR))
+        with open(os.path.join(self.migrations_dir, ZERO_MIGRATION_FILE_NAME), 'w') as f:
+            f.write("SELECT 1;\n-- DBMAKE: SEPARATOR\nSELECT 1;")
+        for connection_name in ("db_1", "db_2"):
+            database.DbConnectionConfig("localhost", connection_name, "postgres", "", connection_name).save(
+                os.path.join(self.migrations_dir, DBMAKE_CONFIG_DIR, DBMAKE_CONFIG_FILE)
+            )
+
+    def tearDown(self):
+        metrics.activate(None)
+        shutil.rmtree(self.migrations_dir)
+
+    @mock.patch("dbmake.database.DbAdapterFactory.create", side_effect=psycopg2.OperationalError("refused"))
+    def test_commands_count_every_failed_database(self, create):
+        for command in (commands.Migrate, commands.Rollback):
+            with mock.patch("builtins.print"):
+                command(["-m", self.migrations_dir]).execute()
+
+        # Both databases are counted by both commands, a failure doesn't stop the fan-out
+        self.assertEqual(self.registry.get("dbmake_connect_failures", connection="db_1"), 2)
+        self.assertEqual(self.registry.get("dbmake_connect_failures", connection="db_2"), 2)
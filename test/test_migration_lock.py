@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+from dbmake import commands
+from dbmake import database
+from dbmake.common import DBMAKE_CONFIG_DIR, DBMAKE_CONFIG_FILE, ZERO_MIGRATION_FILE_NAME, MigrationLockTimeout
+from dbmake.migrations import MigrationLock, MigrationsManager, MigrationVO
+
+
+class TestMigrationLock(TestCase):
+
+    def test_waits_until_lock_is_free(self):
+        migration_lock = MigrationLock(None)
+        listener = mock.Mock()
+
+        with mock.patch.object(migration_lock, "try_acquire", side_effect=[False, False, True]), \
+                mock.patch("dbmake.migrations.time.sleep") as sleep:
+            migration_lock.acquire(60, listener)
+
+        self.assertEqual(sleep.call_count, 2)
+        self.assertEqual(listener.on_message.call_count, 1)
+
+    def test_bounded_wait(self):
+        migration_lock = MigrationLock(None)
+
+        with mock.patch.object(migration_lock, "try_acquire", return_value=False):
+            self.assertRaises(MigrationLockTimeout, migration_lock.acquire, 0)
+
+    def test_lock_queries_dont_commit(self):
+        db_adapter = mock.Mock()
+        db_adapter.get_cursor.return_value.fetchone.return_value = (True,)
+        migration_lock = MigrationLock(db_adapter)
+
+        self.assertTrue(migration_lock.try_acquire())
+        migration_lock.release()
+
+        # Session level locks outlive rollbacks, a commit would count against the run's commit budget
+        db_adapter.commit.assert_not_called()
+        self.assertEqual(db_adapter.rollback.call_count, 3)
+
+
+class TestMigrationLockTimeoutOfCommands(TestCase):
+
+    def setUp(self):
+        self.migrations_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.migrations_dir, DBMAKE_CONFIG_DIR))
+        for file_ in (ZERO_MIGRATION_FILE_NAME, "10_first.sql"):
+            with open(os.path.join(self.migrations_dir, file_), 'w') as f:
+                f.write("SELECT 1;\n-- DBMAKE: SEPARATOR\nSELECT 1;")
+        for connection_name in ("db_1", "db_2"):
+            database.DbConnectionConfig("localhost", connection_name, "postgres", "", connection_name).save(
+                os.path.join(self.migrations_dir, DBMAKE_CONFIG_DIR, DBMAKE_CONFIG_FILE)
+            )
+
+    def tearDown(self):
+        shutil.rmtree(self.migrations_dir)
+
+    @mock.patch("dbmake.database.DbAdapterFactory.create")
+    @mock.patch("dbmake.migrations.MigrationsDao")
+    def test_rollback_reports_lock_timeout(self, migrations_dao_class, create):
+        migration_vo = MigrationVO()
+        migration_vo.revision = 10
+        migrations_dao_class.return_value.is_migration_table_exists.return_value = True
+        migrations_dao_class.return_value.find_most_recent.return_value = migration_vo
+
+        timeout = MigrationLockTimeout("Error! Another dbmake run has been migrating the database for more than 1s")
+        with mock.patch.object(MigrationsManager, "migrate_to_revision", side_effect=timeout) as migrate_to_revision, \
+                mock.patch("builtins.print") as print_:
+            result = commands.Rollback(["-m", self.migrations_dir]).execute()
+
+        self.assertEqual(result, commands.FAILURE)
+        self.assertEqual(migrate_to_revision.call_count, 2)
+        print_.assert_any_call("db_2: %s" % timeout)
@@ -0,0 +1,46 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from dbmake.common import RevisionNotFound
+from dbmake.migrations import MigrationsManager, MigrationDirection
+
+
+class TestMigrationsPlan(TestCase):
+
+    def setUp(self):
+        self.migrations_dir = tempfile.mkdtemp()
+        for file_ in ("0_zero_migration.sql", "10_first.sql", "20_second.sql", "30_third.sql"):
+            with open(os.path.join(self.migrations_dir, file_), 'w') as f:
+                f.write("SELECT 1;\n-- DBMAKE: SEPARATOR\nSELECT 2;")
+
+        self.manager = MigrationsManager(self.migrations_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.migrations_dir)
+
+    def test_plan_up_from_empty_database(self):
+        steps = self.manager.plan(None, 20)
+
+        self.assertEqual([s.revision for s in steps], [0, 10, 20])
+        self.assertTrue(all(s.direction == MigrationDirection.UP for s in steps))
+
+    def test_plan_down(self):
+        steps = self.manager.plan(30, 10)
+
+        # Rolling back a migration takes the database to the previous revision
+        self.assertEqual([s.migration.revision for s in steps], [30, 20])
+        self.assertEqual([s.revision for s in steps], [20, 10])
+        self.assertTrue(all(s.direction == MigrationDirection.DOWN for s in steps))
+
+    def test_plan_current_revision(self):
+        self.assertEqual(self.manager.plan(20, 20), [])
+
+    def test_plan_unknown_revision(self):
+        self.assertRaises(RevisionNotFound, self.manager.plan, 20, 25)
+
+    def test_relative_revision(self):
+        self.assertEqual(self.manager.relative_revision(10, 1), 20)
+        self.assertEqual(self.manager.relative_revision(10, 5), 30)
+        self.assertEqual(self.manager.relative_revision(10, -5), 0)
@@ -0,0 +1,80 @@
+import psycopg2
+
+from dbmake import database
+from dbmake import db_tasks
+from dbmake import migrations
+from dbmake.common import ZERO_MIGRATION_FILE_NAME
+
+from .fixtures import DbTestCase
+
+
+class TestNoTransactionMigrations(DbTestCase):
+
+    def setUp(self):
+        DbTestCase.setUp(self)
+        self.write_migration(ZERO_MIGRATION_FILE_NAME, "SELECT 1;", "SELECT 1;")
+        self.write_migration(
+            "1_t_concurrent_index.sql",
+            "-- DBMAKE: NO TRANSACTION\n"
+            "CREATE TABLE t_events (id int);\n"
+            "CREATE INDEX CONCURRENTLY t_events_id ON t_events (id);",
+            "DROP INDEX CONCURRENTLY t_events_id;\n"
+            "DROP TABLE t_events;"
+        )
+
+        db_tasks.PgDbInit(self.db_config).execute()
+        self.db_adapter = database.DbAdapterFactory.create(self.db_config)
+        self.manager = migrations.MigrationsManager(self.migrations_dir)
+        self.manager.migrate_to_revision(0, self.db_adapter, listener=migrations.MigrationListener())
+
+    def tearDown(self):
+        self.db_adapter.disconnect()
+        DbTestCase.tearDown(self)
+
+    def _fetch_one(self, sql):
+        cursor = self.db_adapter.get_cursor()
+        cursor.execute(sql)
+        result = cursor.fetchone()[0]
+        cursor.close()
+        self.db_adapter.commit()
+        return result
+
+    def test_migrate_up_and_down(self):
+        self.manager.migrate_to_revision(1, self.db_adapter, listener=migrations.MigrationListener())
+
+        self.assertEqual(self._fetch_one("SELECT count(*) FROM pg_indexes WHERE indexname = 't_events_id'"), 1)
+        self.assertEqual(self._fetch_one("SELECT max(revision) FROM _dbmake_migrations"), 1)
+        self.assertEqual(self._fetch_one("SELECT count(*) FROM _dbmake_progress"), 0)
+
+        self.manager.migrate_to_revision(0, self.db_adapter, listener=migrations.MigrationListener())
+
+        self.assertIsNone(self._fetch_one("SELECT to_regclass('t_events')"))
+        self.assertEqual(self._fetch_one("SELECT count(*) FROM _dbmake_progress"), 0)
+
+    def test_resume_failed_concurrent_index(self):
+        self.manager.migrate_to_revision(1, self.db_adapter, listener=migrations.MigrationListener())
+        self.write_migration(
+            "2_t_unique_index.sql",
+            "-- DBMAKE: NO TRANSACTION\n"
+            "CREATE UNIQUE INDEX CONCURRENTLY t_events_id_unique ON t_events (id);\n"
+            "ALTER TABLE t_events ADD CONSTRAINT t_events_id_key UNIQUE USING INDEX t_events_id_unique;",
+            "ALTER TABLE t_events DROP CONSTRAINT t_events_id_key;"
+        )
+        self.db_adapter.execute_string("INSERT INTO t_events VALUES (1), (1)")
+
+        manager = migrations.MigrationsManager(self.migrations_dir)
+        with self.assertRaises(psycopg2.IntegrityError):
+            manager.migrate_to_revision(2, self.db_adapter, listener=migrations.MigrationListener())
+        self.db_adapter.rollback()
+
+        # The failed build leaves an invalid index behind, and no checkpoint as it was the first statement
+        self.assertEqual(self._fetch_one("SELECT count(*) FROM pg_index WHERE NOT indisvalid "
+                                         "AND indexrelid = to_regclass('t_events_id_unique')"), 1)
+        self.assertEqual(self._fetch_one("SELECT count(*) FROM _dbmake_progress"), 0)
+
+        self.db_adapter.execute_string("DELETE FROM t_events")
+        manager.migrate_to_revision(2, self.db_adapter, listener=migrations.MigrationListener())
+
+        self.assertEqual(self._fetch_one("SELECT max(revision) FROM _dbmake_migrations"), 2)
+        self.assertEqual(self._fetch_one("SELECT count(*) FROM pg_constraint WHERE conname = 't_events_id_key'"), 1)
+        self.assertEqual(self._fetch_one("SELECT count(*) FROM _dbmake_progress"), 0)
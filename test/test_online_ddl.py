@@ -0,0 +1,134 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from dbmake import commands
+from dbmake import database
+from dbmake import db_tasks
+from dbmake import migrations
+from dbmake import online_ddl
+from dbmake.common import SUCCESS, ZERO_MIGRATION_FILE_NAME
+from dbmake.migrations import Migration
+
+from .fixtures import DbTestCase
+
+
+class TestRewrite(TestCase):
+
+    def test_create_index(self):
+        self.assertEqual(online_ddl.rewrite("CREATE UNIQUE INDEX users_email ON users (email);"),
+                         ["CREATE UNIQUE INDEX CONCURRENTLY users_email ON users (email);"])
+        self.assertIsNone(online_ddl.rewrite("CREATE INDEX CONCURRENTLY users_email ON users (email);"))
+
+    def test_add_constraint(self):
+        self.assertEqual(
+            online_ddl.rewrite("ALTER TABLE orders ADD CONSTRAINT orders_user FOREIGN KEY (user_id) "
+                               "REFERENCES users (id);"),
+            ["ALTER TABLE orders ADD CONSTRAINT orders_user FOREIGN KEY (user_id) REFERENCES users (id) NOT VALID;",
+             "ALTER TABLE orders VALIDATE CONSTRAINT orders_user;"]
+        )
+        self.assertIsNone(online_ddl.rewrite("ALTER TABLE orders ADD CONSTRAINT positive CHECK (total > 0) NOT VALID;"))
+        self.assertIsNone(online_ddl.rewrite("ALTER TABLE orders ADD CONSTRAINT positive CHECK (total > 0), "
+                                             "ADD COLUMN note text;"))
+
+    def test_set_not_null(self):
+        self.assertEqual(online_ddl.rewrite('ALTER TABLE public.orders ALTER COLUMN "Total" SET NOT NULL;'), [
+            'ALTER TABLE public.orders ADD CONSTRAINT "orders_Total_not_null" CHECK ("Total" IS NOT NULL) NOT VALID;',
+            'ALTER TABLE public.orders VALIDATE CONSTRAINT "orders_Total_not_null";',
+            'ALTER TABLE public.orders ALTER COLUMN "Total" SET NOT NULL;',
+            'ALTER TABLE public.orders DROP CONSTRAINT "orders_Total_not_null";',
+        ])
+
+    def test_other_statements(self):
+        self.assertIsNone(online_ddl.rewrite("ALTER TABLE orders ADD COLUMN note text;"))
+        self.assertIsNone(online_ddl.rewrite("ALTER TABLE orders ALTER COLUMN total DROP NOT NULL;"))
+
+
+class TestTransform(TestCase):
+
+    def setUp(self):
+        self.migrations_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.migrations_dir)
+
+    def migration(self, content):
+        path = os.path.join(self.migrations_dir, "1_a.sql")
+        with open(path, 'w') as f:
+            f.write(content)
+        return Migration(path)
+
+    def test_transform(self):
+        migration = self.migration(
+            "CREATE TABLE events (id int);\n"
+            "CREATE INDEX events_id ON events (id);\n"
+            "CREATE INDEX users_email ON users (email);\n"
+            "UPDATE users SET email = lower(email) WHERE email <> lower(email);\n"
+        )
+        online_migration = online_ddl.transform(migration)
+
+        self.assertIsInstance(online_migration, online_ddl.OnlineMigration)
+        self.assertFalse(online_migration.transactional)
+        self.assertEqual(online_migration.revision, migration.revision)
+        self.assertEqual([statement.line for statement, texts in online_migration.rewrites], [3])
+
+        statements = [sql.decode() for statement, sql in online_migration.statements()]
+        self.assertEqual(statements[1:3], ["CREATE INDEX events_id ON events (id);",
+                                           "CREATE INDEX CONCURRENTLY users_email ON users (email);"])
+        self.assertTrue(any("CONCURRENTLY" in line for line in online_migration.lines()))
+
+    def test_nothing_to_rewrite(self):
+        migration = self.migration("CREATE TABLE events (id int);\nCREATE INDEX events_id ON events (id);\n")
+        self.assertIs(online_ddl.transform(migration), migration)
+
+
+class TestOnlineDdlMigrate(DbTestCase):
+
+    def setUp(self):
+        DbTestCase.setUp(self)
+        self.write_migration(ZERO_MIGRATION_FILE_NAME, "SELECT 1;", "SELECT 1;")
+        self.write_migration("1_t_orders.sql",
+                             "CREATE TABLE t_orders (id int PRIMARY KEY, total int);\n"
+                             "INSERT INTO t_orders SELECT i, i FROM generate_series(1, 100) i;",
+                             "DROP TABLE t_orders;")
+        self.write_migration("2_t_orders_total.sql",
+                             "CREATE INDEX t_orders_total ON t_orders (total);\n"
+                             "ALTER TABLE t_orders ALTER COLUMN total SET NOT NULL;",
+                             "DROP INDEX t_orders_total;\n"
+                             "ALTER TABLE t_orders ALTER COLUMN total DROP NOT NULL;")
+
+        db_tasks.PgDbInit(self.db_config).execute()
+        self.db_adapter = database.DbAdapterFactory.create(self.db_config)
+        migrations.MigrationsManager(self.migrations_dir).migrate_to_revision(
+            0, self.db_adapter, listener=migrations.MigrationListener()
+        )
+
+    def tearDown(self):
+        self.db_adapter.disconnect()
+        DbTestCase.tearDown(self)
+
+    def _fetch_one(self, sql):
+        cursor = self.db_adapter.get_cursor()
+        cursor.execute(sql)
+        result = cursor.fetchone()
+        cursor.close()
+        self.db_adapter.commit()
+        return result
+
+    def test_migrate(self):
+        self.assertEqual(commands.Migrate(["-m", self.migrations_dir, "--online-ddl"]).execute(), SUCCESS)
+
+        self.assertEqual(self._fetch_one("SELECT max(revision) FROM _dbmake_migrations"), (2,))
+        self.assertEqual(self._fetch_one(
+            "SELECT i.indisvalid FROM pg_index i WHERE i.indexrelid = 't_orders_total'::regclass"
+        ), (True,))
+        self.assertEqual(self._fetch_one(
+            "SELECT attnotnull FROM pg_attribute WHERE attrelid = 't_orders'::regclass AND attname = 'total'"
+        ), (True,))
+
+        # The CHECK constraint SET NOT NULL has relied on is dropped again
+        self.assertEqual(self._fetch_one(
+            "SELECT count(*) FROM pg_constraint WHERE conrelid = 't_orders'::regclass AND contype = 'c'"
+        ), (0,))
+        self.assertEqual(self._fetch_one("SELECT count(*) FROM _dbmake_progress"), (0,))
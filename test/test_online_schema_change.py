@@ -0,0 +1,235 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+from dbmake import database
+from dbmake import db_tasks
+from dbmake import migrations
+from dbmake.common import DbmakeException, ZERO_MIGRATION_FILE_NAME
+from dbmake.migrations import MigrationFactory, MigrationProgressVO
+from dbmake.online_schema_change import OnlineSchemaChangeMigration
+
+from .fixtures import DbTestCase
+
+
+class TestOnlineSchemaChangeMigration(TestCase):
+
+    def setUp(self):
+        self.migrations_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.migrations_dir)
+
+    def migration_file(self, content):
+        path = os.path.join(self.migrations_dir, "7_orders_bigint.sql")
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_directives(self):
+        migration = MigrationFactory.create(self.migration_file(
+            "-- DBMAKE: ONLINE SCHEMA CHANGE\n"
+            "-- DBMAKE: TABLE sales.orders\n"
+            "-- DBMAKE: KEY id\n"
+            "-- DBMAKE: CHANGE ALTER COLUMN id TYPE bigint;\n"
+            "-- DBMAKE: CHANGE ALTER COLUMN user_id TYPE bigint\n"
+            "-- DBMAKE: BATCH SIZE 500\n"
+            "-- DBMAKE: LOCK TIMEOUT 0.5\n"
+            "GRANT SELECT ON sales.orders TO reporting;\n"
+            "-- DBMAKE: SEPARATOR\n"
+            "-- DBMAKE: MIGRATE DOWN\n"
+        ))
+
+        self.assertIsInstance(migration, OnlineSchemaChangeMigration)
+        self.assertEqual(migration.table, "sales.orders")
+        self.assertEqual(migration.changes, ["ALTER COLUMN id TYPE bigint", "ALTER COLUMN user_id TYPE bigint"])
+        self.assertEqual((migration.batch_size, migration.lock_timeout), (500, 0.5))
+        self.assertFalse(migration.keep_old_table)
+        self.assertFalse(migration.rehearsable)
+        self.assertEqual(migration.relations(), ["sales.orders"])
+
+    def test_missing_directives(self):
+        with self.assertRaises(DbmakeException):
+            OnlineSchemaChangeMigration(self.migration_file(
+                "-- DBMAKE: ONLINE SCHEMA CHANGE\n-- DBMAKE: TABLE orders\n-- DBMAKE: KEY id\n"
+            ))
+
+    def test_resumes_cleanup(self):
+        migration = OnlineSchemaChangeMigration(self.migration_file(
+            "-- DBMAKE: ONLINE SCHEMA CHANGE\n-- DBMAKE: TABLE orders\n-- DBMAKE: KEY id\n"
+            "-- DBMAKE: CHANGE ALTER COLUMN id TYPE bigint\n"
+        ))
+
+        progress_vo = MigrationProgressVO()
+        progress_vo.checkpoint = json.dumps({"phase": migration.PHASE_CLEANUP})
+        progress_vo.rows_done = 100
+
+        db_adapter = mock.Mock()
+        cursor = db_adapter.get_cursor.return_value
+        cursor.fetchone.return_value = ("public", "orders")
+
+        with mock.patch("dbmake.online_schema_change.MigrationProgressDao") as progress_dao_class:
+            progress_dao = progress_dao_class.return_value
+            progress_dao.find.return_value = progress_vo
+
+            self.assertTrue(migration.migrate(db_adapter, mock.Mock()))
+
+        executed = [call[0][0] for call in cursor.execute.call_args_list]
+        self.assertEqual(executed[1:], [
+            'DROP TABLE IF EXISTS "public"."_dbmake_7_old"',
+            'DROP TABLE IF EXISTS "public"."_dbmake_7_log"',
+        ])
+        progress_dao.delete.assert_called_once_with(7, migration.PROGRESS_TASK)
+
+    def test_catch_up_counts_log_records(self):
+        migration = OnlineSchemaChangeMigration(self.migration_file(
+            "-- DBMAKE: ONLINE SCHEMA CHANGE\n-- DBMAKE: TABLE orders\n-- DBMAKE: KEY id\n"
+            "-- DBMAKE: CHANGE ALTER COLUMN id TYPE bigint\n-- DBMAKE: BATCH SIZE 3\n"
+        ))
+        migration._schema, migration._table_name = "public", "orders"
+
+        progress_vo = MigrationProgressVO()
+        progress_vo.checkpoint = {"phase": migration.PHASE_CATCH_UP}
+        progress_vo.rows_done = 0
+
+        db_adapter = mock.Mock()
+        cursor = db_adapter.get_cursor.return_value
+        # Copied columns, then two chunks of the change log, the first one of a single hot row
+        cursor.fetchall.side_effect = [[("id",), ("total",)], [(1,), (1,), (1,)], [(2,)]]
+
+        with mock.patch("dbmake.online_schema_change.MigrationProgressDao"):
+            migration._catch_up(db_adapter, mock.Mock(), progress_vo)
+
+        log_reads = [call for call in cursor.execute.call_args_list if call[0][0].startswith("DELETE FROM")
+                     and "_dbmake_7_log" in call[0][0]]
+        self.assertEqual(len(log_reads), 2)
+        self.assertEqual(progress_vo.rows_done, 4)
+
+    def test_rejects_non_integer_key(self):
+        migration = OnlineSchemaChangeMigration(self.migration_file(
+            "-- DBMAKE: ONLINE SCHEMA CHANGE\n-- DBMAKE: TABLE orders\n-- DBMAKE: KEY code\n"
+            "-- DBMAKE: CHANGE ALTER COLUMN total TYPE numeric\n"
+        ))
+        migration._schema, migration._table_name = "public", "orders"
+
+        cursor = mock.Mock()
+        cursor.fetchall.return_value = []
+        cursor.fetchone.return_value = ("text",)
+
+        with self.assertRaises(DbmakeException):
+            migration._set_up(mock.Mock(), cursor, MigrationProgressVO())
+
+        self.assertFalse(any("CREATE TABLE" in call[0][0] for call in cursor.execute.call_args_list))
+
+
+class _ConcurrentWritesAdapter(object):
+    """
+    Passes everything to a database adapter and, right after each of its commits, writes to t_orders
+    through another connection, applying the same writes to t_orders_copy
+    """
+
+    def __init__(self, db_adapter, writer):
+        self._db_adapter = db_adapter
+        self._writer = writer
+        self.writes = 0
+        self.last_id = None
+
+    def __getattr__(self, name):
+        return getattr(self._db_adapter, name)
+
+    def commit(self):
+        self._db_adapter.commit()
+        self.writes += 1
+
+        cursor = self._writer.get_cursor()
+        cursor.execute("INSERT INTO t_orders (total, note) VALUES (%s, 'new') RETURNING id", (self.writes,))
+        self.last_id = cursor.fetchone()[0]
+        cursor.execute("INSERT INTO t_orders_copy (id, total, note) VALUES (%s, %s, 'new')",
+                       (self.last_id, self.writes))
+        for table in ("t_orders", "t_orders_copy"):
+            cursor.execute("UPDATE %s SET total = total + 1000, note = 'updated' WHERE id = %%s" % table,
+                           (self.writes * 7,))
+            cursor.execute("DELETE FROM %s WHERE id = %%s" % table, (self.writes * 13,))
+        cursor.close()
+        self._writer.commit()
+
+
+class TestOnlineSchemaChangeMigrate(DbTestCase):
+
+    def setUp(self):
+        DbTestCase.setUp(self)
+        self.write_migration(ZERO_MIGRATION_FILE_NAME, "SELECT 1;", "SELECT 1;")
+        self.write_migration("1_t_orders.sql",
+                             "CREATE TABLE t_orders (id serial PRIMARY KEY, total int NOT NULL, note text);\n"
+                             "INSERT INTO t_orders (total, note) SELECT i, 'row ' || i "
+                             "FROM generate_series(1, 1000) i;\n"
+                             "CREATE TABLE t_orders_copy AS SELECT * FROM t_orders;",
+                             "DROP TABLE t_orders_copy;\nDROP TABLE t_orders;")
+        self.write_migration("2_t_orders_bigint.sql",
+                             "-- DBMAKE: ONLINE SCHEMA CHANGE\n"
+                             "-- DBMAKE: TABLE t_orders\n"
+                             "-- DBMAKE: KEY id\n"
+                             "-- DBMAKE: CHANGE ALTER COLUMN id TYPE bigint\n"
+                             "-- DBMAKE: BATCH SIZE 100")
+
+        db_tasks.PgDbInit(self.db_config).execute()
+        self.db_adapter = database.DbAdapterFactory.create(self.db_config)
+        self.writer = database.PgAdapter(self.db_config)
+        self.manager = migrations.MigrationsManager(self.migrations_dir)
+        self.manager.migrate_to_revision(1, self.db_adapter, listener=migrations.MigrationListener())
+
+    def tearDown(self):
+        self.writer.disconnect()
+        self.db_adapter.disconnect()
+        DbTestCase.tearDown(self)
+
+    def _fetch_all(self, sql):
+        cursor = self.db_adapter.get_cursor()
+        cursor.execute(sql)
+        result = cursor.fetchall()
+        cursor.close()
+        self.db_adapter.commit()
+        return result
+
+    def test_interrupted_change_with_concurrent_writes(self):
+        adapter = _ConcurrentWritesAdapter(self.db_adapter, self.writer)
+        save = OnlineSchemaChangeMigration._save
+
+        def interrupting_save(migration, db_adapter, progress_vo):
+            save(migration, db_adapter, progress_vo)
+            # Killed before the third chunk of the copy is committed
+            if progress_vo.checkpoint["phase"] == migration.PHASE_COPY and progress_vo.checkpoint["key"] >= 300:
+                raise RuntimeError("Interrupted")
+
+        with mock.patch.object(OnlineSchemaChangeMigration, "_save", interrupting_save):
+            with self.assertRaises(RuntimeError):
+                self.manager.migrate_to_revision(2, adapter, listener=migrations.MigrationListener())
+        self.db_adapter.rollback()
+
+        checkpoint = json.loads(self._fetch_all("SELECT checkpoint FROM _dbmake_progress")[0][0])
+        self.assertEqual((checkpoint["phase"], checkpoint["key"]), (OnlineSchemaChangeMigration.PHASE_COPY, 200))
+
+        self.manager.migrate_to_revision(2, adapter, listener=migrations.MigrationListener())
+
+        self.assertEqual(self._fetch_all("SELECT max(revision) FROM _dbmake_migrations"), [(2,)])
+        self.assertEqual(self._fetch_all(
+            "SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+            "WHERE attrelid = 't_orders'::regclass AND attname = 'id'"
+        ), [("bigint",)])
+
+        # Writes of the copy and the catch-up, and those after the swap, are all in the changed table
+        self.assertGreater(adapter.writes, 10)
+        self.assertEqual(self._fetch_all("SELECT id, total, note FROM t_orders ORDER BY id"),
+                         self._fetch_all("SELECT id, total, note FROM t_orders_copy ORDER BY id"))
+
+        # The serial column's sequence has moved to the new table and carries on numbering
+        self.assertEqual(self._fetch_all("SELECT pg_get_serial_sequence('t_orders', 'id')"),
+                         [("public.t_orders_id_seq",)])
+        self.assertEqual(self._fetch_all("SELECT last_value FROM t_orders_id_seq"), [(adapter.last_id,)])
+
+        self.assertEqual(self._fetch_all(
+            "SELECT to_regclass('_dbmake_2_old'), to_regclass('_dbmake_2_log'), to_regclass('_dbmake_2_shadow')"
+        ), [(None, None, None)])
+        self.assertEqual(self._fetch_all("SELECT count(*) FROM _dbmake_progress"), [(0,)])
@@ -0,0 +1,37 @@
+from unittest import TestCase
+
+from dbmake.progress import ProgressEstimator, ProgressSample, format_sample
+
+
+def sample(phase, done, total=1000):
+    return ProgressSample({
+        "command": "CREATE INDEX",
+        "phase": phase,
+        "relation": "orders",
+        "done": done,
+        "total": total,
+        "unit": "blocks",
+        "tuples": None,
+    })
+
+
+class TestProgressEstimator(TestCase):
+
+    def test_eta_from_rate_within_phase(self):
+        estimator = ProgressEstimator()
+
+        self.assertIsNone(estimator.eta(sample("building index: scanning table", 100), 0))
+        self.assertEqual(estimator.eta(sample("building index: scanning table", 300), 10), 35.0)
+
+    def test_phase_change_restarts_estimate(self):
+        estimator = ProgressEstimator()
+        estimator.eta(sample("building index: scanning table", 100), 0)
+
+        self.assertIsNone(estimator.eta(sample("building index: loading tuples in tree", 10), 10))
+        self.assertEqual(estimator.eta(sample("building index: loading tuples in tree", 110), 20), 89.0)
+
+    def test_format_sample(self):
+        self.assertEqual(
+            format_sample(sample("building index: scanning table", 250), 200),
+            "CREATE INDEX on orders: building index: scanning table, 250/1000 blocks (25.0%), ETA 0:03:20"
+        )
@@ -0,0 +1,48 @@
+from dbmake import commands
+from dbmake import database
+from dbmake import db_tasks
+from dbmake import migrations
+from dbmake.common import ZERO_MIGRATION_FILE_NAME
+
+from .fixtures import DbTestCase
+
+
+class TestQueryBudgets(DbTestCase):
+
+    def setUp(self):
+        DbTestCase.setUp(self)
+        self.write_migration(ZERO_MIGRATION_FILE_NAME, "SELECT 1;", "SELECT 1;")
+        for revision in range(1, 11):
+            self.write_migration("%s_t_%s.sql" % (revision, revision),
+                                 "CREATE TABLE t_%s (id int PRIMARY KEY);" % revision,
+                                 "DROP TABLE t_%s;" % revision)
+
+        db_tasks.PgDbInit(self.db_config).execute()
+        db_adapter = database.DbAdapterFactory.create(self.db_config)
+        migrations.MigrationsManager(self.migrations_dir).migrate_to_revision(
+            0, db_adapter, listener=migrations.MigrationListener()
+        )
+        db_adapter.disconnect()
+
+    def test_migrate_commits_per_migration(self):
+        self.stats.reset()
+        commands.Migrate(['-m', self.migrations_dir]).execute()
+
+        # A migration's statements and its history record are committed once each
+        self.assertQueryBudget(commits=1 + 2 * 10, connections=1)
+
+    def test_status_queries_per_database(self):
+        commands.Migrate(['-m', self.migrations_dir]).execute()
+
+        self.stats.reset()
+        commands.Status(['-m', self.migrations_dir]).execute()
+
+        self.assertQueryBudget(round_trips=1, connections=1)
+
+    def test_doc_generate_queries_dont_grow_with_tables(self):
+        commands.Migrate(['-m', self.migrations_dir]).execute()
+
+        self.stats.reset()
+        db_tasks.PgDbDocGenerate(self.db_config)._db_schema(self.db_config.dbname, 10)
+
+        self.assertQueryBudget(round_trips=2)
@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+from dbmake import api, rollout
+from dbmake.database import DbConnectionConfig
+
+
+def target_result(name, error=None):
+    result = api.TargetResult(name)
+    result.from_revision = 1
+    result.to_revision = 1 if error else 2
+    result.duration = 0.1
+    result.error = error
+    return result
+
+
+class TestRollout(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.state_file = os.path.join(self.directory, "rollout.json")
+        self.names = ["db%s" % i for i in range(1, 8)]
+        self.configs = [DbConnectionConfig("localhost", name, "user", "", name) for name in self.names]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_plan_waves(self):
+        self.assertEqual(rollout.plan_waves(self.names, "1", "3"),
+                         [["db1"], ["db2", "db3", "db4"], ["db5", "db6", "db7"]])
+        self.assertEqual(rollout.plan_waves(self.names, ["db3"], "50%"),
+                         [["db3"], ["db1", "db2", "db4", "db5"], ["db6", "db7"]])
+        self.assertEqual(rollout.plan_waves(self.names, "0", "100%"), [self.names])
+
+    def _rollout(self, state, max_failures="0"):
+        manager = mock.Mock()
+        manager.load.return_value = manager
+        return rollout.Rollout(manager, self.configs, state, self.state_file, max_failures=max_failures)
+
+    def test_stops_over_failure_budget_and_continues(self):
+        state = rollout.RolloutState(2, rollout.plan_waves(self.names, "1", "3"), has_canary=True)
+
+        def migrate(configs, manager, **kwargs):
+            return [target_result(c.connection_name, Exception("boom") if c.connection_name in failing else None)
+                    for c in configs]
+
+        failing = ["db2", "db3"]
+        with mock.patch.object(rollout.api, "migrate", side_effect=migrate):
+            state = self._rollout(state, max_failures="1").run()
+
+        self.assertEqual(state.status, rollout.RolloutState.ABORTED)
+        self.assertEqual(state.next_wave, 1)
+
+        failing = []
+        with mock.patch.object(rollout.api, "migrate", side_effect=migrate) as migrate_mock:
+            state = self._rollout(rollout.RolloutState.load(self.state_file)).run()
+
+        self.assertEqual(state.status, rollout.RolloutState.FINISHED)
+        self.assertEqual(state.failed, [])
+        self.assertEqual(migrate_mock.call_count, 2)
+
+    def test_failed_canary_stops(self):
+        state = rollout.RolloutState(2, rollout.plan_waves(self.names, "1", "3"), has_canary=True)
+
+        with mock.patch.object(rollout.api, "migrate", return_value=[target_result("db1", Exception("boom"))]):
+            state = self._rollout(state, max_failures="50%").run()
+
+        self.assertEqual(state.status, rollout.RolloutState.ABORTED)
+        self.assertEqual(state.next_wave, 0)
@@ -0,0 +1,35 @@
+from unittest import TestCase
+
+from dbmake import scheduling
+from dbmake.scheduling import CostEstimate
+
+
+class TestScheduling(TestCase):
+
+    def test_pending_count(self):
+        revisions = [0, 10, 20, 30]
+
+        self.assertEqual(scheduling.pending_count(10, 30, revisions), 2)
+        self.assertEqual(scheduling.pending_count(30, 10, revisions), 2)
+        self.assertEqual(scheduling.pending_count(None, 20, revisions), 3)
+
+    def test_estimate_falls_back_to_fleet_rate(self):
+        estimates = [
+            CostEstimate("small", size=1000, past_duration=1.0),
+            CostEstimate("huge", size=2000000),
+            CostEstimate("fresh", size=10),
+        ]
+        for estimate in estimates:
+            estimate.pending = 2
+
+        scheduling.estimate(estimates)
+
+        self.assertEqual([estimate.cost for estimate in estimates], [2.0, 4000.0, 0.02])
+
+    def test_lpt_shortens_makespan(self):
+        costs = [1, 1, 1, 1, 1, 1, 6]
+        ordered = scheduling.lpt_order(costs, costs)
+
+        self.assertEqual(ordered[0], 6)
+        self.assertEqual(scheduling.makespan(costs, 2), 9)
+        self.assertEqual(scheduling.makespan(ordered, 2), 6)
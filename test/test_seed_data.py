@@ -0,0 +1,145 @@
+import gzip
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+from dbmake import database
+from dbmake.migrations import Migration
+from dbmake.helper import quote_qualified_name
+from dbmake.seed_data import SeedDataFile
+
+from .fixtures import DbTestCase
+
+
+class TestSeedDataFiles(TestCase):
+
+    def setUp(self):
+        self.migrations_dir = tempfile.mkdtemp()
+        self.migration_file = os.path.join(self.migrations_dir, "1430991341_billing.sql")
+        with open(self.migration_file, 'w') as f:
+            f.write("CREATE TABLE billing_plans (id int PRIMARY KEY, name text);")
+
+    def tearDown(self):
+        shutil.rmtree(self.migrations_dir)
+
+    def test_no_seed_data_dir(self):
+        self.assertEqual(Migration(self.migration_file).seed_data_files(), [])
+
+    def test_list_seed_data_files(self):
+        seed_data_dir = os.path.join(self.migrations_dir, "1430991341_billing.data")
+        os.mkdir(seed_data_dir)
+        for file_ in ("public.currencies.csv.gz", "billing_plans.csv", "README", "notes.csv~"):
+            open(os.path.join(seed_data_dir, file_), 'w').close()
+
+        seed_data_files = Migration(self.migration_file).seed_data_files()
+
+        self.assertEqual([s.table for s in seed_data_files], ["billing_plans", "public.currencies"])
+        self.assertEqual([s.gzipped for s in seed_data_files], [False, True])
+
+    def test_quote_qualified_name(self):
+        self.assertEqual(quote_qualified_name('public.my"table'), '"public"."my""table"')
+
+
+class TestSeedDataFile(TestCase):
+
+    def setUp(self):
+        self.seed_data_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.seed_data_dir)
+
+    def seed_data_file(self, name, content):
+        path = os.path.join(self.seed_data_dir, name)
+        with (gzip.open(path, 'wb') if name.endswith(".gz") else open(path, 'wb')) as f:
+            f.write(content)
+        return SeedDataFile(path)
+
+    def copied(self, cursor):
+        """
+        :return: (COPY statements, the data each one has read) of the cursor's copy_expert() calls
+        """
+        copies = []
+        cursor.copy_expert.side_effect = lambda sql, f: copies.append((sql, f.read()))
+        return copies
+
+    def test_load(self):
+        seed_data_file = self.seed_data_file("public.currencies.csv.gz", b"code, name\nEUR,Euro\nUSD,US dollar\n")
+        cursor = mock.Mock()
+        copies = self.copied(cursor)
+
+        seed_data_file.load(cursor)
+
+        # The header names the columns and isn't loaded
+        self.assertEqual(copies, [(
+            'COPY "public"."currencies" ("code", "name") FROM STDIN WITH (FORMAT csv, ENCODING \'utf-8\')',
+            b"EUR,Euro\nUSD,US dollar\n"
+        )])
+
+    def test_unload_by_primary_key(self):
+        seed_data_file = self.seed_data_file("billing_plans.csv", b"id,name\n1,Basic\n")
+        cursor = mock.Mock()
+        copies = self.copied(cursor)
+        cursor.fetchall.return_value = [("id",)]
+
+        seed_data_file.unload(cursor)
+
+        self.assertEqual(copies[0][1], b"1,Basic\n")
+        executed = [call[0][0] for call in cursor.execute.call_args_list]
+        self.assertEqual(executed[-2],
+                         'DELETE FROM "billing_plans" t USING "_dbmake_seed_data" s WHERE t."id" = s."id"')
+        self.assertEqual(executed[-1], 'DROP TABLE "_dbmake_seed_data"')
+
+    def test_unload_by_all_columns(self):
+        seed_data_file = self.seed_data_file("settings.csv", b"name,value\nlimits,\"{\"\"max\"\": 1}\"\n")
+        cursor = mock.Mock()
+        self.copied(cursor)
+        # No primary key, then the columns that have no equality operator
+        cursor.fetchall.side_effect = [[], [("value",)]]
+
+        seed_data_file.unload(cursor)
+
+        executed = [call[0][0] for call in cursor.execute.call_args_list]
+        self.assertEqual(executed[-2], 'DELETE FROM "settings" t USING "_dbmake_seed_data" s WHERE '
+                                       't."name" IS NOT DISTINCT FROM s."name" '
+                                       'AND t."value"::text IS NOT DISTINCT FROM s."value"::text')
+
+
+class TestSeedDataFileOnDatabase(DbTestCase):
+
+    def setUp(self):
+        DbTestCase.setUp(self)
+        self.db_adapter = database.PgAdapter(self.db_config)
+        self.db_adapter.execute_string("CREATE TABLE t_settings (name text, value json)")
+        self.db_adapter.execute_string("INSERT INTO t_settings VALUES ('other', '{}')")
+
+        path = os.path.join(self.migrations_dir, "t_settings.csv")
+        with open(path, 'w') as f:
+            f.write('name,value\nlimits,"{""max"": 1}"\nempty,\n')
+        self.seed_data_file = SeedDataFile(path)
+
+    def tearDown(self):
+        self.db_adapter.disconnect()
+        DbTestCase.tearDown(self)
+
+    def _fetch_all(self, sql):
+        cursor = self.db_adapter.get_cursor()
+        cursor.execute(sql)
+        result = cursor.fetchall()
+        cursor.close()
+        self.db_adapter.commit()
+        return result
+
+    def test_load_and_unload_json(self):
+        cursor = self.db_adapter.get_cursor()
+        self.seed_data_file.load(cursor)
+        self.db_adapter.commit()
+
+        self.assertEqual(self._fetch_all("SELECT count(*) FROM t_settings"), [(3,)])
+
+        # json has no equality operator, the table has no primary key
+        self.seed_data_file.unload(cursor)
+        self.db_adapter.commit()
+        cursor.close()
+
+        self.assertEqual(self._fetch_all("SELECT name FROM t_settings"), [("other",)])
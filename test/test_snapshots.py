@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from dbmake import snapshots
+from dbmake.migrations import MigrationsManager
+
+
+class TestSnapshotCache(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _snapshot(self, cache, revision, size, last_used=None):
+        with open(cache.path(revision), 'wb') as f:
+            f.write(b"x" * size)
+        evicted = cache.add(revision, "fingerprint-%s" % revision)
+        if last_used is not None:
+            cache._entries[str(revision)]["last_used"] = last_used
+        return evicted
+
+    def test_get_checks_fingerprint(self):
+        cache = snapshots.SnapshotCache(self.directory)
+        self._snapshot(cache, 3, 10)
+
+        self.assertEqual(cache.get(3, "fingerprint-3"), cache.path(3))
+        self.assertIsNone(cache.get(4, "fingerprint-4"))
+
+        # A snapshot of edited migration files is dropped
+        self.assertIsNone(cache.get(3, "edited"))
+        self.assertFalse(os.path.exists(cache.path(3)))
+        self.assertEqual(cache.revisions(), [])
+
+    def test_evicts_least_recently_used(self):
+        cache = snapshots.SnapshotCache(self.directory, max_size=25)
+        self._snapshot(cache, 1, 10, last_used=1)
+        self._snapshot(cache, 2, 10, last_used=3)
+        self.assertEqual(self._snapshot(cache, 3, 10, last_used=2), [1])
+        self.assertEqual(cache.revisions(), [2, 3])
+        self.assertFalse(os.path.exists(cache.path(1)))
+
+        cache.get(3, "fingerprint-3")
+        self.assertEqual(self._snapshot(cache, 4, 10), [2])
+        self.assertEqual(cache.size, 20)
+
+    def test_index_is_persisted(self):
+        cache = snapshots.SnapshotCache(self.directory)
+        self._snapshot(cache, 5, 10)
+
+        self.assertEqual(snapshots.SnapshotCache(self.directory).get(5, "fingerprint-5"), cache.path(5))
+
+
+class TestFingerprints(TestCase):
+
+    def setUp(self):
+        self.migrations_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.migrations_dir, ".dbmake"))
+        for name, content in (("0_initial_migration.sql", "CREATE TABLE a (id int);"),
+                              ("1_b.sql", "CREATE TABLE b (id int);"),
+                              ("2_c.sql", "CREATE TABLE c (id int);")):
+            with open(os.path.join(self.migrations_dir, name), 'w') as f:
+                f.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.migrations_dir)
+
+    def test_fingerprint_covers_earlier_migrations(self):
+        manager = MigrationsManager(self.migrations_dir)
+        before = snapshots.fingerprints(manager, self.migrations_dir)
+
+        with open(os.path.join(self.migrations_dir, "1_b.sql"), 'w') as f:
+            f.write("CREATE TABLE b (id bigint);")
+        os.utime(os.path.join(self.migrations_dir, "1_b.sql"), (1, 1))
+        after = snapshots.fingerprints(manager, self.migrations_dir)
+
+        self.assertEqual(before[0], after[0])
+        self.assertNotEqual(before[1], after[1])
+        self.assertNotEqual(before[2], after[2])
@@ -0,0 +1,85 @@
+from unittest import TestCase
+
+from dbmake.common import SqlSyntaxError
+from dbmake.sql_lexer import SqlStatementSplitter, SqlStatementType, BufferReader
+
+
+def split(script):
+    return list(SqlStatementSplitter(script))
+
+
+class TestSqlStatementSplitter(TestCase):
+
+    def test_split_statements(self):
+        statements = split(b"CREATE TABLE a (id int);\n\nDROP TABLE b;\nSELECT 1")
+
+        self.assertEqual(
+            [s.sql for s in statements],
+            [b"CREATE TABLE a (id int);", b"DROP TABLE b;", b"SELECT 1"]
+        )
+
+    def test_skip_empty_statements_and_comments(self):
+        statements = split(b"-- comment\n;\n/* a; b */;\nSELECT 1;\n-- trailing comment\n")
+
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(statements[0].sql, b"SELECT 1;")
+
+    def test_semicolons_in_quotes_and_comments(self):
+        script = (
+            b"INSERT INTO t VALUES ('a;b', 'it''s;');\n"
+            b"SELECT \"weird;name\" FROM t; -- a;b\n"
+            b"SELECT E'\\';still a string';\n"
+            b"/* outer /* nested; */ still; comment */ SELECT 2;"
+        )
+        statements = split(script)
+
+        self.assertEqual(len(statements), 4)
+        self.assertTrue(statements[2].sql.endswith(b"SELECT E'\\';still a string';"))
+        self.assertTrue(statements[3].sql.endswith(b"SELECT 2;"))
+
+    def test_dollar_quotes(self):
+        script = (
+            b"CREATE FUNCTION f() RETURNS int AS $body$\n"
+            b"BEGIN\n  PERFORM 1; RETURN $$x;$$;\nEND;\n$body$ LANGUAGE plpgsql;\n"
+            b"SELECT $1;"
+        )
+        statements = split(script)
+
+        self.assertEqual(len(statements), 2)
+        self.assertTrue(statements[0].sql.endswith(b"LANGUAGE plpgsql;"))
+
+    def test_separator(self):
+        script = (
+            b"-- DBMAKE: MIGRATE UP\nCREATE TABLE a (id int)\n"
+            b"SELECT '-- DBMAKE: SEPARATOR';\n"
+            b"-- DBMAKE: SEPARATOR\n"
+            b"-- DBMAKE: MIGRATE DOWN\nDROP TABLE a;\n"
+        )
+        types = [s.type_ for s in split(script)]
+
+        self.assertEqual(types, [SqlStatementType.STATEMENT, SqlStatementType.SEPARATOR, SqlStatementType.STATEMENT])
+
+    def test_copy_from_stdin(self):
+        script = b"COPY t (a, b) FROM stdin;\n1\tx;y\n2\t'z\n\\.\nSELECT 1;\n"
+        statements = split(script)
+
+        self.assertEqual([s.type_ for s in statements], [SqlStatementType.COPY, SqlStatementType.STATEMENT])
+
+        copy_ = statements[0]
+        reader = BufferReader(script, copy_.copy_data_start, copy_.copy_data_end)
+        self.assertEqual(reader.readline(), b"1\tx;y\n")
+        self.assertEqual(reader.read(), b"2\t'z\n")
+        self.assertEqual(reader.read(8192), b"")
+
+    def test_unterminated_constructs(self):
+        for script in (b"SELECT 'a;", b"SELECT $$a;", b"/* /* */ SELECT 1;", b"COPY t FROM STDIN;\n1\n"):
+            self.assertRaises(SqlSyntaxError, split, script)
+
+    def test_includes(self):
+        statements = split(b"SELECT 1;\n\\ir common/a.sql\n\\i  b.sql  \nSELECT 2;")
+
+        self.assertEqual([s.type_ for s in statements], [SqlStatementType.STATEMENT, SqlStatementType.INCLUDE,
+                                                         SqlStatementType.INCLUDE, SqlStatementType.STATEMENT])
+        self.assertEqual([(s.sql, s.relative) for s in statements[1:3]], [(b"common/a.sql", True), (b"b.sql", False)])
+        self.assertRaises(SqlSyntaxError, split, b"SELECT 1\n\\i a.sql\n;")
+        self.assertRaises(SqlSyntaxError, split, b"\\set x 1\n")
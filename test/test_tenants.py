@@ -0,0 +1,175 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+from dbmake import database
+from dbmake import migrations
+from dbmake import tenants
+from dbmake.common import ZERO_MIGRATION_FILE_NAME
+
+from .fixtures import DbTestCase
+
+
+class TestTenants(TestCase):
+
+    def test_like_pattern(self):
+        self.assertEqual(tenants.like_pattern("tenant_*"), "tenant\\_%")
+        self.assertEqual(tenants.like_pattern("shop?"), "shop_")
+        self.assertEqual(tenants.like_pattern("100%"), "100\\%")
+
+    def test_tenant_lock_key_is_a_bigint(self):
+        key = tenants.tenant_lock_key("tenant_0001")
+
+        self.assertTrue(0 < key < 2 ** 63)
+        self.assertNotEqual(key, tenants.tenant_lock_key("tenant_0002"))
+
+    def test_read_heads_in_batches(self):
+        cursor = mock.Mock()
+        cursor.fetchall.side_effect = [
+            [("t1",), ("t2",), ("t3",)],
+            [("t1", 10), ("t2", 20)],
+            [],
+        ]
+        db_adapter = mock.Mock()
+        db_adapter.get_cursor.return_value = cursor
+
+        heads = tenants.read_heads(db_adapter, ["t1", "t2", "t3", "t4"], batch_size=2)
+
+        self.assertEqual(heads, {"t1": 10, "t2": 20, "t3": None})
+        self.assertEqual(cursor.execute.call_count, 3)
+        self.assertEqual(cursor.execute.call_args[0][1], ["t3"])
+
+
+class TestTenantMigrator(TestCase):
+
+    def setUp(self):
+        self.migrations_dir = tempfile.mkdtemp()
+        for file_ in (ZERO_MIGRATION_FILE_NAME, "10_first.sql", "20_second.sql"):
+            with open(os.path.join(self.migrations_dir, file_), 'w') as f:
+                f.write("SELECT 1;\n-- DBMAKE: SEPARATOR\nSELECT 2;")
+
+    def tearDown(self):
+        shutil.rmtree(self.migrations_dir)
+
+    @staticmethod
+    def head(revision):
+        migration_vo = migrations.MigrationVO()
+        migration_vo.revision = revision
+        return migration_vo
+
+    def test_migrate(self):
+        daos = dict((schema, mock.Mock()) for schema in ("t_1", "t_2", "t_3", "t_4"))
+        daos["t_1"].find_most_recent.return_value = self.head(10)
+        daos["t_2"].find_most_recent.side_effect = RuntimeError("connection lost")
+        daos["t_4"].find_most_recent.return_value = self.head(0)
+        daos["t_4"].table = '"t_4"._dbmake_migrations'
+
+        adapters = []
+
+        def create(db_connection_config):
+            adapters.append(mock.Mock())
+            return adapters[-1]
+
+        def try_acquire(migration_lock):
+            return migration_lock._key != tenants.tenant_lock_key("t_3")
+
+        with mock.patch("dbmake.database.DbAdapterFactory.create", side_effect=create), \
+                mock.patch("dbmake.migrations.MigrationsDao", side_effect=lambda db_adapter, schema: daos[schema]), \
+                mock.patch.object(migrations.MigrationLock, "try_acquire", autospec=True, side_effect=try_acquire), \
+                mock.patch.object(migrations.MigrationLock, "release", autospec=True) as release, \
+                mock.patch.object(tenants, "discover", return_value=sorted(daos)), \
+                mock.patch.object(tenants, "read_heads", return_value={"t_1": 10, "t_2": 10, "t_3": 10}), \
+                mock.patch.object(tenants.scheduling, "schema_sizes", return_value={}):
+            db_connection_config = database.DbConnectionConfig("localhost", "shop", "postgres", "", "shop")
+            migrator = tenants.TenantMigrator(db_connection_config, migrations.MigrationsManager(self.migrations_dir),
+                                              jobs=2, init=True)
+            results = migrator.migrate("t_*")
+
+        self.assertEqual([(r.schema, r.from_revision, r.to_revision, r.steps) for r in results], [
+            ("t_1", 10, 20, 1), ("t_2", 10, 10, 0), ("t_3", 10, 10, 0), ("t_4", 0, 20, 2),
+        ])
+        self.assertIsInstance(results[1].error, RuntimeError)
+        self.assertEqual(results[2].skipped, "another dbmake run is migrating it")
+
+        # Locks are released by the tenants that took them, the failed one's too
+        self.assertEqual(sorted(call[0][0]._key for call in release.call_args_list),
+                         sorted(tenants.tenant_lock_key(schema) for schema in ("t_1", "t_2", "t_4")))
+
+        # The tenant without a migrations table has been recorded at the ZERO-MIGRATION first
+        daos["t_4"].create_table.assert_called_once_with()
+
+        # Connections are reused by tenants, each one prepares the INSERT of records once at most
+        self.assertIn(len(adapters), (1, 2))
+        for db_adapter in adapters:
+            self.assertLessEqual(len([call for call in db_adapter.get_cursor.return_value.execute.call_args_list
+                                      if call[0][0].startswith("PREPARE")]), 1)
+        executed = [call[0] for db_adapter in adapters
+                    for call in db_adapter.get_cursor.return_value.execute.call_args_list]
+        self.assertEqual(sorted(statement[1][0] for statement in executed if statement[0].startswith("EXECUTE")),
+                         [10, 20, 20])
+
+        # Every tenant's search_path is reset, the failed and the skipped ones' too
+        resets = [call for db_adapter in adapters for call in db_adapter.execute_string.call_args_list
+                  if call == mock.call("RESET search_path")]
+        self.assertEqual(len(resets), 4)
+
+
+class TestTenantMigratorOnDatabase(DbTestCase):
+
+    SCHEMAS = ["t_tenant_1", "t_tenant_2", "t_tenant_3"]
+
+    def setUp(self):
+        DbTestCase.setUp(self)
+        self.write_migration(ZERO_MIGRATION_FILE_NAME, "SELECT 1;", "SELECT 1;")
+        self.write_migration("1_t_items.sql", "CREATE TABLE t_items (id int);", "DROP TABLE t_items;")
+        self.write_migration("2_t_items_name.sql", "ALTER TABLE t_items ADD COLUMN name text;",
+                             "ALTER TABLE t_items DROP COLUMN name;")
+
+        self.db_adapter = database.PgAdapter(self.db_config)
+        for schema in self.SCHEMAS:
+            self.db_adapter.execute_string("CREATE SCHEMA %s" % schema)
+
+    def tearDown(self):
+        for schema in self.SCHEMAS:
+            self.db_adapter.execute_string("DROP SCHEMA IF EXISTS %s CASCADE" % schema)
+        self.db_adapter.disconnect()
+        DbTestCase.tearDown(self)
+
+    def _fetch_one(self, sql):
+        cursor = self.db_adapter.get_cursor()
+        cursor.execute(sql)
+        result = cursor.fetchone()
+        cursor.close()
+        self.db_adapter.commit()
+        return result
+
+    def migrate(self, **kwargs):
+        migrator = tenants.TenantMigrator(self.db_config, migrations.MigrationsManager(self.migrations_dir),
+                                          jobs=2, init=True)
+        return migrator.migrate("t_tenant_*", **kwargs)
+
+    def test_migrate_tenants(self):
+        # Three tenants on two connections, a connection's prepared INSERT serves the next tenant's search_path
+        results = self.migrate()
+
+        self.assertTrue(all(result.ok for result in results))
+        self.assertEqual([(result.schema, result.to_revision) for result in results],
+                         [(schema, 2) for schema in self.SCHEMAS])
+        for schema in self.SCHEMAS:
+            self.assertEqual(self._fetch_one("SELECT max(revision) FROM %s._dbmake_migrations" % schema), (2,))
+            self.assertEqual(self._fetch_one(
+                "SELECT count(*) FROM pg_attribute WHERE attrelid = '%s.t_items'::regclass AND attname = 'name'"
+                % schema
+            ), (1,))
+
+        # Migrations run in the tenants' schemas only
+        self.assertEqual(self._fetch_one("SELECT to_regclass('public.t_items')"), (None,))
+
+        self.assertEqual([result.steps for result in self.migrate()], [0, 0, 0])
+
+        results = self.migrate(steps=-1)
+        self.assertEqual([result.to_revision for result in results], [1, 1, 1])
+        self.assertEqual(self._fetch_one(
+            "SELECT count(*) FROM pg_attribute WHERE attrelid = 't_tenant_2.t_items'::regclass AND attname = 'name'"
+        ), (0,))